@@ -1,6 +1,12 @@
-import importlib.metadata
+from .libraries.common import lazy
 
-try:
-    __version__ = importlib.metadata.version("podapp")
-except importlib.metadata.PackageNotFoundError:
-    __version__ = "development"
+# Slow to import, and only needed for `--version`
+importlib_metadata = lazy.load_module("importlib.metadata")
+
+def __getattr__(name: str):
+    if name == "__version__":
+        try:
+            return importlib_metadata.version("podapp")
+        except importlib_metadata.PackageNotFoundError:
+            return "development"
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
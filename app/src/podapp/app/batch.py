@@ -0,0 +1,171 @@
+"""
+Batch inference over a directory of recorded clips.
+
+Each clip is run through its own `AICoprocessor` pipeline in a worker process,
+as fast as the pipeline can go (no clock sync). The detections for each clip
+are written to `<outdir>/<clip name>.det` (see `storage/detections.py`), and a
+line is appended to `<outdir>/progress.jsonl` whenever a clip finishes, so an
+interrupted batch can be resumed by running it again.
+"""
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Set
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import time
+from ..libraries.common import log
+from ..libraries.gstreamer_utils import utils as gst_utils
+from ..libraries.coprocessors import ai
+from ..libraries.storage import detections
+
+PROGRESS_FILE_NAME = "progress.jsonl"
+VIDEO_EXTENSIONS = (".h264", ".264", ".mov")
+
+def find_clips(dpath: str) -> List[str]:
+    """
+    Return a sorted list of all the video clips in the given directory.
+    """
+    clips = []
+    for fname in sorted(os.listdir(dpath)):
+        fpath = os.path.join(dpath, fname)
+        if os.path.isfile(fpath) and os.path.splitext(fname)[1].lower() in VIDEO_EXTENSIONS:
+            clips.append(fpath)
+    return clips
+
+def load_progress(outdir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Return the progress entries (keyed by clip path) of any clips that were already
+    completed in a previous run of a batch into `outdir`.
+    """
+    fpath = os.path.join(outdir, PROGRESS_FILE_NAME)
+    done = {}
+    if not os.path.isfile(fpath):
+        return done
+
+    with open(fpath, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Most likely a line that was half-written when we were killed
+                continue
+            done[entry['clip']] = entry
+    return done
+
+def _output_fpath(outdir: str, clip_fpath: str) -> str:
+    return os.path.join(outdir, os.path.basename(clip_fpath) + ".det")
+
+def _worker_init(config: Dict[str, Any]):
+    """
+    Runs once in each worker process.
+    """
+    log.init(config)
+    gst_utils.configure(config)
+
+def _infer_clip(config: Dict[str, Any], model: ai.AIModelType, clip_fpath: str, out_fpath: str) -> Dict[str, Any]:
+    """
+    Run a single clip through the AI pipeline and write its detections to `out_fpath`.
+    Runs in a worker process.
+    """
+    partial_fpath = out_fpath + ".partial"
+    if os.path.isfile(partial_fpath):
+        # Left over from an interrupted run
+        os.remove(partial_fpath)
+
+    # Results go to their own file per clip rather than to the (single-writer) detection store
+    hailoproc = ai.AICoprocessor(config, store_detections=False)
+    writer = detections.DetectionWriter(partial_fpath)
+    hailoproc.add_results_callback(writer.append)
+    try:
+        err = hailoproc.set_source(clip_fpath)
+        if err:
+            raise err
+
+        err = hailoproc.set_model(model)
+        if err:
+            raise err
+
+        err = hailoproc.set_sinks("null", sync=False)
+        if err:
+            raise err
+
+        start_s = time.monotonic()
+        hailoproc.start()
+        hailoproc.wait()
+        elapsed_s = time.monotonic() - start_s
+
+        if hailoproc.pipeline.error is not None:
+            raise RuntimeError(f"Pipeline error: {hailoproc.pipeline.error}")
+
+        frames = hailoproc.frames_processed
+        labels = dict(hailoproc.results.labels) if hailoproc.results is not None else {}
+    finally:
+        writer.close()
+        hailoproc.shutdown()
+
+    # Only make the output visible once it is complete
+    os.replace(partial_fpath, out_fpath)
+
+    return {
+        "clip": clip_fpath,
+        "output": out_fpath,
+        "frames": frames,
+        "detections": writer.nrows_written,
+        "seconds": elapsed_s,
+        "labels": {str(k): v for k, v in labels.items()},
+    }
+
+def run_batch(config: Dict[str, Any], model: ai.AIModelType, indir: str, outdir: str, njobs: int, echo=print) -> Exception|None:
+    """
+    Run every clip in `indir` through the given model using `njobs` pipelines in parallel.
+    Clips that were completed by a previous run into the same `outdir` are skipped.
+
+    Note that running more than one job at a time requires the Hailo device to be shared
+    between processes (HailoRT's multi-process service).
+    """
+    os.makedirs(outdir, exist_ok=True)
+    clips = find_clips(indir)
+    done = load_progress(outdir)
+    todo = [c for c in clips if c not in done]
+    echo(f"Found {len(clips)} clips in {indir}; {len(clips) - len(todo)} already done, {len(todo)} to go.")
+    if not todo:
+        return None
+
+    failed: Set[str] = set()
+    total_frames = 0
+    ndone = len(clips) - len(todo)
+    start_s = time.monotonic()
+
+    # GStreamer and GLib do not survive a fork, so use fresh interpreters for the workers
+    context = multiprocessing.get_context("spawn")
+    progress_fpath = os.path.join(outdir, PROGRESS_FILE_NAME)
+    with open(progress_fpath, 'a') as progress, concurrent.futures.ProcessPoolExecutor(max_workers=njobs, mp_context=context, initializer=_worker_init, initargs=(config,)) as pool:
+        futures = {pool.submit(_infer_clip, config, model, clip, _output_fpath(outdir, clip)): clip for clip in todo}
+        for future in concurrent.futures.as_completed(futures):
+            clip = futures[future]
+            ndone += 1
+            try:
+                entry = future.result()
+            except Exception as e:
+                log.error("Batch inference failed on %s: %s", clip, e)
+                echo(f"[{ndone}/{len(clips)}] {os.path.basename(clip)}: FAILED ({e})")
+                failed.add(clip)
+                continue
+
+            progress.write(json.dumps(entry) + "\n")
+            progress.flush()
+
+            total_frames += entry['frames']
+            clip_fps = entry['frames'] / entry['seconds'] if entry['seconds'] > 0 else 0.0
+            aggregate_fps = total_frames / (time.monotonic() - start_s)
+            echo(f"[{ndone}/{len(clips)}] {os.path.basename(clip)}: {entry['frames']} frames, {entry['detections']} detections, {clip_fps:.1f} fps (aggregate {aggregate_fps:.1f} fps)")
+
+    elapsed_s = time.monotonic() - start_s
+    echo(f"Processed {total_frames} frames in {elapsed_s:.1f} s ({total_frames / elapsed_s:.1f} fps aggregate).")
+    if failed:
+        return RuntimeError(f"{len(failed)} clips failed. Run the batch again to retry them.")
+
+    return None
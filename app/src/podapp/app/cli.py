@@ -1,39 +1,142 @@
 """
 CLI entry to the application. Useful for testing and for turning on/off various
 components.
+
+Subsystems are imported lazily (see `lazy.py`), the configuration file is only loaded
+by the commands that use it (see `_ContextObject`), and GStreamer is only initialized by
+the commands that need it (see `_init_gstreamer()`), so that simple commands like
+`display on` start quickly. `podapp-cli imports ...` shows where startup time goes.
+
+When the daemon (see `daemon.py`) is running, commands that use hardware are sent to it
+instead of being run here (unless `--local` is given), so pipelines they start keep
+running after the CLI exits.
 """
-from .. import __version__
 from ..libraries.common import appconfig
+from ..libraries.common import lazy
 from ..libraries.common import log
-from ..libraries.gstreamer_utils import utils as gst_utils
-from ..libraries.coprocessors import ai
-from ..libraries.outputs import leds
-from ..libraries.outputs import screen
-from ..libraries.sensors import cameras
+from typing import Callable
+from typing import Iterable
 import click
+import datetime
+import os
+import tempfile
+import time
 
-@click.group(context_settings=dict(help_option_names=['-h', '--help']))
-@click.option('-c', "--config", type=click.Path(exists=True, dir_okay=False, resolve_path=True, allow_dash=False), default=appconfig.DEFAULT_CONFIG_FILE_PATH, help="Path to a configuration file.")
-@click.option('-l', "--log-level", type=click.Choice(log.ALLOWED_LEVELS), default=None, help="Log level override. We use this instead of the config file's value if passed.")
-@click.version_option(version=__version__)
-@click.pass_context
-def cli(ctx, config, log_level):
-    ctx.ensure_object(dict)
+podapp = lazy.load_module("..", __package__)
+batch = lazy.load_module(".batch", __package__)
+client = lazy.load_module(".client", __package__)
+daemon = lazy.load_module(".daemon", __package__)
+profiling = lazy.load_module(".profiling", __package__)
+startup = lazy.load_module(".startup", __package__)
+gst_utils = lazy.load_module("..libraries.gstreamer_utils.utils", __package__)
+gst_decode = lazy.load_module("..libraries.gstreamer_utils.decode", __package__)
+gst_tracking = lazy.load_module("..libraries.gstreamer_utils.tracking", __package__)
+gst_frames = lazy.load_module("..libraries.gstreamer_utils.frames", __package__)
+gst_model = lazy.load_module("..libraries.gstreamer_utils.model", __package__)
+ai = lazy.load_module("..libraries.coprocessors.ai", __package__)
+mcu = lazy.load_module("..libraries.coprocessors.mcu", __package__)
+gpio = lazy.load_module("..libraries.outputs.gpio", __package__)
+leds = lazy.load_module("..libraries.outputs.leds", __package__)
+screen = lazy.load_module("..libraries.outputs.screen", __package__)
+cameras = lazy.load_module("..libraries.sensors.cameras", __package__)
+detections = lazy.load_module("..libraries.storage.detections", __package__)
+metrics = lazy.load_module("..libraries.common.metrics", __package__)
+system = lazy.load_module("..libraries.sensors.system", __package__)
 
-    # Get the configuration file if provided
-    config = appconfig.load_config_file(config)
-    
-    # Initialize logging
-    if log_level is not None:
-        config['moduleconfig']['logging']['log-level'] = log_level
-    log.init(config)
-    log.enable_logging_to_console(config)
+class LazyChoice(click.Choice):
+    """
+    A `click.Choice` whose choices are looked up only when they are needed (to parse or
+    to show help), so that defining a command doesn't import the module they come from.
+    """
+    def __init__(self, get_choices: Callable[[], Iterable[str]], case_sensitive=True) -> None:
+        self._get_choices = get_choices
+        self.case_sensitive = case_sensitive
 
-    # Initialize fundamental systems
+    @property
+    def choices(self):
+        return tuple(self._get_choices())
+
+def _print_version(ctx, param, value):
+    """
+    Like `click.version_option()`, but only looks the version up if asked to.
+    """
+    if not value or ctx.resilient_parsing:
+        return
+    click.echo(f"{ctx.find_root().info_name}, version {podapp.__version__}")
+    ctx.exit()
+
+def _init_gstreamer(config):
+    """
+    Configure and initialize GStreamer, for the commands that build pipelines.
+    """
     gst_utils.configure(config)
+    gst_utils.init()
+
+def _daemon(ctx):
+    """
+    Return a client connected to the daemon, or None if it isn't running (or `--local` was given).
+    """
+    if ctx.obj['local']:
+        return None
+    if 'daemon' not in ctx.obj:
+        ctx.obj['daemon'] = client.Client.connect(ctx.obj['config'])
+    return ctx.obj['daemon']
+
+def _remote(ctx, command: str, **args):
+    """
+    Run a command in the daemon, which must be running. Returns its result.
+    """
+    connection = _daemon(ctx)
+    if connection is None:
+        raise click.ClickException("This command needs the podapp daemon, which is not running.")
+
+    err, result = connection.call(command, **args)
+    if err:
+        raise click.ClickException(str(err))
+    return result
+
+def _echo_results(results):
+    for name, value in results.items():
+        click.echo(f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}")
+
+class _ConfigGroup(click.Group):
+    """
+    A `click.Group` that reports a bad configuration file the way click reports bad arguments,
+    whichever command it was that compiled the section that is bad.
+    """
+    def invoke(self, ctx):
+        try:
+            return super().invoke(ctx)
+        except appconfig.ConfigError as e:
+            raise click.ClickException(f"Bad configuration file: {e}")
 
-    # Attach the configuration to the context
-    ctx.obj['config'] = config
+class _ContextObject(dict):
+    """
+    The object attached to the context. The configuration file is only loaded and
+    compiled (and logging set up) when a command first uses `ctx.obj['config']`, so
+    that commands that don't (e.g., `--help`) don't pay for it.
+    """
+    def __missing__(self, key):
+        if key != 'config':
+            raise KeyError(key)
+
+        raw = appconfig.load_config_file(self['config_fpath'])
+        if self['log_level'] is not None:
+            raw['moduleconfig']['logging']['log-level'] = self['log_level']
+        config = appconfig.compile_config(raw)
+        log.init(config)
+        log.enable_logging_to_console(config)
+        self['config'] = config
+        return config
+
+@click.group(cls=_ConfigGroup, context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-c', "--config", type=click.Path(exists=True, dir_okay=False, resolve_path=True, allow_dash=False), default=appconfig.DEFAULT_CONFIG_FILE_PATH, help="Path to a configuration file.")
+@click.option('-l', "--log-level", type=click.Choice(log.ALLOWED_LEVELS), default=None, help="Log level override. We use this instead of the config file's value if passed.")
+@click.option("--local", is_flag=True, default=False, help="Run the command in this process, even if the daemon is running.")
+@click.option("--version", is_flag=True, expose_value=False, is_eager=True, callback=_print_version, help="Show the version and exit.")
+@click.pass_context
+def cli(ctx, config, log_level, local):
+    ctx.obj = _ContextObject(local=local, config_fpath=config, log_level=log_level)
 
 #########################################################################################################
 ####################### AI COMMANDS #################################################################
@@ -44,27 +147,225 @@ def ai_group(ctx):
     pass
 
 @ai_group.command(name="infer")
-@click.argument("model", type=click.Choice([model_type.value for model_type in ai.AIModelType]), required=True)
+@click.argument("model", type=LazyChoice(lambda: [model_type.value for model_type in ai.AIModelType]), required=True)
 @click.option('-s', "source", type=click.STRING, required=True, help="A path to a file or one of ('rear-camera', 'front-camera')")
 @click.option('-o', "--outfpath", type=click.Path(dir_okay=False, writable=True, resolve_path=True), default=None, help="If given, we save an output file at this location. Otherwise, we attempt to display to screen.")
+@click.option('-m', "--multiplex", type=click.IntRange(min=1), default=None, help="If given, alternate between the front and rear cameras every this many frames. The source must be a camera.")
 @click.pass_context
-def ai_infer(ctx, model, source, outfpath):
+def ai_infer(ctx, model, source, outfpath, multiplex):
+    if _daemon(ctx) is not None:
+        source = os.path.abspath(source) if os.path.isfile(source) else source
+        _remote(ctx, "ai.infer", model=model, source=source, outfpath=outfpath, multiplex=multiplex)
+        return
+
     config = ctx.obj['config']
+    _init_gstreamer(config)
     hailoproc = ai.AICoprocessor(config)
 
     err = hailoproc.set_source(source)
     if err:
         return err
 
+    if multiplex is not None:
+        err = hailoproc.set_camera_mux(cameras.CameraMux.shared(config), multiplex)
+        if err:
+            return err
+
     err = hailoproc.set_model(ai.AIModelType(model))
     if err:
+        hailoproc.shutdown()
         return err
 
     err = hailoproc.set_sinks(outfpath if outfpath is not None else "display")
     if err:
+        hailoproc.shutdown()
         return err
 
+    # Run to the end (or until interrupted), then give back the camera mux and flush the results
     hailoproc.start()
+    try:
+        hailoproc.wait()
+    finally:
+        hailoproc.shutdown()
+
+@ai_group.command(name="standby")
+@click.argument("model", type=LazyChoice(lambda: [model_type.value for model_type in ai.AIModelType]), required=True)
+@click.option('-s', "source", type=click.STRING, required=True, help="A path to a file or one of ('rear-camera', 'front-camera')")
+@click.option('-t', "--timeout", type=click.FloatRange(min=0, min_open=True), default=30.0, help="Seconds to wait for a detection after waking.")
+@click.pass_context
+def ai_standby(ctx, model, source, timeout):
+    """
+    Preroll the pipeline, wait for the activity line, and report how long it took to get from the edge to the first detection.
+    With the daemon, the pipeline stays in standby after this reports the first wake.
+    """
+    if _daemon(ctx) is not None:
+        source = os.path.abspath(source) if os.path.isfile(source) else source
+        pin = _remote(ctx, "ai.standby", model=model, source=source)['pin']
+        click.echo(f"In standby. Waiting for activity on GPIO {pin}...")
+        with client.Client.connect(ctx.obj['config'], timeout_s=None) as events:
+            for _, latencies_ms in events.events(["wake"]):
+                for step, ms in latencies_ms.items():
+                    click.echo(f"{step}: {ms:.1f} ms" if ms is not None else f"{step}: -")
+                return
+
+    config = ctx.obj['config']
+    _init_gstreamer(config)
+    wake_config = appconfig.section(config, appconfig.WakeConfig)
+    hailoproc = ai.AICoprocessor(config, store_detections=False)
+    err = hailoproc.set_source(source)
+    if err:
+        hailoproc.shutdown()
+        return err
+
+    err = hailoproc.set_model(ai.AIModelType(model))
+    if err:
+        hailoproc.shutdown()
+        return err
+
+    err = hailoproc.set_sinks("null", sync=True)
+    if err:
+        hailoproc.shutdown()
+        return err
+
+    err = hailoproc.standby(timeout_s=wake_config.preroll_timeout_seconds)
+    if err:
+        hailoproc.shutdown()
+        return err
+
+    pin = appconfig.section(config, appconfig.WakePinsConfig).activity.pin
+    hailoproc.wake_on_edge(pin, gpio.Edge[wake_config.edge], debounce_ms=wake_config.debounce_ms)
+    click.echo(f"In standby. Waiting for activity on GPIO {pin}...")
+    try:
+        while not hailoproc.wakes:
+            time.sleep(0.01)
+        deadline_s = time.monotonic() + timeout
+        while hailoproc.wakes[-1].first_detection_ns is None and time.monotonic() < deadline_s:
+            time.sleep(0.01)
+    finally:
+        hailoproc.shutdown()
+
+    for step, ms in hailoproc.wakes[-1].latencies_ms().items():
+        click.echo(f"{step}: {ms:.1f} ms" if ms is not None else f"{step}: -")
+
+@ai_group.command(name="stop")
+@click.pass_context
+def ai_stop(ctx):
+    """
+    Stop the daemon's AI pipeline.
+    """
+    _remote(ctx, "ai.stop")
+
+@ai_group.command(name="status")
+@click.pass_context
+def ai_status(ctx):
+    """
+    Show what the daemon's AI pipeline is doing.
+    """
+    _echo_results(_remote(ctx, "ai.status"))
+
+@ai_group.command(name="snapshots")
+@click.option('-n', "--count", type=click.IntRange(min=1), default=20, help="How many of the most recent snapshots to list.")
+@click.pass_context
+def ai_snapshots(ctx, count):
+    """
+    List the daemon's most recent detection snapshots.
+    """
+    for info in _remote(ctx, "snapshots.recent", n=count):
+        cached = "" if info["cached"] else " (not cached)"
+        click.echo(f"{info['id']}: {info['label']} ({info['score']:.2f}) on {info['camera']} -> {info['fpath']}{cached}")
+
+@ai_group.command(name="batch")
+@click.argument("model", type=LazyChoice(lambda: [model_type.value for model_type in ai.AIModelType]), required=True)
+@click.argument("indir", type=click.Path(exists=True, file_okay=False, resolve_path=True))
+@click.option('-o', "--outdir", type=click.Path(file_okay=False, writable=True, resolve_path=True), default=None, help="Where to write the detections. Defaults to '<indir>/detections'. Running again with the same output directory resumes the batch.")
+@click.option('-j', "--jobs", type=click.IntRange(min=1), default=1, help="Number of pipelines to run in parallel.")
+@click.pass_context
+def ai_batch(ctx, model, indir, outdir, jobs):
+    """
+    Run the given model over every video clip in a directory, as fast as possible.
+    """
+    config = ctx.obj['config']
+    _init_gstreamer(config)
+    if outdir is None:
+        outdir = os.path.join(indir, "detections")
+
+    err = batch.run_batch(config, ai.AIModelType(model), indir, outdir, jobs, echo=click.echo)
+    return err
+
+@ai_group.command(name="query")
+@click.argument("dpath", type=click.Path(exists=True, file_okay=False, resolve_path=True))
+@click.option("--since", type=click.DateTime(), default=None, help="Only detections at or after this (local) time.")
+@click.option("--until", type=click.DateTime(), default=None, help="Only detections before this (local) time.")
+@click.option("--label", "labels", type=click.STRING, multiple=True, help="Only detections with this label. May be given more than once.")
+@click.option("--min-score", type=click.FloatRange(0.0, 1.0), default=None, help="Only detections with a score above this.")
+@click.pass_context
+def ai_query(ctx, dpath, since, until, labels, min_score):
+    """
+    Print the detections in the detection store at DPATH that match the given criteria.
+    Detections from recorded files are kept in the store at DPATH/files.
+    """
+    store = detections.DetectionStore(dpath)
+    start_ns = int(since.timestamp() * 1e9) if since is not None else None
+    end_ns = int(until.timestamp() * 1e9) if until is not None else None
+    count = 0
+    for rows in store.iter_query(start_ns=start_ns, end_ns=end_ns, labels=labels or None, min_score=min_score):
+        for row in rows:
+            label = store.labels.get(str(row['model']), {}).get(str(row['class_id']), str(row['class_id']))
+            when = datetime.datetime.fromtimestamp(row['timestamp'] / 1e9).isoformat(timespec='milliseconds')
+            click.echo(f"{when} camera={detections.CameraID(row['camera']).name} {label} {row['score']:.2f} box={tuple(round(float(v), 3) for v in row['box'])}")
+        count += len(rows)
+    click.echo(f"{count} detections.")
+
+def _model_names() -> Iterable[str]:
+    """
+    The model configurations in `gstreamer_utils/model.py` (the values of `ai.AIModelType`, without importing GStreamer).
+    """
+    return [name for name, value in vars(gst_model).items() if isinstance(value, dict) and value.get('hef_name')]
+
+@ai_group.command(name="model")
+@click.argument("model", type=LazyChoice(_model_names), required=True)
+@click.pass_context
+def ai_model(ctx, model):
+    """
+    Show what the given model's HEF says about its streams, and the pipeline that would run it. Doesn't need the accelerator.
+    """
+    gst_utils.configure(ctx.obj['config'])
+    try:
+        model_element = gst_model.GStreamerModel(getattr(gst_model, model))
+    except FileNotFoundError as e:
+        raise click.ClickException(str(e))
+
+    info = model_element.hef_info
+    if info is not None:
+        click.echo(f"network group: {info.network_group}")
+        for direction, streams in (("input", info.inputs), ("output", info.outputs)):
+            for stream in streams:
+                shape = "x".join(str(d) for d in stream.shape)
+                click.echo(f"{direction}: {stream.name} {stream.format_type} {stream.order}({shape})")
+    click.echo(f"input: {model_element.width}x{model_element.height} {model_element.color_format}")
+    click.echo(f"pipeline: {model_element.element_pipeline}")
+
+@ai_group.command(name="postprocess-bench")
+@click.option('-b', "--batch", "batch_size", type=click.IntRange(min=1), default=2, help="Number of frames per batch.")
+@click.option('-c', "--classes", type=click.IntRange(min=1), default=80, help="Number of classes the model scores.")
+@click.option('-s', "--size", type=click.IntRange(min=32), default=640, help="Model input width and height.")
+@click.option("--float/--quantized", "use_float", default=False, help="Whether the output tensors are FLOAT32 or quantized UINT8.")
+@click.pass_context
+def ai_postprocess_bench(ctx, batch_size, classes, size, use_float):
+    """
+    Compare the vectorized Python post-process with a naive one, on synthetic output tensors.
+    """
+    _echo_results(gst_decode.benchmark(batch_size, classes, (size, size), quantized=not use_float))
+
+@ai_group.command(name="track-bench")
+@click.option('-n', "--objects", type=click.IntRange(min=1), default=200, help="Number of synthetic animals in view.")
+@click.option('-f', "--frames", type=click.IntRange(min=1), default=300, help="Number of frames to track them over.")
+@click.pass_context
+def ai_track_bench(ctx, objects, frames):
+    """
+    Measure the tracker's time per frame on synthetic trajectories, and how well its IDs stick to the animals.
+    """
+    _echo_results(gst_tracking.benchmark(objects, frames, max_tracks=max(512, 2 * objects)))
 
 #########################################################################################################
 ####################### LED COMMANDS #################################################################
@@ -80,6 +381,10 @@ def led_flashlight_on(ctx):
     """
     Turn on the flashlight.
     """
+    if _daemon(ctx) is not None:
+        _remote(ctx, "led.fl-on")
+        return
+
     config = ctx.obj['config']
     flashlight = leds.FlashLight(config)
 
@@ -92,12 +397,60 @@ def led_flashlight_off(ctx):
     """
     Turn off the flashlight.
     """
+    if _daemon(ctx) is not None:
+        _remote(ctx, "led.fl-off")
+        return
+
     config = ctx.obj['config']
     flashlight = leds.FlashLight(config)
 
     err = flashlight.turn_off()
     return err
 
+@led_group.command(name="animate")
+@click.argument("effect", type=LazyChoice(lambda: leds.EFFECTS), required=True)
+@click.option('-d', "--duration", type=click.FloatRange(min=0, min_open=True), default=10.0, help="Seconds to animate for.")
+@click.pass_context
+def led_animate(ctx, effect, duration):
+    """
+    Show an effect on the LED strips for a while. With the daemon, this returns straight away.
+    """
+    if _daemon(ctx) is not None:
+        _remote(ctx, "led.animate", effect=effect, duration_s=duration)
+        return
+
+    config = ctx.obj['config']
+    strips = leds.LEDStrips(config)
+    strips.play(leds.EFFECTS[effect]())
+    strips.start()
+    try:
+        time.sleep(duration)
+    finally:
+        strips.shutdown()
+
+    _echo_results(strips.stats())
+
+@led_group.command(name="stop")
+@click.pass_context
+def led_stop(ctx):
+    """
+    Stop the daemon's LED animation and turn the strips off.
+    """
+    _echo_results(_remote(ctx, "led.stop") or {})
+
+@led_group.command(name="bench")
+@click.argument("effect", type=LazyChoice(lambda: leds.EFFECTS), default="rainbow")
+@click.option('-n', "--frames", type=click.IntRange(min=1), default=1000, help="Number of frames to render.")
+@click.pass_context
+def led_bench(ctx, effect, frames):
+    """
+    Measure how fast we can render (and send) LED frames. Uses the configured backend.
+    """
+    config = ctx.obj['config']
+    strips = leds.LEDStrips(config)
+    results = leds.benchmark(strips, leds.EFFECTS[effect](), nframes=frames)
+    _echo_results(results)
+
 #########################################################################################################
 ####################### DISPLAY COMMANDS #################################################################
 #########################################################################################################
@@ -112,6 +465,10 @@ def display_on(ctx):
     """
     Turn on the display.
     """
+    if _daemon(ctx) is not None:
+        _remote(ctx, "display.on")
+        return
+
     config = ctx.obj['config']
     dis = screen.Display(config)
 
@@ -124,6 +481,10 @@ def display_off(ctx):
     """
     Turn off the display.
     """
+    if _daemon(ctx) is not None:
+        _remote(ctx, "display.off")
+        return
+
     config = ctx.obj['config']
     dis = screen.Display(config)
 
@@ -145,9 +506,15 @@ def camera_group(ctx, camera):
 def camera_record(ctx, fpath):
     """
     Turn on the camera and record the given number of seconds. Records to the given file in mp4 format.
+    With the daemon, recording goes on until `camera stop`.
     """
     cam = ctx.obj['camera']
+    if _daemon(ctx) is not None:
+        _remote(ctx, "camera.record", camera=cam.removesuffix("-camera"), fpath=os.path.abspath(fpath))
+        return
+
     config = ctx.obj['config']
+    _init_gstreamer(config)
     if cam == "front-camera":
         camera_device = cameras.FrontCamera(config)
     else:
@@ -156,5 +523,214 @@ def camera_record(ctx, fpath):
     err = camera_device.stream_to_file(fpath)
     return err
 
+@camera_group.command(name="stop")
+@click.pass_context
+def camera_stop(ctx):
+    """
+    Stop the daemon's recording from the camera.
+    """
+    _remote(ctx, "camera.stop", camera=ctx.obj['camera'].removesuffix("-camera"))
+
+#########################################################################################################
+####################### MCU COMMANDS #################################################################
+#########################################################################################################
+@cli.group(name="mcu")
+@click.pass_context
+def mcu_group(ctx):
+    pass
+
+@mcu_group.command(name="bench")
+@click.option('-n', "--requests", type=click.IntRange(min=1), default=10000, help="Number of requests to send.")
+@click.option('-f', "--in-flight", type=click.IntRange(min=1), default=32, help="Maximum number of requests outstanding at once.")
+@click.option("--emulated", is_flag=True, default=False, help="Benchmark against the emulated MCU instead of the real one.")
+@click.pass_context
+def mcu_bench(ctx, requests, in_flight, emulated):
+    """
+    Measure the throughput and latency of the SPI link to the MCU.
+    """
+    config = ctx.obj['config']
+    link = mcu.MCU(config, backend=mcu.EmulatedMCU() if emulated else None)
+    try:
+        results = mcu.benchmark(link, nrequests=requests, in_flight=in_flight)
+    finally:
+        link.shutdown()
+
+    _echo_results(results)
+
+#########################################################################################################
+####################### LOGGING COMMANDS #################################################################
+#########################################################################################################
+@cli.group(name="log")
+@click.pass_context
+def log_group(ctx):
+    pass
+
+@log_group.command(name="bench")
+@click.option('-n', "--calls", type=click.IntRange(min=1), default=10000, help="Number of messages to log.")
+@click.option('-d', "--write-delay-ms", type=click.FloatRange(min=0), default=0.0, help="Extra time every write takes, to stand in for a slow SD card.")
+@click.option('-o', "--fpath", type=click.Path(dir_okay=False, writable=True, resolve_path=True), default=None, help="Log file to write to. Defaults to a temporary file.")
+@click.pass_context
+def log_bench(ctx, calls, write_delay_ms, fpath):
+    """
+    Measure how many log calls per second we can make and how long each one stalls
+    the calling thread, writing directly to the file and through the log writer thread.
+    """
+    config = ctx.obj['config']
+    queue_size = appconfig.section(config, appconfig.LoggingConfig).queue_size
+    if fpath is not None:
+        results = log.benchmark(fpath, ncalls=calls, write_delay_s=write_delay_ms / 1000, queue_size=queue_size)
+    else:
+        with tempfile.TemporaryDirectory() as dpath:
+            results = log.benchmark(os.path.join(dpath, "bench.log"), ncalls=calls, write_delay_s=write_delay_ms / 1000, queue_size=queue_size)
+    _echo_results(results)
+
+#########################################################################################################
+####################### METRICS COMMANDS #################################################################
+#########################################################################################################
+@cli.command(name="metrics")
+@click.pass_context
+def metrics_show(ctx):
+    """
+    Print the daemon's metrics in the OpenMetrics text format (the system's own, if the daemon isn't running).
+    """
+    if _daemon(ctx) is not None:
+        click.echo(_remote(ctx, "metrics"), nl=False)
+        return
+
+    system.register_metrics()
+    click.echo(metrics.REGISTRY.render(), nl=False)
+
+#########################################################################################################
+####################### PROFILING COMMANDS #################################################################
+#########################################################################################################
+@cli.command(name="profile")
+@click.option('-o', "--outdir", type=click.Path(file_okay=False, writable=True, resolve_path=True), default=None, help="Where to write the report. Defaults to the configuration file's value.")
+@click.option('-d', "--duration", type=click.FloatRange(min=0, min_open=True), default=None, help="Seconds to run each scenario. Defaults to the configuration file's value.")
+@click.option('-p', "--period", type=click.FloatRange(min=0, min_open=True), default=None, help="Seconds between samples. Defaults to the configuration file's value.")
+@click.option('-s', "--scenario", "scenarios", type=LazyChoice(lambda: profiling.SCENARIO_NAMES), multiple=True, help="Only run this scenario. May be given more than once. Defaults to all of them.")
+@click.pass_context
+def profile(ctx, outdir, duration, period, scenarios):
+    """
+    Measure power draw, CPU, temperature, memory and frame rate across a fixed set of scenarios.
+    """
+    config = ctx.obj['config']
+    _init_gstreamer(config)
+    profiling_config = appconfig.section(config, appconfig.ProfilingConfig)
+    err = profiling.run_profile(
+        config,
+        outdir=outdir if outdir is not None else profiling_config.output_dpath,
+        duration_s=duration if duration is not None else profiling_config.scenario_seconds,
+        period_s=period if period is not None else profiling_config.sample_period_seconds,
+        scenario_names=scenarios or profiling.SCENARIO_NAMES,
+        echo=click.echo,
+    )
+    return err
+
+@cli.command(name="imports", context_settings=dict(ignore_unknown_options=True))
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+@click.option('-n', "--top", type=click.IntRange(min=1), default=15, help="How many of the slowest imports to show.")
+def imports(args, top):
+    """
+    Run `podapp-cli ARGS...` (just `--help` if not given) with Python's import timing on
+    and report how long startup took and which imports took the longest. Put `--` before
+    ARGS if they contain options, e.g. `podapp-cli imports -- display on`.
+    """
+    wall_s, times = startup.measure_imports(list(args) or ["--help"])
+    click.echo(f"Total: {1000 * wall_s:.1f} ms wall clock, {startup.total_import_us(times) / 1000:.1f} ms importing.")
+    click.echo(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for t in sorted(times, key=lambda t: t.cumulative_us, reverse=True)[:top]:
+        click.echo(f"{t.cumulative_us / 1000:>14.1f} {t.self_us / 1000:>9.1f}  {'  ' * t.depth}{t.name}")
+
+#########################################################################################################
+####################### DAEMON COMMANDS #################################################################
+#########################################################################################################
+@cli.group(name="daemon")
+@click.pass_context
+def daemon_group(ctx):
+    pass
+
+@daemon_group.command(name="run")
+@click.pass_context
+def daemon_run(ctx):
+    """
+    Run the daemon in the foreground (this is what `podapp` does) until CTRL-C.
+    """
+    # Loading the config makes sure every section is valid before touching any hardware
+    config = ctx.obj['config']
+    gst_utils.configure(config)
+    return daemon.Daemon(config, config_fpath=ctx.obj['config_fpath']).run()
+
+@daemon_group.command(name="status")
+@click.pass_context
+def daemon_status(ctx):
+    """
+    Show whether the daemon is running, and what it is doing.
+    """
+    start_s = time.perf_counter()
+    ping = _remote(ctx, "ping")
+    click.echo(f"round_trip_ms: {1000 * (time.perf_counter() - start_s):.2f}")
+    click.echo(f"version: {ping['version']}")
+    _echo_results(_remote(ctx, "daemon.status"))
+
+@daemon_group.command(name="stop")
+@click.pass_context
+def daemon_stop(ctx):
+    """
+    Shut the daemon (and the hardware it is running) down.
+    """
+    _remote(ctx, "daemon.stop")
+
+@daemon_group.command(name="events")
+@click.argument("topics", type=LazyChoice(lambda: daemon.TOPICS), nargs=-1, required=True)
+@click.pass_context
+def daemon_events(ctx, topics):
+    """
+    Print the daemon's events on the given topics, one JSON line each, until CTRL-C.
+    """
+    connection = _daemon(ctx)
+    if connection is None:
+        raise click.ClickException("This command needs the podapp daemon, which is not running.")
+
+    try:
+        for topic, data in connection.events(topics):
+            click.echo(client.encode({"event": topic, "data": data}).decode().rstrip())
+    except KeyboardInterrupt:
+        pass
+
+#########################################################################################################
+####################### GSTREAMER COMMANDS #################################################################
+#########################################################################################################
+@cli.group(name="gst")
+@click.pass_context
+def gst_group(ctx):
+    pass
+
+@gst_group.command(name="warm-up")
+@click.pass_context
+def gst_warm_up(ctx):
+    """
+    Initialize GStreamer and load the configured warm-up elements' plugins, reporting how long each step took.
+    """
+    config = ctx.obj['config']
+    gst_utils.configure(config)
+    start_s = time.perf_counter()
+    gst_utils.init(warm_up=False)
+    click.echo(f"init: {1000 * (time.perf_counter() - start_s):.1f} ms")
+    for name, ms in gst_utils.warm_up_plugins(gst_utils.WARM_UP_ELEMENTS).items():
+        click.echo(f"{name}: {ms:.1f} ms" if ms is not None else f"{name}: not installed")
+
+@gst_group.command(name="tap-bench")
+@click.option('-n', "--frames", type=click.IntRange(min=1), default=300, help="Number of test frames to push through.")
+@click.option('-W', "--width", type=click.IntRange(min=1), default=1280, help="Frame width.")
+@click.option('-H', "--height", type=click.IntRange(min=1), default=720, help="Frame height.")
+@click.option('-f', "--format", "video_format", type=LazyChoice(lambda: list(gst_frames.PLANES)), default="NV12", help="Frame format.")
+@click.pass_context
+def gst_tap_bench(ctx, frames, width, height, video_format):
+    """
+    Measure what it costs to get frames into Python through a frame tap, and how many copies it makes.
+    """
+    gst_utils.configure(ctx.obj['config'])
+    _echo_results(gst_frames.benchmark(frames, width, height, video_format))
+
 if __name__ == "__main__":
     cli()
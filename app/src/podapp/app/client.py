@@ -0,0 +1,113 @@
+"""
+Client for the podapp daemon's control socket (see `daemon.py`).
+
+This only uses the standard library's blocking sockets, so that it is cheap
+to import from the CLI.
+"""
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import Tuple
+import json
+import os
+import socket
+from ..libraries.common import appconfig
+
+class DaemonError(Exception):
+    """
+    The daemon could not carry out a request.
+    """
+    pass
+
+def socket_path(config: Dict[str, Any]) -> str:
+    """
+    The path of the daemon's socket. Falls back to the development path when the
+    configured one's directory isn't there (i.e., we're not running on the pod).
+    """
+    daemon_config = appconfig.section(config, appconfig.DaemonConfig)
+    if os.path.isdir(os.path.dirname(os.path.abspath(daemon_config.socket_path))):
+        return daemon_config.socket_path
+    return daemon_config.socket_path_dev
+
+def encode(message: Dict[str, Any]) -> bytes:
+    """
+    Encode one protocol message: a line of compact JSON.
+    """
+    return json.dumps(message, separators=(',', ':')).encode() + b"\n"
+
+class Client:
+    """
+    A connection to the daemon. Requests are answered in order, and each `call()`
+    waits for its own response, so one `Client` should be used from one thread at a time.
+    """
+    def __init__(self, path: str, timeout_s: float|None = 30.0) -> None:
+        self.path = path
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout_s)
+        self._sock.connect(path)
+        self._file = self._sock.makefile('rb')
+        self._next_id = 0
+
+    @classmethod
+    def connect(cls, config: Dict[str, Any], timeout_s: float|None = 30.0) -> "Client|None":
+        """
+        Connect to the daemon, if it is running. Returns None if it isn't.
+        """
+        try:
+            return cls(socket_path(config), timeout_s=timeout_s)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Close the connection.
+        """
+        self._file.close()
+        self._sock.close()
+
+    def _receive(self) -> Dict[str, Any]:
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("The daemon closed the connection")
+        return json.loads(line)
+
+    def call(self, command: str, **args) -> Tuple[Exception|None, Any]:
+        """
+        Ask the daemon to run `command` with the given arguments. Returns its result.
+        """
+        self._next_id += 1
+        request_id = self._next_id
+        try:
+            self._sock.sendall(encode({"id": request_id, "cmd": command, "args": args}))
+            while True:
+                message = self._receive()
+                # Events that arrive while we wait for the response are not what we asked for
+                if message.get("id") == request_id:
+                    break
+        except (OSError, ValueError) as e:
+            return (e, None)
+
+        if not message["ok"]:
+            return (DaemonError(message["error"]), None)
+        return (None, message.get("result"))
+
+    def events(self, topics: Iterable[str]) -> Iterator[Tuple[str, Any]]:
+        """
+        Subscribe to the given topics and yield (topic, data) for every event, forever.
+        """
+        err, _ = self.call("subscribe", topics=list(topics))
+        if err:
+            raise err
+
+        self._sock.settimeout(None)
+        while True:
+            message = self._receive()
+            if "event" in message:
+                yield message["event"], message.get("data")
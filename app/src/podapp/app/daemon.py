@@ -0,0 +1,653 @@
+"""
+The resident podapp daemon.
+
+The daemon owns the hardware singletons (display, LEDs, cameras, AI coprocessor,
+the MCU link and the telemetry it polls) for as long as it runs, so pipelines keep running between commands and nothing
+is set up twice. Clients (see `client.py`) talk to it over a Unix socket, one line
+of JSON per message:
+
+    request:  {"id": 1, "cmd": "display.on", "args": {}}
+    response: {"id": 1, "ok": true, "result": null}
+              {"id": 1, "ok": false, "error": "..."}
+    event:    {"event": "detections", "data": {...}}
+
+Requests on a connection are answered in order. Events only go to connections that
+subscribed to their topic (see `TOPICS`), through a bounded queue per connection, so
+a slow subscriber loses events rather than holding up the daemon.
+
+Commands that touch hardware all run on one worker thread, one at a time, so the
+hardware objects never see concurrent calls. Hardware modules are only imported
+when a command first needs them.
+
+If the power budget is enabled, the power scheduler (see `scheduler.py`) ticks on a
+thread of its own and duty-cycles the hardware through the same hardware thread.
+"""
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Set
+from typing import Tuple
+import asyncio
+import base64
+import concurrent.futures
+import functools
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from .. import __version__
+from ..libraries.common import appconfig
+from ..libraries.common import lazy
+from ..libraries.common import log
+from ..libraries.common import metrics
+from ..libraries.common import scheduler
+from ..libraries.sensors import system
+from . import client
+
+ai = lazy.load_module("..libraries.coprocessors.ai", __package__)
+gpio = lazy.load_module("..libraries.outputs.gpio", __package__)
+leds = lazy.load_module("..libraries.outputs.leds", __package__)
+mcu = lazy.load_module("..libraries.coprocessors.mcu", __package__)
+screen = lazy.load_module("..libraries.outputs.screen", __package__)
+cameras = lazy.load_module("..libraries.sensors.cameras", __package__)
+sensor_telemetry = lazy.load_module("..libraries.sensors.telemetry", __package__)
+detections = lazy.load_module("..libraries.storage.detections", __package__)
+snapshots = lazy.load_module("..libraries.storage.snapshots", __package__)
+
+# What clients can subscribe to
+TOPICS = ("detections", "wake", "config")
+
+class _Connection:
+    """
+    One client connection, and the events waiting to be sent to it.
+    """
+    def __init__(self, writer: asyncio.StreamWriter, queue_size: int) -> None:
+        self.writer = writer
+        self.topics: Set[str] = set()
+        self.events = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+class Daemon:
+    """
+    The `Daemon` should be a singleton. `run()` serves requests until `stop()`
+    (or SIGINT/SIGTERM, when run in the main thread), then shuts the hardware down.
+
+    `config` should be the compiled configuration (see `appconfig.compile_config()`),
+    which is what the daemon hands to the hardware it creates.
+    """
+    def __init__(self, config: Dict[str, Any], config_fpath=appconfig.DEFAULT_CONFIG_FILE_PATH, path: str|None = None) -> None:
+        daemon_config = appconfig.section(config, appconfig.DaemonConfig)
+        self.config = config
+        self.config_fpath = config_fpath
+        self.path = path if path is not None else client.socket_path(config)
+        self.queue_size = daemon_config.event_queue_size
+        self.config_poll_s = daemon_config.config_poll_seconds
+
+        # Set once we are accepting connections
+        self.ready = threading.Event()
+        self.started_s = time.monotonic()
+
+        # Hardware, created when first needed
+        self.display = None
+        self.flashlight = None
+        self.strips = None
+        self.cameras = {}
+        self.hailoproc = None
+        self.telemetry = None
+        self._wake_watch = None
+        self._published_wake = None
+        self._led_generation = 0
+        self.scheduler = None
+        # Whether anything has used the (shared) snapshotter, which then has to be shut down
+        self._snapshots_used = False
+
+        # Commands that run on the event loop, and get the connection they came from
+        self._inline: Dict[str, Callable[..., Tuple[Exception|None, Any]]] = {
+            "ping": self._ping,
+            "subscribe": self._subscribe,
+            "unsubscribe": self._unsubscribe,
+            "daemon.status": self._status,
+            "daemon.stop": self._stop_command,
+            "metrics": self._metrics,
+            "snapshots.recent": self._snapshots_recent,
+            "snapshots.thumbnail": self._snapshots_thumbnail,
+        }
+        # Commands that run on the hardware thread
+        self._commands: Dict[str, Callable[..., Tuple[Exception|None, Any]]] = {
+            "display.on": self._display_on,
+            "display.off": self._display_off,
+            "display.state": self._display_state,
+            "led.fl-on": self._flashlight_on,
+            "led.fl-off": self._flashlight_off,
+            "led.animate": self._led_animate,
+            "led.stop": self._led_stop,
+            "camera.record": self._camera_record,
+            "camera.stop": self._camera_stop,
+            "ai.infer": self._ai_infer,
+            "ai.standby": self._ai_standby,
+            "ai.stop": self._ai_stop,
+            "ai.status": self._ai_status,
+        }
+
+        self._worker = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="daemon-hardware")
+        self._connections: Set[_Connection] = set()
+        self._subscriber_counts: Dict[str, int] = {}
+        self._loop = None
+        self._stopped = None
+        self._watcher = None
+        self._exporters = []
+
+    #########################################################################################################
+    ####################### SERVING #########################################################################
+    #########################################################################################################
+    def run(self) -> Exception|None:
+        """
+        Serve until stopped.
+        """
+        return asyncio.run(self.serve())
+
+    def stop(self):
+        """
+        Stop serving. Safe to call from any thread.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    def _claim_socket(self) -> Exception|None:
+        """
+        Remove a socket left behind by a daemon that is no longer running.
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except ConnectionRefusedError:
+            os.unlink(self.path)
+            return None
+        finally:
+            probe.close()
+        return RuntimeError(f"Another daemon is already listening on {self.path}")
+
+    async def serve(self) -> Exception|None:
+        """
+        Serve requests until stopped.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        err = self._claim_socket()
+        if err:
+            return err
+
+        server = await asyncio.start_unix_server(self._handle_connection, path=self.path)
+        os.chmod(self.path, 0o660)
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                self._loop.add_signal_handler(signum, self._stopped.set)
+        self._start_config_watcher()
+        self._start_metrics()
+        self._start_scheduler()
+        await self._loop.run_in_executor(self._worker, self._start_telemetry)
+        log.info("podapp daemon listening on %s", self.path)
+        self.ready.set()
+
+        try:
+            async with server:
+                await self._stopped.wait()
+        finally:
+            log.info("podapp daemon shutting down...")
+            for exporter in self._exporters:
+                exporter.shutdown()
+            self._exporters = []
+            for conn in list(self._connections):
+                conn.writer.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            # Not on the hardware thread, since the scheduler's controls wait on it
+            if self.scheduler is not None:
+                await self._loop.run_in_executor(None, self.scheduler.shutdown)
+                self.scheduler = None
+            await self._loop.run_in_executor(self._worker, self._shutdown_hardware)
+            self._worker.shutdown()
+            self._loop = None
+        return None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn = _Connection(writer, self.queue_size)
+        self._connections.add(conn)
+        sender = asyncio.create_task(self._send_events(conn))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    response = {"id": None, "ok": False, "error": "Malformed request"}
+                else:
+                    response = await self._dispatch(conn, message)
+                writer.write(client.encode(response))
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # Client went away, or sent a line longer than the stream's limit
+            pass
+        finally:
+            self._unsubscribe(conn, conn.topics)
+            self._connections.discard(conn)
+            sender.cancel()
+            writer.close()
+
+    async def _dispatch(self, conn: _Connection, message: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Run one request and return its response.
+        """
+        request_id = message.get("id")
+        command = message.get("cmd")
+        args = message.get("args") or {}
+        try:
+            if command in self._inline:
+                err, result = self._inline[command](conn, **args)
+            elif command in self._commands:
+                err, result = await self._loop.run_in_executor(self._worker, functools.partial(self._commands[command], **args))
+            else:
+                err, result = ValueError(f"Unknown command: {command}"), None
+        except Exception as e:
+            log.error("Command '%s' raised an exception: %s", command, e)
+            err, result = e, None
+
+        if err:
+            return {"id": request_id, "ok": False, "error": str(err)}
+        return {"id": request_id, "ok": True, "result": result}
+
+    async def _send_events(self, conn: _Connection):
+        while True:
+            line = await conn.events.get()
+            conn.writer.write(line)
+            await conn.writer.drain()
+
+    def publish(self, topic: str, data: Any):
+        """
+        Send an event to every connection subscribed to `topic`. Safe to call from any thread.
+        """
+        loop = self._loop
+        if loop is not None and self._subscriber_counts.get(topic):
+            loop.call_soon_threadsafe(self._publish, topic, data)
+
+    def _publish(self, topic: str, data: Any):
+        line = client.encode({"event": topic, "data": data})
+        for conn in self._connections:
+            if topic in conn.topics:
+                try:
+                    conn.events.put_nowait(line)
+                except asyncio.QueueFull:
+                    conn.dropped += 1
+
+    def _start_config_watcher(self):
+        """
+        Apply configuration changes to the hardware that can take them, and tell subscribers.
+        """
+        if self.config_poll_s <= 0:
+            return
+
+        try:
+            self._watcher = appconfig.ConfigWatcher(self.config_fpath, config=None if isinstance(self.config, dict) else self.config)
+        except (OSError, appconfig.ConfigError) as e:
+            log.warning("Not watching the configuration file for changes: %s", e)
+            return
+
+        self._watcher.subscribe("screen", lambda section: self._worker.submit(self._reconfigure, "display", section))
+        self._watcher.subscribe("leds", lambda section: self._worker.submit(self._reconfigure, "strips", section))
+        for name in appconfig.AppConfig.__dataclass_fields__:
+            self._watcher.subscribe(name, lambda section, name=name: self.publish("config", {"section": name}))
+        self._watcher.start(self.config_poll_s)
+
+    def _start_metrics(self):
+        """
+        Publish the system's and the daemon's own health, and start the configured exporters.
+        """
+        system.register_metrics()
+        metrics.gauge("daemon_connections", "Clients connected to the daemon", fn=lambda: len(self._connections))
+        metrics.gauge("daemon_events_dropped", "Events dropped because a subscriber fell behind, across the connected subscribers",
+                        fn=lambda: sum(c.dropped for c in self._connections))
+        metrics.counter("log_records_dropped", "Log records dropped because the log writer fell behind", fn=lambda: log.stats()["dropped"])
+        metrics.counter("log_records_suppressed", "Log records suppressed by rate limiting", fn=lambda: log.stats()["suppressed"])
+
+        err, self._exporters = metrics.start_exporters(self.config)
+        if err:
+            log.warning("Could not start exporting metrics: %s", err)
+
+    def _start_scheduler(self):
+        """
+        Keep the hardware within the power budget, if configured to. The scheduler ticks on its own thread,
+        but turns things on and off on the hardware thread, like any other command.
+        """
+        budget_config = appconfig.section(self.config, appconfig.PowerBudgetConfig)
+        if not budget_config.enabled:
+            return
+
+        def on_hardware_thread(fn: Callable) -> Callable:
+            return lambda: self._worker.submit(fn).result()
+
+        controls = {
+            "ai": (self._ai_wake, self._ai_sleep),
+            "camera": (lambda: None, self._cameras_off),
+            "display": (lambda: self._get_display().turn_on(), lambda: self._get_display().turn_off()),
+            "flashlight": (lambda: self._get_flashlight().turn_on(), lambda: self._get_flashlight().turn_off()),
+        }
+        controls = {name: tuple(on_hardware_thread(fn) for fn in fns) for name, fns in controls.items()}
+        self.scheduler = scheduler.from_config(self.config, controls)
+        self.scheduler.start(budget_config.tick_seconds)
+
+    def _start_telemetry(self):
+        """
+        Poll the sensors behind the MCU in the background, if configured to.
+        """
+        if not appconfig.section(self.config, appconfig.TelemetryConfig).enabled:
+            return
+
+        self.telemetry = sensor_telemetry.Telemetry(self.config, mcu.MCU.shared(self.config))
+        self.telemetry.start()
+
+    def _reconfigure(self, attribute: str, section):
+        device = getattr(self, attribute)
+        if device is not None:
+            device.reconfigure(section)
+
+    def _shutdown_hardware(self):
+        if self._watcher is not None:
+            self._watcher.shutdown()
+        self._ai_stop()
+        for camera in self.cameras.values():
+            camera.shutdown()
+        if self.telemetry is not None:
+            self.telemetry.shutdown()
+        if self.strips is not None:
+            self.strips.shutdown()
+        # After everything that talks to the MCU
+        if self.telemetry is not None or self.strips is not None:
+            mcu.MCU.shutdown_shared()
+        if self.flashlight is not None:
+            self.flashlight.shutdown()
+        if self.display is not None:
+            self.display.shutdown()
+        if self._snapshots_used:
+            snapshots.Snapshotter.shutdown_shared()
+
+    #########################################################################################################
+    ####################### INLINE COMMANDS #################################################################
+    #########################################################################################################
+    def _ping(self, conn: _Connection) -> Tuple[Exception|None, Any]:
+        return (None, {"version": __version__, "uptime_s": time.monotonic() - self.started_s})
+
+    def _subscribe(self, conn: _Connection, topics) -> Tuple[Exception|None, Any]:
+        unknown = [t for t in topics if t not in TOPICS]
+        if unknown:
+            return (ValueError(f"Unknown topics: {unknown}. Choose from {TOPICS}"), None)
+
+        for topic in set(topics) - conn.topics:
+            conn.topics.add(topic)
+            self._subscriber_counts[topic] = self._subscriber_counts.get(topic, 0) + 1
+        return (None, sorted(conn.topics))
+
+    def _unsubscribe(self, conn: _Connection, topics) -> Tuple[Exception|None, Any]:
+        for topic in set(topics) & conn.topics:
+            conn.topics.discard(topic)
+            self._subscriber_counts[topic] -= 1
+        return (None, sorted(conn.topics))
+
+    def _status(self, conn: _Connection) -> Tuple[Exception|None, Any]:
+        return (None, {
+            "uptime_s": time.monotonic() - self.started_s,
+            "connections": len(self._connections),
+            "subscribers": {topic: n for topic, n in self._subscriber_counts.items() if n},
+            "events_dropped": sum(c.dropped for c in self._connections),
+            "log": log.stats(),
+            "ai_running": self.hailoproc is not None,
+            "cameras_streaming": sorted(name for name, camera in self.cameras.items() if camera.pipeline is not None),
+            "leds_running": self.strips is not None and self.strips.running,
+            "telemetry_running": self.telemetry is not None,
+        })
+
+    def _metrics(self, conn: _Connection) -> Tuple[Exception|None, Any]:
+        return (None, metrics.REGISTRY.render())
+
+    def _get_snapshotter(self):
+        if not appconfig.section(self.config, appconfig.SnapshotsConfig).enabled:
+            return (RuntimeError("Snapshots are turned off in the configuration"), None)
+        self._snapshots_used = True
+        return (None, snapshots.Snapshotter.shared(self.config))
+
+    def _snapshots_recent(self, conn: _Connection, n: int|None = None) -> Tuple[Exception|None, Any]:
+        err, snapshotter = self._get_snapshotter()
+        if err:
+            return (err, None)
+        return (None, [dict(info, cached=info["id"] in snapshotter.cache) for info in snapshotter.recent(n)])
+
+    def _snapshots_thumbnail(self, conn: _Connection, id: str) -> Tuple[Exception|None, Any]:
+        # Only ever from memory, so this is fine on the event loop
+        err, snapshotter = self._get_snapshotter()
+        if err:
+            return (err, None)
+        jpeg = snapshotter.thumbnail(id)
+        if jpeg is None:
+            return (KeyError(f"Snapshot {id} is not cached"), None)
+        return (None, base64.b64encode(jpeg).decode('ascii'))
+
+    def _stop_command(self, conn: _Connection) -> Tuple[Exception|None, Any]:
+        # After this response has gone out
+        self._loop.call_soon(self._stopped.set)
+        return (None, None)
+
+    #########################################################################################################
+    ####################### HARDWARE COMMANDS ###############################################################
+    #########################################################################################################
+    def _get_display(self):
+        if self.display is None:
+            self.display = screen.Display(self.config)
+        return self.display
+
+    def _display_on(self) -> Tuple[Exception|None, Any]:
+        # If the display is on-demand, the scheduler turns it back off once it hasn't been asked for in a while
+        if self.scheduler is not None and "display" in self.scheduler.components:
+            self.scheduler.notify("display")
+        return (self._get_display().turn_on(), None)
+
+    def _display_off(self) -> Tuple[Exception|None, Any]:
+        return (self._get_display().turn_off(), None)
+
+    def _display_state(self) -> Tuple[Exception|None, Any]:
+        return self._get_display().on()
+
+    def _get_flashlight(self):
+        if self.flashlight is None:
+            self.flashlight = leds.FlashLight(self.config)
+        return self.flashlight
+
+    def _flashlight_on(self) -> Tuple[Exception|None, Any]:
+        return (self._get_flashlight().turn_on(), None)
+
+    def _flashlight_off(self) -> Tuple[Exception|None, Any]:
+        return (self._get_flashlight().turn_off(), None)
+
+    def _led_animate(self, effect: str, duration_s: float|None = None) -> Tuple[Exception|None, Any]:
+        if effect not in leds.EFFECTS:
+            return (ValueError(f"Unknown effect: {effect}"), None)
+
+        if self.strips is None:
+            self.strips = leds.LEDStrips(self.config)
+        self.strips.play(leds.EFFECTS[effect]())
+        if not self.strips.running:
+            self.strips.start()
+
+        # A later animation cancels this one's timeout
+        self._led_generation += 1
+        if duration_s is not None:
+            stop = functools.partial(self._worker.submit, self._led_stop, self._led_generation)
+            self._loop.call_soon_threadsafe(self._loop.call_later, float(duration_s), stop)
+        return (None, None)
+
+    def _led_stop(self, generation: int|None = None) -> Tuple[Exception|None, Any]:
+        if self.strips is None or (generation is not None and generation != self._led_generation):
+            return (None, None)
+
+        self.strips.shutdown()
+        return (None, self.strips.stats())
+
+    def _get_camera(self, camera: str):
+        if camera not in ("front", "rear"):
+            return (ValueError(f"Unknown camera: {camera}"), None)
+
+        if camera not in self.cameras:
+            self.cameras[camera] = cameras.FrontCamera(self.config) if camera == "front" else cameras.RearCamera(self.config)
+        return (None, self.cameras[camera])
+
+    def _camera_record(self, camera: str, fpath: str) -> Tuple[Exception|None, Any]:
+        err, device = self._get_camera(camera)
+        if err:
+            return (err, None)
+        if device.pipeline is not None:
+            return (RuntimeError(f"The {camera} camera is already streaming"), None)
+        return (device.stream_to_file(fpath), None)
+
+    def _camera_stop(self, camera: str) -> Tuple[Exception|None, Any]:
+        err, device = self._get_camera(camera)
+        if err:
+            return (err, None)
+        return (device.stop_streaming(), None)
+
+    def _new_hailoproc(self, model: str, source: str, *steps: Callable):
+        """
+        Replace the AI pipeline with a new one for the given model and source.
+        Each of `steps` gets the new `AICoprocessor` and returns an error (or None).
+        """
+        self._ai_stop()
+        hailoproc = ai.AICoprocessor(self.config)
+        self._snapshots_used |= hailoproc.snapshotter is not None
+        hailoproc.add_results_callback(self._on_results)
+        for step in (lambda h: h.set_source(source), lambda h: h.set_model(ai.AIModelType(model))) + steps:
+            err = step(hailoproc)
+            if err:
+                hailoproc.shutdown()
+                return err
+
+        self.hailoproc = hailoproc
+        return None
+
+    def _ai_infer(self, model: str, source: str, outfpath: str|None = None, multiplex: int|None = None) -> Tuple[Exception|None, Any]:
+        steps = [lambda h: h.set_sinks(outfpath if outfpath is not None else "display")]
+        if multiplex is not None:
+            steps.append(lambda h: h.set_camera_mux(cameras.CameraMux.shared(self.config), multiplex))
+        err = self._new_hailoproc(model, source, *steps)
+        if err:
+            return (err, None)
+
+        self.hailoproc.start()
+        return (None, None)
+
+    def _ai_standby(self, model: str, source: str) -> Tuple[Exception|None, Any]:
+        wake_config = appconfig.section(self.config, appconfig.WakeConfig)
+        err = self._new_hailoproc(model, source, lambda h: h.set_sinks("null", sync=True))
+        if err:
+            return (err, None)
+
+        err = self.hailoproc.standby(timeout_s=wake_config.preroll_timeout_seconds)
+        if err:
+            self._ai_stop()
+            return (err, None)
+
+        pin = appconfig.section(self.config, appconfig.WakePinsConfig).activity.pin
+        # Wake on the hardware thread, like everything else that touches the pipeline
+        self._wake_watch = self.hailoproc.wake_on_edge(pin, gpio.Edge[wake_config.edge], debounce_ms=wake_config.debounce_ms, submit=self._worker.submit)
+        return (None, {"pin": pin})
+
+    def _ai_wake(self) -> Exception|None:
+        """
+        Power scheduler control: wake the AI pipeline, if there is one.
+        """
+        if self.hailoproc is None:
+            return None
+        return self.hailoproc.wake()
+
+    def _ai_sleep(self) -> Exception|None:
+        """
+        Power scheduler control: put the AI pipeline (if any) in standby, rather than tearing it down,
+        so that waking it again is quick.
+        """
+        if self.hailoproc is None or not self.hailoproc.awake:
+            return None
+        wake_config = appconfig.section(self.config, appconfig.WakeConfig)
+        return self.hailoproc.standby(timeout_s=wake_config.preroll_timeout_seconds)
+
+    def _cameras_off(self) -> Exception|None:
+        """
+        Power scheduler control: stop any camera that is streaming. Cameras only start when asked to.
+        """
+        for camera in self.cameras.values():
+            if camera.pipeline is not None:
+                err = camera.stop_streaming()
+                if err:
+                    return err
+        return None
+
+    def _ai_stop(self) -> Tuple[Exception|None, Any]:
+        if self._wake_watch is not None:
+            gpio.remove_edge_callback(self._wake_watch)
+            self._wake_watch = None
+        if self.hailoproc is not None:
+            self.hailoproc.shutdown()
+            self.hailoproc = None
+        return (None, None)
+
+    def _ai_status(self) -> Tuple[Exception|None, Any]:
+        hailoproc = self.hailoproc
+        if hailoproc is None:
+            return (None, {"running": False})
+
+        wake = hailoproc.wakes[-1] if hailoproc.wakes else None
+        return (None, {
+            "running": True,
+            "model": hailoproc.model_type.value if hailoproc.model_type is not None else None,
+            "awake": hailoproc.awake,
+            "frames_processed": hailoproc.frames_processed,
+            "last_wake_ms": wake.latencies_ms() if wake is not None else None,
+            "inference_stride": hailoproc.inference_stride,
+            "thermal_level": hailoproc.thermal.level if hailoproc.thermal is not None else None,
+            "temperature_c": hailoproc.thermal.temperature_c if hailoproc.thermal is not None else None,
+            "adaptive_rung": hailoproc.adaptive.rung if hailoproc.adaptive is not None else None,
+            "latency_ms": hailoproc.adaptive.latency_s * 1000 if hailoproc.adaptive is not None and hailoproc.adaptive.latency_s is not None else None,
+            "tracks": len(hailoproc.tracker.tracks()) if hailoproc.tracker is not None else None,
+            "individuals": hailoproc.tracker.confirmed if hailoproc.tracker is not None else None,
+        })
+
+    def _on_results(self, records):
+        """
+        Results callback for the AI pipeline. Runs in the streaming thread.
+        """
+        hailoproc = self.hailoproc
+        if hailoproc is None:
+            return
+
+        if len(records) > 0 and self._subscriber_counts.get("detections"):
+            labels = hailoproc.results.labels if hailoproc.results is not None else {}
+            self.publish("detections", {
+                "timestamp": int(records[0]['timestamp']),
+                "camera": detections.CameraID(int(records[0]['camera'])).name,
+                "detections": [
+                    {
+                        "label": labels.get(int(r['class_id']), str(int(r['class_id']))),
+                        "score": round(float(r['score']), 3),
+                        "box": [round(float(v), 4) for v in r['box']],
+                    }
+                    for r in records
+                ],
+            })
+
+        if hailoproc.wakes:
+            wake = hailoproc.wakes[-1]
+            if wake is not self._published_wake and wake.first_detection_ns is not None:
+                self._published_wake = wake
+                self.publish("wake", wake.latencies_ms())
@@ -1,40 +1,24 @@
 """
+Main entry to the application.
+
+This runs the resident daemon (see `daemon.py`), which owns the hardware and serves
+`podapp-cli` over a Unix socket until it gets SIGINT or SIGTERM. The power and
+performance profile is run with `podapp-cli profile`.
 """
-from typing import Any
-from typing import List
-import functools
-import os
-import signal
+import sys
 from ..libraries.common import appconfig
 from ..libraries.common import log
 from ..libraries.gstreamer_utils import utils as gst_utils
-from ..libraries.coprocessors import ai
-from ..libraries.outputs import leds
-from ..libraries.outputs import screen
-from ..libraries.sensors import cameras
-
-def _clean_exit(hardware_objects: List[Any]):
-    """
-    Shut down the application cleanly by calling 'shutdown()' on each object.
-    """
-    log.info("CTRL-C being handled. Shutting down all hardware objects...")
-    for o in hardware_objects:
-        if hasattr(o, 'shutdown'):
-            o.shutdown()
-
-def _read_power_number() -> float:
-    power_val = None
-    while power_val is None:
-        power_val_raw = input("Enter power value: ")
-        try:
-            power_val = float(power_val_raw.strip())
-        except ValueError:
-            print("Cannot interpret the input as a number.")
-    return power_val
+from . import daemon
 
 def main():
-    # Parse the config file
-    config = appconfig.load_config_file()
+    # Parse the config file and make sure every section of it is valid before touching any hardware.
+    # The components get the compiled config, so each of their `appconfig.section()` calls is a lookup.
+    try:
+        config = appconfig.compile_config(appconfig.load_config_file())
+    except appconfig.ConfigError as e:
+        print(f"Bad configuration file: {e}", file=sys.stderr)
+        sys.exit(1)
 
     # Set up logging
     log.init(config)
@@ -43,125 +27,10 @@ def main():
     # Initialize fundamental systems
     gst_utils.configure(config)
 
-    # Initialize all the hardware singletons
-    hailoproc = ai.AICoprocessor(config)
-    flashlight = leds.FlashLight(config)
-    display = screen.Display(config)
-    front_camera = cameras.FrontCamera(config)
-    rear_camera = cameras.RearCamera(config)
-
-    # Set up signal handler for SIGINT (Ctrl-C)
-    signal_handler = functools.partial(_clean_exit, hardware_objects=[hailoproc, flashlight, display, front_camera, rear_camera])
-    signal.signal(signal.SIGINT, signal_handler)
-
-    # For now, run a simple sequence to test the power draw
-    print("TURNING OFF DISPLAY...")
-    err = display.turn_off()
-    if err:
-        log.error(f"Error when turning off the display: {err}")
-   
-    print("IDLING...")
-    power_draw_idle = _read_power_number()
-
-    ## Screen
-    print("TURNING ON SCREEN...")
-    err = display.turn_on()
-    if err:
-        log.error(f"Error when turning on the display: {err}")
-
-    power_draw_screen_only = _read_power_number()
-
-    print("TURNING OFF DISPLAY...")
-    err = display.turn_off()
-    if err:
-        log.error(f"Error when turning off the display: {err}")
-
-    ## Camera
-    print("STREAMING CAMERA TO FILE...")
-    video_fpath = "./scratch-video.h264"
-    err = rear_camera.stream_to_file(video_fpath)
-    if err:
-        log.error(f"Error when trying to stream the camera output to a file: {err}")
-
-    power_draw_camera_only = _read_power_number()
-
-    print("STOP STREAMING...")
-    err = rear_camera.stop_streaming()
-    if err:
-        log.error(f"Error when trying to stop the camera: {err}")
-
-    ## AI Module
-    err = hailoproc.set_source(video_fpath)
-    if err:
-        log.error(f"Could not set the AI pipeline source URI: {err}")
-
-    err = hailoproc.set_model(ai.AIModelType.OBJECT_DETECTION_YOLO_V8)
+    err = daemon.Daemon(config).run()
     if err:
-        log.error(f"Could not set the AI pipeline model: {err}")
-
-    inference_overlaid_fpath = "./scratch-video-overlaid.h264"
-    err = hailoproc.set_sinks(inference_overlaid_fpath)
-    if err:
-        log.error(f"Could not set the AI pipeline sink URI: {err}")
-
-    print("SETTING AI PARAMETERS:")
-    print(f"  SOURCE: {video_fpath}")
-    print(f"  MODEL:  {ai.AIModelType.OBJECT_DETECTION_YOLO_V8}")
-    print(f"  SINKS:  {inference_overlaid_fpath}")
-
-    print("STARTING MODEL PIPELINE...")
-    hailoproc.start(loop=True)
-    power_draw_hailo_only = _read_power_number()
-    print("STOPPING MODEL PIPELINE...")
-    hailoproc.stop()
-
-    ## All at once
-    ### Display
-    print("TURNING ON DISPLAY...")
-    err = display.turn_on()
-    if err:
-        log.error(f"Cannot turn on display: {err}")
-
-    ### AI and camera
-    err = hailoproc.set_source(rear_camera.cam_id)
-    if err:
-        log.error(f"Could not set the AI pipeline source URI: {err}")
-
-    err = hailoproc.set_model(ai.AIModelType.OBJECT_DETECTION_YOLO_V8)
-    if err:
-        log.error(f"Could not set the AI pipeline model: {err}")
-
-    err = hailoproc.set_sinks(inference_overlaid_fpath)
-    if err:
-        log.error(f"Could not set the AI pipeline sink URI: {err}")
-
-    print("SETTING AI PARAMETERS:")
-    print(f"  SOURCE: {rear_camera.cam_id}")
-    print(f"  MODEL:  {ai.AIModelType.OBJECT_DETECTION_YOLO_V8}")
-    print(f"  SINKS:  {inference_overlaid_fpath}")
-
-    print("STARTING MODEL PIPELINE...")
-    hailoproc.start()
-
-    ### Read power measurement
-    power_draw_experimental_total = _read_power_number()
-
-    ### Turn everything off
-    print("TURNING EVERYTHING OFF...")
-    hailoproc.stop()
-    rear_camera.shutdown()
-    display.turn_off()
-
-    # Clean up after ourselves
-    os.remove(video_fpath)
-
-    summed_total = sum([power_draw_screen_only - power_draw_idle, power_draw_camera_only - power_draw_idle, power_draw_hailo_only - power_draw_idle])
-    print("Totals:")
-    print(f"  Screen..............  {power_draw_screen_only}")
-    print(f"  Camera..............  {power_draw_camera_only}")
-    print(f"  AI Module...........  {power_draw_hailo_only}")
-    print(f"  Calculated Total....  {summed_total}")
-    print(f"  Experimental Total..  {power_draw_experimental_total}")
+        log.error("Error running the daemon: %s", err)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
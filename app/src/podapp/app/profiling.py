@@ -0,0 +1,243 @@
+"""
+Unattended power and performance profiling.
+
+Runs the pod through a fixed set of scenarios (idle, screen only, camera to file,
+AI only, everything on), each for a fixed duration. While each scenario runs, we
+periodically sample the power draw (from a power meter), CPU utilization,
+temperature, our memory usage and the pipeline's frame rate. The results are
+written to `<outdir>/profile.json` (per-scenario summary) and
+`<outdir>/profile.csv` (every sample).
+"""
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+import collections
+import csv
+import json
+import os
+import time
+from ..libraries.common import log
+from ..libraries.coprocessors import ai
+from ..libraries.outputs import screen
+from ..libraries.sensors import cameras
+from ..libraries.sensors import power
+from ..libraries.sensors import system
+
+# `start` returns an Exception or None, `stop` returns nothing, and `frames` returns
+# the number of frames the scenario's pipeline has produced so far (or None if there is no pipeline).
+Scenario = collections.namedtuple("Scenario", "name start stop frames")
+
+SCENARIO_NAMES = ("idle", "screen", "camera", "ai", "all")
+SAMPLE_FIELDS = ("scenario", "elapsed_s", "power_w", "cpu_fraction", "temperature_c", "rss_bytes", "fps")
+
+class _FrameCounter:
+    """
+    Counts the buffers coming out of a pipeline element.
+    """
+    def __init__(self) -> None:
+        self.frames = 0
+
+    def __call__(self, pts) -> bool:
+        self.frames += 1
+        return True
+
+def build_scenarios(hailoproc: ai.AICoprocessor, display: screen.Display, camera: cameras.Camera, video_fpath: str) -> List[Scenario]:
+    """
+    Build the standard set of scenarios. They should be run in order, since the AI scenario
+    uses the video that the camera scenario records (see `check_scenarios()`).
+    """
+    camera_frames = _FrameCounter()
+    hailoproc.add_results_callback(lambda records: None)  # Just so that the pipeline counts frames
+
+    def start_idle():
+        return display.turn_off()
+
+    def start_screen():
+        return display.turn_on()
+
+    def start_camera():
+        err = camera.stream_to_file(video_fpath)
+        if err:
+            return err
+        camera_frames.frames = 0
+        if camera.pipeline is not None:
+            camera.pipeline.add_buffer_probe("source", camera_frames)
+        return None
+
+    def start_ai(source_uri: str, loop: bool):
+        hailoproc.clear()
+        err = hailoproc.set_source(source_uri)
+        if err:
+            return err
+        err = hailoproc.set_model(ai.AIModelType.OBJECT_DETECTION_YOLO_V8)
+        if err:
+            return err
+        err = hailoproc.set_sinks("null", sync=False)
+        if err:
+            return err
+        hailoproc.start(loop=loop)
+        return None
+
+    def start_all():
+        err = display.turn_on()
+        if err:
+            return err
+        return start_ai(camera.cam_id, loop=False)
+
+    def stop_ai():
+        hailoproc.shutdown()
+
+    def start_recorded_ai():
+        if not os.path.isfile(video_fpath):
+            return FileNotFoundError(f"No video at {video_fpath}: the 'camera' scenario did not record one")
+        return start_ai(video_fpath, loop=True)
+
+    return [
+        Scenario("idle", start_idle, lambda: None, lambda: None),
+        Scenario("screen", start_screen, display.turn_off, lambda: None),
+        Scenario("camera", start_camera, camera.stop_streaming, lambda: camera_frames.frames),
+        Scenario("ai", start_recorded_ai, stop_ai, lambda: hailoproc.frames_processed),
+        Scenario("all", start_all, lambda: (stop_ai(), display.turn_off()), lambda: hailoproc.frames_processed),
+    ]
+
+def check_scenarios(scenario_names) -> Exception|None:
+    """
+    Make sure the given scenarios (by name) exist and can run together.
+    """
+    unknown = [name for name in scenario_names if name not in SCENARIO_NAMES]
+    if unknown:
+        return ValueError(f"Unknown profiling scenarios: {', '.join(unknown)}")
+    if "ai" in scenario_names and "camera" not in scenario_names:
+        return ValueError("The 'ai' scenario profiles the video that the 'camera' scenario records, so it needs the 'camera' scenario too")
+    return None
+
+def profile_scenario(scenario: Scenario, duration_s: float, period_s: float, meter, sysroot="/",
+                     clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> List[Dict[str, Any]]:
+    """
+    Run the given scenario for `duration_s` seconds, sampling every `period_s` seconds.
+    Returns the samples.
+    """
+    samples = []
+    err = scenario.start()
+    if err:
+        log.error("Could not start profiling scenario '%s': %s", scenario.name, err)
+        scenario.stop()
+        return samples
+
+    try:
+        cpu = system.CPUUsage(sysroot)
+        start_s = clock()
+        last_s = start_s
+        last_frames = scenario.frames()
+        while clock() - start_s < duration_s:
+            sleep(period_s)
+            now_s = clock()
+
+            err, watts = meter.read_watts()
+            if err:
+                log.warning("Could not read the power meter: %s", err)
+
+            frames = scenario.frames()
+            fps = None
+            if frames is not None and last_frames is not None and now_s > last_s:
+                fps = (frames - last_frames) / (now_s - last_s)
+
+            temperatures = system.read_temperatures_c(sysroot)
+            samples.append({
+                "scenario": scenario.name,
+                "elapsed_s": now_s - start_s,
+                "power_w": watts,
+                "cpu_fraction": cpu.sample(),
+                "temperature_c": max(temperatures) if temperatures else None,
+                "rss_bytes": system.read_rss_bytes(root=sysroot),
+                "fps": fps,
+            })
+            last_s, last_frames = now_s, frames
+    finally:
+        scenario.stop()
+
+    return samples
+
+def summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Return the mean, min and max of each metric over the given samples.
+    """
+    summary = {"samples": len(samples)}
+    for field in SAMPLE_FIELDS[2:]:
+        values = [s[field] for s in samples if s[field] is not None]
+        if values:
+            summary[field] = {"mean": sum(values) / len(values), "min": min(values), "max": max(values)}
+        else:
+            summary[field] = None
+    return summary
+
+def write_report(outdir: str, samples: List[Dict[str, Any]], summaries: Dict[str, Dict[str, Any]]):
+    """
+    Write the per-scenario summary as JSON and all the samples as CSV.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    report = {"scenarios": summaries}
+
+    # Compare the sum of the components' individual draw with everything running at once
+    def mean_power(name):
+        summary = summaries.get(name)
+        return summary['power_w']['mean'] if summary and summary['power_w'] else None
+
+    idle = mean_power("idle")
+    components = [mean_power(name) for name in ("screen", "camera", "ai")]
+    if idle is not None and None not in components:
+        report["calculated_total_w"] = idle + sum(c - idle for c in components)
+        report["experimental_total_w"] = mean_power("all")
+
+    with open(os.path.join(outdir, "profile.json"), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    with open(os.path.join(outdir, "profile.csv"), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SAMPLE_FIELDS)
+        writer.writeheader()
+        writer.writerows(samples)
+
+def run_profile(config: Dict[str, Any], outdir: str, duration_s: float, period_s: float, scenario_names=SCENARIO_NAMES, echo=print) -> Exception|None:
+    """
+    Run the given scenarios (by name) with the real hardware and write the report to `outdir`.
+    """
+    err = check_scenarios(scenario_names)
+    if err:
+        return err
+
+    err, meter = power.from_config(config)
+    if err:
+        return err
+
+    hailoproc = ai.AICoprocessor(config, store_detections=False)
+    display = screen.Display(config)
+    camera = cameras.RearCamera(config)
+
+    # Don't let the display blank itself in the middle of a scenario
+    display.timeout_seconds = 0
+    video_fpath = os.path.join(outdir, "scratch-video.h264")
+    os.makedirs(outdir, exist_ok=True)
+
+    samples = []
+    summaries = {}
+    try:
+        for scenario in build_scenarios(hailoproc, display, camera, video_fpath):
+            if scenario.name not in scenario_names:
+                continue
+            echo(f"Profiling '{scenario.name}' for {duration_s} s...")
+            scenario_samples = profile_scenario(scenario, duration_s, period_s, meter)
+            samples += scenario_samples
+            summaries[scenario.name] = summarize(scenario_samples)
+            if summaries[scenario.name]['power_w'] is not None:
+                echo(f"  mean power: {summaries[scenario.name]['power_w']['mean']:.3f} W")
+    finally:
+        hailoproc.shutdown()
+        camera.shutdown()
+        display.shutdown()
+        if os.path.isfile(video_fpath):
+            os.remove(video_fpath)
+
+    write_report(outdir, samples, summaries)
+    echo(f"Wrote report to {outdir}")
+    return None
@@ -0,0 +1,58 @@
+"""
+Measures how long the CLI takes to start, and which imports that time goes to,
+using Python's own import timing (`python -X importtime`).
+"""
+from typing import List
+from typing import Tuple
+import collections
+import os
+import subprocess
+import sys
+import time
+
+# One line of `-X importtime` output. `depth` is how deeply nested the import was (0 is top-level).
+ImportTime = collections.namedtuple("ImportTime", "name self_us cumulative_us depth")
+
+_PREFIX = "import time:"
+
+def parse_importtime(text: str) -> Tuple[List[ImportTime], List[str]]:
+    """
+    Split the stderr of a `python -X importtime` run into the import times and every other line.
+    """
+    times = []
+    other = []
+    for line in text.splitlines():
+        if not line.startswith(_PREFIX):
+            other.append(line)
+            continue
+
+        fields = line[len(_PREFIX):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # The header line
+            continue
+        name = fields[2].rstrip()[1:]
+        stripped = name.lstrip()
+        times.append(ImportTime(stripped, int(fields[0]), int(fields[1]), (len(name) - len(stripped)) // 2))
+    return times, other
+
+def total_import_us(times: List[ImportTime]) -> int:
+    """
+    Total time spent importing, in microseconds.
+    """
+    return sum(t.cumulative_us for t in times if t.depth == 0)
+
+def measure_imports(args: List[str]) -> Tuple[float, List[ImportTime]]:
+    """
+    Run the CLI with the given arguments in a fresh interpreter with import timing on.
+    Returns the wall clock time it took (seconds) and the import times. The command's
+    own output is passed through.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    start_s = time.perf_counter()
+    p = subprocess.run([sys.executable, "-X", "importtime", "-m", __package__ + ".cli"] + args, stderr=subprocess.PIPE, env=env, encoding='utf-8')
+    wall_s = time.perf_counter() - start_s
+
+    times, other = parse_importtime(p.stderr)
+    for line in other:
+        print(line, file=sys.stderr)
+    return wall_s, times
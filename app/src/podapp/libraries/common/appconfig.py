@@ -1,19 +1,278 @@
 """
 This module contains all the code for parsing the application's configuration file.
+
+`load_config_file()` returns the raw configuration (nested dicts of strings, as
+parsed by YAML's base loader). Parsing is skipped entirely when the file hasn't
+changed since the last time we parsed it (see `CACHE_DPATH`).
+
+`compile_config()` compiles all of it into immutable, typed, validated sections at
+once (an `AppConfig`), which is what we do at startup so that a bad configuration file
+fails early and says where it is bad. That compiled configuration is what we hand to
+the components, which get the sections they use with `section()` (e.g.,
+`section(config, MCUConfig)`). `section()` also compiles a section straight from the
+raw configuration, for tests and tools. `ConfigWatcher` reloads the file when it changes
+and tells only the subscribers whose sections changed.
+
+The section classes are defined in `sections.py`, which is only imported once one of
+them is used (as `appconfig.MCUConfig`, etc.), so that commands that never look at
+the configuration (e.g., `--help`) don't pay for defining them.
 """
 from typing import Any
+from typing import Callable
 from typing import Dict
+from typing import List
+import functools
+import marshal
 import os
-import yaml
+import threading
+import typing
+from . import lazy
+from . import log
+
+# Only needed when the cached parse is out of date
+yaml = lazy.load_module("yaml")
+# Only needed once the file is loaded, or a section is used
+dataclasses = lazy.load_module("dataclasses")
+hashlib = lazy.load_module("hashlib")
+sections = lazy.load_module(".sections", __package__)
 
 DEFAULT_CONFIG_FILE_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'appconfig.yaml')
 
-def load_config_file(fpath=DEFAULT_CONFIG_FILE_PATH) -> Dict[str, Any]:
+# Where we keep already-parsed configuration files
+CACHE_DPATH = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "creaturepod")
+
+def __getattr__(name: str):
+    if name.endswith("Config"):
+        return getattr(sections, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class ConfigError(ValueError):
+    """
+    The configuration file is missing something or has a bad value.
+    """
+    pass
+
+def _cache_fpath(fpath: str) -> str:
+    return os.path.join(CACHE_DPATH, "config-" + hashlib.sha1(os.path.abspath(fpath).encode()).hexdigest() + ".marshal")
+
+def _load_cached(fpath: str, stat: os.stat_result) -> Dict[str, Any]|None:
+    """
+    Return the cached parse of the given file, if it is still valid.
+    """
+    try:
+        with open(_cache_fpath(fpath), 'rb') as f:
+            cached = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if cached['mtime_ns'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+        return cached['raw']
+
+    # Touched but maybe not changed. If it wasn't, remember the new timestamp so that we
+    # don't have to read it again next time.
+    with open(fpath, 'rb') as f:
+        contents = f.read()
+    if hashlib.sha256(contents).hexdigest() == cached['sha256']:
+        _store_cached(fpath, stat, contents, cached['raw'])
+        return cached['raw']
+    return None
+
+def _store_cached(fpath: str, stat: os.stat_result, contents: bytes, raw: Dict[str, Any]):
+    try:
+        os.makedirs(CACHE_DPATH, exist_ok=True)
+        cache_fpath = _cache_fpath(fpath)
+        with open(cache_fpath + ".tmp", 'wb') as f:
+            marshal.dump({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": hashlib.sha256(contents).hexdigest(), "raw": raw}, f)
+        os.replace(cache_fpath + ".tmp", cache_fpath)
+    except OSError:
+        # No cache is no big deal (e.g., a read-only file system)
+        pass
+
+def load_config_file(fpath=DEFAULT_CONFIG_FILE_PATH, use_cache=True) -> Dict[str, Any]:
     """
     Load the configuration file and return the entire thing
     as a dict.
     """
-    with open(fpath, 'r') as f:
-        raw = yaml.load(f, Loader=yaml.BaseLoader)
+    stat = os.stat(fpath)
+    if use_cache:
+        raw = _load_cached(fpath, stat)
+        if raw is not None:
+            return raw
 
+    with open(fpath, 'rb') as f:
+        contents = f.read()
+    # libyaml's loader, if PyYAML was built with it, is several times faster
+    raw = yaml.load(contents, Loader=getattr(yaml, "CBaseLoader", yaml.BaseLoader))
+
+    if use_cache:
+        _store_cached(fpath, stat, contents, raw)
     return raw
+
+_TRUE = ("true", "yes", "on", "1")
+_FALSE = ("false", "no", "off", "0")
+
+def _convert(tp, raw, path: str, field: "dataclasses.Field|None" = None):
+    """
+    Convert a raw (string) value into the given type, validating it.
+    """
+    if dataclasses.is_dataclass(tp):
+        return _build(tp, raw, path)
+
+    origin = typing.get_origin(tp)
+    if origin is tuple:
+        if not isinstance(raw, list):
+            raise ConfigError(f"{path}: expected a list, got {raw!r}")
+        return tuple(_convert(typing.get_args(tp)[0], v, f"{path}[{i}]", field) for i, v in enumerate(raw))
+    if origin is dict:
+        if not isinstance(raw, dict):
+            raise ConfigError(f"{path}: expected a mapping, got {raw!r}")
+        return {str(k): _convert(typing.get_args(tp)[1], v, f"{path}.{k}", field) for k, v in raw.items()}
+
+    if not isinstance(raw, str):
+        raise ConfigError(f"{path}: expected a single value, got {raw!r}")
+    try:
+        if tp is bool:
+            if raw.lower() not in _TRUE + _FALSE:
+                raise ValueError(raw)
+            value = raw.lower() in _TRUE
+        elif tp is int:
+            value = int(raw, 0)
+        else:
+            value = tp(raw)
+    except ValueError:
+        raise ConfigError(f"{path}: expected {tp.__name__}, got {raw!r}") from None
+
+    metadata = field.metadata if field is not None else {}
+    if "choices" in metadata and value not in metadata["choices"]:
+        raise ConfigError(f"{path}: must be one of {metadata['choices']}, got {value!r}")
+    if "min" in metadata and value < metadata["min"]:
+        raise ConfigError(f"{path}: must be at least {metadata['min']}, got {value!r}")
+    if "max" in metadata and value > metadata["max"]:
+        raise ConfigError(f"{path}: must be at most {metadata['max']}, got {value!r}")
+    return value
+
+@functools.cache
+def _type_hints(cls) -> Dict[str, Any]:
+    return typing.get_type_hints(cls)
+
+def _build(cls, raw, path: str):
+    if not isinstance(raw, dict):
+        raise ConfigError(f"{path}: expected a mapping, got {raw!r}")
+
+    hints = _type_hints(cls)
+    kwargs = {}
+    for field in dataclasses.fields(cls):
+        key = field.metadata.get("key", field.name.replace('_', '-'))
+        if key not in raw:
+            if field.default is dataclasses.MISSING:
+                raise ConfigError(f"{path}.{key}: missing")
+            continue
+        kwargs[field.name] = _convert(hints[field.name], raw[key], f"{path}.{key}", field)
+    built = cls(**kwargs)
+
+    # Sections can check things that involve more than one field
+    check = getattr(built, "check", None)
+    problem = check() if check is not None else None
+    if problem:
+        raise ConfigError(f"{path}: {problem}")
+    return built
+
+T = typing.TypeVar("T")
+
+@functools.cache
+def _field_names() -> Dict[type, str]:
+    """
+    The name of the `AppConfig` field that holds each section class.
+    """
+    return {tp: name for name, tp in _type_hints(sections.AppConfig).items()}
+
+def section(config: "Dict[str, Any]|sections.AppConfig", cls: typing.Type[T]) -> T:
+    """
+    Get the part of the configuration that the given section class describes.
+
+    `config` is either the compiled configuration (see `compile_config()`), in which case
+    this is an attribute lookup, or the raw configuration, in which case the section is
+    compiled from it, which raises `ConfigError` if it is missing something or has a bad value.
+    """
+    if not isinstance(config, dict):
+        return getattr(config, _field_names()[cls])
+
+    raw = config
+    for key in cls.PATH:
+        raw = raw.get(key, {}) if isinstance(raw, dict) else {}
+    return _build(cls, raw, ".".join(cls.PATH))
+
+def compile_config(config: Dict[str, Any]) -> "sections.AppConfig":
+    """
+    Compile and validate every typed section of the (raw) configuration.
+    Raises `ConfigError` if any of them is missing something or has a bad value.
+    """
+    hints = _type_hints(sections.AppConfig)
+    return sections.AppConfig(**{field.name: section(config, hints[field.name]) for field in dataclasses.fields(sections.AppConfig)})
+
+class ConfigWatcher:
+    """
+    Reloads the configuration file when it changes and calls the subscribers
+    of the sections that changed (and only those) with their new section.
+    A file that doesn't compile is logged and otherwise ignored.
+
+    `config` is the file's already compiled configuration, if we have it.
+    """
+    def __init__(self, fpath=DEFAULT_CONFIG_FILE_PATH, config: "sections.AppConfig|None" = None) -> None:
+        self.fpath = fpath
+        self._mtime_ns = os.stat(fpath).st_mtime_ns
+        self.config = config if config is not None else compile_config(load_config_file(fpath))
+        self._subscribers: Dict[str, List[Callable]] = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self, name: str, callback: Callable):
+        """
+        Call `callback(new_section)` whenever the named section (an `AppConfig` field, e.g. "screen") changes.
+        """
+        if name not in sections.AppConfig.__dataclass_fields__:
+            raise ValueError(f"No such configuration section: {name}")
+        self._subscribers.setdefault(name, []).append(callback)
+
+    def check(self) -> List[str]:
+        """
+        Reload the file if it has changed. Returns the names of the sections that changed.
+        """
+        try:
+            mtime_ns = os.stat(self.fpath).st_mtime_ns
+            if mtime_ns == self._mtime_ns:
+                return []
+            self._mtime_ns = mtime_ns
+            new_config = compile_config(load_config_file(self.fpath))
+        except (OSError, yaml.YAMLError, ConfigError) as e:
+            log.error("Could not reload the configuration file %s: %s", self.fpath, e)
+            return []
+
+        changed = [name for name in sections.AppConfig.__dataclass_fields__ if getattr(new_config, name) != getattr(self.config, name)]
+        self.config = new_config
+        for name in changed:
+            log.info("Configuration section '%s' changed", name)
+            for callback in self._subscribers.get(name, []):
+                callback(getattr(new_config, name))
+        return changed
+
+    def start(self, poll_s=2.0):
+        """
+        Check for changes every `poll_s` seconds in a background thread.
+        """
+        def run():
+            while not self._stop.wait(poll_s):
+                self.check()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """
+        Clean shutdown function.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,46 @@
+"""
+Lazily imported modules.
+
+A module loaded with `load_module()` is only actually imported the first time
+one of its attributes is used. This keeps things that most callers never touch
+(GStreamer, numpy, the AI stack) out of the startup path of the CLI.
+"""
+import importlib.util
+import sys
+import types
+
+class _MissingModule(types.ModuleType):
+    """
+    Stands in for a module that isn't installed. Using it raises the `ModuleNotFoundError`
+    that importing it would have, so that only the code that needs it fails.
+    """
+    def __getattr__(self, name: str):
+        raise ModuleNotFoundError(f"No module named '{self.__name__}'", name=self.__name__)
+
+def load_module(name: str, package: str|None = None) -> types.ModuleType:
+    """
+    Return the named module (relative to `package`, if given), without importing it yet.
+    If it has already been imported, it is returned as is. If it isn't installed, the
+    error is raised when it is first used.
+    """
+    fullname = importlib.util.resolve_name(name, package) if name.startswith('.') else name
+    if fullname in sys.modules:
+        return sys.modules[fullname]
+
+    try:
+        spec = importlib.util.find_spec(fullname)
+    except ModuleNotFoundError:
+        # A submodule of a package that isn't installed
+        spec = None
+    if spec is None:
+        return _MissingModule(fullname)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[fullname] = module
+    spec.loader.exec_module(module)
+
+    # Like a normal import, make the module an attribute of its package
+    parent, _, child = fullname.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
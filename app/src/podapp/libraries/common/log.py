@@ -1,81 +1,400 @@
 """
 Module for logging.
+
+Logging calls never write to the log file themselves. A record is put on a bounded
+queue and a single writer thread ("log-writer") formats it and writes it out, so a
+slow SD card holds up the writer instead of the GLib loop or a streaming thread.
+If the writer falls so far behind that the queue fills up, new records are dropped
+(and counted) rather than blocking the caller.
+
+Messages are formatted lazily: pass the arguments instead of an f-string, like
+`log.debug("Switched to %s in %.1f ms", name, ms)`, and they are only formatted (by the
+writer thread) if the record is actually logged. Each line of code may only log so many
+messages per second; the rest are counted and reported with the next one that gets through.
+
+The log file is rotated once it gets too big or too old, and the old one is gzipped
+in the background.
 """
 from typing import Any
 from typing import Dict
+from typing import List
+from typing import Tuple
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from . import lazy
+
+# Only needed once the log file is rotated
+gzip = lazy.load_module("gzip")
+shutil = lazy.load_module("shutil")
 
 LOGGER_NAME = "CREATUREPOD"
 ALLOWED_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+LOG_FORMAT = "[%(asctime)s:%(name)s:%(levelname)s]: %(message)s"
+
+_logger = logging.getLogger(LOGGER_NAME)
+
+def debug(msg: str, *args):
+    """
+    Log at the DEBUG level. `msg` is %-formatted with `args`, but only if it is logged.
+    """
+    _logger.debug(msg, *args, stacklevel=2)
+
+def info(msg: str, *args):
+    """
+    Log at the INFO level. `msg` is %-formatted with `args`, but only if it is logged.
+    """
+    _logger.info(msg, *args, stacklevel=2)
+
+def warning(msg: str, *args):
+    """
+    Log at the WARNING level. `msg` is %-formatted with `args`, but only if it is logged.
+    """
+    _logger.warning(msg, *args, stacklevel=2)
+
+def error(msg: str, *args):
+    """
+    Log at the ERROR level. `msg` is %-formatted with `args`, but only if it is logged.
+    """
+    _logger.error(msg, *args, stacklevel=2)
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `max_messages` records from each call site (file and line)
+    every `period_s` seconds. The next record from a call site after some were
+    suppressed says how many were.
+    """
+    def __init__(self, max_messages: int, period_s: float) -> None:
+        super().__init__()
+        self.max_messages = max_messages
+        self.period_s = period_s
+        self.suppressed = 0
+        self._lock = threading.Lock()
+        # (pathname, lineno) -> [window start, messages let through, messages suppressed]
+        self._sites: Dict[Tuple[str, int], List] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [record.created, 0, 0]
+            elif record.created - site[0] >= self.period_s:
+                site[0] = record.created
+                site[1] = 0
+
+            if site[1] >= self.max_messages:
+                site[2] += 1
+                self.suppressed += 1
+                return False
+
+            site[1] += 1
+            nsuppressed = site[2]
+            site[2] = 0
+
+        if nsuppressed:
+            # Rare, so it's fine to format this one here
+            record.msg = f"{record.getMessage()} [{nsuppressed} similar messages suppressed]"
+            record.args = None
+        return True
+
+class RotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    A file handler that rotates its file once it is at least `max_bytes` long or `rotate_s`
+    seconds old (either may be 0 to turn it off), keeping `backup_count` old files.
+    The old files are gzipped by a background thread, so rotating doesn't hold up the writer.
+    """
+    def __init__(self, fpath: str, max_bytes=0, rotate_s=0.0, backup_count=0) -> None:
+        super().__init__(fpath, mode='a', maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.rotate_s = rotate_s
+        self.rollover_at = time.time() + rotate_s if rotate_s > 0 else None
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._rotate
+        self._compressor = None
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.rollover_at is not None and record.created >= self.rollover_at:
+            return True
+        # Unlike the base class, don't format the record an extra time just to measure it.
+        # The file just ends up one record over `max_bytes`.
+        if self.maxBytes > 0 and self.stream is not None:
+            return self.stream.tell() >= self.maxBytes
+        return False
+
+    def doRollover(self):
+        # Shifting the old files along while the newest is still being compressed would lose it
+        self.wait_for_compression()
+        super().doRollover()
+        if self.rotate_s > 0:
+            self.rollover_at = time.time() + self.rotate_s
+
+    def _rotate(self, source: str, dest: str):
+        if not os.path.exists(source):
+            return
+        uncompressed = dest.removesuffix(".gz")
+        os.rename(source, uncompressed)
+        self._compressor = threading.Thread(target=_compress, args=(uncompressed, dest), name="log-compress", daemon=True)
+        self._compressor.start()
+
+    def wait_for_compression(self):
+        """
+        Wait for the last rotated file to be compressed.
+        """
+        if self._compressor is not None:
+            self._compressor.join()
+            self._compressor = None
+
+    def close(self):
+        super().close()
+        self.wait_for_compression()
 
-def debug(msg: str):
+def _compress(src: str, dest: str):
     """
-    Log at the DEBUG level.
+    Gzip `src` to `dest` and remove `src`.
     """
-    logging.getLogger(LOGGER_NAME).debug(msg)
+    try:
+        with open(src, 'rb') as fin, gzip.open(dest + ".part", 'wb') as fout:
+            shutil.copyfileobj(fin, fout)
+        os.replace(dest + ".part", dest)
+        os.remove(src)
+    except OSError:
+        # Leave the uncompressed file where it is; nothing is lost
+        pass
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue without formatting them and without ever blocking.
+    Records that don't fit are dropped.
+    """
+    def __init__(self, q: queue.Queue) -> None:
+        super().__init__(q)
+        self.dropped = 0
 
-def info(msg: str):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the writer thread. This means mutable arguments
+        # are formatted as they are when the record is written, not when it was logged.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _Writer(logging.handlers.QueueListener):
     """
-    Log at the INFO level.
+    The thread that takes records off the queue and hands them to the real handlers.
     """
-    logging.getLogger(LOGGER_NAME).info(msg)
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name="log-writer", daemon=True)
+        self._thread.start()
 
-def warning(msg: str):
+    def enqueue_sentinel(self):
+        # The queue may be full, and the sentinel must not be dropped
+        self.queue.put(self._sentinel)
+
+class _Pipeline:
     """
-    Log at the WARNING level.
+    A queue between a logger and its handlers, with a writer thread.
     """
-    logging.getLogger(LOGGER_NAME).warning(msg)
+    def __init__(self, logger: logging.Logger, handlers: List[logging.Handler], queue_size: int) -> None:
+        self.logger = logger
+        self.queue_handler = _QueueHandler(queue.Queue(maxsize=queue_size))
+        self.writer = _Writer(self.queue_handler.queue, *handlers, respect_handler_level=True)
+        self.writer.start()
+        self.logger.addHandler(self.queue_handler)
+
+    def add_handler(self, handler: logging.Handler):
+        # The writer only ever reads the tuple, so swapping it out is safe
+        self.writer.handlers = self.writer.handlers + (handler,)
 
-def error(msg: str):
+    def stop(self):
+        """
+        Write out everything that's queued, then stop the writer and close the handlers.
+        """
+        self.logger.removeHandler(self.queue_handler)
+        self.writer.stop()
+        for handler in self.writer.handlers:
+            handler.close()
+
+_pipeline: _Pipeline|None = None
+_rate_limit: RateLimitFilter|None = None
+
+def _section(config: Dict[str, Any]):
     """
-    Log at the ERROR level.
+    The logging section of the configuration. Returns (section, the problem with it or None),
+    falling back to the defaults if it is bad, since we can't refuse to log.
     """
-    logging.getLogger(LOGGER_NAME).error(msg)
+    # appconfig logs, so it can't be imported until it's needed
+    from . import appconfig
+    try:
+        return appconfig.section(config, appconfig.LoggingConfig), None
+    except appconfig.ConfigError as e:
+        return appconfig.LoggingConfig(), e
 
 def init(config: Dict[str, Any]):
     """
-    Initialize the logging set up.
+    Initialize the logging set up. Calling it again replaces the previous set up.
     """
-    raw_log_level = str(config['moduleconfig']['logging']['log-level'])
-    log_level = raw_log_level
-    if log_level not in ALLOWED_LEVELS:
-        # Default to ERROR level
-        log_level = "ERROR"
-        loglevel_invalid = True
-    else:
-        loglevel_invalid = False
+    shutdown()
+    logging_config, problem = _section(config)
 
     # Try to find the log file
-    raw_fpath = config['moduleconfig']['logging']['log-file-path']
-    fpath = raw_fpath
+    fpath = logging_config.log_file_path
     try:
         test = open(fpath, 'a')
         test.close()
         log_fpath_invalid = False
     except Exception as e:
-        fpath = config['moduleconfig']['logging']['log-file-path-dev']
+        fpath = logging_config.log_file_path_dev
         log_fpath_invalid = True
 
-    handler = logging.FileHandler(fpath, mode='a', encoding='utf-8')
-    handler.setLevel(getattr(logging, log_level))
-    handler.setFormatter(logging.Formatter("[%(asctime)s:%(name)s:%(levelname)s]: %(message)s"))
-    logging.getLogger(LOGGER_NAME).addHandler(handler)
+    handler = RotatingFileHandler(fpath, max_bytes=logging_config.max_bytes, rotate_s=logging_config.rotate_seconds, backup_count=logging_config.backup_count)
+    handler.setLevel(getattr(logging, logging_config.log_level))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    global _pipeline
+    global _rate_limit
+    _pipeline = _Pipeline(_logger, [handler], logging_config.queue_size)
+    if logging_config.rate_limit_messages > 0:
+        _rate_limit = RateLimitFilter(logging_config.rate_limit_messages, logging_config.rate_limit_seconds)
+        _logger.addFilter(_rate_limit)
 
     # Now log any errors we found in configuring the logger
-    if loglevel_invalid:
-        warning(f"Configuration file's 'log-level' is invalid. Value given: {raw_log_level}")
+    if problem:
+        warning("Configuration file's logging section is invalid, so using the defaults: %s", problem)
 
     if log_fpath_invalid:
-        warning(f"Configuration file's 'log-file-path' is invalid. Value given: {raw_fpath}")
+        warning("Configuration file's 'log-file-path' is invalid. Value given: %s", logging_config.log_file_path)
 
-    logging.getLogger(LOGGER_NAME).setLevel(log_level)
+    _logger.setLevel(logging_config.log_level)
 
 def enable_logging_to_console(config: Dict[str, Any]):
     """
     Enable logging to the console. Assumes that 'init' has been called already.
     """
-    if config['moduleconfig']['logging']['log-to-console']:
+    logging_config, _ = _section(config)
+    if logging_config.log_to_console:
         handler = logging.StreamHandler()
-        handler.setLevel(logging.getLogger(LOGGER_NAME).level)
-        handler.setFormatter(logging.Formatter("[%(asctime)s:%(name)s:%(levelname)s]: %(message)s"))
-        logging.getLogger(LOGGER_NAME).addHandler(handler)
+        handler.setLevel(_logger.level)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        if _pipeline is not None:
+            _pipeline.add_handler(handler)
+        else:
+            _logger.addHandler(handler)
+
+def stats() -> Dict[str, int]:
+    """
+    How many records have been dropped (because the writer fell behind) and suppressed
+    (by rate limiting) since `init()`.
+    """
+    return {
+        "dropped": _pipeline.queue_handler.dropped if _pipeline is not None else 0,
+        "suppressed": _rate_limit.suppressed if _rate_limit is not None else 0,
+    }
+
+def shutdown():
+    """
+    Write out everything that has been logged and stop the writer thread.
+    Until `init()` is called again, only warnings and errors are logged (to stderr).
+    """
+    global _pipeline
+    global _rate_limit
+    if _pipeline is not None:
+        dropped = _pipeline.queue_handler.dropped
+        if dropped:
+            # Goes straight to the handlers, since the queue is what dropped them
+            record = _logger.makeRecord(_logger.name, logging.WARNING, __file__, 0, "%d log records were dropped because the log writer fell behind", (dropped,), None)
+            _pipeline.writer.handle(record)
+        _pipeline.stop()
+        _pipeline = None
+    if _rate_limit is not None:
+        _logger.removeFilter(_rate_limit)
+        _rate_limit = None
+
+atexit.register(shutdown)
+
+class _SlowFileHandler(logging.FileHandler):
+    """
+    A file handler that takes at least `delay_s` for every write, like a slow SD card.
+    """
+    def __init__(self, fpath: str, delay_s: float) -> None:
+        super().__init__(fpath, mode='a', encoding='utf-8')
+        self.delay_s = delay_s
+
+    def emit(self, record: logging.LogRecord):
+        time.sleep(self.delay_s)
+        super().emit(record)
+
+def _percentile(sorted_values: List[int], fraction: float) -> int:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def benchmark(fpath: str, ncalls=10000, write_delay_s=0.0, queue_size=10000) -> Dict[str, float]:
+    """
+    Log `ncalls` DEBUG messages to `fpath`, first writing each one directly (like a plain
+    `FileHandler` would) and then through the queue, and report the calls per second and
+    how long each call stalled the calling thread. `write_delay_s` is added to every
+    write to stand in for a slow SD card. Also reports the calls per second of messages
+    that are rate limited and of messages below the log level.
+    """
+    results = {}
+    payload = "x" * 64
+    for name in ("sync", "queued"):
+        logger = logging.getLogger(f"{LOGGER_NAME}.benchmark.{name}")
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        handler = _SlowFileHandler(fpath, write_delay_s)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        if name == "sync":
+            logger.addHandler(handler)
+        else:
+            pipeline = _Pipeline(logger, [handler], queue_size)
+
+        stalls_ns = []
+        start_s = time.perf_counter()
+        for i in range(ncalls):
+            call_start_ns = time.perf_counter_ns()
+            logger.debug("Benchmark message %d of %d: %s", i, ncalls, payload)
+            stalls_ns.append(time.perf_counter_ns() - call_start_ns)
+        elapsed_s = time.perf_counter() - start_s
+
+        if name == "sync":
+            logger.removeHandler(handler)
+            handler.close()
+        else:
+            drain_start_s = time.perf_counter()
+            pipeline.stop()
+            results["queued_drain_s"] = time.perf_counter() - drain_start_s
+            results["queued_dropped"] = pipeline.queue_handler.dropped
+
+        stalls_ns.sort()
+        results[f"{name}_calls_per_s"] = ncalls / elapsed_s
+        results[f"{name}_stall_us_p50"] = _percentile(stalls_ns, 0.50) / 1000
+        results[f"{name}_stall_us_p99"] = _percentile(stalls_ns, 0.99) / 1000
+        results[f"{name}_stall_us_max"] = stalls_ns[-1] / 1000
+        results[f"{name}_stall_ms_total"] = sum(stalls_ns) / 1e6
+
+    # Messages that never get as far as a handler
+    logger = logging.getLogger(f"{LOGGER_NAME}.benchmark.filtered")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    rate_limit = RateLimitFilter(20, 1.0)
+    logger.addFilter(rate_limit)
+    pipeline = _Pipeline(logger, [logging.NullHandler()], queue_size)
+    start_s = time.perf_counter()
+    for i in range(ncalls):
+        logger.debug("Benchmark message %d of %d: %s", i, ncalls, payload)
+    results["rate_limited_calls_per_s"] = ncalls / (time.perf_counter() - start_s)
+    pipeline.stop()
+    logger.removeFilter(rate_limit)
+
+    logger.setLevel(logging.INFO)
+    start_s = time.perf_counter()
+    for i in range(ncalls):
+        logger.debug("Benchmark message %d of %d: %s", i, ncalls, payload)
+    results["below_level_calls_per_s"] = ncalls / (time.perf_counter() - start_s)
+    return results
@@ -0,0 +1,397 @@
+"""
+Metrics: counters, gauges and fixed-bucket histograms that the rest of the
+application publishes into, and two ways of getting them out.
+
+Components get their metrics from the `Registry` once (usually when they are built)
+and keep them, so that updating one in a hot path (a streaming thread's probe) is just
+an addition. Values that are cheap to read but costly to keep up to date (queue levels,
+temperatures) are given as a function instead, which is only called when the metrics are
+collected.
+
+A `MetricsServer` serves the registry as OpenMetrics text on localhost (for scraping),
+and a `SnapshotWriter` appends a JSON snapshot of it to a file every so often (for pods
+that nobody scrapes).
+
+Updates aren't locked. Each metric should be updated from one thread (or losing the
+odd increment to a race should be acceptable).
+"""
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Sequence
+from typing import Tuple
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from . import appconfig
+from . import lazy
+from . import log
+
+# Only needed by the daemon, which serves the metrics
+http_server = lazy.load_module("http.server")
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Bucket upper bounds (seconds) for things that take milliseconds
+LATENCY_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Counter:
+    """
+    A value that only goes up. If `fn` is given, it is called for the value instead
+    (for counts that something else already keeps).
+    """
+    TYPE = "counter"
+
+    def __init__(self, fn: Callable[[], float]|None = None) -> None:
+        self.value = 0
+        self.fn = fn
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self) -> float:
+        return self.fn() if self.fn is not None else self.value
+
+class Gauge:
+    """
+    A value that goes up and down. If `fn` is given, it is called for the value instead;
+    it can return None when there is nothing to read, and if it raises the value is None too.
+    """
+    TYPE = "gauge"
+
+    def __init__(self, fn: Callable[[], float]|None = None) -> None:
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def get(self) -> float|None:
+        if self.fn is None:
+            return self.value
+        try:
+            return self.fn()
+        except Exception as e:
+            log.debug("Could not read a gauge with %s: %s", self.fn, e)
+            return None
+
+class Histogram:
+    """
+    Counts observations into buckets with fixed upper bounds (and one more for everything above them).
+    """
+    TYPE = "histogram"
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = tuple(sorted(float(b) for b in bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def get(self) -> Dict[str, Any]:
+        """
+        The cumulative count of each bucket (keyed by its upper bound), the total count and the sum.
+        """
+        counts = list(self.counts)
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            cumulative += count
+            buckets[_format_value(bound)] = cumulative
+        return {"buckets": buckets, "count": cumulative, "sum": self.sum}
+
+class _Family:
+    """
+    All the metrics with one name, keyed by their labels.
+    """
+    def __init__(self, cls, help: str) -> None:
+        self.cls = cls
+        self.help = help
+        self.metrics: Dict[Labels, Any] = {}
+
+class Registry:
+    """
+    Every metric, by name and labels. Getting a metric that already exists returns it,
+    so a component that is rebuilt keeps counting where it left off.
+    """
+    def __init__(self, prefix="podapp_") -> None:
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._families: Dict[str, _Family] = {}
+
+    def _get(self, cls, name: str, help: str, labels: Dict[str, str]|None, make: Callable):
+        key = tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = _Family(cls, help)
+            elif family.cls is not cls:
+                raise ValueError(f"Metric {name} is a {family.cls.TYPE}, not a {cls.TYPE}")
+
+            metric = family.metrics.get(key)
+            if metric is None:
+                metric = family.metrics[key] = make()
+            return metric
+
+    def counter(self, name: str, help: str, labels: Dict[str, str]|None = None, fn: Callable[[], float]|None = None) -> Counter:
+        """
+        Get (or create) a counter. Its name should not end in `_total`; that is added for OpenMetrics.
+        """
+        counter = self._get(Counter, name, help, labels, lambda: Counter(fn))
+        if fn is not None:
+            counter.fn = fn
+        return counter
+
+    def gauge(self, name: str, help: str, labels: Dict[str, str]|None = None, fn: Callable[[], float]|None = None) -> Gauge:
+        """
+        Get (or create) a gauge. Giving `fn` replaces the function of an existing one.
+        """
+        gauge = self._get(Gauge, name, help, labels, lambda: Gauge(fn))
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name: str, help: str, bounds: Sequence[float] = LATENCY_BUCKETS_S, labels: Dict[str, str]|None = None) -> Histogram:
+        """
+        Get (or create) a histogram with the given bucket upper bounds.
+        """
+        return self._get(Histogram, name, help, labels, lambda: Histogram(bounds))
+
+    def remove(self, name: str, labels: Dict[str, str]|None = None):
+        """
+        Forget a metric (e.g., one whose `fn` refers to something that is gone).
+        """
+        key = tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is not None:
+                family.metrics.pop(key, None)
+
+    def collect(self) -> List[Tuple[str, _Family, List[Tuple[Labels, Any]]]]:
+        """
+        Read every metric: (name, family, [(labels, value)]) sorted by name. A metric
+        whose function raises or returns None is left out.
+        """
+        with self._lock:
+            families = [(name, family, list(family.metrics.items())) for name, family in sorted(self._families.items())]
+
+        collected = []
+        for name, family, metrics in families:
+            values = []
+            for labels, metric in metrics:
+                try:
+                    value = metric.get()
+                except Exception as e:
+                    log.debug("Could not read metric %s%s: %s", name, dict(labels), e)
+                    continue
+                if value is not None:
+                    values.append((labels, value))
+            collected.append((name, family, values))
+        return collected
+
+    def render(self) -> str:
+        """
+        Every metric in the OpenMetrics text format.
+        """
+        lines = []
+        for name, family, values in self.collect():
+            name = self.prefix + name
+            lines.append(f"# TYPE {name} {family.cls.TYPE}")
+            lines.append(f"# HELP {name} {_escape(family.help)}")
+            for labels, value in values:
+                if family.cls is Counter:
+                    lines.append(f"{name}_total{_format_labels(labels)} {_format_value(value)}")
+                elif family.cls is Gauge:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                else:
+                    for bound, count in value["buckets"].items():
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Every metric as plain data: {name: [{"labels": {...}, "value": ...}]}.
+        """
+        return {self.prefix + name: [{"labels": dict(labels), "value": value} for labels, value in values] for name, _, values in self.collect()}
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+# The registry everything publishes into
+REGISTRY = Registry()
+
+def counter(name: str, help: str, labels: Dict[str, str]|None = None, fn: Callable[[], float]|None = None) -> Counter:
+    """
+    Get (or create) a counter in the shared registry.
+    """
+    return REGISTRY.counter(name, help, labels, fn)
+
+def gauge(name: str, help: str, labels: Dict[str, str]|None = None, fn: Callable[[], float]|None = None) -> Gauge:
+    """
+    Get (or create) a gauge in the shared registry.
+    """
+    return REGISTRY.gauge(name, help, labels, fn)
+
+def histogram(name: str, help: str, bounds: Sequence[float] = LATENCY_BUCKETS_S, labels: Dict[str, str]|None = None) -> Histogram:
+    """
+    Get (or create) a histogram in the shared registry.
+    """
+    return REGISTRY.histogram(name, help, bounds, labels)
+
+class MetricsServer:
+    """
+    Serves a registry as OpenMetrics text at `http://<host>:<port>/metrics`, from a background thread.
+    Port 0 picks a free port (see `port`).
+    """
+    def __init__(self, registry: Registry = REGISTRY, host="127.0.0.1", port=0) -> None:
+        class Handler(http_server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("Metrics request: " + format, *args)
+
+        self._server = http_server.ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """
+        Stop serving.
+        """
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+class SnapshotWriter:
+    """
+    Appends a snapshot of a registry to a file in `dpath` every `period_s` seconds (and once
+    more on `shutdown()`), one line of JSON each: {"time": <unix seconds>, "metrics": {...}}.
+    There is one file per (UTC) day, `metrics-YYYY-MM-DD.jsonl`.
+    """
+    def __init__(self, dpath: str, period_s: float, registry: Registry = REGISTRY) -> None:
+        self.dpath = dpath
+        self.period_s = period_s
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self) -> Exception|None:
+        """
+        Append one snapshot now.
+        """
+        now_s = time.time()
+        line = json.dumps({"time": now_s, "metrics": self.registry.snapshot()}, separators=(',', ':'))
+        fpath = os.path.join(self.dpath, time.strftime("metrics-%Y-%m-%d.jsonl", time.gmtime(now_s)))
+        try:
+            with open(fpath, 'a') as f:
+                f.write(line + "\n")
+        except OSError as e:
+            return e
+        return None
+
+    def start(self):
+        def run():
+            while not self._stop.wait(self.period_s):
+                err = self.write()
+                if err:
+                    log.warning("Could not write a metrics snapshot: %s", err)
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="metrics-snapshot", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """
+        Stop, after writing one last snapshot.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.write()
+
+def start_exporters(config: Dict[str, Any], registry: Registry = REGISTRY) -> Tuple[Exception|None, List]:
+    """
+    Start whichever of the HTTP endpoint and the snapshot writer are configured.
+    Returns the ones that started; call `shutdown()` on each when done.
+    """
+    metrics_config = appconfig.section(config, appconfig.MetricsConfig)
+    exporters = []
+    err = None
+
+    if metrics_config.http_port > 0:
+        try:
+            server = MetricsServer(registry, metrics_config.http_host, metrics_config.http_port)
+        except OSError as e:
+            err = e
+        else:
+            server.start()
+            exporters.append(server)
+            log.info("Serving metrics on http://%s:%d/metrics", metrics_config.http_host, server.port)
+
+    if metrics_config.snapshot_seconds > 0:
+        dpath = metrics_config.snapshot_dpath
+        try:
+            os.makedirs(dpath, exist_ok=True)
+        except OSError:
+            log.warning("Configuration file's metrics 'snapshot-dpath' is not usable. Value given: %s", dpath)
+            dpath = metrics_config.snapshot_dpath_dev
+        try:
+            os.makedirs(dpath, exist_ok=True)
+        except OSError as e:
+            err = e
+        else:
+            writer = SnapshotWriter(dpath, metrics_config.snapshot_seconds, registry)
+            writer.start()
+            exporters.append(writer)
+
+    return (err, exporters)
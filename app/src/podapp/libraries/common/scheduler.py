@@ -0,0 +1,250 @@
+"""
+This module contains the power-budget scheduler, which duty-cycles the
+power-hungry components of the pod (AI coprocessor, cameras, display, LEDs)
+so that their average draw stays within a budget.
+
+Each component has a cost (watts while on), a priority, and a schedule: a list
+of time-of-day windows, each with a duty cycle (on for `on_s` out of every `period_s`
+seconds). Components can also be on-demand (e.g., the display is only on for a while
+after it is touched). Every `tick()`, the scheduler works out what each component is
+asking for, sheds the least important components' duty cycles until the expected
+average draw fits the budget, and then turns components on or off through their
+usual APIs.
+
+Time comes from a `clock` function (seconds since the epoch), so the whole thing can
+be driven by a `SimulatedClock` in tests.
+"""
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+import collections
+import datetime
+import json
+import threading
+import time
+from . import appconfig
+from . import log
+
+# A time-of-day window ([start_h, end_h) in hours, wrapping around midnight if end_h < start_h)
+# during which a component should be on for `on_s` seconds out of every `period_s` seconds.
+Window = collections.namedtuple("Window", "start_h end_h on_s period_s")
+
+# Which profiling scenario measures which component (see app/profiling.py)
+PROFILE_SCENARIOS = {"display": "screen", "camera": "camera", "ai": "ai"}
+
+class SimulatedClock:
+    """
+    A clock that only moves when told to.
+    """
+    def __init__(self, start_s: float) -> None:
+        self.now_s = start_s
+
+    def __call__(self) -> float:
+        return self.now_s
+
+    def advance(self, seconds: float):
+        self.now_s += seconds
+
+class ScheduledComponent:
+    """
+    A component that the scheduler turns on and off.
+
+    `turn_on` and `turn_off` are called with no arguments and may return an Exception.
+    Lower `priority` numbers are more important and are the last to be shed.
+    If `demand_hold_s` is not None, the component is on-demand: it asks to be on for
+    `demand_hold_s` seconds after each `PowerScheduler.notify()`, on top of its windows.
+
+    `is_on` is None until the scheduler has first set the component's state, since it may
+    already be on (e.g., the display at boot); the first tick always turns it on or off.
+    """
+    def __init__(self, name: str, cost_w: float, turn_on: Callable, turn_off: Callable, priority=0, windows: List[Window]|None = None, demand_hold_s: float|None = None) -> None:
+        self.name = name
+        self.cost_w = cost_w
+        self.turn_on = turn_on
+        self.turn_off = turn_off
+        self.priority = priority
+        self.windows = windows if windows is not None else []
+        self.demand_hold_s = demand_hold_s
+
+        self.is_on = None
+        self.demanded_until_s = None
+        self.duty = 0.0
+        self.period_s = 1.0
+
+    def requested(self, now_s: float) -> tuple:
+        """
+        Return (duty cycle, period) that this component is asking for at the given time.
+        """
+        if self.demand_hold_s is not None and self.demanded_until_s is not None and now_s < self.demanded_until_s:
+            return (1.0, 1.0)
+
+        hour = _hour_of_day(now_s)
+        for window in self.windows:
+            if _in_window(hour, window):
+                return (min(1.0, window.on_s / window.period_s), window.period_s)
+        return (0.0, 1.0)
+
+def _hour_of_day(now_s: float) -> float:
+    t = datetime.datetime.fromtimestamp(now_s)
+    return t.hour + t.minute / 60 + t.second / 3600
+
+def _in_window(hour: float, window: Window) -> bool:
+    if window.start_h <= window.end_h:
+        return window.start_h <= hour < window.end_h
+    return hour >= window.start_h or hour < window.end_h
+
+class PowerScheduler:
+    """
+    The `PowerScheduler` class should be used as a singleton. It keeps the average power
+    draw of its components (plus `baseline_w` for everything else) under `budget_w`.
+    """
+    def __init__(self, budget_w: float, baseline_w: float, components: List[ScheduledComponent], clock: Callable[[], float] = time.time) -> None:
+        self.budget_w = budget_w
+        self.baseline_w = baseline_w
+        self.components = {c.name: c for c in components}
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def notify(self, name: str):
+        """
+        Tell an on-demand component that it is wanted (e.g., the display was touched).
+        Takes effect on the next tick.
+        """
+        with self._lock:
+            component = self.components[name]
+            if component.demand_hold_s is not None:
+                component.demanded_until_s = self.clock() + component.demand_hold_s
+
+    def expected_power_w(self) -> float:
+        """
+        The average power we expect to draw with the current duty cycles.
+        """
+        return self.baseline_w + sum(c.cost_w * c.duty for c in self.components.values())
+
+    def _allocate(self, now_s: float):
+        """
+        Work out each component's duty cycle for right now, shedding the least important
+        components until we fit the budget.
+        """
+        for component in self.components.values():
+            component.duty, component.period_s = component.requested(now_s)
+
+        overage_w = self.expected_power_w() - self.budget_w
+        for component in sorted(self.components.values(), key=lambda c: c.priority, reverse=True):
+            if overage_w <= 0:
+                break
+            if component.duty == 0 or component.cost_w <= 0:
+                continue
+            shed = min(component.duty, overage_w / component.cost_w)
+            component.duty -= shed
+            overage_w -= shed * component.cost_w
+
+    def tick(self):
+        """
+        Bring every component into the state it should be in right now.
+        """
+        with self._lock:
+            now_s = self.clock()
+            self._allocate(now_s)
+            changes = []
+            for component in self.components.values():
+                # On for the first `duty` fraction of each period
+                should_be_on = component.duty > 0 and (now_s % component.period_s) < component.duty * component.period_s
+                if should_be_on != component.is_on:
+                    changes.append((component, should_be_on))
+
+        for component, on in changes:
+            try:
+                err = component.turn_on() if on else component.turn_off()
+            except Exception as e:
+                err = e
+            if err:
+                log.error("Power scheduler could not turn %s %s: %s", 'on' if on else 'off', component.name, err)
+                continue
+            component.is_on = on
+            log.debug("Power scheduler turned %s %s (duty %.2f, expected %.2f W)", component.name, 'on' if on else 'off', component.duty, self.expected_power_w())
+
+    def start(self, tick_s: float):
+        """
+        Tick every `tick_s` seconds in a background thread.
+        """
+        def run():
+            while not self._stop.wait(tick_s):
+                self.tick()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """
+        Clean shutdown function. Stops ticking and turns every component off.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        for component in self.components.values():
+            if component.is_on:
+                component.turn_off()
+                component.is_on = False
+
+def load_costs_from_profile(fpath: str) -> Dict[str, float]:
+    """
+    Return each component's cost (watts above idle) from a profiling report (profile.json).
+    """
+    with open(fpath, 'r') as f:
+        scenarios = json.load(f)['scenarios']
+
+    def mean_power(name):
+        summary = scenarios.get(name)
+        return summary['power_w']['mean'] if summary and summary['power_w'] else None
+
+    idle = mean_power("idle")
+    costs = {}
+    for component, scenario in PROFILE_SCENARIOS.items():
+        watts = mean_power(scenario)
+        if idle is not None and watts is not None:
+            costs[component] = max(0.0, watts - idle)
+    return costs
+
+def _parse_hour(raw: str) -> float:
+    hours, minutes = raw.split(':')
+    return int(hours) + int(minutes) / 60
+
+def from_config(config: Dict[str, Any], controls: Dict[str, tuple], clock: Callable[[], float] = time.time) -> PowerScheduler:
+    """
+    Build the scheduler described by the configuration.
+
+    `controls` maps component names (as in the configuration) to (turn_on, turn_off) functions.
+    Components in the configuration without a control are ignored.
+    """
+    budget_config = appconfig.section(config, appconfig.PowerBudgetConfig)
+    costs = {}
+    if budget_config.profile_fpath:
+        try:
+            costs = load_costs_from_profile(budget_config.profile_fpath)
+        except (OSError, KeyError, ValueError) as e:
+            log.warning("Could not load measured component costs from %s, using configured costs: %s", budget_config.profile_fpath, e)
+
+    components = []
+    for name, component_config in budget_config.components.items():
+        if name not in controls:
+            continue
+        turn_on, turn_off = controls[name]
+        windows = [Window(_parse_hour(w.start), _parse_hour(w.end), w.on_seconds, w.period_seconds) for w in component_config.schedule]
+        components.append(ScheduledComponent(
+            name,
+            costs.get(name, component_config.cost_watts),
+            turn_on,
+            turn_off,
+            priority=component_config.priority,
+            windows=windows,
+            demand_hold_s=component_config.on_demand_seconds or None,
+        ))
+
+    return PowerScheduler(budget_config.budget_watts, budget_config.baseline_watts, components, clock=clock)
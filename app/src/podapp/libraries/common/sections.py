@@ -0,0 +1,375 @@
+"""
+The typed sections of the application's configuration (see `appconfig.py`).
+
+Each section is an immutable dataclass. Classes with a `PATH` are top-level sections,
+found at that path in the configuration file; the rest are parts of them. Each field's
+YAML key is its name with '-' instead of '_', unless given as metadata "key". Fields
+with a default are optional. Metadata "choices", "min" and "max" are validated, and a
+section can check things that involve more than one field in a `check()` method that
+returns what is wrong, or None.
+
+Defining all of these takes a while, so `appconfig` only imports this module once a
+section is used.
+"""
+from typing import ClassVar
+from typing import Dict
+from typing import Tuple
+import dataclasses
+from . import log
+
+_frozen = dataclasses.dataclass(frozen=True, slots=True)
+
+@_frozen
+class PinConfig:
+    pin: int = dataclasses.field(metadata={"min": 0, "max": 27})
+    physical: int = dataclasses.field(metadata={"min": 1, "max": 40})
+
+@_frozen
+class CameraPinConfig:
+    id: str
+    mux_active_level: str = dataclasses.field(metadata={"choices": ("HIGH", "LOW")})
+    enabled: bool
+
+@_frozen
+class CameraPinsConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("pinconfig", "cameras")
+    camera_mux: PinConfig
+    front_camera: CameraPinConfig
+    rear_camera: CameraPinConfig
+
+@_frozen
+class DSIConfig:
+    id: str
+
+@_frozen
+class ScreenPinsConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("pinconfig", "screen")
+    i2c_sda: PinConfig
+    i2c_scl: PinConfig
+    dsi: DSIConfig
+
+@_frozen
+class WakePinsConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("pinconfig", "wake")
+    activity: PinConfig
+
+@_frozen
+class LoggingConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "logging")
+    log_file_path: str = "/logs/creaturepod.log"
+    # Used if log-file-path can't be written to (e.g., off the device)
+    log_file_path_dev: str = "./creaturepod.log"
+    log_level: str = dataclasses.field(default="ERROR", metadata={"choices": log.ALLOWED_LEVELS})
+    log_to_console: bool = False
+    max_bytes: int = dataclasses.field(default=10 * 1024 * 1024, metadata={"min": 0})
+    rotate_seconds: float = dataclasses.field(default=86400.0, metadata={"min": 0})
+    backup_count: int = dataclasses.field(default=5, metadata={"min": 0})
+    queue_size: int = dataclasses.field(default=10000, metadata={"min": 0})
+    rate_limit_messages: int = dataclasses.field(default=20, metadata={"min": 0})
+    rate_limit_seconds: float = dataclasses.field(default=1.0, metadata={"min": 0})
+
+@_frozen
+class QueueParamsConfig:
+    max_buffers: int = dataclasses.field(default=3, metadata={"min": 0})
+    max_bytes: int = dataclasses.field(default=0, metadata={"min": 0})
+    max_time: int = dataclasses.field(default=0, metadata={"min": 0})
+    leaky: str = dataclasses.field(default="no", metadata={"choices": ("no", "upstream", "downstream")})
+
+@_frozen
+class DotGraphConfig:
+    save: bool = False
+    dpath: str = "./"
+
+@_frozen
+class RegistryConfig:
+    update: bool = True
+    fork: bool = True
+    warm_up_elements: Tuple[str, ...] = ()
+
+@_frozen
+class HailoConfig:
+    post_process_folder_path: str = "/usr/lib/aarch64-linux-gnu/hailo/tappas/post_processes"
+    cropping_algorithm_folder_path: str = "/usr/lib/aarch64-linux-gnu/hailo/tappas/post_processes/cropping_algorithms"
+    base_model_folder_path: str = "/usr/share/hailo-models"
+    vdevice_group_id: str = "podapp"
+    scheduling_algorithm: str = dataclasses.field(default="HAILO_SCHEDULING_ALGORITHM_ROUND_ROBIN",
+                                                  metadata={"choices": ("HAILO_SCHEDULING_ALGORITHM_ROUND_ROBIN", "HAILO_SCHEDULING_ALGORITHM_NONE")})
+    multi_process_service: bool = False
+
+@_frozen
+class GstLoggingConfig:
+    level: str = dataclasses.field(default="ERROR", metadata={"choices": ("NONE", "ERROR", "WARNING", "FIXME", "INFO", "DEBUG", "LOG", "TRACE", "MEMDUMP")})
+
+@_frozen
+class GStreamerUtilsConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "gstreamer-utils")
+    queue_params: QueueParamsConfig = QueueParamsConfig()
+    dot_graph: DotGraphConfig = DotGraphConfig()
+    registry: RegistryConfig = RegistryConfig()
+    hailo: HailoConfig = HailoConfig()
+    logging: GstLoggingConfig = GstLoggingConfig()
+
+@_frozen
+class PowerMeterConfig:
+    type: str = dataclasses.field(default="ina219-hwmon", metadata={"choices": ("ina219-hwmon", "ina219-i2c", "file")})
+    # "auto" to find it by name
+    hwmon_dpath: str = "auto"
+    i2c_bus: int = dataclasses.field(default=1, metadata={"min": 0})
+    i2c_address: int = dataclasses.field(default=0x40, metadata={"min": 0, "max": 0x7f})
+    shunt_ohms: float = dataclasses.field(default=0.1, metadata={"min": 0})
+    fpath: str = "./power.txt"
+
+@_frozen
+class ProfilingConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "profiling")
+    scenario_seconds: float = dataclasses.field(default=30.0, metadata={"min": 0})
+    sample_period_seconds: float = dataclasses.field(default=1.0, metadata={"min": 0})
+    output_dpath: str = "./profile"
+    power_meter: PowerMeterConfig = PowerMeterConfig()
+
+@_frozen
+class ScreenConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "screen")
+    timeout_seconds: float = dataclasses.field(metadata={"min": 0})
+    state_refresh_seconds: float = dataclasses.field(default=30.0, metadata={"min": 0})
+
+@_frozen
+class MainStreamConfig:
+    format: str
+    width: int = dataclasses.field(metadata={"min": 1})
+    height: int = dataclasses.field(metadata={"min": 1})
+
+@_frozen
+class CamerasConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "cameras")
+    mux_settle_frames: int = dataclasses.field(default=2, metadata={"min": 0})
+    dual_stream: bool = False
+    main_stream: MainStreamConfig = MainStreamConfig("NV12", 1920, 1080)
+
+@_frozen
+class DetectionsConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "detections")
+    store: bool = False
+    store_dpath: str = "/data/detections"
+    store_dpath_dev: str = "./detections"
+    chunk_rows: int = dataclasses.field(default=65536, metadata={"min": 1})
+
+@_frozen
+class SnapshotsConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "snapshots")
+    enabled: bool = False
+    min_score: float = dataclasses.field(default=0.6, metadata={"min": 0, "max": 1})
+    min_interval_seconds: float = dataclasses.field(default=10.0, metadata={"min": 0})
+    full_frames: bool = False
+    padding: float = dataclasses.field(default=0.1, metadata={"min": 0})
+    jpeg_quality: int = dataclasses.field(default=85, metadata={"min": 1, "max": 100})
+    thumbnail_size: int = dataclasses.field(default=160, metadata={"min": 1})
+    cache_bytes: int = dataclasses.field(default=8 * 1024 * 1024, metadata={"min": 0})
+    recent_count: int = dataclasses.field(default=500, metadata={"min": 1})
+    queue_size: int = dataclasses.field(default=16, metadata={"min": 1})
+    dpath: str = "/data/snapshots"
+    dpath_dev: str = "./snapshots"
+
+@_frozen
+class PreprocessConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "preprocess")
+    enabled: bool = False
+    so_fpath: str = ""
+    function_name: str = "podapp_preprocess"
+    # Empty for frames as they come
+    video_format: str = ""
+    drop_on_error: bool = False
+
+    def check(self) -> str|None:
+        if self.enabled and not self.so_fpath:
+            return "so-fpath is needed when enabled"
+        return None
+
+@_frozen
+class TrackingConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "tracking")
+    enabled: bool = False
+    high_score: float = dataclasses.field(default=0.5, metadata={"min": 0, "max": 1})
+    low_score: float = dataclasses.field(default=0.1, metadata={"min": 0, "max": 1})
+    iou_threshold: float = dataclasses.field(default=0.3, metadata={"min": 0, "max": 1})
+    low_iou_threshold: float = dataclasses.field(default=0.5, metadata={"min": 0, "max": 1})
+    min_hits: int = dataclasses.field(default=3, metadata={"min": 1})
+    max_age_frames: int = dataclasses.field(default=30, metadata={"min": 0})
+    max_tracks: int = dataclasses.field(default=512, metadata={"min": 1})
+
+    def check(self) -> str|None:
+        if self.low_score > self.high_score:
+            return "low-score must not be more than high-score"
+        return None
+
+@_frozen
+class MCUConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "mcu")
+    backend: str = dataclasses.field(metadata={"choices": ("spidev", "emulated")})
+    spi_bus: int = dataclasses.field(metadata={"min": 0})
+    spi_device: int = dataclasses.field(metadata={"min": 0})
+    spi_speed_hz: int = dataclasses.field(metadata={"min": 1})
+    # Must fit at least a frame with an empty payload
+    transfer_size: int = dataclasses.field(metadata={"min": 7})
+    request_timeout_seconds: float = dataclasses.field(metadata={"min": 0})
+    batch_window_seconds: float = dataclasses.field(metadata={"min": 0})
+
+@_frozen
+class LEDsConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "leds")
+    backend: str = dataclasses.field(metadata={"choices": ("mcu", "null")})
+    strips: Tuple[int, ...]
+    fps: float = dataclasses.field(metadata={"min": 1})
+    brightness: float = dataclasses.field(metadata={"min": 0, "max": 1})
+    gamma: float = dataclasses.field(metadata={"min": 0})
+    merge_gap_pixels: int = dataclasses.field(metadata={"min": 0})
+
+@_frozen
+class TelemetryConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "telemetry")
+    enabled: bool
+    sensors: Tuple[str, ...] = dataclasses.field(metadata={"choices": ("temperature-humidity", "gps", "imu")})
+    sample_period_seconds: float = dataclasses.field(metadata={"min": 0})
+    ring_samples: int = dataclasses.field(metadata={"min": 1})
+    history: Dict[str, int]
+    flush_rows: int = dataclasses.field(metadata={"min": 1})
+    dpath: str
+    dpath_dev: str
+
+@_frozen
+class WakeConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "wake")
+    edge: str = dataclasses.field(metadata={"choices": ("RISING", "FALLING", "BOTH")})
+    debounce_ms: float = dataclasses.field(metadata={"min": 0})
+    preroll_timeout_seconds: float = dataclasses.field(metadata={"min": 0})
+
+@_frozen
+class DaemonConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "daemon")
+    socket_path: str
+    socket_path_dev: str
+    event_queue_size: int = dataclasses.field(metadata={"min": 1})
+    config_poll_seconds: float = dataclasses.field(metadata={"min": 0})
+
+@_frozen
+class MetricsConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "metrics")
+    http_host: str
+    http_port: int = dataclasses.field(metadata={"min": 0, "max": 65535})
+    snapshot_seconds: float = dataclasses.field(metadata={"min": 0})
+    snapshot_dpath: str
+    snapshot_dpath_dev: str
+
+@_frozen
+class ThermalConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "thermal")
+    enabled: bool
+    sysfs_root: str
+    poll_seconds: float = dataclasses.field(metadata={"min": 0})
+    strides: Tuple[int, ...] = dataclasses.field(metadata={"min": 1})
+    step_down_celsius: Tuple[float, ...]
+    hysteresis_celsius: float = dataclasses.field(metadata={"min": 0})
+    hold_seconds: float = dataclasses.field(metadata={"min": 0})
+
+    def check(self) -> str|None:
+        if len(self.step_down_celsius) != len(self.strides) - 1:
+            return "there must be one step-down-celsius for each stride after the first"
+        if list(self.step_down_celsius) != sorted(self.step_down_celsius):
+            return "step-down-celsius must be in increasing order"
+        return None
+
+@_frozen
+class AdaptiveConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "adaptive")
+    enabled: bool
+    target_latency_ms: float = dataclasses.field(metadata={"min": 0})
+    max_drop_fraction: float = dataclasses.field(metadata={"min": 0, "max": 1})
+    headroom: float = dataclasses.field(metadata={"min": 0, "max": 1})
+    window_seconds: float = dataclasses.field(metadata={"min": 0})
+    hold_seconds: float = dataclasses.field(metadata={"min": 0})
+    ladder: Tuple[str, ...]
+
+    def rungs(self) -> Tuple[Tuple[int, int, float], ...]:
+        """
+        The ladder as (width, height, fps), best first. Raises ValueError if a rung isn't WIDTHxHEIGHT@FPS.
+        """
+        rungs = []
+        for rung in self.ladder:
+            size, sep, fps = rung.partition("@")
+            width, x, height = size.partition("x")
+            if not sep or not x:
+                raise ValueError(f"{rung} is not WIDTHxHEIGHT@FPS")
+            rungs.append((int(width), int(height), float(fps)))
+        return tuple(rungs)
+
+    def check(self) -> str|None:
+        if not self.ladder:
+            return "the ladder needs at least one rung"
+        try:
+            self.rungs()
+        except ValueError as e:
+            return f"bad ladder: {e}"
+        return None
+
+@_frozen
+class ScheduleWindowConfig:
+    # Local time, "HH:MM"
+    start: str
+    end: str
+    on_seconds: float = dataclasses.field(metadata={"min": 0})
+    period_seconds: float = dataclasses.field(metadata={"min": 0})
+
+    def check(self) -> str|None:
+        for value in (self.start, self.end):
+            hours, sep, minutes = value.partition(":")
+            if not sep or not hours.isdigit() or not minutes.isdigit() or int(hours) > 23 or int(minutes) > 59:
+                return f"{value!r} is not HH:MM"
+        if self.period_seconds <= 0:
+            return "period-seconds must be more than 0"
+        return None
+
+@_frozen
+class ScheduledComponentConfig:
+    cost_watts: float = dataclasses.field(metadata={"min": 0})
+    priority: int
+    schedule: Tuple[ScheduleWindowConfig, ...] = ()
+    # 0 means the component is not on-demand
+    on_demand_seconds: float = dataclasses.field(default=0.0, metadata={"min": 0})
+
+@_frozen
+class PowerBudgetConfig:
+    PATH: ClassVar[Tuple[str, ...]] = ("moduleconfig", "power-budget")
+    enabled: bool = False
+    budget_watts: float = dataclasses.field(default=6.0, metadata={"min": 0})
+    baseline_watts: float = dataclasses.field(default=2.5, metadata={"min": 0})
+    tick_seconds: float = dataclasses.field(default=0.5, metadata={"min": 0.01})
+    profile_fpath: str = ""
+    components: Dict[str, ScheduledComponentConfig] = dataclasses.field(default_factory=dict)
+
+@_frozen
+class AppConfig:
+    """
+    Every typed section, compiled from one configuration file.
+    """
+    camera_pins: CameraPinsConfig
+    screen_pins: ScreenPinsConfig
+    wake_pins: WakePinsConfig
+    logging: LoggingConfig
+    gstreamer_utils: GStreamerUtilsConfig
+    profiling: ProfilingConfig
+    screen: ScreenConfig
+    cameras: CamerasConfig
+    detections: DetectionsConfig
+    snapshots: SnapshotsConfig
+    tracking: TrackingConfig
+    preprocess: PreprocessConfig
+    mcu: MCUConfig
+    leds: LEDsConfig
+    telemetry: TelemetryConfig
+    wake: WakeConfig
+    daemon: DaemonConfig
+    metrics: MetricsConfig
+    thermal: ThermalConfig
+    adaptive: AdaptiveConfig
+    power_budget: PowerBudgetConfig
+
@@ -2,43 +2,205 @@
 This module provides high-level API functions for the AI
 coprocessor.
 """
+import collections
 import enum
+import os
+import time
 from typing import Any
+from typing import Callable
 from typing import Dict
+from ..gstreamer_utils import adaptive
 from ..gstreamer_utils import app as gst_app
+from ..gstreamer_utils import frames as gst_frames
 from ..gstreamer_utils import model as gst_model
 from ..gstreamer_utils import postproc as gst_postproc
 from ..gstreamer_utils import preproc as gst_preproc
+from ..gstreamer_utils import results as gst_results
 from ..gstreamer_utils import sink as gst_sink
 from ..gstreamer_utils import source as gst_source
+from ..gstreamer_utils import tracking
 from ..gstreamer_utils import utils as gst_utils
+from ..common import appconfig
+from ..common import log
+from ..common import metrics
+from ..outputs import gpio
+from ..sensors import thermal
+from ..storage import detections
+from ..storage import snapshots
 
 class AIModelType(enum.StrEnum):
     """
     The allowed AI models.
 
     THE VALUES MUST MATCH THE NAMES OF CONFIGURATION DICTS IN gstreamer_utils/model.py!
+    Every model also needs an entry in `MODEL_IDS`.
     """
-    OBJECT_DETECTION_YOLO_V8 = "OBJECT_DETECTION_YOLOV8"
-    INSTANCE_SEGMENTATION    = "INSTANCE_SEGMENTATION"
-    POSE_ESTIMATION          = "POSE_ESTIMATION"
+    OBJECT_DETECTION_YOLO_V8        = "OBJECT_DETECTION_YOLOV8"
+    INSTANCE_SEGMENTATION           = "INSTANCE_SEGMENTATION"
+    POSE_ESTIMATION                 = "POSE_ESTIMATION"
+    OBJECT_DETECTION_YOLO_V8_PYTHON = "OBJECT_DETECTION_YOLOV8_PYTHON"
+
+    @property
+    def id(self) -> int:
+        """
+        The model's ID in the detection store (see `MODEL_IDS`).
+        """
+        return MODEL_IDS[self]
+
+# Each model's ID in the detection store (its `model` column and its labels).
+# These are saved to disk, so never change or reuse one.
+MODEL_IDS = {
+    AIModelType.OBJECT_DETECTION_YOLO_V8: 0,
+    AIModelType.INSTANCE_SEGMENTATION: 1,
+    AIModelType.POSE_ESTIMATION: 2,
+    AIModelType.OBJECT_DETECTION_YOLO_V8_PYTHON: 3,
+}
+
+class WakeTimeline:
+    """
+    When each step of a wake from standby happened, in `time.monotonic_ns()`.
+    Steps that haven't happened (yet) are None.
+    """
+    def __init__(self, edge_ns: int|None, wake_ns: int) -> None:
+        # The activity signal (e.g., a GPIO edge), if the wake was triggered by one
+        self.edge_ns = edge_ns
+        # `wake()` was called
+        self.wake_ns = wake_ns
+        # The pipeline reached PLAYING
+        self.playing_ns = None
+        # The first buffer left the source
+        self.first_buffer_ns = None
+        # The first frame with at least one detection came out of the model
+        self.first_detection_ns = None
+
+    def latencies_ms(self) -> Dict[str, float|None]:
+        """
+        The time from the start of the wake (the edge if there was one) to each step, in milliseconds.
+        """
+        start_ns = self.edge_ns if self.edge_ns is not None else self.wake_ns
+        steps = {"wake": self.wake_ns, "playing": self.playing_ns, "first_buffer": self.first_buffer_ns, "first_detection": self.first_detection_ns}
+        return {name: (t - start_ns) / 1e6 if t is not None else None for name, t in steps.items()}
+
+# Bucket upper bounds (seconds) for wake latencies
+WAKE_BUCKETS_S = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
 
 class AICoprocessor:
     """
     The `AICoprocessor` class should be used as a singleton
     for controlling the AI coprocessor in the system.
     """
-    def __init__(self, config: Dict[str, Any]) -> None:
+    def __init__(self, config: Dict[str, Any], store_detections=True) -> None:
+        """
+        If `store_detections` is False, the detection store is not used, regardless of the configuration.
+        """
+        self.results_callbacks = []
+        self.frame_callbacks = []
+        self.store = None
+        self.file_store = None
+        self._results_store = None
         self.clear()
 
+        # Wakes from standby, most recent last
+        self.wakes = collections.deque(maxlen=100)
+        self._tracking_wakes = False
+
+        # When each frame (by PTS) went into the accelerator, for the ones that haven't come out yet
+        self._inference_started_s: Dict[int, float] = {}
+        self.inference_latency_metric = metrics.histogram("ai_inference_latency_seconds", "Time each frame spends in the accelerator")
+        self.inference_busy_metric = metrics.counter("ai_inference_busy_seconds", "Time the accelerator has spent on frames (its rate is the accelerator's utilization)")
+        self.wake_latency_metric = metrics.histogram("ai_wake_latency_seconds", "Time from the start of a wake to the first detection", bounds=WAKE_BUCKETS_S)
+        metrics.gauge("ai_awake", "Whether the AI pipeline is running (1) or not (0)", fn=lambda: int(self.awake))
+
+        # Run inference on every `inference_stride`th frame, stepping it up as the SoC heats up (if configured to,
+        # and only if the model has its own stream from the camera; see `_build()`)
+        thermal_config = appconfig.section(config, appconfig.ThermalConfig)
+        self.strides = thermal_config.strides
+        self.inference_stride = self.strides[0]
+        self._model_input_frames = 0
+        self.stride_drops_metric = metrics.counter("ai_stride_drops", "Frames skipped (not run through the model) because of the inference stride")
+        self.thermal = thermal.ThermalController(thermal_config, self._on_thermal_level) if thermal_config.enabled else None
+
+        # Keep up with a live camera by changing its caps as the pipeline falls behind (if configured to)
+        adaptive_config = appconfig.section(config, appconfig.AdaptiveConfig)
+        self.frame_tracker = adaptive.FrameTracker()
+        self.adaptive = adaptive.AdaptiveController(adaptive_config, self._on_adaptive_rung) if adaptive_config.enabled else None
+        self._adapting = False
+
+        # If the source is a camera, should we have it give us a model-sized stream for inference
+        # and a separate full-resolution stream for the sinks?
+        camera_config = appconfig.section(config, appconfig.CamerasConfig)
+        self.dual_stream = camera_config.dual_stream
+        if self.dual_stream:
+            main_stream = camera_config.main_stream
+            self.main_stream = (main_stream.format, main_stream.width, main_stream.height)
+
+        # Keep every detection in the detection store, if configured to
+        store_config = appconfig.section(config, appconfig.DetectionsConfig)
+        if store_detections and store_config.store:
+            dpath = store_config.store_dpath
+            try:
+                os.makedirs(dpath, exist_ok=True)
+            except OSError:
+                log.warning("Configuration file's 'store-dpath' is not usable. Value given: %s", dpath)
+                dpath = store_config.store_dpath_dev
+            # Detections from recorded files are timestamped by PTS, so they get a store of their own
+            # rather than landing near 1970 among the live ones
+            self.store = detections.DetectionStore(dpath, chunk_rows=store_config.chunk_rows)
+            self.file_store = detections.DetectionStore(os.path.join(dpath, detections.FILE_RUNS_DNAME), chunk_rows=store_config.chunk_rows)
+            self.add_results_callback(self._on_store_results)
+
+        # Run our own native pre-process on every frame, if configured to
+        self.native_preprocess = None
+        preprocess_config = appconfig.section(config, appconfig.PreprocessConfig)
+        if preprocess_config.enabled:
+            try:
+                self.native_preprocess = gst_preproc.GStreamerPreprocess(preprocess_config.so_fpath, preprocess_config.function_name,
+                                                                         video_format=preprocess_config.video_format or None,
+                                                                         drop_on_error=preprocess_config.drop_on_error)
+            except (OSError, ValueError) as e:
+                log.error("Could not load the native pre-process: %s", e)
+
+        # Follow each animal from frame to frame, if configured to
+        tracking_config = appconfig.section(config, appconfig.TrackingConfig)
+        self.tracker = tracking.Tracker(tracking_config) if tracking_config.enabled else None
+
+        # Snapshot what we detect, if configured to
+        self.snapshotter = None
+        if appconfig.section(config, appconfig.SnapshotsConfig).enabled:
+            self.snapshotter = snapshots.Snapshotter.shared(config)
+            self.frame_callbacks.append(self._on_frame_results)
+
+    def _commit_results(self):
+        """
+        Make sure everything the pipeline has produced so far is persisted.
+        """
+        for store in (self.store, self.file_store):
+            if store is not None:
+                if self.results is not None:
+                    store.set_labels(self.results.model_index, self.results.labels)
+                store.flush()
+
     def shutdown(self):
         """
         Clean shutdown function.
         """
         if self.pipeline is not None:
+            if self.camera_mux is not None:
+                self.camera_mux.detach(self.pipeline)
             self.pipeline.shutdown()
             self.pipeline = None
 
+        if self.camera_mux is not None:
+            self.camera_mux.release(self._camera_mux_handle)
+            self.camera_mux = None
+
+        self.awake = False
+        self._stop_controllers()
+        self._commit_results()
+        for store in (self.store, self.file_store):
+            if store is not None:
+                store.close()
+
     def clear(self) -> None:
         """
         Clear all configured pipeline elements.
@@ -46,9 +208,17 @@ class AICoprocessor:
         self.source = None
         self.preprocess = None
         self.model = None
+        self.model_type = None
         self.postprocess = None
+        self.results = None
+        self.frame_tap = None
         self.sink = None
         self.pipeline = None
+        self.camera_mux = None
+        self._camera_mux_handle = None
+        self.frames_per_camera = None
+        self.awake = False
+        self._wake = None
 
     def set_source(self, source_uri: str) -> Exception|None:
         """
@@ -73,33 +243,314 @@ class AICoprocessor:
         # Create the model configuration by mapping the enum's str to a data class in gst_model
         model_config = getattr(gst_model, model.value)
 
-        # Set the model portion of the pipeline
-        self.preprocess = gst_preproc.GStreamerHailoPreprocess(model_config)
+        # Set the model portion of the pipeline, fit to the model's input as the HEF describes it
+        self.model_type = model
         self.model = gst_model.GStreamerModel(model_config)
-        self.postprocess = gst_postproc.GStreamerHailoPostprocess(model_config)
+        model_config = model_config | {"width": self.model.width, "height": self.model.height, "color_format": self.model.color_format}
+        self.preprocess = gst_preproc.GStreamerHailoPreprocess(model_config)
+        if model_config.get('post_process') == "python":
+            self.postprocess = gst_postproc.GStreamerCustomPostprocess(model_config)
+        else:
+            self.postprocess = gst_postproc.GStreamerHailoPostprocess(model_config)
 
-    def set_sinks(self, *sink_uris) -> Exception|None:
+    def set_sinks(self, *sink_uris, sync=True) -> Exception|None:
         """
         Set the sinks for the AI processing pipeline.
 
         `sink_uris`: (List of `str`) Each argument should be a URI for a sink. Either an RTSP
-        sink (e.g., "rtsp://192.168.1.1:5000"), the word "display", or a path to a file to save.
+        sink (e.g., "rtsp://192.168.1.1:5000"), the word "display", the word "null" (discard the video),
+        or a path to a file to save.
+
+        `sync`: (`bool`) If False, the sinks do not wait on the clock, so the pipeline runs as fast as it can.
+        This is what you want when processing recorded files.
         """
         for uri in sink_uris:
             if not gst_utils.sink_uri_valid(uri):
                 return ValueError(f"Invalid sink URI: {uri}")
 
-        self.sink = gst_sink.GStreamerSink(sink_uris)
+        self.sink = gst_sink.GStreamerSink(sink_uris, sync=sync)
+
+    def set_camera_mux(self, camera_mux, frames_per_camera: int) -> Exception|None:
+        """
+        Time-multiplex the cameras: alternate between the front and rear cameras every
+        `frames_per_camera` frames, feeding both into the same model. Results are tagged with
+        the camera each frame came from. The source must be a camera.
+
+        `camera_mux`: (`cameras.CameraMux`) The camera mux. We are one of its users until `shutdown()`.
+        """
+        if frames_per_camera < 1:
+            return ValueError(f"Invalid number of frames per camera: {frames_per_camera}")
+
+        if camera_mux is not self.camera_mux:
+            if self.camera_mux is not None:
+                self.camera_mux.release(self._camera_mux_handle)
+            self._camera_mux_handle = camera_mux.acquire()
+        self.camera_mux = camera_mux
+        self.frames_per_camera = frames_per_camera
+
+    def set_frame_tap(self, frame_tap: gst_frames.FrameTap) -> Exception|None:
+        """
+        Hand the frames that come out of the model to Python, along the way to the sinks. The tap
+        gets the model-sized frames that the detections are for, so it is put in passthrough mode.
+        Must be set before `start()`.
+        """
+        frame_tap.passthrough = True
+        self.frame_tap = frame_tap
+        return None
+
+    def add_results_callback(self, callback: Callable) -> None:
+        """
+        Register a function to be called with the detections for each frame. The function
+        receives a numpy array of `storage.detections.DETECTION_DTYPE` records (possibly empty)
+        and is called from the GStreamer streaming thread, so it should return quickly.
+
+        Callbacks must be registered before `start()`.
+        """
+        self.results_callbacks.append(callback)
+
+    @property
+    def frames_processed(self) -> int:
+        """
+        The number of frames that have made it through the model so far.
+        Only counted if there is at least one results callback.
+        """
+        return 0 if self.results is None else self.results.frames
+
+    def _build(self):
+        """
+        Construct the pipeline from the configured elements.
+        """
+        preprocess = self.preprocess
+        sink = self.sink
+        if self.dual_stream and self.source is not None and self.source.is_camera and self.model is not None:
+            # Have the camera's ISP produce the model's input directly, and send its full-resolution stream
+            # to the sinks. The model branch then ends in the results (if any).
+            self.source.video_format = self.model.color_format
+            self.source.video_width = self.model.width
+            self.source.video_height = self.model.height
+            err = self.source.set_main_stream(*self.main_stream, sink=self.sink)
+            if err:
+                log.error("Could not set up the camera's main stream: %s", err)
+            else:
+                self.model.prescaled = True
+                preprocess = None
+                sink = gst_sink.GStreamerSink("null", sync=False, name="model_sink")
+
+        # Only a live camera has caps we can change as we go
+        self._adapting = self.adaptive is not None and self.source is not None and self.source.is_camera and self.model is not None
+        if self._adapting:
+            width, height, fps = self.adaptive.settings
+            if not self.model.prescaled:
+                self.source.video_width = width
+                self.source.video_height = height
+            self.source.video_framerate = fps
+
+        if self.tracker is not None:
+            self.tracker.clear()
+
+        if self.results_callbacks or self.frame_callbacks or self.tracker is not None:
+            model_index = self.model_type.id if self.model_type is not None else 0
+            live = not os.path.isfile(self.source.source_uri)
+            self._results_store = self.store if live else self.file_store
+            camera_of = self.camera_mux.camera_for_pts if self.camera_mux is not None else None
+            self.results = gst_results.GStreamerResultsTap(self.results_callbacks, model_index=model_index, camera_of=camera_of, wall_clock=live, frame_callbacks=self.frame_callbacks, tracker=self.tracker)
+
+        # It is okay for some of these to be None (only source and sink are technically required to be non-None)
+        self.pipeline = gst_app.GStreamerApp("hailo-pipeline", self.source, self.native_preprocess, preprocess, self.model, self.postprocess, self.results, self.frame_tap, sink)
+
+        if self.camera_mux is not None:
+            self.camera_mux.attach(self.pipeline, self.source)
+            err = self.camera_mux.start_multiplexing(self.frames_per_camera)
+            if err:
+                log.error("Could not multiplex the cameras: %s", err)
+
+        if self.model is not None:
+            # Frames skipped because of the inference stride are dropped, which is only okay on the model's
+            # own branch of a dual-stream camera. In a linear pipeline (a file, or dual-stream off) the sinks
+            # get the frames that come out of the model, so they would lose them too.
+            self._model_input_frames = 0
+            if self.model.prescaled:
+                self.pipeline.add_buffer_probe(self.model.input_name, self._on_model_input, pad_name="sink")
+            elif self.thermal is not None:
+                log.info("Running inference on every frame whatever the temperature, since the sinks share the model's frames")
+            self._inference_started_s.clear()
+            self.pipeline.add_buffer_probe(f"{self.model.name}_hailonet", self._on_inference_start, pad_name="sink")
+            self.pipeline.add_buffer_probe(f"{self.model.name}_hailonet", self._on_inference_end, pad_name="src")
+
+        if self._adapting:
+            self.frame_tracker.clear()
+            self.pipeline.add_buffer_probe(self.source.caps_name, self.frame_tracker.frame_in)
+
+    def _on_store_results(self, records):
+        """
+        Results callback: keep the records in the store for the current source (live or recorded).
+        """
+        if self._results_store is not None:
+            self._results_store.append(records)
+
+    def _on_frame_results(self, records, frame, track_ids):
+        self.snapshotter.offer(records, frame, self.results.labels, track_ids)
+
+    def _on_model_input(self, pts) -> bool:
+        self._model_input_frames += 1
+        stride = self.inference_stride
+        if stride > 1 and self._model_input_frames % stride:
+            self.stride_drops_metric.inc()
+            self.frame_tracker.skip(pts)
+            return False
+        return True
+
+    def _on_adaptive_rung(self, rung: int, settings):
+        width, height, fps = settings
+        if self.model.prescaled:
+            # The camera's model-sized stream has to stay model-sized
+            caps = self.source.caps_string(video_framerate=fps)
+        else:
+            caps = self.source.caps_string(width, height, fps)
+        err = self.pipeline.set_caps(self.source.caps_name, caps)
+        if err:
+            log.error("Could not change the camera's caps: %s", err)
+
+    def _on_thermal_level(self, level: int):
+        self.inference_stride = self.strides[level]
+        log.info("Running inference on every %s frame(s)", self.inference_stride)
+
+    def _start_controllers(self):
+        if self.thermal is not None:
+            self.thermal.start()
+        if self._adapting:
+            self.adaptive.start(self.frame_tracker)
+
+    def _stop_controllers(self):
+        if self.thermal is not None:
+            self.thermal.shutdown()
+        if self.adaptive is not None:
+            self.adaptive.shutdown()
+
+    def _on_inference_start(self, pts) -> bool:
+        started = self._inference_started_s
+        # Frames the accelerator dropped never come out, so don't let them pile up
+        if len(started) > 64:
+            started.clear()
+        started[pts] = time.perf_counter()
+        return True
+
+    def _on_inference_end(self, pts) -> bool:
+        started_s = self._inference_started_s.pop(pts, None)
+        if started_s is not None:
+            latency_s = time.perf_counter() - started_s
+            self.inference_latency_metric.observe(latency_s)
+            self.inference_busy_metric.inc(latency_s)
+        self.frame_tracker.frame_out(pts)
+        return True
 
     def start(self, loop=False):
         """
         Start the pipeline.
         """
         if self.pipeline is None:
-            # It is okay for some of these to be None (only source and sink are technically required to be non-None)
-            self.pipeline = gst_app.GStreamerApp("hailo-pipeline", self.source, self.preprocess, self.model, self.postprocess, self.sink)
+            self._build()
+
+        self.awake = True
+        self._start_controllers()
+        self.pipeline.run(repeat_on_end_of_stream=loop)
+
+    def standby(self, timeout_s=5.0) -> Exception|None:
+        """
+        Get the pipeline ready to go without running it: build it (if needed) and preroll it
+        in PAUSED, with the camera configured and the model loaded, but no frames flowing.
+        Also puts a running pipeline back into standby. `wake()` then only has to start it.
+        """
+        if self.pipeline is None:
+            # Track the first detection after each wake
+            if not self._tracking_wakes:
+                self.add_results_callback(self._on_wake_results)
+                self._tracking_wakes = True
+
+            self._build()
+            self.pipeline.add_state_callback(self._on_wake_state)
+            self.pipeline.add_buffer_probe(self.source.name, self._on_wake_buffer)
+
+        self.awake = False
+        self._stop_controllers()
+        return self.pipeline.preroll(timeout_s)
+
+    def wake(self, loop=False, edge_ns: int|None = None) -> Exception|None:
+        """
+        Take the pipeline from standby to PLAYING.
+
+        `edge_ns`: (`int`) When the activity that triggered the wake happened (`time.monotonic_ns()`),
+        if known, so that it is included in the wake's timeline.
+        """
+        if self.pipeline is None:
+            return RuntimeError("Nothing to wake; call standby() first")
+        if self.awake:
+            return None
 
+        self._wake = WakeTimeline(edge_ns, time.monotonic_ns())
+        self.wakes.append(self._wake)
+        self.awake = True
+        self._start_controllers()
         self.pipeline.run(repeat_on_end_of_stream=loop)
+        return None
+
+    def wake_on_edge(self, pin: int, edge=gpio.Edge.RISING, debounce_ms=0.0, submit: Callable|None = None):
+        """
+        Wake whenever the given input pin (e.g., a PIR sensor or the MCU's interrupt line) sees the given edge.
+        Returns the handle from `gpio.add_edge_callback()`.
+
+        `submit`: (`Callable`) If given, the wake is handed to it as `submit(fn, *args)` (e.g., an executor's
+        `submit()`) instead of running on the GPIO dispatcher thread, so that it runs on the same thread as
+        everything else that controls the pipeline.
+        """
+        gpio.configure_pin(pin, gpio.Direction.IN)
+        def wake(edge_ns: int):
+            if self.pipeline is None:
+                # Shut down since the edge
+                return
+            err = self.wake(edge_ns=edge_ns)
+            if err:
+                log.error("Could not wake the AI pipeline: %s", err)
+
+        def on_edge(event: gpio.EdgeEvent):
+            if submit is None:
+                wake(event.timestamp_ns)
+                return
+            try:
+                submit(wake, event.timestamp_ns)
+            except RuntimeError as e:
+                # The executor has been shut down
+                log.debug("Not waking the AI pipeline: %s", e)
+        return gpio.add_edge_callback(pin, edge, on_edge, debounce_ms=debounce_ms)
+
+    def _on_wake_state(self, state: str, timestamp_ns: int):
+        wake = self._wake
+        if wake is not None and state == "PLAYING" and wake.playing_ns is None:
+            wake.playing_ns = timestamp_ns
+
+    def _on_wake_buffer(self, pts) -> bool:
+        wake = self._wake
+        if wake is not None and wake.first_buffer_ns is None:
+            wake.first_buffer_ns = time.monotonic_ns()
+        return True
+
+    def _on_wake_results(self, records):
+        wake = self._wake
+        if wake is not None and wake.first_detection_ns is None and len(records) > 0:
+            wake.first_detection_ns = time.monotonic_ns()
+            start_ns = wake.edge_ns if wake.edge_ns is not None else wake.wake_ns
+            self.wake_latency_metric.observe((wake.first_detection_ns - start_ns) / 1e9)
+            log.info("Wake latencies (ms): %s", wake.latencies_ms())
+
+    def wait(self, timeout_s=None) -> bool:
+        """
+        Block until the pipeline finishes (e.g., at the end of a file source).
+        Returns False if we timed out or there is no pipeline.
+        """
+        if self.pipeline is None:
+            return False
+
+        return self.pipeline.wait(timeout_s)
 
     def stop(self):
         """
@@ -108,3 +559,7 @@ class AICoprocessor:
         if self.pipeline is not None:
             self.pipeline.shutdown()
             self.pipeline.rewind()
+
+        self.awake = False
+        self._stop_controllers()
+        self._commit_results()
@@ -1,3 +1,516 @@
 """
 This module enables low-level communications with the microcontroller.
+
+We talk to the MCU over SPI. Every SPI transaction is a fixed-size, full-duplex
+transfer of `transfer_size` bytes. The bytes we send are a sequence of request
+frames followed by zero padding, and the bytes we get back at the same time are
+the MCU's response frames to the requests from the *previous* transaction (the MCU
+can't answer a request while it is still being clocked in). Packing as many frames
+as possible into each transaction keeps the per-transaction overhead down.
+
+Frame layout (little-endian):
+
+    | SOF (0xA5) | seq (u8) | command (u8) | length (u8) | payload (length bytes) | CRC-16/CCITT-FALSE (u16) |
+
+The CRC covers seq, command, length and payload. Responses echo the request's seq,
+with the command's top bit set (or `ERROR_RESPONSE` if the MCU could not do it).
+A response frame that doesn't fit in what is left of a transaction carries on in
+the next one, so we hold on to a frame that is cut off at the end of a transaction.
+
+Requests return `concurrent.futures.Future`s, so callers can block on them, wait on
+several at once, or await them from asyncio (see `MCU.arequest()`).
 """
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+import asyncio
+import binascii
+import collections
+import concurrent.futures
+import enum
+import struct
+import threading
+import time
+from ..common import appconfig
+from ..common import log
+
+try:
+    import spidev
+    SPIDEV_ENABLED = True
+except ImportError:
+    SPIDEV_ENABLED = False
+
+SOF = 0xA5
+HEADER_SIZE = 4
+CRC_SIZE = 2
+FRAME_OVERHEAD = HEADER_SIZE + CRC_SIZE
+MAX_PAYLOAD = 255
+RESPONSE_FLAG = 0x80
+ERROR_RESPONSE = 0xFF
+
+class Command(enum.IntEnum):
+    """
+    Commands understood by the MCU.
+    """
+    # Does nothing. Payload is echoed back.
+    PING          = 0x01
+    # Payload: sensor ID (u8). Response: the sensor's values (f32 each).
+    READ_SENSOR   = 0x02
+    # Payload: on (u8). Response: empty.
+    FLASHLIGHT    = 0x03
+    # Payload: strip (u8), first pixel (u16), then RGB triplets. Response: empty.
+    LED_PIXELS    = 0x04
+    # Payload: strip (u8). Latch the pixels sent so far. Response: empty.
+    LED_SHOW      = 0x05
+
+class Sensor(enum.IntEnum):
+    """
+    Sensors behind the MCU, and the number of f32 values each one returns.
+    """
+    # Degrees C, percent relative humidity
+    TEMPERATURE_HUMIDITY = 0
+    # Latitude (degrees), longitude (degrees), altitude (m), fix quality
+    GPS                  = 1
+    # Acceleration (m/s^2) x, y, z; angular rate (rad/s) x, y, z
+    IMU                  = 2
+
+SENSOR_VALUE_COUNTS = {
+    Sensor.TEMPERATURE_HUMIDITY: 2,
+    Sensor.GPS: 4,
+    Sensor.IMU: 6,
+}
+
+class MCUError(Exception):
+    """
+    The MCU sent back an error for a request.
+    """
+    pass
+
+def crc16(data) -> int:
+    """
+    CRC-16/CCITT-FALSE of the given bytes.
+    """
+    return binascii.crc_hqx(data, 0xFFFF)
+
+def pack_frame(buffer: bytearray, offset: int, seq: int, command: int, payload: bytes) -> int:
+    """
+    Write a frame into `buffer` at `offset` and return the offset just past it.
+    """
+    end = offset + HEADER_SIZE + len(payload)
+    buffer[offset] = SOF
+    buffer[offset + 1] = seq
+    buffer[offset + 2] = command
+    buffer[offset + 3] = len(payload)
+    buffer[offset + HEADER_SIZE:end] = payload
+    struct.pack_into("<H", buffer, end, crc16(memoryview(buffer)[offset + 1:end]))
+    return end + CRC_SIZE
+
+def unpack_frames(buffer) -> Tuple[List[Tuple[int, int, bytes]], int, int]:
+    """
+    Parse all the frames in `buffer`. Returns a list of (seq, command, payload), the
+    number of corrupt frames that were skipped, and the offset of the frame that is
+    cut off at the end of the buffer (`len(buffer)` if there isn't one).
+    """
+    frames = []
+    corrupt = 0
+    view = memoryview(buffer)
+    i = 0
+    n = len(buffer)
+    while i < n:
+        if buffer[i] != SOF:
+            # Padding (or garbage); skip to the next possible start of frame
+            i += 1
+            continue
+
+        if i + HEADER_SIZE > n:
+            return frames, corrupt, i
+
+        length = buffer[i + 3]
+        end = i + HEADER_SIZE + length
+        if end + CRC_SIZE > n:
+            return frames, corrupt, i
+
+        (crc,) = struct.unpack_from("<H", buffer, end)
+        if crc != crc16(view[i + 1:end]):
+            corrupt += 1
+            i += 1
+            continue
+
+        frames.append((buffer[i + 1], buffer[i + 2], bytes(view[i + HEADER_SIZE:end])))
+        i = end + CRC_SIZE
+
+    return frames, corrupt, n
+
+class SpidevBackend:
+    """
+    Talks to the real MCU through spidev.
+    """
+    def __init__(self, bus: int, device: int, speed_hz: int) -> None:
+        self.spi = spidev.SpiDev()
+        self.spi.open(bus, device)
+        self.spi.max_speed_hz = speed_hz
+        self.spi.mode = 0
+
+    def transfer(self, tx: bytearray, rx: bytearray):
+        """
+        Clock out `tx` while clocking in `rx` (same length).
+        """
+        rx[:] = bytes(self.spi.xfer2(tx))
+
+    def close(self):
+        self.spi.close()
+
+class EmulatedMCU:
+    """
+    A software stand-in for the MCU firmware. Like the real thing, it answers the
+    requests from one transaction during the next one. It only sends whole frames in a
+    transaction, unless a frame is bigger than a whole transaction.
+
+    `sensors` maps `Sensor`s to functions that return their values.
+    """
+    def __init__(self, sensors: Dict[Sensor, Callable[[], List[float]]]|None = None) -> None:
+        self.sensors = sensors if sensors is not None else {
+            Sensor.TEMPERATURE_HUMIDITY: lambda: [21.5, 40.0],
+            Sensor.GPS: lambda: [0.0, 0.0, 0.0, 0.0],
+            Sensor.IMU: lambda: [0.0, 0.0, 9.81, 0.0, 0.0, 0.0],
+        }
+        self.flashlight_on = False
+        self.led_pixels: Dict[int, bytearray] = collections.defaultdict(bytearray)
+        self.led_shown: Dict[int, bytes] = {}
+        self.transactions = 0
+        self._outbox = collections.deque()
+
+    def _handle(self, command: int, payload: bytes) -> Tuple[int, bytes]:
+        match command:
+            case Command.PING:
+                return (command | RESPONSE_FLAG, payload)
+            case Command.READ_SENSOR:
+                sensor = Sensor(payload[0])
+                values = self.sensors[sensor]()
+                return (command | RESPONSE_FLAG, struct.pack(f"<{len(values)}f", *values))
+            case Command.FLASHLIGHT:
+                self.flashlight_on = bool(payload[0])
+                return (command | RESPONSE_FLAG, b"")
+            case Command.LED_PIXELS:
+                strip = payload[0]
+                (first,) = struct.unpack_from("<H", payload, 1)
+                rgb = payload[3:]
+                pixels = self.led_pixels[strip]
+                if len(pixels) < 3 * first + len(rgb):
+                    pixels.extend(bytes(3 * first + len(rgb) - len(pixels)))
+                pixels[3 * first:3 * first + len(rgb)] = rgb
+                return (command | RESPONSE_FLAG, b"")
+            case Command.LED_SHOW:
+                self.led_shown[payload[0]] = bytes(self.led_pixels[payload[0]])
+                return (command | RESPONSE_FLAG, b"")
+            case _:
+                return (ERROR_RESPONSE, bytes([command]))
+
+    def transfer(self, tx: bytearray, rx: bytearray):
+        """
+        Clock out `tx` while clocking in `rx` (same length).
+        """
+        self.transactions += 1
+
+        # Send as much of what we prepared during the last transaction as fits
+        n = 0
+        while self._outbox and n + len(self._outbox[0]) <= len(rx):
+            frame = self._outbox.popleft()
+            rx[n:n + len(frame)] = frame
+            n += len(frame)
+        if n == 0 and self._outbox:
+            frame = self._outbox[0]
+            n = len(rx)
+            rx[:] = frame[:n]
+            del frame[:n]
+        rx[n:] = bytes(len(rx) - n)
+
+        # And prepare the responses to this one
+        frames, _, _ = unpack_frames(tx)
+        for seq, command, payload in frames:
+            try:
+                response_command, response = self._handle(command, payload)
+            except (ValueError, IndexError, KeyError, struct.error):
+                response_command, response = ERROR_RESPONSE, bytes([command])
+            frame = bytearray(FRAME_OVERHEAD + len(response))
+            pack_frame(frame, 0, seq, response_command, response)
+            self._outbox.append(frame)
+
+    def close(self):
+        pass
+
+class MCU:
+    """
+    The `MCU` class should be used as a singleton for talking to the microcontroller.
+
+    Requests are queued and a background thread packs as many of them as fit into each
+    SPI transaction, so many small requests cost only a few transactions.
+
+    If a transaction fails (e.g., the SPI device goes away), the link is down for good:
+    every request that was queued or in flight fails, `link_error` says why, and new
+    requests fail straight away.
+    """
+    _shared = None
+
+    def __init__(self, config: Dict[str, Any], backend=None) -> None:
+        mcu_config = appconfig.section(config, appconfig.MCUConfig)
+        self.transfer_size = mcu_config.transfer_size
+        self.timeout_s = mcu_config.request_timeout_seconds
+        self.batch_window_s = mcu_config.batch_window_seconds
+
+        if backend is not None:
+            self.backend = backend
+        elif mcu_config.backend == "spidev" and SPIDEV_ENABLED:
+            self.backend = SpidevBackend(mcu_config.spi_bus, mcu_config.spi_device, mcu_config.spi_speed_hz)
+        else:
+            if mcu_config.backend == "spidev":
+                log.warning("spidev is not installed. Using the emulated MCU.")
+            self.backend = EmulatedMCU()
+
+        # Pre-allocated transfer buffers, reused for every transaction, and the start of
+        # a response frame that was cut off at the end of the last transaction
+        self._tx = bytearray(self.transfer_size)
+        self._rx = bytearray(self.transfer_size)
+        self._rx_partial = bytearray()
+
+        self.transactions = 0
+        self.crc_errors = 0
+        self.link_error: Exception|None = None
+
+        self._seq = 0
+        self._queue = collections.deque()
+        self._pending: Dict[int, Tuple[concurrent.futures.Future, float]] = {}
+        self._cv = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="mcu", daemon=True)
+        self._thread.start()
+
+    @property
+    def max_payload(self) -> int:
+        """
+        The longest payload a single request can carry.
+        """
+        return min(MAX_PAYLOAD, self.transfer_size - FRAME_OVERHEAD)
+
+    @classmethod
+    def shared(cls, config: Dict[str, Any]) -> "MCU":
+        """
+        Return the link shared by everything that talks to the MCU, creating it if needed.
+        """
+        if cls._shared is None:
+            cls._shared = MCU(config)
+        return cls._shared
+
+    @classmethod
+    def shutdown_shared(cls):
+        """
+        Shut down the shared link, if there is one.
+        """
+        if cls._shared is not None:
+            cls._shared.shutdown()
+
+    def shutdown(self):
+        """
+        Clean shutdown function.
+        """
+        if MCU._shared is self:
+            MCU._shared = None
+
+        with self._cv:
+            self._running = False
+            self._cv.notify()
+        self._thread.join()
+        self.backend.close()
+
+        for future, _ in self._pending.values():
+            future.set_exception(MCUError("MCU link shut down"))
+        self._pending.clear()
+        while self._queue:
+            _, _, future = self._queue.popleft()
+            if future.set_running_or_notify_cancel():
+                future.set_exception(MCUError("MCU link shut down"))
+
+    def request(self, command: Command, payload=b"") -> concurrent.futures.Future:
+        """
+        Queue a request. The returned future resolves to the response's payload (`bytes`),
+        or raises `MCUError` or `TimeoutError`.
+        """
+        if len(payload) > self.max_payload:
+            raise ValueError(f"Payload too long: {len(payload)} bytes")
+
+        future = concurrent.futures.Future()
+        with self._cv:
+            if self.link_error is not None:
+                future.set_exception(MCUError(f"MCU link is down: {self.link_error}"))
+            elif not self._running:
+                future.set_exception(MCUError("MCU link shut down"))
+            else:
+                self._queue.append((command, bytes(payload), future))
+                self._cv.notify()
+        return future
+
+    async def arequest(self, command: Command, payload=b"") -> bytes:
+        """
+        Like `request()`, but for use from asyncio.
+        """
+        return await asyncio.wrap_future(self.request(command, payload))
+
+    def call(self, command: Command, payload=b"") -> Tuple[Exception|None, bytes|None]:
+        """
+        Make a request and wait for the response.
+        """
+        try:
+            return (None, self.request(command, payload).result())
+        except (MCUError, TimeoutError) as e:
+            return (e, None)
+
+    def read_sensor(self, sensor: Sensor) -> concurrent.futures.Future:
+        """
+        Request the given sensor's values. The future resolves to a tuple of floats.
+        """
+        future = concurrent.futures.Future()
+        raw = self.request(Command.READ_SENSOR, bytes([sensor]))
+
+        def done(f):
+            try:
+                payload = f.result()
+                future.set_result(struct.unpack(f"<{len(payload) // 4}f", payload))
+            except Exception as e:
+                future.set_exception(e)
+
+        raw.add_done_callback(done)
+        return future
+
+    def _next_seq(self) -> int:
+        # Skip sequence numbers that are still waiting on a response
+        for _ in range(256):
+            self._seq = (self._seq + 1) & 0xFF
+            if self._seq not in self._pending:
+                return self._seq
+        raise MCUError("Too many requests in flight")
+
+    def _run(self):
+        """
+        The link thread: pack, transfer, unpack, repeat.
+        """
+        while True:
+            with self._cv:
+                while self._running and not self._queue and not self._pending:
+                    self._cv.wait()
+                if not self._running:
+                    return
+
+            # Give other requests a moment to pile up, so they can share the transaction
+            if self.batch_window_s > 0:
+                time.sleep(self.batch_window_s)
+
+            try:
+                self._transact()
+            except Exception as e:
+                log.error("MCU link failed: %s", e)
+                self._fail(e)
+                return
+
+    def _fail(self, e: Exception):
+        """
+        Take the link down: fail everything that was queued or in flight, and everything that comes after.
+        """
+        error = MCUError(f"MCU link failed: {e}")
+        error.__cause__ = e
+        with self._cv:
+            self.link_error = e
+            futures = [future for future, _ in self._pending.values()]
+            self._pending.clear()
+            while self._queue:
+                _, _, future = self._queue.popleft()
+                if future.set_running_or_notify_cancel():
+                    futures.append(future)
+
+        for future in futures:
+            future.set_exception(error)
+
+    def _transact(self):
+        """
+        Do one SPI transaction.
+        """
+        now_s = time.monotonic()
+        offset = 0
+        with self._cv:
+            while self._queue:
+                command, payload, future = self._queue[0]
+                if offset + FRAME_OVERHEAD + len(payload) > self.transfer_size or len(self._pending) >= 256:
+                    # The rest wait for the next transaction (or for sequence numbers to free up)
+                    break
+                self._queue.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                seq = self._next_seq()
+                self._pending[seq] = (future, now_s)
+                offset = pack_frame(self._tx, offset, seq, command, payload)
+
+        self._tx[offset:] = bytes(self.transfer_size - offset)
+        self.backend.transfer(self._tx, self._rx)
+        self.transactions += 1
+
+        if self._rx_partial:
+            self._rx_partial += self._rx
+            received = self._rx_partial
+        else:
+            received = self._rx
+        frames, corrupt, partial = unpack_frames(received)
+        self._rx_partial = bytearray(received[partial:])
+        self.crc_errors += corrupt
+        if corrupt:
+            log.warning("%d corrupt frames from the MCU", corrupt)
+
+        with self._cv:
+            for seq, command, payload in frames:
+                if seq not in self._pending:
+                    log.warning("Unexpected response from the MCU (seq %d, command %#x)", seq, command)
+                    continue
+                future, _ = self._pending.pop(seq)
+                if command == ERROR_RESPONSE:
+                    future.set_exception(MCUError(f"MCU could not handle command {payload[0] if payload else '?'}"))
+                else:
+                    future.set_result(payload)
+
+            # Anything we have waited on for too long is not coming
+            for seq, (future, sent_s) in list(self._pending.items()):
+                if now_s - sent_s > self.timeout_s:
+                    del self._pending[seq]
+                    future.set_exception(TimeoutError(f"No response from the MCU for seq {seq}"))
+
+def benchmark(mcu: MCU, nrequests=10000, in_flight=32) -> Dict[str, float]:
+    """
+    Send `nrequests` PINGs with up to `in_flight` outstanding at a time and report
+    transactions per second, requests per second, and request latency.
+    """
+    latencies = []
+    transactions_before = mcu.transactions
+    start_s = time.perf_counter()
+    outstanding = collections.deque()
+    for i in range(nrequests):
+        outstanding.append((time.perf_counter(), mcu.request(Command.PING, i.to_bytes(4, 'little'))))
+        if len(outstanding) >= in_flight:
+            sent_s, future = outstanding.popleft()
+            future.result()
+            latencies.append(time.perf_counter() - sent_s)
+    while outstanding:
+        sent_s, future = outstanding.popleft()
+        future.result()
+        latencies.append(time.perf_counter() - sent_s)
+    elapsed_s = time.perf_counter() - start_s
+
+    latencies.sort()
+    transactions = mcu.transactions - transactions_before
+    return {
+        "requests": nrequests,
+        "transactions": transactions,
+        "transactions_per_s": transactions / elapsed_s,
+        "requests_per_s": nrequests / elapsed_s,
+        "requests_per_transaction": nrequests / transactions if transactions else 0.0,
+        "latency_p50_ms": latencies[len(latencies) // 2] * 1000,
+        "latency_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
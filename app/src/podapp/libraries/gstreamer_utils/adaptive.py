@@ -0,0 +1,217 @@
+"""
+This module keeps a pipeline from falling behind its camera.
+
+A `FrameTracker` follows frames (by PTS) from one point in a pipeline to another and,
+every window, reports how long they took and what fraction of them never made it
+(e.g., dropped by a leaky queue). The `AdaptiveController` takes those measurements and
+moves along a ladder of camera settings (rung 0 being the best): it steps down a rung
+as soon as a window is over the target latency or drop fraction, and steps back up only
+once the latency has been well under the target (`headroom`) for a while (`hold`).
+What a rung means is up to whoever is told about it (e.g., `AICoprocessor` changes the
+caps of the camera's capsfilter on the running pipeline).
+
+Nothing in here needs GStreamer, so the control loop can be tested off-device.
+"""
+from typing import Callable
+from typing import Dict
+from typing import Tuple
+import threading
+import time
+from ..common import appconfig
+from ..common import log
+from ..common import metrics
+
+# Bucket upper bounds (seconds) for end-to-end latencies
+E2E_BUCKETS_S = (0.025, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0, 2.0)
+
+class FrameTracker:
+    """
+    Call `frame_in(pts)` where frames enter, `skip(pts)` for frames that are dropped
+    on purpose (they don't count as lost), and `frame_out(pts)` where frames leave.
+    These may be called from different streaming threads.
+
+    A frame that hasn't come out `timeout_s` after it went in is lost. So is the
+    oldest frame in flight, if there are ever more than `max_in_flight`.
+    """
+    def __init__(self, timeout_s=1.0, max_in_flight=256, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.timeout_s = timeout_s
+        self.max_in_flight = max_in_flight
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._in_flight: Dict[int, float] = {}
+        self._latencies_s = []
+        self._lost = 0
+        self.latency_metric = metrics.histogram("ai_end_to_end_latency_seconds", "Time each frame takes from the camera to the model's output", bounds=E2E_BUCKETS_S)
+        self.lost_metric = metrics.counter("ai_frames_lost", "Frames that went into the pipeline but never came out of the model")
+
+    def frame_in(self, pts) -> bool:
+        with self._lock:
+            self._in_flight[pts] = self.clock()
+            if len(self._in_flight) > self.max_in_flight:
+                # Dicts keep insertion order, so this is the oldest
+                del self._in_flight[next(iter(self._in_flight))]
+                self._lost += 1
+                self.lost_metric.inc()
+        return True
+
+    def skip(self, pts) -> None:
+        with self._lock:
+            self._in_flight.pop(pts, None)
+
+    def frame_out(self, pts) -> bool:
+        with self._lock:
+            started_s = self._in_flight.pop(pts, None)
+            if started_s is None:
+                return True
+            latency_s = self.clock() - started_s
+            self._latencies_s.append(latency_s)
+        self.latency_metric.observe(latency_s)
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._in_flight.clear()
+            self._latencies_s = []
+            self._lost = 0
+
+    def take_window(self) -> Tuple[float|None, float, int]:
+        """
+        Returns (90th percentile latency in seconds or None if no frames came out, fraction of frames lost,
+        number of frames that came out or were lost) since the last call, and starts a new window.
+        """
+        with self._lock:
+            now_s = self.clock()
+            timed_out = [pts for pts, started_s in self._in_flight.items() if now_s - started_s > self.timeout_s]
+            for pts in timed_out:
+                del self._in_flight[pts]
+            lost = self._lost + len(timed_out)
+            latencies_s = self._latencies_s
+            self._latencies_s = []
+            self._lost = 0
+
+        self.lost_metric.inc(len(timed_out))
+        nframes = len(latencies_s) + lost
+        if not nframes:
+            return None, 0.0, 0
+
+        latency_s = None
+        if latencies_s:
+            latencies_s.sort()
+            latency_s = latencies_s[min(len(latencies_s) - 1, int(0.9 * len(latencies_s)))]
+        return latency_s, lost / nframes, nframes
+
+class AdaptiveController:
+    """
+    Calls `on_rung(rung, (width, height, fps))` (from its own thread, once started) whenever the rung changes.
+    `clock` tells the time in seconds, and can be swapped out for testing.
+    """
+    def __init__(self, adaptive_config: appconfig.AdaptiveConfig, on_rung: Callable[[int, Tuple[int, int, float]], None], clock: Callable[[], float] = time.monotonic) -> None:
+        self.on_rung = on_rung
+        self.clock = clock
+        self.reconfigure(adaptive_config)
+
+        self.rung = 0
+        self.latency_s = None
+        self.drop_fraction = 0.0
+        self._comfortable_since_s = None
+        self._settling = False
+
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.rung_metric = metrics.gauge("adaptive_rung", "Rung of the camera settings ladder the pipeline is on (0 is the best)")
+        self.step_down_metric = metrics.counter("adaptive_transitions", "Times the adaptive controller changed rung", {"direction": "down"})
+        self.step_up_metric = metrics.counter("adaptive_transitions", "Times the adaptive controller changed rung", {"direction": "up"})
+
+    def reconfigure(self, adaptive_config: appconfig.AdaptiveConfig) -> None:
+        """
+        Apply a (new) adaptive configuration section. Takes effect from the next window.
+        """
+        self.target_s = adaptive_config.target_latency_ms / 1000
+        self.max_drop_fraction = adaptive_config.max_drop_fraction
+        self.headroom = adaptive_config.headroom
+        self.period_s = adaptive_config.window_seconds
+        self.hold_s = adaptive_config.hold_seconds
+        self.rungs = adaptive_config.rungs()
+
+    @property
+    def settings(self) -> Tuple[int, int, float]:
+        """
+        The (width, height, fps) of the current rung.
+        """
+        return self.rungs[min(self.rung, len(self.rungs) - 1)]
+
+    def update(self, latency_s: float|None, drop_fraction: float) -> int:
+        """
+        Take a window's measurements into account. `latency_s` is None if no frames came out.
+        Returns the (possibly new) rung.
+        """
+        self.latency_s = latency_s
+        self.drop_fraction = drop_fraction
+
+        if self._settling:
+            # This window straddles the last change (the camera renegotiating), so it says nothing about the new rung
+            self._settling = False
+            return self.rung
+
+        rung = min(self.rung, len(self.rungs) - 1)
+        behind = drop_fraction > self.max_drop_fraction or latency_s is None or latency_s > self.target_s
+        if behind:
+            # Falling behind only gets worse: go down right away
+            if rung < len(self.rungs) - 1:
+                rung += 1
+            self._comfortable_since_s = None
+        elif rung > 0 and latency_s < self.target_s * self.headroom:
+            now_s = self.clock()
+            if self._comfortable_since_s is None:
+                self._comfortable_since_s = now_s
+            if now_s - self._comfortable_since_s >= self.hold_s:
+                rung -= 1
+                # The next rung up has to wait out its own hold
+                self._comfortable_since_s = None
+        else:
+            self._comfortable_since_s = None
+
+        if rung != self.rung:
+            width, height, fps = self.rungs[rung]
+            latency_ms = float("nan") if latency_s is None else latency_s * 1000
+            log.info("Adaptive rung %d -> %d (%dx%d@%g) at %.0f ms, %.0f%% lost", self.rung, rung, width, height, fps, latency_ms, drop_fraction * 100)
+            (self.step_down_metric if rung > self.rung else self.step_up_metric).inc()
+            self.rung = rung
+            self.rung_metric.set(rung)
+            self._settling = True
+            self.on_rung(rung, self.rungs[rung])
+        return rung
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, tracker: FrameTracker):
+        """
+        Take a window from `tracker` every period in a background thread until `shutdown()`.
+        Does nothing if already started.
+        """
+        if self._thread is not None:
+            return
+
+        def run():
+            # Whatever was in flight from before we started says nothing about now
+            tracker.clear()
+            while not self._stop.wait(self.period_s):
+                latency_s, drop_fraction, nframes = tracker.take_window()
+                if nframes:
+                    self.update(latency_s, drop_fraction)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="adaptive", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """
+        Stop adapting. The rung is kept, so that starting again doesn't start out behind.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -1,10 +1,12 @@
 import os
 import threading
+import time
 import gi
 gi.require_version('Gst', '1.0')
 from gi.repository import GLib
 from gi.repository import Gst
 from ..common import log
+from ..common import metrics
 from . import utils
 
 # TODO: Think over how to make this asynchronous. It's kind of hacked together
@@ -16,25 +18,67 @@ class GStreamerApp:
         self.repeat_on_end_of_stream = False
 
         # Create the pipeline
-        Gst.init(None)
+        utils.init()
         pipeline_string = " ! ".join([e.element_pipeline for e in self.elements if e.element_pipeline])
-        log.debug(f"Parse-Launching: {pipeline_string}")
+        log.debug("Parse-Launching: %s", pipeline_string)
         ######################
         # TODO : REMOVE ME
         print(pipeline_string)
         ######################
         self.pipeline = Gst.parse_launch(pipeline_string)
 
+        # Let any elements hook into the constructed pipeline
+        for e in self.elements:
+            e.attach(self.pipeline)
+
         # Save dot file (if desired)
-        log.debug(f"Checking for GST_DEBUG_DUMP_DOT_DIR in environment.")
+        log.debug("Checking for GST_DEBUG_DUMP_DOT_DIR in environment.")
         if os.environ.get("GST_DEBUG_DUMP_DOT_DIR", None) is not None:
             path = os.environ.get("GST_DEBUG_DUMP_DOT_DIR")
-            log.debug(f"Writing dot files to: {path}")
+            log.debug("Writing dot files to: %s", path)
             Gst.debug_bin_to_dot_file(self.pipeline, Gst.DebugGraphDetails.ALL, self.name)
 
         # Create the mainloop
         self.loop = GLib.MainLoop()
         self.loop_thread = None
+        self._bus_watched = False
+
+        # Set once the pipeline has been shut down (EOS, error, or explicit shutdown)
+        self.finished = threading.Event()
+        self.error = None
+
+        # Called with (state name, time.monotonic_ns()) whenever the pipeline changes state
+        self.state_callbacks = []
+
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """
+        Publish the pipeline's health. Queue levels are only read when the metrics are collected.
+        """
+        labels = {"pipeline": self.name}
+        self.state_metric = metrics.gauge("gstreamer_state", "The pipeline's state (0 void pending, 1 null, 2 ready, 3 paused, 4 playing)", labels)
+        self.warnings_metric = metrics.counter("gstreamer_warnings", "Warnings posted on the pipeline's bus", labels)
+        self.errors_metric = metrics.counter("gstreamer_errors", "Errors posted on the pipeline's bus", labels)
+        self.qos_metric = metrics.counter("gstreamer_qos_messages", "QoS messages (late or dropped buffers) posted on the pipeline's bus", labels)
+        # Per-element metrics, as (name, labels), to forget when the pipeline is shut down
+        self._element_metrics = []
+        for e in self.pipeline.iterate_recurse():
+            factory = e.get_factory()
+            if factory is not None and factory.get_name() == "queue":
+                queue_labels = {"pipeline": self.name, "queue": e.get_name()}
+                metrics.gauge("gstreamer_queue_level_buffers", "Buffers waiting in each of the pipeline's queues",
+                              queue_labels, fn=lambda q=e: q.get_property("current-level-buffers"))
+                self._element_metrics.append(("gstreamer_queue_level_buffers", queue_labels))
+
+    def _unregister_element_metrics(self):
+        """
+        Forget the per-element metrics, which would otherwise keep the elements alive
+        (and keep being reported) after the pipeline is gone.
+        """
+        for name, labels in self._element_metrics:
+            metrics.REGISTRY.remove(name, labels)
+        self._element_metrics = []
 
     def _handle_end_of_stream(self) -> bool:
         """
@@ -50,7 +94,7 @@ class GStreamerApp:
             success = True
 
         if not success:
-            log.error(f"Could not rewind pipeline {self.name}")
+            log.error("Could not rewind pipeline %s", self.name)
 
         return success
 
@@ -67,59 +111,172 @@ class GStreamerApp:
             case Gst.MessageType.INFO:
                 # An info debug message ocurred in the pipeline
                 info, debug = message.parse_warning()
-                log.info(f"Info in the GStreamer pipeline {self.name}: {info}, {debug}")
+                log.info("Info in the GStreamer pipeline %s: %s, %s", self.name, info, debug)
                 return True
             case Gst.MessageType.WARNING:
                 # A warning ocurred in the pipeline
                 warning, debug = message.parse_warning()
-                log.warning(f"Warning in the GStreamer pipeline {self.name}: {warning}, {debug}")
+                log.warning("Warning in the GStreamer pipeline %s: %s, %s", self.name, warning, debug)
+                self.warnings_metric.inc()
                 return True
             case Gst.MessageType.ERROR:
                 # An error ocurred in the pipeline
                 err, debug = message.parse_error()
-                log.error(f"Error in the GStreamer pipeline {self.name}: {err}, {debug}")
+                log.error("Error in the GStreamer pipeline %s: %s, %s", self.name, err, debug)
+                self.errors_metric.inc()
+                self.error = err
                 self.shutdown()
                 return True
             case Gst.MessageType.QOS:
                 # Quality of streaming notification
                 qos_element = message.src.get_name()
-                log.warning(f"Quality of service message received from pipeline {self.name}, element {qos_element}. Message: {message}")
+                log.warning("Quality of service message received from pipeline %s, element %s. Message: %s", self.name, qos_element, message)
+                self.qos_metric.inc()
+                _, _, dropped = message.parse_qos_stats()
+                qos_labels = {"pipeline": self.name, "element": qos_element}
+                metrics.gauge("gstreamer_qos_dropped_buffers", "Buffers each element has dropped, as of its last QoS message", qos_labels).set(dropped)
+                if ("gstreamer_qos_dropped_buffers", qos_labels) not in self._element_metrics:
+                    self._element_metrics.append(("gstreamer_qos_dropped_buffers", qos_labels))
                 return True
             case Gst.MessageType.STREAM_STATUS:
                 # A change in the stream status
                 status, owner = message.parse_stream_status()
-                log.info(f"Stream status changed in pipeline {self.name}: {status}. Owner: {owner}")
+                log.info("Stream status changed in pipeline %s: %s. Owner: %s", self.name, status, owner)
                 return True
             case Gst.MessageType.ELEMENT:
                 # Element-specific bus message. Potentially could want a handler.
                 # TODO: Add element-wise handlers?
-                log.info(f"Pipeline {self.name} received an element-specific message from {message.src.get_name()}: {message}")
+                log.info("Pipeline %s received an element-specific message from %s: %s", self.name, message.src.get_name(), message)
                 return True
             case _:
                 # There are a ton of possible message types. Mostly just ignore them and pretend like we handled them.
                 return True
 
+    def _on_sync_state_changed(self, bus, message):
+        """
+        Handler for state changes, called synchronously from whichever thread made the change,
+        so that the timestamps don't include the main loop's latency.
+        """
+        if message.src == self.pipeline:
+            _, new_state, _ = message.parse_state_changed()
+            timestamp_ns = time.monotonic_ns()
+            self.state_metric.set(int(new_state))
+            for callback in self.state_callbacks:
+                callback(Gst.Element.state_get_name(new_state), timestamp_ns)
+
+    def add_state_callback(self, callback):
+        """
+        Call `callback(state_name, timestamp_ns)` whenever the pipeline changes state (e.g., to "PLAYING").
+        `timestamp_ns` is from `time.monotonic_ns()`.
+        """
+        self.state_callbacks.append(callback)
+
+    def _start_loop(self):
+        """
+        Watch the bus and run the GLib event loop, if we aren't already.
+        """
+        # Add a watch for messages on the pipeline's bus (only once, in case we are run again after a shutdown)
+        if not self._bus_watched:
+            bus = self.pipeline.get_bus()
+            bus.add_signal_watch()
+            bus.connect("message", self.bus_call, self.loop)
+            bus.enable_sync_message_emission()
+            bus.connect("sync-message::state-changed", self._on_sync_state_changed)
+            self._bus_watched = True
+
+        # Disable QoS to prevent frame drops
+        utils.disable_qos(self.pipeline)
+
+        # Run the GLib event loop
+        if self.loop_thread is None or not self.loop_thread.is_alive():
+            self.loop_thread = threading.Thread(target=self.loop.run)
+            self.loop_thread.start()
+
+    def preroll(self, timeout_s=5.0) -> Exception|None:
+        """
+        Take the pipeline to PAUSED and wait for it to get there, so that everything
+        (devices, caps negotiation, the model on the accelerator) is set up and `run()`
+        only has to start the data flowing.
+
+        Live sources (cameras) don't produce a buffer until PLAYING, so for those
+        we only wait for the state change itself.
+        """
+        self.finished.clear()
+        self._start_loop()
+
+        ret = self.pipeline.set_state(Gst.State.PAUSED)
+        if ret == Gst.StateChangeReturn.ASYNC:
+            ret, _, _ = self.pipeline.get_state(int(timeout_s * Gst.SECOND))
+
+        match ret:
+            case Gst.StateChangeReturn.SUCCESS | Gst.StateChangeReturn.NO_PREROLL:
+                return None
+            case Gst.StateChangeReturn.ASYNC:
+                return TimeoutError(f"Pipeline {self.name} did not preroll within {timeout_s} s")
+            case _:
+                return RuntimeError(f"Pipeline {self.name} could not preroll")
+
     def run(self, repeat_on_end_of_stream=False):
         """
         Run the pipeline. Argument `repeat_on_end_of_stream` most likely only makes
         sense (and will probably only work) in the case of a file input source.
         """
         self.repeat_on_end_of_stream = repeat_on_end_of_stream
+        self.finished.clear()
+        self._start_loop()
 
-        # Add a watch for messages on the pipeline's bus
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect("message", self.bus_call, self.loop)
+        # Set pipeline to PLAYING state
+        self.pipeline.set_state(Gst.State.PLAYING)
 
-        # Disable QoS to prevent frame drops
-        utils.disable_qos(self.pipeline)
+    def pause(self):
+        """
+        Pause the pipeline without tearing anything down, so that it can be resumed quickly.
+        """
+        self.pipeline.set_state(Gst.State.PAUSED)
 
-        # Set pipeline to PLAYING state
+    def resume(self):
+        """
+        Resume a paused pipeline.
+        """
         self.pipeline.set_state(Gst.State.PLAYING)
 
-        # Run the GLib event loop
-        self.loop_thread = threading.Thread(target=self.loop.run)
-        self.loop_thread.start()
+    def add_buffer_probe(self, element_name: str, callback, pad_name="src") -> int:
+        """
+        Call `callback(pts)` for every buffer leaving the given element's pad (from the streaming thread).
+        If the callback returns False, the buffer is dropped. Returns the probe's ID.
+        """
+        def probe(pad, info):
+            buffer = info.get_buffer()
+            if buffer is None:
+                return Gst.PadProbeReturn.OK
+            return Gst.PadProbeReturn.OK if callback(buffer.pts) else Gst.PadProbeReturn.DROP
+
+        pad = self.pipeline.get_by_name(element_name).get_static_pad(pad_name)
+        return pad.add_probe(Gst.PadProbeType.BUFFER, probe)
+
+    def set_caps(self, capsfilter_name: str, caps: str) -> Exception|None:
+        """
+        Change the caps of the named capsfilter on the running pipeline. The capsfilter asks
+        upstream to renegotiate, so the source (which must support renegotiating, as
+        libcamerasrc does) switches to the new caps without the pipeline being rebuilt.
+        """
+        capsfilter = self.pipeline.get_by_name(capsfilter_name)
+        if capsfilter is None:
+            return ValueError(f"No element named {capsfilter_name} in pipeline {self.name}")
+
+        new_caps = Gst.Caps.from_string(caps)
+        if new_caps is None:
+            return ValueError(f"Invalid caps: {caps}")
+
+        capsfilter.set_property("caps", new_caps)
+        log.debug("Set the caps of %s in pipeline %s to %s", capsfilter_name, self.name, caps)
+        return None
+
+    def remove_buffer_probe(self, element_name: str, probe_id: int, pad_name="src"):
+        """
+        Remove a probe added with `add_buffer_probe()`.
+        """
+        self.pipeline.get_by_name(element_name).get_static_pad(pad_name).remove_probe(probe_id)
 
     def shutdown(self, signum=None, frame=None):
         """
@@ -133,10 +290,20 @@ class GStreamerApp:
 
         self.pipeline.set_state(Gst.State.NULL)
         GLib.idle_add(self.loop.quit)
+        self._unregister_element_metrics()
 
-        if self.loop_thread is not None:
+        # We may be called from the loop thread itself (e.g., on EOS), in which case we can't join it
+        if self.loop_thread is not None and self.loop_thread is not threading.current_thread():
             self.loop_thread.join()
 
+        self.finished.set()
+
+    def wait(self, timeout_s=None) -> bool:
+        """
+        Block until the pipeline has shut down. Returns False if we timed out.
+        """
+        return self.finished.wait(timeout_s)
+
     def rewind(self):
         """
         Attempt to rewind the pipeline to the beginning.
@@ -0,0 +1,257 @@
+"""
+This module turns a detector's raw output tensors into detections, vectorized in NumPy.
+
+It is what `postproc.GStreamerCustomPostprocess` runs on the tensors hailonet puts on
+each buffer, for models (or heads) that the vendor's post-process libraries don't know.
+Everything works on a batch of frames at once:
+
+1. `dequantize()` the outputs, if they are quantized (UINT8/UINT16) rather than FLOAT32.
+2. Decode them into boxes and per-class scores (`decode_yolov8()` for YOLOv8-style
+   anchor-free heads with distribution focal loss box regression).
+3. `batched_nms()` thresholds the scores and runs class-aware non-maximum suppression
+   over every frame of the batch in one go.
+
+The `*_naive()` versions do the same thing one cell, class and box at a time. They are
+the reference the vectorized versions are tested against, and what `benchmark()`
+compares them with.
+"""
+from typing import Dict
+from typing import List
+from typing import Sequence
+from typing import Tuple
+import math
+import time
+import numpy as np
+
+# (boxes (K, 4) as normalized (xmin, ymin, xmax, ymax), scores (K,), class IDs (K,)), best first
+Detections = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+def dequantize(tensor: np.ndarray, scale: float, zero_point: float) -> np.ndarray:
+    """
+    Map a quantized tensor to float32 (`(q - zero_point) * scale`). Float tensors are returned as they are.
+    """
+    if tensor.dtype == np.float32:
+        return tensor
+    return (tensor.astype(np.float32) - np.float32(zero_point)) * np.float32(scale)
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-x))
+
+def decode_yolov8(box_maps: Sequence[np.ndarray], score_maps: Sequence[np.ndarray], input_size: Tuple[int, int], scores_are_logits=False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decode YOLOv8-style outputs, one box map and one score map per stride (any order).
+
+    `box_maps`: (B, H, W, 4 * reg_max) distribution logits of each cell's distance to its box's left, top, right and bottom edges.
+    `score_maps`: (B, H, W, classes) class scores (logits if `scores_are_logits`).
+    `input_size`: (width, height) of the model's input, which gives each map's stride.
+
+    Returns boxes (B, N, 4) as normalized (xmin, ymin, xmax, ymax), and scores (B, N, classes), N being the total number of cells.
+    """
+    input_width, input_height = input_size
+    all_boxes, all_scores = [], []
+    for box_map, score_map in zip(box_maps, score_maps):
+        batch, height, width, channels = box_map.shape
+        reg_max = channels // 4
+        stride_x = input_width / width
+        stride_y = input_height / height
+
+        # Expected distance (in cells) from the softmax over each edge's bins
+        logits = box_map.reshape(batch, height, width, 4, reg_max)
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        weights = np.exp(logits)
+        distances = (weights @ np.arange(reg_max, dtype=np.float32)) / weights.sum(axis=-1)
+
+        cx = (np.arange(width, dtype=np.float32) + 0.5)[None, None, :]
+        cy = (np.arange(height, dtype=np.float32) + 0.5)[None, :, None]
+        boxes = np.stack([
+            (cx - distances[..., 0]) * stride_x / input_width,
+            (cy - distances[..., 1]) * stride_y / input_height,
+            (cx + distances[..., 2]) * stride_x / input_width,
+            (cy + distances[..., 3]) * stride_y / input_height,
+        ], axis=-1)
+        all_boxes.append(np.clip(boxes, 0, 1).reshape(batch, -1, 4))
+
+        scores = _sigmoid(score_map) if scores_are_logits else score_map
+        all_scores.append(scores.reshape(batch, height * width, -1))
+
+    return np.concatenate(all_boxes, axis=1), np.concatenate(all_scores, axis=1)
+
+def _iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    Intersection over union of one box with each of `boxes`.
+    """
+    width = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    height = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    intersection = width * height
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(area + areas - intersection, np.float32(1e-9))
+
+def batched_nms(boxes: np.ndarray, scores: np.ndarray, score_threshold: float, iou_threshold: float, max_detections=100, pre_nms_top_k=1000) -> List[Detections]:
+    """
+    Greedy non-maximum suppression for every class of every frame of a batch at once.
+
+    `boxes`: (B, N, 4) normalized (xmin, ymin, xmax, ymax).
+    `scores`: (B, N, classes).
+
+    Only (box, class) pairs scoring at least `score_threshold` are considered, at most
+    `pre_nms_top_k` of them per frame (the best ones). Returns each frame's detections,
+    at most `max_detections` of them.
+    """
+    batch = boxes.shape[0]
+    num_classes = scores.shape[2]
+
+    # Every (frame, box, class) over the threshold, best first
+    frame_ids, box_ids, class_ids = np.nonzero(scores >= score_threshold)
+    candidate_scores = scores[frame_ids, box_ids, class_ids]
+    order = np.lexsort((-candidate_scores, frame_ids))
+    frame_ids, box_ids, class_ids, candidate_scores = frame_ids[order], box_ids[order], class_ids[order], candidate_scores[order]
+
+    # Only the best `pre_nms_top_k` of each frame
+    starts = np.searchsorted(frame_ids, np.arange(batch))
+    rank = np.arange(len(frame_ids)) - starts[frame_ids]
+    top = rank < pre_nms_top_k
+    frame_ids, box_ids, class_ids, candidate_scores = frame_ids[top], box_ids[top], class_ids[top], candidate_scores[top]
+
+    order = np.argsort(-candidate_scores, kind='stable')
+    frame_ids, box_ids, class_ids, candidate_scores = frame_ids[order], box_ids[order], class_ids[order], candidate_scores[order]
+    candidate_boxes = boxes[frame_ids, box_ids]
+
+    # Move each (frame, class) group's boxes out of the way of every other group's,
+    # so that one pass of suppression never lets one group suppress another's boxes
+    # (in float64, so that the offsets don't cost the boxes their precision)
+    shifted = candidate_boxes.astype(np.float64) + (2.0 * (frame_ids * num_classes + class_ids))[:, None]
+
+    keep = []
+    remaining = np.arange(len(shifted))
+    while remaining.size:
+        best = remaining[0]
+        keep.append(best)
+        rest = remaining[1:]
+        remaining = rest[_iou(shifted[best], shifted[rest]) <= iou_threshold]
+    keep = np.array(keep, dtype=np.intp)
+
+    results = []
+    for frame in range(batch):
+        kept = keep[frame_ids[keep] == frame][:max_detections]
+        results.append((candidate_boxes[kept], candidate_scores[kept], class_ids[kept]))
+    return results
+
+def postprocess_yolov8(box_maps: Sequence[np.ndarray], score_maps: Sequence[np.ndarray], input_size: Tuple[int, int], score_threshold: float, iou_threshold: float, max_detections=100, pre_nms_top_k=1000, scores_are_logits=False) -> List[Detections]:
+    """
+    `decode_yolov8()` followed by `batched_nms()`. The maps should already be dequantized.
+    """
+    boxes, scores = decode_yolov8(box_maps, score_maps, input_size, scores_are_logits)
+    return batched_nms(boxes, scores, score_threshold, iou_threshold, max_detections, pre_nms_top_k)
+
+def postprocess_yolov8_naive(box_maps: Sequence[np.ndarray], score_maps: Sequence[np.ndarray], input_size: Tuple[int, int], score_threshold: float, iou_threshold: float, max_detections=100, pre_nms_top_k=1000, scores_are_logits=False) -> List[Detections]:
+    """
+    The same as `postprocess_yolov8()`, one frame, cell, class and box at a time.
+    """
+    input_width, input_height = input_size
+    batch = box_maps[0].shape[0]
+    results = []
+    for frame in range(batch):
+        candidates = []
+        for box_map, score_map in zip(box_maps, score_maps):
+            _, height, width, channels = box_map.shape
+            reg_max = channels // 4
+            for y in range(height):
+                for x in range(width):
+                    distances = []
+                    for edge in range(4):
+                        logits = [float(v) for v in box_map[frame, y, x, edge * reg_max:(edge + 1) * reg_max]]
+                        top = max(logits)
+                        weights = [math.exp(v - top) for v in logits]
+                        distances.append(sum(i * w for i, w in enumerate(weights)) / sum(weights))
+                    stride_x = input_width / width
+                    stride_y = input_height / height
+                    box = (
+                        min(max((x + 0.5 - distances[0]) * stride_x / input_width, 0.0), 1.0),
+                        min(max((y + 0.5 - distances[1]) * stride_y / input_height, 0.0), 1.0),
+                        min(max((x + 0.5 + distances[2]) * stride_x / input_width, 0.0), 1.0),
+                        min(max((y + 0.5 + distances[3]) * stride_y / input_height, 0.0), 1.0),
+                    )
+                    for class_id in range(score_map.shape[3]):
+                        score = float(score_map[frame, y, x, class_id])
+                        if scores_are_logits:
+                            score = 1 / (1 + math.exp(-score))
+                        if score >= score_threshold:
+                            candidates.append((score, class_id, box))
+
+        # Python's sort is stable, like the vectorized version's
+        candidates.sort(key=lambda c: -c[0])
+        kept = []
+        for score, class_id, box in candidates[:pre_nms_top_k]:
+            if all(k[1] != class_id or _iou_naive(box, k[2]) <= iou_threshold for k in kept):
+                kept.append((score, class_id, box))
+        kept = kept[:max_detections]
+        results.append((
+            np.array([k[2] for k in kept], dtype=np.float32).reshape(-1, 4),
+            np.array([k[0] for k in kept], dtype=np.float32),
+            np.array([k[1] for k in kept], dtype=np.intp),
+        ))
+    return results
+
+def _iou_naive(a, b) -> float:
+    width = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    height = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / max(union, 1e-9)
+
+def synthetic_yolov8(batch=2, num_classes=80, input_size=(640, 640), reg_max=16, quantized=True, objects=20, seed=0) -> Tuple[List[np.ndarray], List[np.ndarray], Tuple[float, float], Tuple[float, float]]:
+    """
+    Random YOLOv8-style outputs for strides 8, 16 and 32, with `objects` confident cells per frame
+    (each a cluster of overlapping boxes, to give NMS something to do). Returns (box maps, score maps,
+    box (scale, zero point), score (scale, zero point)); the maps are UINT8 if `quantized`, else FLOAT32.
+    """
+    rng = np.random.default_rng(seed)
+    input_width, input_height = input_size
+    box_quant = (0.1, 128.0)
+    score_quant = (1 / 255, 0.0)
+    box_maps, score_maps = [], []
+    for stride in (8, 16, 32):
+        height, width = input_height // stride, input_width // stride
+        boxes = rng.normal(0, 2, size=(batch, height, width, 4 * reg_max)).astype(np.float32)
+        scores = rng.uniform(0, 0.05, size=(batch, height, width, num_classes)).astype(np.float32)
+        for frame in range(batch):
+            for _ in range(objects // 3 + 1):
+                y, x, class_id = rng.integers(1, height - 1), rng.integers(1, width - 1), rng.integers(num_classes)
+                scores[frame, y - 1:y + 2, x - 1:x + 2, class_id] = rng.uniform(0.5, 1.0, size=(3, 3))
+
+        if quantized:
+            boxes = np.clip(np.round(boxes / box_quant[0] + box_quant[1]), 0, 255).astype(np.uint8)
+            scores = np.clip(np.round(scores / score_quant[0] + score_quant[1]), 0, 255).astype(np.uint8)
+        box_maps.append(boxes)
+        score_maps.append(scores)
+    return box_maps, score_maps, box_quant, score_quant
+
+def benchmark(batch=2, num_classes=80, input_size=(640, 640), quantized=True, score_threshold=0.3, iou_threshold=0.45, repeats=5) -> Dict[str, float]:
+    """
+    Time the vectorized post-process against the naive one on synthetic outputs, checking that they agree.
+    """
+    box_maps, score_maps, box_quant, score_quant = synthetic_yolov8(batch, num_classes, input_size, quantized=quantized)
+
+    def run(postprocess) -> Tuple[float, List[Detections]]:
+        start_s = time.perf_counter()
+        boxes = [dequantize(m, *box_quant) for m in box_maps]
+        scores = [dequantize(m, *score_quant) for m in score_maps]
+        results = postprocess(boxes, scores, input_size, score_threshold, iou_threshold)
+        return time.perf_counter() - start_s, results
+
+    vectorized_s = min(run(postprocess_yolov8)[0] for _ in range(repeats))
+    _, results = run(postprocess_yolov8)
+    naive_s, naive_results = run(postprocess_yolov8_naive)
+
+    agree = all(
+        len(a[1]) == len(b[1]) and np.allclose(a[0], b[0], atol=1e-5) and np.allclose(a[1], b[1]) and np.array_equal(a[2], b[2])
+        for a, b in zip(results, naive_results)
+    )
+    return {
+        "vectorized_ms_per_batch": 1000 * vectorized_s,
+        "naive_ms_per_batch": 1000 * naive_s,
+        "speedup": naive_s / vectorized_s,
+        "detections": sum(len(r[1]) for r in results),
+        "agree": agree,
+    }
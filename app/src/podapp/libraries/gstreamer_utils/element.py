@@ -7,3 +7,11 @@ class Element:
     """
     def __init__(self, name: str) -> None:
         self.name = name
+
+    def attach(self, pipeline) -> None:
+        """
+        Called by the `GStreamerApp` once the pipeline has been constructed.
+        Elements that need to hook into the live pipeline (probes, signals, etc.)
+        should override this. The default does nothing.
+        """
+        pass
@@ -0,0 +1,374 @@
+"""
+This module gets frames out of a pipeline and into Python as NumPy arrays, without copying them.
+
+A `Frame` maps a `Gst.Buffer` and wraps each of its planes in a NumPy array that is
+backed directly by the mapped memory, honoring the buffer's strides and plane offsets
+(from its `GstVideoMeta` if it has one, and GStreamer's default layout otherwise).
+The arrays are only valid until the frame is released, after which the buffer goes
+back to whoever allocated it.
+
+A `FrameTap` is an element that ends in an appsink and hands out `Frame`s, either
+only ever the latest one (for consumers that just want to look at what's happening
+now) or queued in order (for consumers that want every frame they can get). Either
+way, old frames are dropped rather than holding up the pipeline, and a consumer can
+only hold on to `max_outstanding` frames at a time, so the buffers it holds back from
+their pool are bounded.
+"""
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Tuple
+import threading
+import time
+import numpy as np
+from ..common import log
+from ..common import metrics
+from . import element
+from . import utils
+
+# Only the frame layout helpers work without GStreamer
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+    GST_ENABLED = True
+except (ImportError, ValueError):
+    GST_ENABLED = False
+
+GSTVIDEO_ENABLED = False
+if GST_ENABLED:
+    try:
+        gi.require_version('GstVideo', '1.0')
+        from gi.repository import GstVideo
+        GSTVIDEO_ENABLED = True
+    except (ImportError, ValueError):
+        pass
+
+# For each supported format, its planes as (row subsampling, column subsampling, bytes per element)
+PLANES: Dict[str, Tuple[Tuple[int, int, int], ...]] = {
+    "RGB": ((1, 1, 3),),
+    "BGR": ((1, 1, 3),),
+    "RGBA": ((1, 1, 4),),
+    "BGRA": ((1, 1, 4),),
+    "ARGB": ((1, 1, 4),),
+    "ABGR": ((1, 1, 4),),
+    "RGBx": ((1, 1, 4),),
+    "BGRx": ((1, 1, 4),),
+    "xRGB": ((1, 1, 4),),
+    "xBGR": ((1, 1, 4),),
+    "GRAY8": ((1, 1, 1),),
+    # Packed 4:2:2, each element being two pixels' worth (e.g., Y0 U Y1 V)
+    "YUY2": ((1, 2, 4),),
+    "UYVY": ((1, 2, 4),),
+    "YVYU": ((1, 2, 4),),
+    # Y, then interleaved chroma
+    "NV12": ((1, 1, 1), (2, 2, 2)),
+    "NV21": ((1, 1, 1), (2, 2, 2)),
+    "NV16": ((1, 1, 1), (1, 2, 2)),
+    # Y, then each chroma plane
+    "I420": ((1, 1, 1), (2, 2, 1), (2, 2, 1)),
+    "YV12": ((1, 1, 1), (2, 2, 1), (2, 2, 1)),
+    "Y42B": ((1, 1, 1), (1, 2, 1), (1, 2, 1)),
+    "Y444": ((1, 1, 1), (1, 1, 1), (1, 1, 1)),
+}
+
+def _ceil_div(a: int, b: int) -> int:
+    return -(-a // b)
+
+def default_layout(video_format: str, width: int, height: int) -> Tuple[List[int], List[int]]:
+    """
+    The plane offsets and strides (in bytes) GStreamer uses for a buffer without a `GstVideoMeta`:
+    planes one after the other, rows padded to a multiple of 4 bytes.
+    """
+    if video_format not in PLANES:
+        raise ValueError(f"Unsupported video format: {video_format}")
+
+    offsets, strides = [], []
+    offset = 0
+    for row_div, col_div, nbytes in PLANES[video_format]:
+        stride = (_ceil_div(width, col_div) * nbytes + 3) & ~3
+        offsets.append(offset)
+        strides.append(stride)
+        offset += stride * _ceil_div(height, row_div)
+    return offsets, strides
+
+def plane_views(data, video_format: str, width: int, height: int, offsets: List[int]|None = None, strides: List[int]|None = None) -> List[np.ndarray]:
+    """
+    Wrap each plane of a frame in `data` (anything that supports the buffer protocol) in a NumPy
+    array, without copying. A plane is (rows, columns, bytes per element), or (rows, columns)
+    when that is one byte. If `offsets` and `strides` aren't given, the default layout is assumed.
+    """
+    if offsets is None or strides is None:
+        offsets, strides = default_layout(video_format, width, height)
+    elif video_format not in PLANES:
+        raise ValueError(f"Unsupported video format: {video_format}")
+
+    views = []
+    for (row_div, col_div, nbytes), offset, stride in zip(PLANES[video_format], offsets, strides):
+        rows = _ceil_div(height, row_div)
+        cols = _ceil_div(width, col_div)
+        shape, plane_strides = ((rows, cols, nbytes), (stride, nbytes, 1)) if nbytes > 1 else ((rows, cols), (stride, 1))
+        try:
+            views.append(np.ndarray(shape, dtype=np.uint8, buffer=data, offset=offset, strides=plane_strides))
+        except TypeError as e:
+            raise ValueError(f"A {width}x{height} {video_format} frame does not fit in the buffer: {e}")
+    return views
+
+class Frame:
+    """
+    A mapped buffer. `planes` are NumPy arrays backed by the buffer's memory (see `plane_views()`),
+    and `array` is the first (and for packed formats, only) one. They are only valid until
+    `release()`, which must be called (or use the frame as a context manager) once done with them.
+    Copy anything that needs to outlive the frame.
+    """
+    def __init__(self, buffer, caps, on_release=None) -> None:
+        structure = caps.get_structure(0)
+        self.format = structure.get_value("format")
+        self.width = structure.get_value("width")
+        self.height = structure.get_value("height")
+        self.pts = buffer.pts
+        self._buffer = buffer
+        self._on_release = on_release
+
+        offsets, strides = None, None
+        meta = GstVideo.buffer_get_video_meta(buffer) if GSTVIDEO_ENABLED else None
+        if meta is not None:
+            offsets, strides = list(meta.offset[:meta.n_planes]), list(meta.stride[:meta.n_planes])
+
+        ok, self._mapinfo = buffer.map(Gst.MapFlags.READ)
+        if not ok:
+            raise ValueError("Could not map the buffer")
+
+        # Older bindings hand us a copy of the memory rather than a view of it
+        data = self._mapinfo.data
+        self.copies = 0 if isinstance(data, memoryview) else 1
+        try:
+            self.planes = plane_views(data, self.format, self.width, self.height, offsets, strides)
+        except ValueError:
+            buffer.unmap(self._mapinfo)
+            raise
+
+    @property
+    def array(self) -> np.ndarray:
+        return self.planes[0]
+
+    def release(self):
+        """
+        Unmap the buffer and let it go. Safe to call more than once.
+        """
+        if self._buffer is None:
+            return
+
+        self.planes = []
+        self._buffer.unmap(self._mapinfo)
+        self._buffer = None
+        self._mapinfo = None
+        if self._on_release is not None:
+            self._on_release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+class FrameTap(element.Element):
+    """
+    Hands the frames that reach it to Python (see `pull()` and `frames()`).
+
+    `mode`: "latest" to keep only the most recent frame, or "queue" to keep up to `queue_size`
+    frames in order (the oldest are dropped when it's full).
+
+    `max_outstanding`: How many frames the consumer may hold (not yet released) at once. While it
+    holds that many, `pull()` returns None and the pipeline drops frames instead of waiting.
+
+    `video_format`: If given, frames are converted to this format first. Otherwise, they come as they are.
+
+    `passthrough`: If True, the tap is a branch off the stream, which carries on to whatever comes next
+    in the pipeline. Otherwise, the tap is where the stream ends.
+    """
+    def __init__(self, mode="latest", queue_size=4, max_outstanding=2, video_format: str|None = None, passthrough=False, name="tap") -> None:
+        super().__init__(name)
+        if mode not in ("latest", "queue"):
+            raise ValueError(f"Invalid frame tap mode: {mode}")
+
+        self.mode = mode
+        self.queue_size = queue_size
+        self.max_outstanding = max_outstanding
+        self.video_format = video_format
+        self.passthrough = passthrough
+        self.appsink = None
+
+        self.frames_in = 0
+        self.frames_pulled = 0
+        self.copies = 0
+        self.outstanding = 0
+        self.held_back = 0
+        self._lock = threading.Lock()
+
+        labels = {"tap": name}
+        self.map_metric = metrics.histogram("frame_tap_map_seconds", "Time to pull, map and wrap each frame handed out by a frame tap", labels=labels)
+        metrics.counter("frame_tap_frames", "Frames that reached a frame tap", labels, fn=lambda: self.frames_in)
+        metrics.counter("frame_tap_pulled", "Frames a frame tap handed out", labels, fn=lambda: self.frames_pulled)
+        metrics.counter("frame_tap_copies", "Frames a frame tap had to copy to hand out", labels, fn=lambda: self.copies)
+
+    @property
+    def element_pipeline(self) -> str:
+        """
+        The string representation of this element.
+        """
+        max_buffers = 1 if self.mode == "latest" else self.queue_size
+        branch = f'queue name={self.name}_queue leaky=downstream max-size-buffers={max_buffers} max-size-bytes=0 max-size-time=0 ! '
+        if self.video_format is not None:
+            branch += f'videoconvert name={self.name}_videoconvert n-threads=2 ! video/x-raw, format={self.video_format} ! '
+        branch += f'appsink name={self.name}_appsink emit-signals=false sync=false max-buffers={max_buffers} drop=true '
+
+        if not self.passthrough:
+            return branch
+
+        return (
+            f'tee name={self.name}_tee ! '
+            f'{branch} '
+            f'{self.name}_tee. ! '
+            f'queue name={self.name}_passthrough_queue leaky={utils.QUEUE_PARAMS.leaky} max-size-buffers={utils.QUEUE_PARAMS.max_buffers} max-size-bytes={utils.QUEUE_PARAMS.max_bytes} max-size-time={utils.QUEUE_PARAMS.max_time} '
+        )
+
+    def attach(self, pipeline) -> None:
+        """
+        Find the appsink and count the frames that reach it.
+        """
+        self.appsink = pipeline.get_by_name(f"{self.name}_appsink")
+
+        def count(pad, info):
+            self.frames_in += 1
+            return Gst.PadProbeReturn.OK
+
+        self.appsink.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, count)
+
+    @property
+    def dropped(self) -> int:
+        """
+        Frames that reached the tap but were never handed out (including any still waiting to be).
+        """
+        return self.frames_in - self.frames_pulled
+
+    def _released(self):
+        with self._lock:
+            self.outstanding -= 1
+
+    def pull(self, timeout_s=0.0) -> Frame|None:
+        """
+        The next frame (the latest one, in "latest" mode), waiting up to `timeout_s` for one.
+        None if there isn't one, or if the consumer already holds `max_outstanding` frames.
+        """
+        if self.appsink is None:
+            return None
+
+        with self._lock:
+            if self.outstanding >= self.max_outstanding:
+                self.held_back += 1
+                return None
+            self.outstanding += 1
+
+        start_s = time.perf_counter()
+        sample = self.appsink.try_pull_sample(int(timeout_s * Gst.SECOND))
+        if sample is None:
+            self._released()
+            return None
+
+        try:
+            frame = Frame(sample.get_buffer(), sample.get_caps(), on_release=self._released)
+        except ValueError as e:
+            log.warning("Frame tap %s could not map a frame: %s", self.name, e)
+            self._released()
+            return None
+
+        self.map_metric.observe(time.perf_counter() - start_s)
+        self.frames_pulled += 1
+        self.copies += frame.copies
+        return frame
+
+    def frames(self, timeout_s=1.0) -> Iterator[Frame]:
+        """
+        Yield frames until the stream ends. Each one is released when the next is asked for,
+        so don't hold on to a frame's arrays past the loop iteration.
+        """
+        while True:
+            frame = self.pull(timeout_s)
+            if frame is None:
+                if self.appsink is None or self.appsink.is_eos():
+                    return
+                continue
+
+            try:
+                yield frame
+            finally:
+                frame.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "frames_in": self.frames_in,
+            "frames_pulled": self.frames_pulled,
+            "dropped": self.dropped,
+            "copies": self.copies,
+            "outstanding": self.outstanding,
+            "held_back": self.held_back,
+        }
+
+def benchmark(nframes=300, width=1280, height=720, video_format="NV12") -> Dict[str, float]:
+    """
+    Measure what a `FrameTap` costs: push `nframes` test frames through a pipeline that just
+    throws them away, and then through one that hands them all to Python (which reads a pixel
+    from every plane of each), and report the rates, the time to hand out each frame, and the
+    number of copies made.
+    """
+    utils.init()
+    caps = f'video/x-raw, format={video_format}, width={width}, height={height}, framerate=0/1'
+    source = f'videotestsrc num-buffers={nframes} pattern=black ! {caps} ! '
+
+    def run(pipeline, consume=None) -> float:
+        start_s = time.perf_counter()
+        pipeline.set_state(Gst.State.PLAYING)
+        if consume is not None:
+            consume()
+        bus = pipeline.get_bus()
+        message = bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        elapsed_s = time.perf_counter() - start_s
+        pipeline.set_state(Gst.State.NULL)
+        if message.type == Gst.MessageType.ERROR:
+            raise RuntimeError(f"Benchmark pipeline failed: {message.parse_error()[0]}")
+        return elapsed_s
+
+    baseline_s = run(Gst.parse_launch(source + 'fakesink sync=false'))
+
+    # Big enough to keep every frame, so that we measure the tap rather than its drops
+    tap = FrameTap(mode="queue", queue_size=nframes, max_outstanding=1, name="bench_tap")
+    pipeline = Gst.parse_launch(source + tap.element_pipeline)
+    tap.attach(pipeline)
+    pull_s = []
+
+    def consume():
+        while True:
+            start_s = time.perf_counter()
+            frame = tap.pull(timeout_s=1.0)
+            if frame is None:
+                if tap.appsink.is_eos():
+                    return
+                continue
+            with frame:
+                for plane in frame.planes:
+                    plane[0, 0]
+            pull_s.append(time.perf_counter() - start_s)
+
+    tap_s = run(pipeline, consume)
+
+    pull_us = np.array(pull_s) * 1e6 if pull_s else np.zeros(1)
+    return {
+        "baseline_fps": nframes / baseline_s,
+        "tap_fps": len(pull_s) / tap_s,
+        "overhead_us_per_frame": 1e6 * (tap_s - baseline_s) / nframes,
+        "pull_us_p50": float(np.percentile(pull_us, 50)),
+        "pull_us_p99": float(np.percentile(pull_us, 99)),
+        "copies_per_frame": tap.copies / max(1, tap.frames_pulled),
+        "dropped": tap.dropped,
+    }
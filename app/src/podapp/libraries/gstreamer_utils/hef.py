@@ -0,0 +1,153 @@
+"""
+This module reads what a model's HEF file says about it (its input and output streams),
+so that the pipeline can be built to fit the model rather than to hard-coded sizes.
+
+Reading a HEF means going through HailoRT (its Python bindings if they are installed, or
+`hailortcli parse-hef` otherwise), which takes a while, so each file is only read once:
+the result is kept in memory and in a small JSON file next to the configuration cache
+(see `appconfig.CACHE_DPATH`), both keyed by the file's path, size and modification time.
+Off-device, where there is no HailoRT, `read_hef_info()` returns an error and callers
+fall back to their configured values.
+"""
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+import collections
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+from ..common import appconfig
+from ..common import lazy
+from ..common import log
+
+hailo_platform = lazy.load_module("hailo_platform")
+
+# One input or output stream. `shape` is (height, width, channels) for NHWC streams,
+# and empty for streams that don't have one (e.g., the on-chip NMS's output).
+VStreamInfo = collections.namedtuple("VStreamInfo", "name format_type order shape")
+HefInfo = collections.namedtuple("HefInfo", "network_group inputs outputs")
+
+_cache: Dict[str, Tuple[Tuple[int, int], HefInfo]] = {}
+_cache_lock = threading.Lock()
+
+# e.g. "Input  yolov8s/input_layer1 UINT8, NHWC(640x640x3)" or "Output yolov8s/yolov8_nms_postprocess FLOAT32, HAILO NMS(...)"
+_STREAM_RE = re.compile(r"^\s*(Input|Output)\s+(\S+)\s+(\w+),\s+([\w ]+?)\((.*)\)\s*$")
+_NETWORK_GROUP_RE = re.compile(r"^\s*Network group name:\s*([^,\s]+)")
+
+def parse_hailortcli(text: str) -> HefInfo:
+    """
+    Parse the output of `hailortcli parse-hef`. Raises ValueError if it has no input stream.
+    """
+    network_group = None
+    inputs, outputs = [], []
+    for line in text.splitlines():
+        match = _NETWORK_GROUP_RE.match(line)
+        if match and network_group is None:
+            network_group = match.group(1)
+            continue
+
+        match = _STREAM_RE.match(line)
+        if not match:
+            continue
+        direction, name, format_type, order, dims = match.groups()
+        shape = ()
+        if re.fullmatch(r"\d+(x\d+)*", dims):
+            shape = tuple(int(d) for d in dims.split("x"))
+        (inputs if direction == "Input" else outputs).append(VStreamInfo(name, format_type, order.strip(), shape))
+
+    if not inputs:
+        raise ValueError("No input streams in the HEF description")
+    return HefInfo(network_group, tuple(inputs), tuple(outputs))
+
+def _read_with_hailort(hef_fpath: str) -> HefInfo:
+    """
+    Read the HEF with HailoRT's Python bindings.
+    """
+    try:
+        hef = hailo_platform.HEF(hef_fpath)
+    except hailo_platform.HailoRTException as e:
+        raise RuntimeError(f"HailoRT could not read the HEF: {e}") from e
+
+    def info(stream) -> VStreamInfo:
+        return VStreamInfo(stream.name, stream.format.type.name, stream.format.order.name, tuple(int(d) for d in stream.shape))
+
+    return HefInfo(hef.get_network_group_names()[0], tuple(info(s) for s in hef.get_input_vstream_infos()), tuple(info(s) for s in hef.get_output_vstream_infos()))
+
+def _read_with_hailortcli(hef_fpath: str) -> HefInfo:
+    """
+    Read the HEF by asking `hailortcli` to describe it.
+    """
+    result = subprocess.run(["hailortcli", "parse-hef", hef_fpath], capture_output=True, text=True, timeout=30, check=True)
+    return parse_hailortcli(result.stdout)
+
+def _default_reader() -> Callable[[str], HefInfo]|None:
+    if importlib.util.find_spec("hailo_platform") is not None:
+        return _read_with_hailort
+    if shutil.which("hailortcli"):
+        return _read_with_hailortcli
+    return None
+
+def _cache_fpath(hef_fpath: str) -> str:
+    return os.path.join(appconfig.CACHE_DPATH, "hef-" + hashlib.sha1(hef_fpath.encode()).hexdigest() + ".json")
+
+def _to_json(key: Tuple[int, int], info: HefInfo) -> Dict:
+    return {"key": list(key), "network_group": info.network_group,
+            "inputs": [s._asdict() for s in info.inputs], "outputs": [s._asdict() for s in info.outputs]}
+
+def _from_json(cached: Dict) -> Tuple[Tuple[int, int], HefInfo]:
+    def streams(raw: List[Dict]) -> Tuple[VStreamInfo, ...]:
+        return tuple(VStreamInfo(s["name"], s["format_type"], s["order"], tuple(s["shape"])) for s in raw)
+    return tuple(cached["key"]), HefInfo(cached["network_group"], streams(cached["inputs"]), streams(cached["outputs"]))
+
+def read_hef_info(hef_fpath: str, reader: Callable[[str], HefInfo]|None = None) -> Tuple[Exception|None, HefInfo|None]:
+    """
+    Return what the given HEF says about its streams, reading it only if it isn't cached (or has changed since).
+    `reader` reads a HEF; by default, whatever HailoRT offers.
+    """
+    hef_fpath = os.path.realpath(hef_fpath)
+    try:
+        stat = os.stat(hef_fpath)
+    except OSError as e:
+        return e, None
+    key = (stat.st_size, stat.st_mtime_ns)
+
+    with _cache_lock:
+        cached = _cache.get(hef_fpath)
+        if cached is not None and cached[0] == key:
+            return None, cached[1]
+
+        try:
+            with open(_cache_fpath(hef_fpath), 'r') as f:
+                cached = _from_json(json.load(f))
+            if cached[0] == key:
+                _cache[hef_fpath] = cached
+                return None, cached[1]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        reader = reader if reader is not None else _default_reader()
+        if reader is None:
+            return RuntimeError("Neither HailoRT's Python bindings nor hailortcli are available to read HEF files"), None
+        try:
+            info = reader(hef_fpath)
+        except (OSError, ValueError, RuntimeError, subprocess.SubprocessError) as e:
+            return e, None
+        log.debug("Read %s: inputs %s, outputs %s", hef_fpath, info.inputs, info.outputs)
+        _cache[hef_fpath] = (key, info)
+
+        try:
+            os.makedirs(appconfig.CACHE_DPATH, exist_ok=True)
+            cache_fpath = _cache_fpath(hef_fpath)
+            with open(cache_fpath + ".tmp", 'w') as f:
+                json.dump(_to_json(key, info), f)
+            os.replace(cache_fpath + ".tmp", cache_fpath)
+        except OSError:
+            # No cache is no big deal (e.g., a read-only file system)
+            pass
+        return None, info
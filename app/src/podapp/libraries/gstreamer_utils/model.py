@@ -1,19 +1,39 @@
 import os
 from typing import Any
 from typing import Dict
+from ..common import log
 from . import element
+from . import hef
 from . import utils
 
+# The 80 classes of the COCO dataset, which the stock models are trained on, in class ID order
+COCO_LABELS = (
+    "person", "bicycle", "car", "motorcycle", "airplane", "bus", "train", "truck", "boat", "traffic light",
+    "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat", "dog", "horse", "sheep", "cow",
+    "elephant", "bear", "zebra", "giraffe", "backpack", "umbrella", "handbag", "tie", "suitcase", "frisbee",
+    "skis", "snowboard", "sports ball", "kite", "baseball bat", "baseball glove", "skateboard", "surfboard", "tennis racket", "bottle",
+    "wine glass", "cup", "fork", "knife", "spoon", "bowl", "banana", "apple", "sandwich", "orange",
+    "broccoli", "carrot", "hot dog", "pizza", "donut", "cake", "chair", "couch", "potted plant", "bed",
+    "dining table", "toilet", "tv", "laptop", "mouse", "remote", "keyboard", "cell phone", "microwave", "oven",
+    "toaster", "sink", "refrigerator", "book", "clock", "vase", "scissors", "teddy bear", "hair drier", "toothbrush",
+)
+
 # Default values for AI Model Configurations
 DEFAULT_AI_MODEL_CONFIGURATION = {
     # Batch size
     "batch_size": 2,
-    # Width of input (or maybe the output?)  # TODO: Double check the resolution of output video to confirm whether this is input or output
+    # Width, height and color format (RGB, etc.) of the model's input. These are read from the HEF
+    # (see `hef.py`); the values here are only used when it can't be read (e.g., off-device).
     "width": 640,
-    # Height of input (or maybe the output?)
     "height": 640,
-    # Color format (RGB, etc.)
     "color_format": "RGB",
+
+    # How the model scheduler shares the device with the other models loaded in the same virtual device
+    # (see `utils.HAILO_PARAMS`): higher priority models go first, and a model is switched to once
+    # `scheduler_threshold` frames are waiting for it or its oldest one has waited `scheduler_timeout_ms`.
+    "scheduler_priority": 16,
+    "scheduler_timeout_ms": 0,
+    "scheduler_threshold": 1,
     # Post-processing function name
     "post_process_so_function": "filter",
 
@@ -30,8 +50,6 @@ OBJECT_DETECTION_YOLOV8 = DEFAULT_AI_MODEL_CONFIGURATION | {
     "hef_name": "yolov8s_h8l.hef",
     "post_process_so_name": "libyolo_hailortpp_postprocess.so",
     "output_format_type": "HAILO_FORMAT_TYPE_FLOAT32",
-    "width": 1536,
-    "height": 864,
 
     # Non-maximal suppression score threshold
     "nms_score_threshold": 0.3,
@@ -39,6 +57,24 @@ OBJECT_DETECTION_YOLOV8 = DEFAULT_AI_MODEL_CONFIGURATION | {
     "nms_iou_threshold": 0.45,
 }
 
+# Values for object detection with YOLOv8, post-processed in Python (see `postproc.GStreamerCustomPostprocess`)
+# rather than by the vendor's library. The HEF must be compiled without the on-chip NMS, so that
+# hailonet hands us the raw (quantized) box and class maps.
+OBJECT_DETECTION_YOLOV8_PYTHON = OBJECT_DETECTION_YOLOV8 | {
+    "hef_name": "yolov8s_h8l_raw.hef",
+    "post_process": "python",
+    "output_format_type": "HAILO_FORMAT_TYPE_UINT8",
+
+    # Bins per box edge in the distribution focal loss regression
+    "reg_max": 16,
+    # Names of the outputs that are box maps; if empty, box maps are told from score maps by their channel count
+    "box_outputs": (),
+    # Most detections to keep per frame
+    "max_detections": 100,
+    # Label of each class ID (the vendor's post-process has these built in)
+    "labels": COCO_LABELS,
+}
+
 # Values for instance segmentation
 INSTANCE_SEGMENTATION = DEFAULT_AI_MODEL_CONFIGURATION | {
     "hef_name": "yolov5n_seg_h8l_mz.hef",
@@ -63,15 +99,66 @@ class GStreamerModel(element.Element):
         self.hef_fpath = os.path.join(utils.HAILO_PARAMS.base_model_folder_path, model_config['hef_name'])
         self.batch_size = model_config['batch_size']
         self.color_format = model_config['color_format']
+        self.width = model_config['width']
+        self.height = model_config['height']
+        self.scheduler_priority = model_config['scheduler_priority']
+        self.scheduler_timeout_ms = model_config['scheduler_timeout_ms']
+        self.scheduler_threshold = model_config['scheduler_threshold']
+
+        # Set to True if the upstream elements already deliver frames of the right size and format
+        # (e.g., a camera's secondary stream), in which case we skip scaling and converting.
+        self.prescaled = False
 
         if not os.path.isfile(self.hef_fpath):
             raise FileNotFoundError(f"Cannot find the given hef file: {self.hef_fpath}")
 
+        # Fit the pipeline to the model's actual input
+        err, self.hef_info = hef.read_hef_info(self.hef_fpath)
+        if err:
+            log.warning("Could not read %s, so assuming a %sx%s %s input: %s", self.hef_fpath, self.width, self.height, self.color_format, err)
+        else:
+            model_input = self.hef_info.inputs[0]
+            if model_input.order == "NHWC" and len(model_input.shape) == 3:
+                self.height, self.width, channels = model_input.shape
+                self.color_format = {1: "GRAY8", 3: "RGB"}.get(channels, self.color_format)
+
+    @property
+    def hailonet_pipeline(self) -> str:
+        """
+        The hailonet element, in the virtual device it shares with the other models (see `utils.HAILO_PARAMS`).
+        """
+        params = utils.HAILO_PARAMS
+        element_pipeline = f'hailonet name={self.name}_hailonet hef-path={self.hef_fpath} batch-size={self.batch_size} '
+        if params.vdevice_group_id:
+            element_pipeline += f'vdevice-group-id={params.vdevice_group_id} '
+        if params.multi_process_service:
+            element_pipeline += 'multi-process-service=true '
+        element_pipeline += f'scheduling-algorithm={params.scheduling_algorithm} '
+        if params.scheduling_algorithm != "HAILO_SCHEDULING_ALGORITHM_NONE":
+            element_pipeline += (
+                f'scheduler-priority={self.scheduler_priority} scheduler-timeout-ms={self.scheduler_timeout_ms} '
+                f'scheduler-threshold={self.scheduler_threshold} '
+            )
+        return element_pipeline + 'force-writable=true '
+
+    @property
+    def input_name(self) -> str:
+        """
+        The name of the first element of the model's part of the pipeline.
+        """
+        return "inference_hailonet_q" if self.prescaled else f"{self.name}_queue_scale0"
+
     @property
     def element_pipeline(self) -> str:
         """
         The string representation of this element.
         """
+        if self.prescaled:
+            return (
+                f'queue name=inference_hailonet_q leaky=no max-size-buffers=3 max-size-bytes=0 max-size-time=0 ! '
+                + self.hailonet_pipeline
+            )
+
         element_pipeline = (
             # Scale the video to whatever is required by the neural network
             f'queue name={self.name}_queue_scale0 leaky={utils.QUEUE_PARAMS.leaky} max-size-buffers={utils.QUEUE_PARAMS.max_buffers} max-size-bytes={utils.QUEUE_PARAMS.max_bytes} max-size-time={utils.QUEUE_PARAMS.max_time} ! '
@@ -88,7 +175,7 @@ class GStreamerModel(element.Element):
 
             # Feed into the neural network (which will run on the coprocessor)
             f'queue name=inference_hailonet_q leaky=no max-size-buffers=3 max-size-bytes=0 max-size-time=0 ! '
-            f'hailonet name={self.name}_hailonet hef-path={self.hef_fpath} batch-size={self.batch_size} force-writable=true '
+            + self.hailonet_pipeline
         )
  
         return element_pipeline
@@ -1,10 +1,24 @@
 import os
 from typing import Any
 from typing import Dict
+import time
+import numpy as np
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+from ..common import log
+from ..common import metrics
+from . import decode
 from . import element
 from . import model
 from . import utils
 
+try:
+    import hailo
+    HAILO_ENABLED = True
+except ImportError:
+    HAILO_ENABLED = False
+
 class GStreamerHailoPostprocess(element.Element):
     def __init__(self, model_config: Dict[str, Any], name="ai-post-process") -> None:
         super().__init__(name)
@@ -33,13 +47,92 @@ class GStreamerHailoPostprocess(element.Element):
         return element_pipeline
 
 class GStreamerCustomPostprocess(element.Element):
-    def __init__(self, name="post-process") -> None:
+    """
+    A post-process written in Python (see `decode.py`), for models whose raw output tensors
+    the vendor's post-process libraries don't handle (e.g., custom heads).
+
+    It reads hailonet's output tensors off each buffer, dequantizes and decodes them, and adds
+    the detections to the buffer's ROI, just like `hailofilter` would, so that nothing
+    downstream (e.g., the results tap) knows the difference. It runs in the streaming thread.
+
+    Only YOLOv8-style outputs (a box map and a class score map for each stride) are decoded for now.
+    Box maps are told apart from score maps by the output names in `box_outputs`, if the model
+    config has them (see the HEF's outputs), and otherwise by their channel count, which is
+    `4 * reg_max` for box maps and the number of classes for score maps.
+    """
+    def __init__(self, model_config: Dict[str, Any], name="post-process") -> None:
         super().__init__(name)
-        raise NotImplementedError()
+        self.input_size = (model_config['width'], model_config['height'])
+        self.score_threshold = model_config.get('nms_score_threshold', 0.3)
+        self.iou_threshold = model_config.get('nms_iou_threshold', 0.45)
+        self.max_detections = model_config.get('max_detections', 100)
+        self.reg_max = model_config.get('reg_max', 16)
+        self.scores_are_logits = model_config.get('scores_are_logits', False)
+        self.labels = model_config.get('labels', [])
+        self.box_outputs = frozenset(model_config.get('box_outputs', ()))
+        if not self.box_outputs and len(self.labels) == 4 * self.reg_max:
+            raise ValueError(f"Cannot tell box maps from score maps by their channel count ({4 * self.reg_max}); give the box output names as 'box_outputs'")
+        self.latency_metric = metrics.histogram("ai_postprocess_seconds", "Time the Python post-process spends on each frame")
 
     @property
     def element_pipeline(self) -> str:
         """
-        The string representation of this element. 
+        The string representation of this element.
+        """
+        element_pipeline = (
+            f'queue name={self.name}_queue leaky={utils.QUEUE_PARAMS.leaky} max-size-buffers={utils.QUEUE_PARAMS.max_buffers} max-size-bytes={utils.QUEUE_PARAMS.max_bytes} max-size-time={utils.QUEUE_PARAMS.max_time} ! '
+            f'identity name={self.name}_identity '
+        )
+
+        return element_pipeline
+
+    def attach(self, pipeline) -> None:
+        """
+        Install the buffer probe on the identity element.
         """
-        return ""
+        identity = pipeline.get_by_name(f"{self.name}_identity")
+        pad = identity.get_static_pad("src")
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._probe)
+
+    def _is_box_map(self, name: str, array: np.ndarray) -> bool:
+        """
+        Is the output tensor with the given name and (dequantized) contents a box map, rather than a score map?
+        """
+        if self.box_outputs:
+            return name in self.box_outputs
+        return array.shape[-1] == 4 * self.reg_max
+
+    def _probe(self, pad, info) -> Gst.PadProbeReturn:
+        """
+        Runs in the streaming thread for every buffer that passes through.
+        """
+        buffer = info.get_buffer()
+        if buffer is None or not HAILO_ENABLED:
+            return Gst.PadProbeReturn.OK
+
+        start_s = time.perf_counter()
+        try:
+            roi = hailo.get_roi_from_buffer(buffer)
+            box_maps, score_maps = [], []
+            for tensor in roi.get_tensors():
+                quant_info = tensor.vstream_info().quant_info
+                # A view of the tensor's memory; only dequantizing makes a (float32) copy
+                array = decode.dequantize(np.asarray(tensor), quant_info.qp_scale, quant_info.qp_zp)
+                (box_maps if self._is_box_map(tensor.name(), array) else score_maps).append(array[None])
+
+            # Pair each stride's box map with its score map
+            box_maps.sort(key=lambda m: m.shape[1])
+            score_maps.sort(key=lambda m: m.shape[1])
+            (boxes, scores, class_ids), = decode.postprocess_yolov8(box_maps, score_maps, self.input_size, self.score_threshold, self.iou_threshold,
+                                                                   max_detections=self.max_detections, scores_are_logits=self.scores_are_logits)
+
+            for (xmin, ymin, xmax, ymax), score, class_id in zip(boxes.tolist(), scores.tolist(), class_ids.tolist()):
+                label = self.labels[class_id] if class_id < len(self.labels) else str(class_id)
+                bbox = hailo.HailoBBox(xmin, ymin, xmax - xmin, ymax - ymin)
+                roi.add_object(hailo.HailoDetection(bbox, class_id, label, score))
+        except Exception as e:
+            log.error("Could not post-process a frame: %s", e)
+            return Gst.PadProbeReturn.OK
+
+        self.latency_metric.observe(time.perf_counter() - start_s)
+        return Gst.PadProbeReturn.OK
@@ -1,7 +1,33 @@
 from typing import Any
 from typing import Dict
+from typing import List
+import ctypes
+import os
+import time
+import numpy as np
+from ..common import log
+from ..common import metrics
 from . import element
+from . import frames
 from . import model
+from . import utils
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    gi.require_version('GstBase', '1.0')
+    from gi.repository import GObject
+    from gi.repository import Gst
+    from gi.repository import GstBase
+    GST_ENABLED = True
+except (ImportError, ValueError):
+    GST_ENABLED = False
+
+if frames.GSTVIDEO_ENABLED:
+    from gi.repository import GstVideo
+
+# Bucket upper bounds (seconds) for native pre-process calls
+CALL_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1)
 
 class GStreamerHailoPreprocess(element.Element):
     def __init__(self, model_config: Dict[str, Any], name="ai-pre-process") -> None:
@@ -32,14 +58,223 @@ class GStreamerHailoPreprocess(element.Element):
 
         return element_pipeline
 
+# (return type, argument types) of the function a `NativeFunction` calls
+PREPROCESS_SIGNATURE = (ctypes.c_int, [
+    ctypes.c_void_p, ctypes.c_uint64, ctypes.c_int32, ctypes.c_int32, ctypes.c_char_p,
+    ctypes.c_int32, ctypes.POINTER(ctypes.c_int32), ctypes.POINTER(ctypes.c_int32), ctypes.c_int64,
+])
+
+class NativeFunction:
+    """
+    A preprocessing function from a user shared object, which works on frames in place.
+    The shared object is loaded once per process, however many pipelines use it.
+
+    The function must have this signature (see `PREPROCESS_SIGNATURE`):
+
+        int function(uint8_t *data, uint64_t size, int32_t width, int32_t height, const char *format,
+                     int32_t n_planes, const int32_t *offsets, const int32_t *strides, int64_t pts);
+
+    `data` points to the frame's `size` bytes, which the function may change in place (but must not
+    keep a pointer to after returning). Plane `i` starts at `data + offsets[i]`, with rows `strides[i]`
+    bytes apart. `format` is the GStreamer name of the video format (e.g. "NV12"), and `pts` the frame's
+    presentation timestamp in nanoseconds. It returns 0 on success, and anything else is an error code.
+    It is called from one streaming thread at a time.
+    """
+    _libraries: Dict[str, ctypes.CDLL] = {}
+
+    def __init__(self, so_fpath: str, function_name: str) -> None:
+        if not os.path.isfile(so_fpath):
+            raise FileNotFoundError(f"Cannot find the given .so file: {so_fpath}")
+
+        so_fpath = os.path.realpath(so_fpath)
+        if so_fpath not in NativeFunction._libraries:
+            NativeFunction._libraries[so_fpath] = ctypes.CDLL(so_fpath)
+        try:
+            self.function = getattr(NativeFunction._libraries[so_fpath], function_name)
+        except AttributeError:
+            raise ValueError(f"{so_fpath} has no function named {function_name}") from None
+        self.function.restype = PREPROCESS_SIGNATURE[0]
+        self.function.argtypes = PREPROCESS_SIGNATURE[1]
+        self.so_fpath = so_fpath
+        self.function_name = function_name
+
+        self.calls = 0
+        self.errors = 0
+        # (return code, seconds) of the most recent call
+        self.last_result = None
+        self._last_code = 0
+
+    def __call__(self, data, video_format: str, width: int, height: int, offsets: List[int]|None = None, strides: List[int]|None = None, pts=0) -> int:
+        """
+        Run the function on a frame in `data`, a writable buffer (e.g. a mapped `Gst.Buffer`'s memoryview or a
+        NumPy array), without copying it. If `offsets` and `strides` aren't given, the default layout is assumed.
+        Returns the function's return code.
+        """
+        if offsets is None or strides is None:
+            offsets, strides = frames.default_layout(video_format, width, height)
+
+        array = np.frombuffer(data, dtype=np.uint8)
+        if not array.flags.writeable:
+            raise ValueError("The frame is not writable")
+
+        n_planes = len(offsets)
+        start_s = time.perf_counter()
+        code = self.function(array.ctypes.data, array.nbytes, width, height, video_format.encode(), n_planes,
+                             (ctypes.c_int32 * n_planes)(*offsets), (ctypes.c_int32 * n_planes)(*strides), pts)
+        duration_s = time.perf_counter() - start_s
+
+        self.calls += 1
+        self.last_result = (code, duration_s)
+        if code != 0:
+            self.errors += 1
+            # Every call is counted, but only a change of error is logged
+            if code != self._last_code:
+                log.error("%s in %s returned %d on a %dx%d %s frame", self.function_name, self.so_fpath, code, width, height, video_format)
+        self._last_code = code
+        return code
+
+# The GStreamer element that runs a `NativeFunction` (see `GStreamerPreprocess`)
+TRANSFORM_ELEMENT_NAME = "podapppreprocess"
+
+if GST_ENABLED:
+    class NativePreprocessTransform(GstBase.BaseTransform):
+        """
+        An in-place transform that hands each frame to `process(buffer, caps)`, which returns
+        whether to keep it. Being in place (and never passthrough), the base class makes sure
+        the buffer is writable before `do_transform_ip()` gets it, copying it if anyone else
+        holds a reference to it.
+        """
+        __gstmetadata__ = ("Native pre-process", "Filter/Effect/Video", "Runs a function from a shared object on each frame, in place", "podapp")
+        __gsttemplates__ = (
+            Gst.PadTemplate.new("sink", Gst.PadDirection.SINK, Gst.PadPresence.ALWAYS, Gst.Caps.from_string("video/x-raw")),
+            Gst.PadTemplate.new("src", Gst.PadDirection.SRC, Gst.PadPresence.ALWAYS, Gst.Caps.from_string("video/x-raw")),
+        )
+
+        def __init__(self) -> None:
+            super().__init__()
+            self.set_in_place(True)
+            self.set_passthrough(False)
+            self.process = None
+            self.caps = None
+
+        def do_set_caps(self, incaps, outcaps) -> bool:
+            self.caps = incaps
+            return True
+
+        def do_transform_ip(self, buffer):
+            if self.process is None or self.process(buffer, self.caps):
+                return Gst.FlowReturn.OK
+            # GST_BASE_TRANSFORM_FLOW_DROPPED
+            return Gst.FlowReturn.CUSTOM_SUCCESS
+
+_registered = False
+
+def register_element():
+    """
+    Register `NativePreprocessTransform` as the `TRANSFORM_ELEMENT_NAME` element, if it isn't already,
+    so that pipeline strings can use it.
+    """
+    global _registered
+    if _registered:
+        return
+    utils.init(warm_up=False)
+    GObject.type_register(NativePreprocessTransform)
+    if not Gst.Element.register(None, TRANSFORM_ELEMENT_NAME, Gst.Rank.NONE, NativePreprocessTransform.__gtype__):
+        raise RuntimeError(f"Could not register the {TRANSFORM_ELEMENT_NAME} element")
+    _registered = True
+
 class GStreamerPreprocess(element.Element):
-    def __init__(self, so_fpath: str, name="pre-process") -> None:
+    """
+    Runs a function from a user shared object (see `NativeFunction`) on every frame, in place, in the
+    streaming thread (e.g., undistortion or IR normalization in C).
+
+    `video_format`: If given, frames are converted to this format first. Otherwise, they come as they are.
+
+    `drop_on_error`: If True, frames the function fails on are dropped. Otherwise, they carry on
+    (possibly half processed).
+
+    Each call's return code and duration are in `function.last_result` and in the metrics.
+    The function runs in a `NativePreprocessTransform`, an in-place `GstBase.BaseTransform`, which
+    is what gets it a buffer it can write to; one it still can't write to counts as an error.
+    """
+    def __init__(self, so_fpath: str, function_name="podapp_preprocess", video_format: str|None = None, drop_on_error=False, name="pre-process") -> None:
         super().__init__(name)
-        raise NotImplementedError()
+        self.function = NativeFunction(so_fpath, function_name)
+        self.video_format = video_format
+        self.drop_on_error = drop_on_error
+        self.calls_metric = metrics.counter("preprocess_calls", "Frames run through the native pre-process", {"function": function_name})
+        self.errors_metric = metrics.counter("preprocess_errors", "Frames the native pre-process failed on", {"function": function_name})
+        self.latency_metric = metrics.histogram("preprocess_call_seconds", "Time each call to the native pre-process takes", bounds=CALL_BUCKETS_S, labels={"function": function_name})
 
     @property
     def element_pipeline(self) -> str:
         """
-        The string representation of this element. 
+        The string representation of this element.
         """
-        return ""
+        if GST_ENABLED:
+            register_element()
+
+        element_pipeline = ""
+        if self.video_format is not None:
+            element_pipeline += f"videoconvert name={self.name}_convert ! video/x-raw, format={self.video_format} ! "
+        element_pipeline += (
+            f'queue name={self.name}_queue leaky={utils.QUEUE_PARAMS.leaky} max-size-buffers={utils.QUEUE_PARAMS.max_buffers} max-size-bytes={utils.QUEUE_PARAMS.max_bytes} max-size-time={utils.QUEUE_PARAMS.max_time} ! '
+            f'{TRANSFORM_ELEMENT_NAME} name={self.name}_transform '
+        )
+
+        return element_pipeline
+
+    def attach(self, pipeline) -> None:
+        """
+        Have the transform element call us with each frame.
+        """
+        pipeline.get_by_name(f"{self.name}_transform").process = self._on_frame
+
+    def _on_frame(self, buffer, caps) -> bool:
+        """
+        Runs in the streaming thread for every buffer that passes through. Returns whether to keep it.
+        """
+        calls = self.function.calls
+        code = self._process(buffer, caps)
+        self.calls_metric.inc()
+        if self.function.calls > calls:
+            self.latency_metric.observe(self.function.last_result[1])
+        if code != 0:
+            self.errors_metric.inc()
+            if self.drop_on_error:
+                return False
+        return True
+
+    def _process(self, buffer, caps) -> int:
+        """
+        Map the buffer for writing and run the function on it. Returns its return code (-1 if it couldn't be called).
+        """
+        structure = caps.get_structure(0)
+        video_format = structure.get_value("format")
+        width = structure.get_value("width")
+        height = structure.get_value("height")
+
+        offsets, strides = None, None
+        meta = GstVideo.buffer_get_video_meta(buffer) if frames.GSTVIDEO_ENABLED else None
+        if meta is not None:
+            offsets, strides = list(meta.offset[:meta.n_planes]), list(meta.stride[:meta.n_planes])
+
+        ok, mapinfo = buffer.map(Gst.MapFlags.READ | Gst.MapFlags.WRITE)
+        if not ok:
+            self.function.errors += 1
+            if self.function.errors == 1:
+                log.error("Could not map a frame for writing to run %s on it", self.function.function_name)
+            return -1
+
+        try:
+            # Older bindings hand us a copy of the memory, which would be pointless to change
+            if not isinstance(mapinfo.data, memoryview):
+                raise ValueError("The bindings copied the frame")
+            return self.function(mapinfo.data, video_format, width, height, offsets, strides, pts=buffer.pts)
+        except ValueError as e:
+            self.function.errors += 1
+            if self.function.errors == 1:
+                log.error("Could not run %s on a frame: %s", self.function.function_name, e)
+            return -1
+        finally:
+            buffer.unmap(mapinfo)
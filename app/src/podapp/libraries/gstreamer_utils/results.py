@@ -0,0 +1,154 @@
+from typing import Callable
+from typing import Dict
+from typing import List
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+from ..common import log
+from ..common import metrics
+from ..storage import detections
+from . import element
+from . import frames
+from . import tracking
+from . import utils
+
+try:
+    import hailo
+    HAILO_ENABLED = True
+except ImportError:
+    HAILO_ENABLED = False
+
+class GStreamerResultsTap(element.Element):
+    """
+    A pass-through element that pulls the HAILO detection metadata off of
+    each buffer and hands it to the registered callbacks as an array of
+    `detections.DETECTION_DTYPE` records.
+
+    Should be placed after the post-process in the pipeline.
+
+    If `wall_clock` is True, the records are timestamped with the time they come out of
+    the model (which is what we want for live cameras). Otherwise, they are timestamped
+    with the buffer's presentation timestamp (which is what we want for recorded clips).
+
+    Buffers without a PTS are dropped unless `wall_clock` is True.
+
+    If `camera_of` is given, it is called with each buffer's PTS to find out which camera the
+    frame came from (for when the cameras are time-multiplexed). Otherwise (or when the buffer
+    has no PTS), every record is tagged with `camera`.
+
+    If `tracker` is given (see `tracking.Tracker`), every frame's records go through it.
+
+    `frame_callbacks` are called as `callback(records, frame, track_ids)` for frames with detections,
+    `frame` being the frame's pixels as an (H, W, 3) array, mapped straight from the buffer
+    (see `frames.Frame`, so only valid for the duration of the call), and `track_ids` the track ID
+    of each record (None without a tracker). Only RGB frames are handed out.
+    """
+    def __init__(self, callbacks: List[Callable], model_index=0, camera=detections.CameraID.UNKNOWN, camera_of: Callable|None = None, wall_clock=False, frame_callbacks: List[Callable]|None = None, tracker: tracking.Tracker|None = None, name="results") -> None:
+        super().__init__(name)
+        self.tracker = tracker
+        self.callbacks = callbacks
+        self.frame_callbacks = frame_callbacks if frame_callbacks is not None else []
+        self.model_index = model_index
+        self.camera = camera
+        self.camera_of = camera_of
+        self.wall_clock = wall_clock
+        self.frames = 0
+        self.labels: Dict[int, str] = {}
+        self.frames_metric = metrics.counter("ai_frames", "Frames that have come out of the model", {"model": model_index})
+        self.detections_metric = metrics.counter("ai_detections", "Detections that have come out of the model", {"model": model_index})
+
+    @property
+    def element_pipeline(self) -> str:
+        """
+        The string representation of this element.
+        """
+        element_pipeline = (
+            f'queue name={self.name}_queue leaky={utils.QUEUE_PARAMS.leaky} max-size-buffers={utils.QUEUE_PARAMS.max_buffers} max-size-bytes={utils.QUEUE_PARAMS.max_bytes} max-size-time={utils.QUEUE_PARAMS.max_time} ! '
+            f'identity name={self.name}_identity '
+        )
+
+        return element_pipeline
+
+    def attach(self, pipeline) -> None:
+        """
+        Install the buffer probe on the identity element.
+        """
+        identity = pipeline.get_by_name(f"{self.name}_identity")
+        pad = identity.get_static_pad("src")
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._probe)
+
+    def _probe(self, pad, info) -> Gst.PadProbeReturn:
+        """
+        Runs in the streaming thread for every buffer that passes through.
+        """
+        buffer = info.get_buffer()
+        if buffer is None:
+            return Gst.PadProbeReturn.OK
+
+        frame = self.frames
+        self.frames += 1
+        self.frames_metric.inc()
+
+        if not HAILO_ENABLED:
+            return Gst.PadProbeReturn.OK
+
+        pts = None if buffer.pts == Gst.CLOCK_TIME_NONE else buffer.pts
+        if pts is None and not self.wall_clock:
+            log.warning("Dropping the detections of frame %d: it has no presentation timestamp", frame)
+            return Gst.PadProbeReturn.OK
+
+        try:
+            roi = hailo.get_roi_from_buffer(buffer)
+            hailo_detections = roi.get_objects_typed(hailo.HAILO_DETECTION)
+            records = detections.empty(len(hailo_detections))
+            records['timestamp'] = time.time_ns() if self.wall_clock else pts
+            records['frame'] = frame
+            camera = self.camera if self.camera_of is None or pts is None else self.camera_of(pts)
+            records['camera'] = camera
+            records['model'] = self.model_index
+            for i, d in enumerate(hailo_detections):
+                bbox = d.get_bbox()
+                class_id = d.get_class_id()
+                records[i]['class_id'] = class_id
+                records[i]['score'] = d.get_confidence()
+                records[i]['box'] = (bbox.xmin(), bbox.ymin(), bbox.xmax(), bbox.ymax())
+                if class_id not in self.labels:
+                    self.labels[class_id] = d.get_label()
+        except Exception as e:
+            log.error("Could not read the detections of frame %d: %s", frame, e)
+            return Gst.PadProbeReturn.OK
+
+        self.detections_metric.inc(len(records))
+        track_ids = self.tracker.update(records, camera) if self.tracker is not None else None
+        for callback in self.callbacks:
+            try:
+                callback(records)
+            except Exception as e:
+                log.error("Results callback %s raised an exception: %s", callback, e)
+
+        if self.frame_callbacks and len(records) > 0:
+            self._call_frame_callbacks(pad, buffer, records, track_ids)
+
+        return Gst.PadProbeReturn.OK
+
+    def _call_frame_callbacks(self, pad, buffer, records, track_ids):
+        """
+        Map the buffer's pixels and hand them to the frame callbacks.
+        """
+        caps = pad.get_current_caps()
+        if caps.get_structure(0).get_value("format") != "RGB":
+            return
+
+        try:
+            frame = frames.Frame(buffer, caps)
+        except ValueError as e:
+            log.warning("Could not map a frame for the frame callbacks: %s", e)
+            return
+
+        with frame:
+            for callback in self.frame_callbacks:
+                try:
+                    callback(records, frame.array, track_ids)
+                except Exception as e:
+                    log.error("Frame callback %s raised an exception: %s", callback, e)
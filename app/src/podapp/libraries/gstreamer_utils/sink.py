@@ -4,13 +4,16 @@ from . import element
 from . import utils
 
 class GStreamerSink(element.Element):
-    def __init__(self, sink_uris: List[str]|str, overlay=False, name="sink") -> None:
+    def __init__(self, sink_uris: List[str]|str, overlay=False, sync=True, name="sink") -> None:
         """
         Accepts a list of sink URIs or a single one.
 
         URIs should be endpoints. Either RTSP endpoints such as "rtsp://192.168.1.1:5000",
         file paths such as "/path/to/out.h264",
-        or "display", in which case the screen is used.
+        "display", in which case the screen is used,
+        or "null", in which case the frames are discarded (useful when we only care about the inference results).
+
+        If `sync` is False, the sinks render buffers as fast as they arrive rather than at the stream's rate.
         """
         super().__init__(name)
         if issubclass(type(sink_uris), str):
@@ -19,12 +22,17 @@ class GStreamerSink(element.Element):
 
         self.sink_uris = sink_uris
         self.overlay = overlay
+        self.sync = "true" if sync else "false"
 
     @property
     def element_pipeline(self) -> str:
         """
         The string representation of this element. 
         """
+        if all(uri == "null" for uri in self.sink_uris):
+            # Nothing to convert for; just throw the frames away
+            return f'fakesink name={self.name}_fakesink sync={self.sync}'
+
         element_pipeline = ""
         if self.overlay:
             element_pipeline += (
@@ -62,7 +70,10 @@ class GStreamerSink(element.Element):
                 element_pipeline += f'udpsink'  # TODO
             elif uri == "display":
                 # Display to screen
-                element_pipeline += f'fpsdisplaysink name={self.name}_xvimagesink_with_fps video-sink=xvimagesink sync=true text-overlay=true signal-fps-measurements=true'
+                element_pipeline += f'fpsdisplaysink name={self.name}_xvimagesink_with_fps video-sink=xvimagesink sync={self.sync} text-overlay=true signal-fps-measurements=true'
+            elif uri == "null":
+                # Discard the frames
+                element_pipeline += f'fakesink name={self.name}_fakesink{i} sync={self.sync}'
             else:
                 # Treat as a filesink
                 element_pipeline += f'filesink name={self.name}_filesink location={uri}'
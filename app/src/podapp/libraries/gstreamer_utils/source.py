@@ -1,3 +1,4 @@
+import fractions
 import os
 from . import element
 from . import utils
@@ -6,7 +7,7 @@ class GStreamerSource(element.Element):
     """
     A class to encapsulate a GStreamer source that can be added into a pipeline.
     """
-    def __init__(self, source_uri: str, video_format="RGB", video_width=640, video_height=640, name="source") -> None:
+    def __init__(self, source_uri: str, video_format="RGB", video_width=640, video_height=640, video_framerate=None, name="source") -> None:
         """
         Create an instance of a GStreamerSource that can be added to a pipeline.
 
@@ -19,6 +20,7 @@ class GStreamerSource(element.Element):
         - `video_format`: (`str`) The format of the video. See the GStreamer pad documentation for your source.
         - `video_width`: (`int`) The width (in pixels) of the video.
         - `video_height`: (`int`) The height (in pixels) of the video.
+        - `video_framerate`: (`float`) Frames per second to ask a camera for. If None, we take what it gives us.
         - `name`: (`str`) The name of the source element for debugging.
         """
         super().__init__(name)
@@ -26,6 +28,65 @@ class GStreamerSource(element.Element):
         self.video_format = video_format
         self.video_width = video_width
         self.video_height = video_height
+        self.video_framerate = video_framerate
+
+        # Secondary (full-resolution) stream; see `set_main_stream()`
+        self.main_stream = None
+        self.main_stream_sink = None
+
+    @property
+    def is_camera(self) -> bool:
+        """
+        Is this source a CSI camera (as opposed to a file or a network stream)?
+        """
+        return not os.path.exists(self.source_uri) and not (self.source_uri.startswith("http") or self.source_uri.startswith("rtsp"))
+
+    def set_main_stream(self, video_format: str, video_width: int, video_height: int, sink: element.Element) -> Exception|None:
+        """
+        Ask the camera for a second stream. libcamera scales and converts both streams in the ISP,
+        so this lets us have a full-resolution stream (fed into `sink`, e.g., for recording or display)
+        at the same time as the (usually much smaller) stream that this element outputs into the rest
+        of the pipeline, without doing any scaling or conversion on the CPU.
+
+        Only valid for camera sources.
+        """
+        if not self.is_camera:
+            return ValueError(f"Only camera sources can have two streams. Source: {self.source_uri}")
+
+        self.main_stream = (video_format, video_width, video_height)
+        self.main_stream_sink = sink
+        return None
+
+    @property
+    def caps_name(self) -> str:
+        """
+        The name of the capsfilter right after a camera, whose caps can be changed on the
+        running pipeline (see `GStreamerApp.set_caps()`) to renegotiate the camera's stream.
+        """
+        return f"{self.name}_caps"
+
+    def caps_string(self, video_width: int|None = None, video_height: int|None = None, video_framerate: float|None = None) -> str:
+        """
+        The caps of the stream that a camera sends down the pipeline. Anything not given is this source's own setting.
+        """
+        width = self.video_width if video_width is None else video_width
+        height = self.video_height if video_height is None else video_height
+        framerate = self.video_framerate if video_framerate is None else video_framerate
+        caps = f"video/x-raw,format={self.video_format},width={width},height={height}"
+        if self.main_stream is not None:
+            caps += ",pixel-aspect-ratio=1/1"
+        if framerate is not None:
+            # As a fraction, since that's what caps take (e.g., 7.5 is 15/2)
+            framerate = fractions.Fraction(framerate).limit_denominator(1001)
+            caps += f",framerate={framerate.numerator}/{framerate.denominator}"
+        return caps
+
+    def attach(self, pipeline) -> None:
+        """
+        Pass the pipeline along to the main stream's sink (if any).
+        """
+        if self.main_stream_sink is not None:
+            self.main_stream_sink.attach(pipeline)
 
     @property
     def element_pipeline(self) -> str:
@@ -93,6 +154,23 @@ class GStreamerSource(element.Element):
                 # Decode H.264 to x-raw
                 f'avdec_h264 max-threads=2 '
             )
+        elif self.main_stream is not None:
+            # Source is CSI camera interface, and we want two streams out of it.
+            main_format, main_width, main_height = self.main_stream
+            source_element = (
+                # The always pad ('src') is the full-resolution stream. The first request pad ('src_0')
+                # is the small stream that goes down the rest of the pipeline.
+                f'libcamerasrc name={self.name} camera-name={self.source_uri} src::stream-role=video-recording src_0::stream-role=view-finder '
+
+                # Main stream goes off to its own sink
+                f'{self.name}.src ! video/x-raw, format={main_format}, width={main_width}, height={main_height} ! '
+                f'queue name={self.name}_queue_main leaky={utils.QUEUE_PARAMS.leaky} max-size-buffers={utils.QUEUE_PARAMS.max_buffers} max-size-bytes={utils.QUEUE_PARAMS.max_bytes} max-size-time={utils.QUEUE_PARAMS.max_time} ! '
+                f'{self.main_stream_sink.element_pipeline} '
+
+                # Secondary stream continues on to whatever comes after this element
+                f'{self.name}.src_0 ! '
+                f'capsfilter name={self.caps_name} caps="{self.caps_string()}" '
+            )
         else:
             # Source is CSI camera interface
             source_element = (
@@ -100,7 +178,8 @@ class GStreamerSource(element.Element):
                 # Note that this element is not part of a normal GStreamer installation
                 # and is not documented as part of GStreamer. The element is provided as part of libcamera.
                 f'libcamerasrc name={self.name} camera-name={self.source_uri} ! '
-                f'video/x-raw, format={self.video_format}, width={self.video_width}, height={self.video_height} '
+                # A named capsfilter (rather than bare caps), so that the caps can be changed while running
+                f'capsfilter name={self.caps_name} caps="{self.caps_string()}" '
             )
 
         element_pipeline = (
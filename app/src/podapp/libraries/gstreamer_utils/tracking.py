@@ -0,0 +1,325 @@
+"""
+This module follows detections from frame to frame, so that each animal gets one track ID
+for as long as it stays in view (e.g., to count animals, or to snapshot each one once).
+
+The `Tracker` is SORT/ByteTrack-style: each track has a constant-velocity Kalman filter
+over its box's (center x, center y, width, height). For every frame, it
+
+1. predicts where every track of the frame's camera is now,
+2. matches the high-scoring detections to the tracks by IoU (only within a class),
+3. matches the low-scoring detections to the confirmed tracks that are left (which keeps
+   tracks alive through frames where the animal is partly hidden or blurry),
+4. corrects the matched tracks with their detections, and
+5. starts tentative tracks from the high-scoring detections that matched nothing.
+
+A tentative track is confirmed (and given its ID) once it has been matched `min-hits` times
+in a row, and a confirmed track is dropped after `max-age-frames` frames without a match.
+
+Every track's state lives in preallocated arrays (at most `max-tracks` tracks), and every
+step works on all of a frame's tracks at once: the Kalman predictions and corrections are
+batched matrix products, and the IoU cost matrix is one broadcast. Only the matching walks
+the (few) overlapping track/detection pairs one by one: it is greedy, best IoU first, rather
+than optimal (Hungarian), which makes no difference unless animals overlap heavily.
+
+Nothing in here needs GStreamer, so the tracker can be tested and benchmarked off-device.
+"""
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+import threading
+import time
+import numpy as np
+from ..common import appconfig
+from ..common import metrics
+from ..storage import detections
+
+# Process and measurement noise, as fractions of each box's size (as in ByteTrack)
+STD_POSITION = 1 / 20
+STD_VELOCITY = 1 / 160
+
+# State transition: positions move by their velocities each frame
+_F = np.eye(8, dtype=np.float64)
+_F[np.arange(4), np.arange(4) + 4] = 1
+
+# Bucket upper bounds (seconds) for tracker updates
+UPDATE_BUCKETS_S = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)
+
+def _to_xywh(boxes: np.ndarray) -> np.ndarray:
+    """
+    (xmin, ymin, xmax, ymax) -> (center x, center y, width, height)
+    """
+    return np.concatenate([(boxes[:, :2] + boxes[:, 2:]) / 2, boxes[:, 2:] - boxes[:, :2]], axis=1)
+
+def _to_xyxy(boxes: np.ndarray) -> np.ndarray:
+    """
+    (center x, center y, width, height) -> (xmin, ymin, xmax, ymax)
+    """
+    return np.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2], axis=1)
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Intersection over union of every box of `a` (M, 4) with every box of `b` (N, 4), as (M, N).
+    """
+    width = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    height = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    intersection = width * height
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-12)
+
+def _match(iou: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Greedily pair rows with columns, best IoU first, ignoring pairs under the threshold.
+    Returns the (row, column) indices of the pairs.
+    """
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind='stable')
+    used_rows = np.zeros(iou.shape[0], dtype=bool)
+    used_cols = np.zeros(iou.shape[1], dtype=bool)
+    matched_rows, matched_cols = [], []
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if not used_rows[row] and not used_cols[col]:
+            used_rows[row] = used_cols[col] = True
+            matched_rows.append(row)
+            matched_cols.append(col)
+    return np.array(matched_rows, dtype=np.intp), np.array(matched_cols, dtype=np.intp)
+
+def _noise_scale(sizes: np.ndarray) -> np.ndarray:
+    """
+    (K, 2) widths and heights -> (K, 4) the matching scale of (x, y, width, height).
+    """
+    return np.concatenate([sizes, sizes], axis=1)
+
+class Tracker:
+    """
+    Call `update(records, camera)` with each frame's detection records, in order. The cameras'
+    tracks are kept apart, so time-multiplexed cameras can share a tracker. Thread-safe.
+
+    Track IDs start at 1; 0 means "not tracked (yet)".
+    """
+    def __init__(self, tracking_config: appconfig.TrackingConfig) -> None:
+        self.high_score = tracking_config.high_score
+        self.low_score = tracking_config.low_score
+        self.iou_threshold = tracking_config.iou_threshold
+        self.low_iou_threshold = tracking_config.low_iou_threshold
+        self.min_hits = tracking_config.min_hits
+        self.max_age = tracking_config.max_age_frames
+        self.max_tracks = tracking_config.max_tracks
+        self._lock = threading.Lock()
+
+        capacity = self.max_tracks
+        self._active = np.zeros(capacity, dtype=bool)
+        self._x = np.zeros((capacity, 8), dtype=np.float64)
+        self._P = np.zeros((capacity, 8, 8), dtype=np.float64)
+        self._ids = np.zeros(capacity, dtype=np.uint32)
+        self._camera = np.zeros(capacity, dtype=np.uint8)
+        self._class_id = np.zeros(capacity, dtype=np.int32)
+        self._hits = np.zeros(capacity, dtype=np.int32)
+        self._misses = np.zeros(capacity, dtype=np.int32)
+        self._next_id = 1
+
+        metrics.gauge("tracks_active", "Confirmed tracks currently being followed", fn=lambda: int(np.count_nonzero(self._active & (self._ids > 0))))
+        self.confirmed_metric = metrics.counter("tracks_confirmed", "Tracks confirmed (each one an individual, as far as the tracker can tell)")
+        self.dropped_metric = metrics.counter("tracks_dropped", "Detections that could not start a track because every track slot was taken")
+        self.update_metric = metrics.histogram("tracker_update_seconds", "Time the tracker spends on each frame", bounds=UPDATE_BUCKETS_S)
+
+    def clear(self) -> None:
+        """
+        Forget every track (e.g., when the source changes). IDs keep counting up.
+        """
+        with self._lock:
+            self._active[:] = False
+            self._ids[:] = 0
+
+    @property
+    def confirmed(self) -> int:
+        """
+        The number of tracks confirmed so far, that is, how many individuals have been seen.
+        """
+        return self._next_id - 1
+
+    def tracks(self) -> List[Dict[str, Any]]:
+        """
+        The confirmed tracks being followed, with their current (predicted or corrected) boxes.
+        """
+        with self._lock:
+            slots = np.flatnonzero(self._active & (self._ids > 0))
+            boxes = _to_xyxy(self._x[slots, :4])
+            return [
+                {
+                    "id": int(self._ids[slot]),
+                    "camera": detections.CameraID(int(self._camera[slot])).name,
+                    "class_id": int(self._class_id[slot]),
+                    "box": [round(float(v), 4) for v in box],
+                    "hits": int(self._hits[slot]),
+                    "misses": int(self._misses[slot]),
+                }
+                for slot, box in zip(slots.tolist(), boxes)
+            ]
+
+    def _predict(self, slots: np.ndarray):
+        self._x[slots] = self._x[slots] @ _F.T
+        # Keep boxes that have been shrinking without a match from turning inside out
+        self._x[slots, 2:4] = np.maximum(self._x[slots, 2:4], 1e-4)
+        scale = _noise_scale(self._x[slots, 2:4])
+        q = np.concatenate([STD_POSITION * scale, STD_VELOCITY * scale], axis=1) ** 2
+        P = _F @ self._P[slots] @ _F.T
+        P[:, np.arange(8), np.arange(8)] += q
+        self._P[slots] = P
+
+    def _correct(self, slots: np.ndarray, boxes: np.ndarray):
+        z = _to_xywh(boxes.astype(np.float64))
+        P = self._P[slots]
+        S = P[:, :4, :4].copy()
+        S[:, np.arange(4), np.arange(4)] += (STD_POSITION * _noise_scale(self._x[slots, 2:4])) ** 2
+        # K = P H^T S^-1, solved rather than inverted (S and P are symmetric)
+        K = np.linalg.solve(S, P[:, :4, :]).transpose(0, 2, 1)
+        innovation = z - self._x[slots, :4]
+        self._x[slots] += (K @ innovation[:, :, None])[:, :, 0]
+        self._P[slots] = P - K @ P[:, :4, :]
+
+    def _start(self, slots: np.ndarray, boxes: np.ndarray, class_ids: np.ndarray, camera: int):
+        xywh = _to_xywh(boxes.astype(np.float64))
+        self._x[slots] = 0
+        self._x[slots, :4] = xywh
+        scale = _noise_scale(xywh[:, 2:])
+        variances = np.concatenate([2 * STD_POSITION * scale, 10 * STD_VELOCITY * scale], axis=1) ** 2
+        self._P[slots] = 0
+        self._P[slots[:, None], np.arange(8), np.arange(8)] = variances
+        self._active[slots] = True
+        self._ids[slots] = 0
+        self._camera[slots] = camera
+        self._class_id[slots] = class_ids
+        self._hits[slots] = 1
+        self._misses[slots] = 0
+
+    def _confirm(self, slots: np.ndarray):
+        """
+        Give IDs to the tentative tracks among `slots` that have now been matched often enough.
+        """
+        new = slots[(self._ids[slots] == 0) & (self._hits[slots] >= self.min_hits)]
+        self._ids[new] = np.arange(self._next_id, self._next_id + len(new), dtype=np.uint32)
+        self._next_id += len(new)
+        self.confirmed_metric.inc(len(new))
+
+    def update(self, records: np.ndarray, camera=detections.CameraID.UNKNOWN) -> np.ndarray:
+        """
+        Take one frame's detection records (`detections.DETECTION_DTYPE`) from the given camera
+        into account. Returns the track ID of each record (0 for records that aren't tracked (yet)).
+        """
+        start_s = time.perf_counter()
+        boxes = records['box']
+        scores = records['score']
+        class_ids = records['class_id'].astype(np.int32)
+        track_ids = np.zeros(len(records), dtype=np.uint32)
+
+        with self._lock:
+            slots = np.flatnonzero(self._active & (self._camera == camera))
+            self._predict(slots)
+            predicted = _to_xyxy(self._x[slots, :4]).astype(np.float32)
+
+            # High-scoring detections get the first pick of every track
+            high = np.flatnonzero(scores >= self.high_score)
+            iou = iou_matrix(predicted, boxes[high])
+            iou[self._class_id[slots][:, None] != class_ids[high][None, :]] = 0
+            rows, cols = _match(iou, self.iou_threshold)
+            matched_slots, matched = slots[rows], high[cols]
+
+            # Low-scoring detections can only keep confirmed tracks going
+            left = np.setdiff1d(np.arange(len(slots)), rows)
+            left = left[self._ids[slots[left]] > 0]
+            low = np.flatnonzero((scores >= self.low_score) & (scores < self.high_score))
+            iou = iou_matrix(predicted[left], boxes[low])
+            iou[self._class_id[slots[left]][:, None] != class_ids[low][None, :]] = 0
+            rows, cols = _match(iou, self.low_iou_threshold)
+            matched_slots = np.concatenate([matched_slots, slots[left[rows]]])
+            matched = np.concatenate([matched, low[cols]])
+
+            self._correct(matched_slots, boxes[matched])
+            self._hits[matched_slots] += 1
+            self._misses[matched_slots] = 0
+
+            # Tentative tracks have to be matched every frame; confirmed ones can coast for a while
+            unmatched = np.setdiff1d(slots, matched_slots)
+            self._misses[unmatched] += 1
+            dead = unmatched[(self._ids[unmatched] == 0) | (self._misses[unmatched] > self.max_age)]
+            self._active[dead] = False
+
+            new = np.setdiff1d(high, matched)
+            free = np.flatnonzero(~self._active)[:len(new)]
+            if len(free) < len(new):
+                self.dropped_metric.inc(len(new) - len(free))
+                new = new[:len(free)]
+            self._start(free, boxes[new], class_ids[new], camera)
+
+            self._confirm(np.concatenate([matched_slots, free]))
+            track_ids[matched] = self._ids[matched_slots]
+            track_ids[new] = self._ids[free]
+
+        self.update_metric.observe(time.perf_counter() - start_s)
+        return track_ids
+
+def synthetic_trajectories(objects=200, frames=100, num_classes=4, miss_rate=0.05, jitter=0.002, seed=0) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Make up a clip's worth of detections of `objects` boxes moving in straight lines (bouncing
+    off the edges of the frame), with some noise and some missed detections.
+    Returns, for each frame, (records, the ground truth object of each record).
+    """
+    rng = np.random.default_rng(seed)
+    sizes = rng.uniform(0.02, 0.05, size=(objects, 2))
+    centers = rng.uniform(0.05, 0.95, size=(objects, 2))
+    velocities = rng.uniform(-0.004, 0.004, size=(objects, 2))
+    class_ids = rng.integers(0, num_classes, size=objects)
+
+    clip = []
+    for frame in range(frames):
+        centers += velocities
+        bounced = (centers < sizes / 2) | (centers > 1 - sizes / 2)
+        velocities[bounced] *= -1
+        centers = np.clip(centers, sizes / 2, 1 - sizes / 2)
+
+        seen = np.flatnonzero(rng.random(objects) >= miss_rate)
+        noisy = centers[seen] + rng.normal(0, jitter, size=(len(seen), 2))
+        records = detections.empty(len(seen))
+        records['timestamp'] = frame
+        records['frame'] = frame
+        records['camera'] = detections.CameraID.FRONT
+        records['model'] = 0
+        records['class_id'] = class_ids[seen]
+        records['score'] = rng.uniform(0.3, 0.95, size=len(seen))
+        records['box'] = np.clip(np.concatenate([noisy - sizes[seen] / 2, noisy + sizes[seen] / 2], axis=1), 0, 1)
+        clip.append((records, seen))
+    return clip
+
+def benchmark(objects=200, frames=100, max_tracks=1024, seed=0) -> Dict[str, float]:
+    """
+    Track synthetic trajectories, reporting the time per frame and how well the IDs stuck to the objects.
+    """
+    config = appconfig.TrackingConfig(enabled=True, max_tracks=max_tracks)
+    tracker = Tracker(config)
+    clip = synthetic_trajectories(objects, frames, seed=seed)
+
+    durations_s = []
+    ids_per_object = [set() for _ in range(objects)]
+    tracked = total = 0
+    for records, truth in clip:
+        start_s = time.perf_counter()
+        track_ids = tracker.update(records, detections.CameraID.FRONT)
+        durations_s.append(time.perf_counter() - start_s)
+        for obj, track_id in zip(truth.tolist(), track_ids.tolist()):
+            if track_id:
+                ids_per_object[obj].add(track_id)
+        tracked += int(np.count_nonzero(track_ids))
+        total += len(records)
+
+    durations_s.sort()
+    return {
+        "objects": objects,
+        "frames": frames,
+        "ms_per_frame": 1000 * sum(durations_s) / len(durations_s),
+        "p99_ms_per_frame": 1000 * durations_s[min(len(durations_s) - 1, int(0.99 * len(durations_s)))],
+        "tracks_confirmed": tracker.confirmed,
+        "id_switches": sum(max(0, len(ids) - 1) for ids in ids_per_object),
+        "tracked_fraction": tracked / max(1, total),
+    }
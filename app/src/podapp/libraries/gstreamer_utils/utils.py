@@ -1,86 +1,117 @@
 import collections
 import os
+import threading
+import time
 import urllib
 import sys
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import GObject
-from gi.repository import Gst
+from ..common import appconfig
+from ..common import lazy
 from ..common import log
 from typing import Any
 from typing import Dict
+from typing import Iterable
+
+# GStreamer is only imported (and initialized, see `init()`) by code that builds pipelines
+gi = lazy.load_module("gi")
 
 # Some default parameters for the gst queues. These can be overridden by the application configuration.
 QueueParams = collections.namedtuple("QueueParams", "max_buffers max_bytes max_time leaky")
 QUEUE_PARAMS = QueueParams(max_buffers=3, max_bytes=0, max_time=0, leaky='no')
 
 # Some default parameters for the HAILO-specific elements. These can be overridden by the application configuration.
-HailoParams = collections.namedtuple("HailoParams", "cropping_algorithm_folder_path base_model_folder_path post_process_folder_path")
-HAILO_PARAMS = HailoParams(cropping_algorithm_folder_path="UNINITIALIZED", base_model_folder_path="UNINITIALIZED", post_process_folder_path="UNINITIALIZED")
+# Every hailonet with the same `vdevice_group_id` shares one virtual device, whose model scheduler
+# (`scheduling_algorithm`) time-shares the accelerator between the models loaded into it.
+HailoParams = collections.namedtuple("HailoParams", "cropping_algorithm_folder_path base_model_folder_path post_process_folder_path vdevice_group_id scheduling_algorithm multi_process_service")
+HAILO_PARAMS = HailoParams(cropping_algorithm_folder_path="UNINITIALIZED", base_model_folder_path="UNINITIALIZED", post_process_folder_path="UNINITIALIZED",
+                           vdevice_group_id="podapp", scheduling_algorithm="HAILO_SCHEDULING_ALGORITHM_ROUND_ROBIN", multi_process_service=False)
+
+# Elements whose plugins `init()` loads in the background, so building the first pipeline doesn't have to
+WARM_UP_ELEMENTS = ()
+
+_init_lock = threading.Lock()
+_warm_up_thread = None
+
 
+# GST_DEBUG's value for each of GStreamer's log levels
+_GST_DEBUG_LEVELS = {"NONE": "0", "ERROR": "1", "WARNING": "2", "FIXME": "3", "INFO": "4", "DEBUG": "5", "LOG": "6", "TRACE": "7", "MEMDUMP": "9"}  # No 8 for some reason
 
 def configure(config: Dict[str, Any]):
     """
     Configure the gstreamer utils.
     """
-    if 'gstreamer-utils' not in config['moduleconfig']:
-        return
-
-    gstreamer_config = config['moduleconfig']['gstreamer-utils']
+    gstreamer_config = appconfig.section(config, appconfig.GStreamerUtilsConfig)
 
     # Queue params
     global QUEUE_PARAMS
-    if 'queue-params' in gstreamer_config:
-        leaky = gstreamer_config['queue-params'].get('leaky', QUEUE_PARAMS.leaky)
-        max_buffers = gstreamer_config['queue-params'].get('max-buffers', QUEUE_PARAMS.max_buffers)
-        max_bytes = gstreamer_config['queue-params'].get('max-bytes', QUEUE_PARAMS.max_bytes)
-        max_time = gstreamer_config['queue-params'].get('max-time', QUEUE_PARAMS.max_time)
-        QUEUE_PARAMS = QueueParams(leaky=leaky, max_buffers=max_buffers, max_bytes=max_bytes, max_time=max_time)
+    queue_config = gstreamer_config.queue_params
+    QUEUE_PARAMS = QueueParams(leaky=queue_config.leaky, max_buffers=queue_config.max_buffers, max_bytes=queue_config.max_bytes, max_time=queue_config.max_time)
 
     # Dot graph (the GStreamer pipeline can print itself to a dot file)
-    if 'dot-graph' in gstreamer_config and gstreamer_config['dot-graph']['save']:
-        dpath = gstreamer_config['dot-graph']['dpath']
+    if gstreamer_config.dot_graph.save:
+        dpath = gstreamer_config.dot_graph.dpath
         if os.path.isdir(dpath):
-            log.debug(f"Will save DOT files to directory: {dpath}")
+            log.debug("Will save DOT files to directory: %s", dpath)
             os.environ["GST_DEBUG_DUMP_DOT_DIR"] = dpath
         else:
-            log.warning(f"Config file's moduleconfig->gstreamer-utils->dot-graph->dpath does not point to a directory. Given {dpath}")
+            log.warning("Config file's moduleconfig->gstreamer-utils->dot-graph->dpath does not point to a directory. Given %s", dpath)
 
     # HAILO-specific stuff
     global HAILO_PARAMS
-    if 'hailo' in gstreamer_config:
-        hailo_config = gstreamer_config['hailo']
-        cropping_algorithm_folder_path = hailo_config['cropping-algorithm-folder-path']
-        base_model_folder_path = hailo_config['base-model-folder-path']
-        post_process_folder_path = hailo_config['post-process-folder-path']
+    hailo_config = gstreamer_config.hailo
+    HAILO_PARAMS = HailoParams(cropping_algorithm_folder_path=hailo_config.cropping_algorithm_folder_path, base_model_folder_path=hailo_config.base_model_folder_path,
+                               post_process_folder_path=hailo_config.post_process_folder_path, vdevice_group_id=hailo_config.vdevice_group_id,
+                               scheduling_algorithm=hailo_config.scheduling_algorithm, multi_process_service=hailo_config.multi_process_service)
 
-        HAILO_PARAMS = HailoParams(cropping_algorithm_folder_path=cropping_algorithm_folder_path, base_model_folder_path=base_model_folder_path, post_process_folder_path=post_process_folder_path)
+    # Plugin registry. With a cached registry, GStreamer still stats every plugin on startup
+    # to see whether it needs rescanning; skipping that is worth it once the plugins are installed.
+    registry_config = gstreamer_config.registry
+    if not registry_config.update:
+        os.environ.setdefault("GST_REGISTRY_UPDATE", "no")
+    if not registry_config.fork:
+        os.environ.setdefault("GST_REGISTRY_FORK", "no")
+    global WARM_UP_ELEMENTS
+    WARM_UP_ELEMENTS = registry_config.warm_up_elements
 
     # GStreamer has separate logging parameters
-    if 'logging' in gstreamer_config:
-        log_level = gstreamer_config['logging']['level']
-        match log_level.upper():
-            case "NONE":
-                os.environ['GST_DEBUG'] = "0"
-            case "ERROR":
-                os.environ['GST_DEBUG'] = "1"
-            case "WARNING":
-                os.environ['GST_DEBUG'] = "2"
-            case "FIXME":
-                os.environ['GST_DEBUG'] = "3"
-            case "INFO":
-                os.environ['GST_DEBUG'] = "4"
-            case "DEBUG":
-                os.environ['GST_DEBUG'] = "5"
-            case "LOG":
-                os.environ['GST_DEBUG'] = "6"
-            case "TRACE":
-                os.environ['GST_DEBUG'] = "7"
-            case "MEMDUMP":
-                os.environ['GST_DEBUG'] = "9"  # No 8 for some reason
-            case _:
-                log.warning(f"Unrecognized log level for GST: '{log_level}'. Defaulting to 'WARNING'")
-                os.environ['GST_DEBUG'] = "2"  # Default to warning
+    os.environ['GST_DEBUG'] = _GST_DEBUG_LEVELS[gstreamer_config.logging.level]
+
+def init(warm_up=True):
+    """
+    Import and initialize GStreamer, if we haven't already. Call `configure()` first,
+    since GStreamer reads its environment variables here.
+
+    If `warm_up` is True, the plugins for `WARM_UP_ELEMENTS` are loaded in a background thread.
+    """
+    global _warm_up_thread
+    with _init_lock:
+        gi.require_version('Gst', '1.0')
+        from gi.repository import Gst
+        if not Gst.is_initialized():
+            start_s = time.perf_counter()
+            Gst.init(None)
+            log.debug("Initialized GStreamer in %.1f ms", 1000 * (time.perf_counter() - start_s))
+
+        if warm_up and WARM_UP_ELEMENTS and _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up_plugins, args=(WARM_UP_ELEMENTS,), name="gst-warm-up", daemon=True)
+            _warm_up_thread.start()
+
+def warm_up_plugins(element_names: Iterable[str]) -> Dict[str, float|None]:
+    """
+    Load the plugin behind each of the given elements, so that building a pipeline with them later
+    doesn't have to. Returns how long each took (ms), or None for elements that aren't installed.
+    """
+    from gi.repository import Gst
+    timings_ms = {}
+    for name in element_names:
+        start_s = time.perf_counter()
+        factory = Gst.ElementFactory.find(name)
+        if factory is None or factory.load() is None:
+            log.warning("Could not find GStreamer element '%s' to warm up.", name)
+            timings_ms[name] = None
+            continue
+        timings_ms[name] = 1000 * (time.perf_counter() - start_s)
+    log.debug("Warmed up GStreamer plugins: %s", timings_ms)
+    return timings_ms
 
 def disable_qos(pipeline):
     """
@@ -92,6 +123,9 @@ def disable_qos(pipeline):
     
     This function is taken almost completely from HAILO examples repo.
     """
+    from gi.repository import GObject
+    from gi.repository import Gst
+
     # Iterate through all elements in the pipeline
     it = pipeline.iterate_elements()
     while True:
@@ -103,7 +137,7 @@ def disable_qos(pipeline):
         if 'qos' in GObject.list_properties(element):
             # Set the 'qos' property to False
             element.set_property('qos', False)
-            log.debug(f"Set qos to False for {element.get_name()}")
+            log.debug("Set qos to False for %s", element.get_name())
 
 def remote_uri_valid(uri: str) -> bool:
     """
@@ -137,7 +171,7 @@ def sink_uri_valid(sink_uri: str) -> bool:
     """
     Return whether the given sink URI is valid.
     """
-    if sink_uri == "display":
+    if sink_uri in ("display", "null"):
         return True
     elif remote_uri_valid(sink_uri):
         return True
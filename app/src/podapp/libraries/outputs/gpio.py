@@ -2,8 +2,24 @@
 Module to keep all GPIO dependencies in one place (which should help with dev/testing).
 
 All pins are numbered according to BCM.
+
+Input edges are delivered through a single dispatcher thread, which waits on a
+selector rather than polling. Edges from the GPIO library's own callback thread (or
+injected with `simulate_edge()` when there is no GPIO library) are posted to it,
+debounced per callback, and handed to the callbacks, either on the dispatcher
+thread or on an asyncio event loop.
 """
+from typing import Callable
+from typing import Dict
+from typing import List
+from ..common import log
+import asyncio
+import collections
 import enum
+import os
+import selectors
+import threading
+import time
 
 try:
     import RPi.GPIO as GPIO
@@ -28,6 +44,17 @@ class Level(enum.IntEnum):
     HIGH     = 1
     TRISTATE = 2
 
+class Edge(enum.IntEnum):
+    """
+    Which input transitions to call back on.
+    """
+    RISING  = 0
+    FALLING = 1
+    BOTH    = 2
+
+# What a callback gets: the pin, its new level, and when the edge happened (`time.monotonic_ns()`)
+EdgeEvent = collections.namedtuple("EdgeEvent", "pin level timestamp_ns")
+
 class Pin:
     """
     An object to represent the configuration and state of a pin
@@ -67,3 +94,185 @@ def deconfigure_pin(pin: int):
         GPIO.cleanup(pin)
     else:
         pin_dict[pin].direction = Direction.IN
+
+def output_many(levels: Dict[int, Level]):
+    """
+    Set several pins at once.
+    """
+    if GPIO_ENABLED:
+        GPIO.output(list(levels.keys()), list(levels.values()))
+    else:
+        for pin, level in levels.items():
+            pin_dict[pin].level = level
+
+def input_level(pin: int) -> Level:
+    """
+    Read the given pin's level.
+    """
+    if GPIO_ENABLED:
+        return Level(GPIO.input(pin))
+    else:
+        return pin_dict[pin].level
+
+class _EdgeWatch:
+    """
+    One registered edge callback.
+    """
+    def __init__(self, pin: int, edge: Edge, callback: Callable[[EdgeEvent], None], debounce_ns: int, loop: asyncio.AbstractEventLoop|None) -> None:
+        self.pin = pin
+        self.edge = edge
+        self.callback = callback
+        self.debounce_ns = debounce_ns
+        self.loop = loop
+        self.last_ns = None
+
+    def wants(self, event: EdgeEvent) -> bool:
+        if self.edge == Edge.RISING and event.level != Level.HIGH:
+            return False
+        if self.edge == Edge.FALLING and event.level != Level.LOW:
+            return False
+
+        # Ignore anything too soon after the last edge we accepted (contact bounce)
+        if self.last_ns is not None and event.timestamp_ns - self.last_ns < self.debounce_ns:
+            return False
+        self.last_ns = event.timestamp_ns
+        return True
+
+class _EdgeDispatcher:
+    """
+    Delivers edge events to their callbacks from one thread.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._events = collections.deque()
+        self._watches: Dict[int, List[_EdgeWatch]] = collections.defaultdict(list)
+
+        # Self-pipe: posting an event writes a byte, which wakes up the selector
+        self._rfd, self._wfd = os.pipe()
+        os.set_blocking(self._rfd, False)
+        os.set_blocking(self._wfd, False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._rfd, selectors.EVENT_READ)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="gpio-edges", daemon=True)
+        self._thread.start()
+
+    def add(self, watch: _EdgeWatch):
+        with self._lock:
+            self._watches[watch.pin].append(watch)
+
+    def remove(self, watch: _EdgeWatch) -> bool:
+        """
+        Remove the watch. Returns whether its pin has no more watches.
+        """
+        with self._lock:
+            watches = self._watches[watch.pin]
+            if watch in watches:
+                watches.remove(watch)
+            return not watches
+
+    def watched(self, pin: int) -> bool:
+        with self._lock:
+            return bool(self._watches.get(pin))
+
+    def post(self, event: EdgeEvent):
+        """
+        Queue an edge for dispatch. Safe to call from any thread.
+        """
+        self._events.append(event)
+        try:
+            os.write(self._wfd, b"\0")
+        except BlockingIOError:
+            # The pipe is full, so the dispatcher is already awake
+            pass
+
+    def _run(self):
+        while self._running:
+            for _ in self._selector.select():
+                try:
+                    while os.read(self._rfd, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+
+            while self._events:
+                self._dispatch(self._events.popleft())
+
+    def _dispatch(self, event: EdgeEvent):
+        with self._lock:
+            watches = [watch for watch in self._watches.get(event.pin, []) if watch.wants(event)]
+
+        for watch in watches:
+            if watch.loop is not None:
+                watch.loop.call_soon_threadsafe(watch.callback, event)
+                continue
+            try:
+                watch.callback(event)
+            except Exception as e:
+                log.error("Edge callback for pin %s raised: %s", event.pin, e)
+
+    def shutdown(self):
+        self._running = False
+        os.write(self._wfd, b"\0")
+        self._thread.join()
+        self._selector.close()
+        os.close(self._rfd)
+        os.close(self._wfd)
+
+_dispatcher: _EdgeDispatcher|None = None
+
+def _get_dispatcher() -> _EdgeDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = _EdgeDispatcher()
+    return _dispatcher
+
+def _on_gpio_edge(pin: int):
+    """
+    Called by the GPIO library (on its own thread) on both edges of a watched pin.
+    """
+    _get_dispatcher().post(EdgeEvent(pin, Level(GPIO.input(pin)), time.monotonic_ns()))
+
+def add_edge_callback(pin: int, edge: Edge, callback: Callable[[EdgeEvent], None], debounce_ms=0.0, loop: asyncio.AbstractEventLoop|None = None) -> _EdgeWatch:
+    """
+    Call `callback(EdgeEvent)` on the given edge(s) of the given input pin, ignoring edges
+    less than `debounce_ms` after the last one we called back on. Callbacks run on the
+    dispatcher thread, or on `loop` if given, so they should be quick.
+
+    Returns a handle for `remove_edge_callback()`.
+    """
+    watch = _EdgeWatch(pin, edge, callback, int(debounce_ms * 1e6), loop)
+    dispatcher = _get_dispatcher()
+    if GPIO_ENABLED and not dispatcher.watched(pin):
+        GPIO.add_event_detect(pin, GPIO.BOTH, callback=_on_gpio_edge)
+    dispatcher.add(watch)
+    return watch
+
+def remove_edge_callback(watch: _EdgeWatch):
+    """
+    Stop calling back on the edge registered by `add_edge_callback()`.
+    """
+    if _get_dispatcher().remove(watch) and GPIO_ENABLED:
+        GPIO.remove_event_detect(watch.pin)
+
+def simulate_edge(pin: int, level: Level, timestamp_ns: int|None = None):
+    """
+    Drive a (fake) input pin to the given level, as if it changed at `timestamp_ns`
+    (`time.monotonic_ns()`, default now). Only for when there is no GPIO library.
+    """
+    if GPIO_ENABLED:
+        raise RuntimeError("Cannot simulate edges on real pins")
+
+    if pin_dict[pin].level == level:
+        return
+    pin_dict[pin].level = level
+    _get_dispatcher().post(EdgeEvent(pin, level, timestamp_ns if timestamp_ns is not None else time.monotonic_ns()))
+
+def shutdown():
+    """
+    Stop delivering edges.
+    """
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.shutdown()
+        _dispatcher = None
@@ -1,9 +1,27 @@
 """
 This module is responsible for the LEDs present in the pod.
+
+The NeoPixel strips are driven by the MCU. We render animations here, a frame
+at a time for every pixel at once, and send the MCU only the pixel ranges that
+changed since the last frame it got.
 """
+from ..common import appconfig
+from ..common import log
 from ..coprocessors import mcu
 from typing import Any
+from typing import Callable
 from typing import Dict
+from typing import List
+import concurrent.futures
+import colorsys
+import struct
+import threading
+import time
+import numpy as np
+
+# An effect takes the time (seconds) and every pixel's position along its strip (in [0, 1))
+# and returns each pixel's RGB color as an (npixels, 3) array of floats in [0, 1].
+Effect = Callable[[float, np.ndarray], np.ndarray]
 
 class FlashLight:
     """
@@ -48,17 +66,302 @@ class FlashLight:
         # TODO
         pass
 
+def off() -> Effect:
+    """
+    Every pixel off.
+    """
+    def render(t_s: float, x: np.ndarray) -> np.ndarray:
+        return np.zeros((len(x), 3), dtype=np.float32)
+    return render
+
+def solid(color=(1.0, 1.0, 1.0)) -> Effect:
+    """
+    Every pixel the same color.
+    """
+    rgb = np.asarray(color, dtype=np.float32)
+    def render(t_s: float, x: np.ndarray) -> np.ndarray:
+        return np.broadcast_to(rgb, (len(x), 3))
+    return render
+
+def breathe(color=(1.0, 1.0, 1.0), period_s=4.0) -> Effect:
+    """
+    Every pixel the same color, fading in and out.
+    """
+    rgb = np.asarray(color, dtype=np.float32)
+    def render(t_s: float, x: np.ndarray) -> np.ndarray:
+        level = 0.5 - 0.5 * np.cos(2 * np.pi * t_s / period_s)
+        return np.broadcast_to(rgb * np.float32(level), (len(x), 3))
+    return render
+
+def rainbow(period_s=5.0) -> Effect:
+    """
+    A rainbow along each strip that scrolls around once every `period_s`.
+    """
+    # Hue -> RGB lookup table, so rendering is just an index
+    lut = np.array([colorsys.hsv_to_rgb(h / 256, 1.0, 1.0) for h in range(256)], dtype=np.float32)
+    def render(t_s: float, x: np.ndarray) -> np.ndarray:
+        hue = ((x + t_s / period_s) * 256).astype(np.int64) & 0xFF
+        return lut[hue]
+    return render
+
+def chase(color=(1.0, 1.0, 1.0), width=0.1, period_s=2.0) -> Effect:
+    """
+    A band of light `width` (fraction of the strip) wide that runs along each strip.
+    """
+    rgb = np.asarray(color, dtype=np.float32)
+    def render(t_s: float, x: np.ndarray) -> np.ndarray:
+        head = (t_s / period_s) % 1.0
+        distance = (head - x) % 1.0
+        level = np.clip(1.0 - distance / width, 0.0, 1.0)
+        return level[:, np.newaxis] * rgb
+    return render
+
+EFFECTS = {"off": off, "solid": solid, "breathe": breathe, "rainbow": rainbow, "chase": chase}
+
+class NullLink:
+    """
+    Stands in for the MCU link and throws away everything sent to it.
+    Useful for benchmarking animations off-device.
+    """
+    max_payload = mcu.MAX_PAYLOAD
+
+    def request(self, command: mcu.Command, payload=b"") -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        future.set_result(b"")
+        return future
+
 class LEDStrips:
     """
     The `LEDStrips` class should be a singleton
     that is responsible for the LED strips in the system.
+
+    Call `play()` with an effect and `start()` to animate the strips at the configured
+    frame rate. If the MCU link is still busy with the previous frame when a new one is
+    ready, the new frame is dropped rather than queued, so the strips never lag behind.
     """
-    def __init__(self, config: Dict[str, Any]) -> None:
-        pass
+    def __init__(self, config: Dict[str, Any], link=None, clock: Callable[[], float] = time.monotonic) -> None:
+        led_config = appconfig.section(config, appconfig.LEDsConfig)
+        self.clock = clock
+
+        if link is not None:
+            self.link = link
+        elif led_config.backend == "null":
+            self.link = NullLink()
+        else:
+            self.link = mcu.MCU.shared(config)
+
+        # All strips' pixels live in one array, so an effect renders every pixel in one go
+        self.strip_lengths: List[int] = list(led_config.strips)
+        self.strip_offsets = np.concatenate(([0], np.cumsum(self.strip_lengths))).astype(np.int64)
+        self.positions = np.concatenate([np.arange(n, dtype=np.float32) / n for n in self.strip_lengths])
+        npixels = int(self.strip_offsets[-1])
+        self.frame = np.zeros((npixels, 3), dtype=np.uint8)
+        self._sent = np.zeros((npixels, 3), dtype=np.uint8)
+        self._sent_valid = False
+        self._scaled = np.zeros((npixels, 3), dtype=np.float32)
+        self._levels = np.zeros((npixels, 3), dtype=np.uint8)
+
+        self.reconfigure(led_config)
+
+        # Largest number of pixels we can send in one request
+        self._max_run = (self.link.max_payload - 3) // 3
+
+        self.effect: Effect = off()
+        self._in_flight: List[concurrent.futures.Future] = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.reset_stats()
+
+    def reconfigure(self, led_config: appconfig.LEDsConfig):
+        """
+        Apply a (new) LED configuration section. The frame rate, brightness, gamma and
+        merge gap take effect from the next frame; the strips and backend can't change.
+        """
+        self.fps = led_config.fps
+        self.merge_gap = led_config.merge_gap_pixels
+        # Brightness and gamma correction, folded into one lookup table
+        self._lut = np.round(255 * led_config.brightness * (np.arange(256) / 255) ** led_config.gamma).astype(np.uint8)
+
+    def reset_stats(self):
+        """
+        Zero the render and link statistics.
+        """
+        self.frames_rendered = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.bytes_sent = 0
+        self.render_s_total = 0.0
+        self.render_s_max = 0.0
+        self._stats_start_s = self.clock()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Frame counts, render times and link bandwidth since the last `reset_stats()`.
+        """
+        elapsed_s = max(self.clock() - self._stats_start_s, 1e-9)
+        return {
+            "frames_rendered": self.frames_rendered,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "render_ms_mean": 1000 * self.render_s_total / self.frames_rendered if self.frames_rendered else 0.0,
+            "render_ms_max": 1000 * self.render_s_max,
+            "bytes_sent": self.bytes_sent,
+            "link_bytes_per_s": self.bytes_sent / elapsed_s,
+        }
+
+    def play(self, effect: Effect):
+        """
+        Show the given effect on every strip from the next frame on.
+        """
+        with self._lock:
+            self.effect = effect
+
+    def render(self, t_s: float):
+        """
+        Render the current effect at time `t_s` into `self.frame`.
+        """
+        start_s = time.perf_counter()
+        with self._lock:
+            rgb = self.effect(t_s, self.positions)
+        np.clip(rgb, 0.0, 1.0, out=self._scaled)
+        self._scaled *= 255
+        np.copyto(self._levels, self._scaled, casting='unsafe')
+        np.take(self._lut, self._levels, out=self.frame)
+
+        elapsed_s = time.perf_counter() - start_s
+        self.frames_rendered += 1
+        self.render_s_total += elapsed_s
+        self.render_s_max = max(self.render_s_max, elapsed_s)
+
+    def _changed_runs(self, strip: int) -> List[tuple]:
+        """
+        Return (first, end) pixel ranges of the given strip that differ from what the MCU has.
+        Ranges separated by no more than `merge_gap` unchanged pixels are merged, since each
+        request costs more than a few pixels' worth of bytes.
+        """
+        lo, hi = self.strip_offsets[strip], self.strip_offsets[strip + 1]
+        if not self._sent_valid:
+            changed = np.arange(hi - lo)
+        else:
+            changed = np.flatnonzero(np.any(self.frame[lo:hi] != self._sent[lo:hi], axis=1))
+        if len(changed) == 0:
+            return []
+
+        breaks = np.flatnonzero(np.diff(changed) > self.merge_gap + 1)
+        firsts = changed[np.concatenate(([0], breaks + 1))]
+        ends = changed[np.concatenate((breaks, [len(changed) - 1]))] + 1
+
+        runs = []
+        for first, end in zip(firsts.tolist(), ends.tolist()):
+            for chunk in range(first, end, self._max_run):
+                runs.append((chunk, min(end, chunk + self._max_run)))
+        return runs
+
+    def send(self, force=False) -> bool:
+        """
+        Send the changed parts of `self.frame` to the MCU. Returns False (and drops the frame)
+        if the link has not finished with the previous one, unless `force` is True, in which
+        case the whole frame is sent anyway, since we can't know how much of the previous one made it.
+        """
+        if any(not f.done() for f in self._in_flight):
+            if not force:
+                self.frames_dropped += 1
+                return False
+            self._sent_valid = False
+        # If anything went wrong last time, we don't know what the MCU has; send everything
+        elif any(f.exception() is not None for f in self._in_flight):
+            log.warning("Could not update the LED strips; resending the whole frame.")
+            self._sent_valid = False
+
+        futures = []
+        for strip in range(len(self.strip_lengths)):
+            runs = self._changed_runs(strip)
+            lo = self.strip_offsets[strip]
+            for first, end in runs:
+                payload = struct.pack("<BH", strip, first) + self.frame[lo + first:lo + end].tobytes()
+                futures.append(self.link.request(mcu.Command.LED_PIXELS, payload))
+                self.bytes_sent += mcu.FRAME_OVERHEAD + len(payload)
+            if runs:
+                futures.append(self.link.request(mcu.Command.LED_SHOW, bytes([strip])))
+                self.bytes_sent += mcu.FRAME_OVERHEAD + 1
+
+        self._sent[:] = self.frame
+        self._sent_valid = True
+        self._in_flight = futures
+        self.frames_sent += 1
+        return True
+
+    def flush(self, timeout_s: float|None = None):
+        """
+        Wait for the MCU to finish with the last frame we sent.
+        """
+        concurrent.futures.wait(self._in_flight, timeout=timeout_s)
+
+    @property
+    def running(self) -> bool:
+        """
+        Are we animating the strips (see `start()`)?
+        """
+        return self._thread is not None
+
+    def start(self):
+        """
+        Animate the strips in a background thread until `stop()`.
+        """
+        def run():
+            start_s = self.clock()
+            deadline_s = start_s
+            while not self._stop.is_set():
+                now_s = self.clock()
+                self.render(now_s - start_s)
+                self.send()
+
+                # If we fell behind, don't try to catch up with a burst of frames
+                deadline_s = max(deadline_s + 1.0 / self.fps, self.clock())
+                self._stop.wait(max(0.0, deadline_s - self.clock()))
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="leds", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop animating (the strips keep showing the last frame).
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
 
     def shutdown(self) -> None:
         """
-        Clean shutdown function.
+        Clean shutdown function. Stops animating and turns the strips off.
         """
-        # TODO
-        pass
+        self.stop()
+
+        # The last animation frame may still be on its way; the off frame must not be dropped
+        self.flush(timeout_s=1.0)
+        self.play(off())
+        self.render(0.0)
+        self.send(force=True)
+        self.flush(timeout_s=1.0)
+
+def benchmark(strips: LEDStrips, effect: Effect, nframes=1000) -> Dict[str, float]:
+    """
+    Render and send `nframes` frames of the given effect as fast as possible, as if
+    they were `1 / fps` seconds apart, and report the statistics.
+    """
+    strips.play(effect)
+    strips.reset_stats()
+    start_s = time.perf_counter()
+    for i in range(nframes):
+        strips.render(i / strips.fps)
+        strips.send()
+    strips.flush()
+    elapsed_s = time.perf_counter() - start_s
+
+    results = strips.stats()
+    results["fps"] = nframes / elapsed_s
+    results["bytes_per_frame"] = strips.bytes_sent / nframes
+    return results
@@ -1,72 +1,278 @@
 """
 This module provides some high-level functions
 for controlling the display.
+
+Asking the compositor about the display means forking `wlr-randr`, which
+is slow on the Pi, so the `Display` caches what it knows about the output's
+state and only asks again when the cache gets old. It also blanks the
+display after it has been idle for a while, to save power.
 """
 from typing import Any
+from typing import Callable
 from typing import Dict
+from typing import List
 from typing import Tuple
+from ..common import appconfig
 from ..common import error
-import re
+from ..common import log
+from ..common import metrics
 import subprocess
+import threading
+import time
+
+# How long to wait on wlr-randr before giving up
+COMMAND_TIMEOUT_SECONDS = 5
+
+# The longest the idle watcher sleeps before looking at the clock again
+IDLE_POLL_SECONDS = 1.0
+
+def run_wlr_randr(args: List[str]) -> Tuple[int, str]:
+    """
+    Run `wlr-randr` with the given arguments and return its return code and (combined) output.
+    """
+    p = subprocess.run(["wlr-randr"] + args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=COMMAND_TIMEOUT_SECONDS, encoding='utf-8')
+    return p.returncode, p.stdout
 
 class Display:
     """
     The `Display` class should be used as a singleton
     for controlling the display.
+
+    `run_command` is the function used to run `wlr-randr` (see `run_wlr_randr()`), `clock`
+    is the function used to tell the time (in seconds), and `sleep` the one used to wait
+    for the idle timeout. All of them can be swapped out for testing.
     """
-    def __init__(self, config: Dict[str, Any]) -> None:
-        self.touch_i2c_sda_pin = int(config['pinconfig']['screen']['i2c-sda']['pin'])
-        self.touch_i2c_scl_pin = int(config['pinconfig']['screen']['i2c-scl']['pin'])
-        self.timeout_seconds = int(config['moduleconfig']['screen']['timeout-seconds'])
-        self.dsi_id = config['pinconfig']['screen']['dsi']['id']
+    def __init__(self, config: Dict[str, Any], run_command: Callable[[List[str]], Tuple[int, str]] = run_wlr_randr,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> None:
+        pins = appconfig.section(config, appconfig.ScreenPinsConfig)
+        self.touch_i2c_sda_pin = pins.i2c_sda.pin
+        self.touch_i2c_scl_pin = pins.i2c_scl.pin
+        self.dsi_id = pins.dsi.id
+        self.reconfigure(appconfig.section(config, appconfig.ScreenConfig))
+        self.run_command = run_command
+        self.clock = clock
+        self.sleep = sleep
+
+        # Cached output state: None means we don't know
+        self._enabled = None
+        self._enabled_at = None
+
+        # The state we have most recently been asked for, and the request being applied (if any)
+        self._lock = threading.Lock()
+        self._wanted = None
+        self._applying = None
+
+        # When to blank the display (by the clock), and the thread waiting for that
+        self._idle_deadline_s = None
+        self._idle_thread = None
+
+        self.command_metric = metrics.histogram("display_wlr_randr_seconds", "Time each run of wlr-randr takes")
+        self.cached_queries_metric = metrics.counter("display_state_queries", "Questions about the display's state", {"answered_from": "cache"})
+        self.compositor_queries_metric = metrics.counter("display_state_queries", "Questions about the display's state", {"answered_from": "compositor"})
+        metrics.gauge("display_enabled", "Whether the display is on (1), off (0), or we don't know (-1)", fn=self._enabled_metric)
+
+    def _enabled_metric(self) -> int:
+        # Only what we already know; collecting metrics shouldn't fork wlr-randr
+        enabled = self._enabled
+        return -1 if enabled is None else int(enabled)
+
+    def _run(self, args: List[str]) -> Tuple[int, str]:
+        start_s = time.perf_counter()
+        try:
+            return self.run_command(args)
+        finally:
+            self.command_metric.observe(time.perf_counter() - start_s)
+
+    def reconfigure(self, screen_config: appconfig.ScreenConfig) -> None:
+        """
+        Apply a (new) screen configuration section. Takes effect from the next idle timer or query.
+        """
+        self.timeout_seconds = screen_config.timeout_seconds
+        self.refresh_seconds = screen_config.state_refresh_seconds
 
     def shutdown(self) -> None:
         """
         Clean shutdown function.
         """
-        # TODO
-        pass
+        self._cancel_idle_timer()
+        with self._lock:
+            idle_thread = self._idle_thread
+        if idle_thread is not None:
+            idle_thread.join()
+
+    def invalidate(self) -> None:
+        """
+        Forget the cached state, so that the next query asks the compositor.
+        """
+        with self._lock:
+            self._enabled = None
+
+    def _query(self) -> Tuple[Exception|None, bool|None]:
+        """
+        Ask the compositor whether our output is enabled.
+        """
+        returncode, output = self._run([])
+        if returncode != 0:
+            return (error.SubprocessException(f"Non-zero return code running 'wlr-randr': {output}"), None)
+
+        found_id = False
+        for line in output.splitlines():
+            if line.strip().startswith(self.dsi_id):
+                found_id = True
+            if found_id and line.strip().startswith("Enabled:"):
+                return (None, line.strip().split()[-1] == "yes")
+        return (error.SubprocessException(f"Could not find DSI identifier {self.dsi_id} in wlr-randr output. Output: {output}"), None)
 
     def on(self) -> Tuple[Exception|None, bool|None]:
         """
         Is the screen on?
         """
-        p = subprocess.run("wlr-randr", stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=self.timeout_seconds, encoding='utf-8')
-        if p.returncode == 0:
-            found_id = False
-            for line in p.stdout.splitlines():
-                if line.strip().startswith(self.dsi_id):
-                    found_id = True
-                if found_id and line.strip().startswith("Enabled:"):
-                    return (None, line.strip().split()[-1] == "yes")
-            return (error.SubprocessException(f"Could not find DSI identifier {self.dsi_id} in wlr-randr output. Output: {p.stdout}"), None)
-        else:
-            return (error.SubprocessException(f"Non-zero return code running 'xset -q': {p.stdout}"), None)
+        with self._lock:
+            if self._enabled is not None and self.clock() - self._enabled_at < self.refresh_seconds:
+                self.cached_queries_metric.inc()
+                return (None, self._enabled)
+
+        self.compositor_queries_metric.inc()
+        err, enabled = self._query()
+        if err:
+            return (err, None)
+
+        with self._lock:
+            self._enabled = enabled
+            self._enabled_at = self.clock()
+        return (None, enabled)
 
     def off(self) -> Tuple[Exception|None, bool|None]:
         """
         Is the screen off?
         """
         err, on = self.on()
-        return (err, not on)
+        return (err, None if on is None else not on)
+
+    def _request(self, enable: bool) -> Exception|None:
+        """
+        Ask for the output to be enabled or disabled, and wait for it to happen.
+
+        Requests are coalesced: if another thread is already changing the output,
+        we just update what it should end up as and wait for it to finish, getting
+        its result. Requests for the state we are already in cost nothing.
+        """
+        with self._lock:
+            self._wanted = enable
+            request = self._applying
+            if request is None:
+                request = self._applying = _Request()
+                applying = True
+            else:
+                applying = False
+
+        if not applying:
+            request.done.wait()
+            return request.err
+
+        try:
+            request.err = self._apply()
+        except Exception as e:
+            request.err = e
+            raise
+        finally:
+            with self._lock:
+                if self._applying is request:
+                    self._applying = None
+            request.done.set()
+
+        return request.err
+
+    def _apply(self) -> Exception|None:
+        """
+        Keep running wlr-randr until the output is in the state most recently asked for.
+        Stops taking on merged requests (see `_request()`) as soon as it decides to return.
+        """
+        while True:
+            with self._lock:
+                wanted = self._wanted
+                if wanted == self._enabled and self.clock() - self._enabled_at < self.refresh_seconds:
+                    self._applying = None
+                    return None
+
+            flag = "--on" if wanted else "--off"
+            returncode, output = self._run(["--output", self.dsi_id, flag])
+            if returncode != 0:
+                with self._lock:
+                    self._enabled = None
+                    self._applying = None
+                return error.SubprocessException(f"Non-zero return code running 'wlr-randr --output {self.dsi_id} {flag}': {output}")
+
+            with self._lock:
+                self._enabled = wanted
+                self._enabled_at = self.clock()
 
     def turn_on(self) -> Exception|None:
         """
-        Turn on the screen. Does not block.
+        Turn on the screen. Blocks until the screen has been switched, by us or by whichever
+        thread is already switching it.
+
+        The screen is turned back off after `timeout-seconds` without any activity
+        (see `notify_activity()`).
         """
-        p = subprocess.run(f"wlr-randr --output {self.dsi_id} --on".split(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=self.timeout_seconds, encoding='utf-8')
-        if p.returncode != 0:
-            return error.SubprocessException(f"Non-zero return code running 'xset dpms force on': {p.stdout}")
-        else:
-            return None
+        err = self._request(True)
+        if not err:
+            self.notify_activity()
+        return err
 
     def turn_off(self) -> Exception|None:
         """
-        Turn off the screen. Does not block.
+        Turn off the screen. Blocks like `turn_on()`.
         """
         # TODO: This does not turn off the touch interface
-        p = subprocess.run(f"wlr-randr --output {self.dsi_id} --off".split(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=self.timeout_seconds, encoding='utf-8')
-        if p.returncode != 0:
-            return error.SubprocessException(f"Non-zero return code running 'xset dpms force off': {p.stdout}")
-        else:
-            return None
+        self._cancel_idle_timer()
+        return self._request(False)
+
+    def notify_activity(self) -> None:
+        """
+        Let the display know that someone is using it (e.g., the screen was touched),
+        which restarts the idle auto-blank timer.
+        """
+        if self.timeout_seconds <= 0:
+            self._cancel_idle_timer()
+            return
+
+        with self._lock:
+            self._idle_deadline_s = self.clock() + self.timeout_seconds
+            if self._idle_thread is None:
+                self._idle_thread = threading.Thread(target=self._watch_idle, daemon=True)
+                self._idle_thread.start()
+
+    def _cancel_idle_timer(self) -> None:
+        with self._lock:
+            self._idle_deadline_s = None
+
+    def _watch_idle(self) -> None:
+        """
+        Wait (by the clock) for the idle deadline, which activity keeps pushing back, then blank the display.
+        """
+        while True:
+            with self._lock:
+                if self._idle_deadline_s is None:
+                    self._idle_thread = None
+                    return
+                remaining_s = self._idle_deadline_s - self.clock()
+                if remaining_s <= 0:
+                    self._idle_deadline_s = None
+
+            if remaining_s > 0:
+                self.sleep(min(remaining_s, IDLE_POLL_SECONDS))
+                continue
+
+            log.debug("Display has been idle for %s seconds. Turning it off.", self.timeout_seconds)
+            err = self._request(False)
+            if err:
+                log.error("Could not blank the idle display: %s", err)
+
+class _Request:
+    """
+    A change to the output that one thread applies on behalf of everyone who asked for it.
+    """
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.err = None
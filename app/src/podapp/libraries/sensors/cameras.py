@@ -1,40 +1,295 @@
 """
 This module provides high-level API functions
 for the cameras in the system.
+
+Both cameras share a single CSI port through a mux, which is selected by a GPIO pin.
+The `CameraMux` owns that pin. Because the cameras share a port, a pipeline that
+is reading from one camera can be switched over to the other by pausing it, flipping
+the mux, and resuming it, rather than rebuilding it.
 """
 from typing import Any
 from typing import Dict
+from typing import List
+import collections
+import threading
+import time
+from ..common import appconfig
 from ..common import log
+from ..common import metrics
 from ..outputs import gpio
+from ..storage import detections
 from ..gstreamer_utils import app as gst_app
+from ..gstreamer_utils import frames as gst_frames
 from ..gstreamer_utils import source as gst_source
 from ..gstreamer_utils import sink as gst_sink
 
-# TODO: This whole module is going to need to be reconsidered when I get around to dealing with the camera mux
+class CameraMux:
+    """
+    The `CameraMux` class should be used as a singleton (see `CameraMux.shared()`)
+    for controlling which camera is connected to the CSI port.
+
+    Frames that are captured right after a switch may come from either camera,
+    so the first `settle_frames` frames after every switch are dropped from any pipeline
+    the mux is attached to. The time from a switch to the first frame after that
+    is recorded in `switch_latencies_s`.
+    """
+    _shared = None
+
+    # How many PTS -> camera entries to remember for tagging results
+    _TAG_HISTORY = 256
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        pins = appconfig.section(config, appconfig.CameraPinsConfig)
+        self.pin = pins.camera_mux.pin
+        self.settle_frames = appconfig.section(config, appconfig.CamerasConfig).mux_settle_frames
+        self.levels = {}
+        for camera_config, camera in ((pins.front_camera, detections.CameraID.FRONT), (pins.rear_camera, detections.CameraID.REAR)):
+            if camera_config.enabled:
+                self.levels[camera] = gpio.Level[camera_config.mux_active_level]
+
+        self.active = detections.CameraID.UNKNOWN
+        self.switch_latencies_s = collections.deque(maxlen=100)
+
+        self._lock = threading.Lock()
+        self._handles = set()
+        self._next_handle = 0
+        self._pipeline = None
+        self._element_name = None
+        self._probe = None
+        self._switch_started_s = None
+        self._settle_remaining = 0
+        self._multiplex_cameras: List[detections.CameraID] = []
+        self._frames_per_camera = 0
+        self._frames_on_camera = 0
+        self._tags = collections.OrderedDict()
+
+        self.frames_metrics = {camera: metrics.counter("camera_frames", "Frames each camera has produced (its rate is the camera's fps)", {"camera": camera.name})
+                               for camera in self.levels}
+        self.settle_drops_metric = metrics.counter("camera_mux_settle_drops", "Frames dropped right after switching the camera mux")
+        self.switches_metric = metrics.counter("camera_mux_switches", "Times the camera mux has been switched")
+        self.switch_latency_metric = metrics.histogram("camera_mux_switch_latency_seconds", "Time from switching the camera mux to the first frame after that")
+
+        if self.levels:
+            gpio.configure_pin(self.pin, gpio.Direction.OUT)
+
+    @classmethod
+    def shared(cls, config: Dict[str, Any]) -> "CameraMux":
+        """
+        Return the mux shared by all the cameras, creating it if needed.
+        """
+        if cls._shared is None:
+            cls._shared = CameraMux(config)
+        return cls._shared
+
+    @property
+    def users(self) -> int:
+        """
+        How many users the mux has.
+        """
+        return len(self._handles)
+
+    def acquire(self) -> int:
+        """
+        Register a user of the mux (a camera). Returns the handle to give back to `release()`.
+        """
+        with self._lock:
+            self._next_handle += 1
+            self._handles.add(self._next_handle)
+            return self._next_handle
+
+    def release(self, handle: int):
+        """
+        Unregister the user that got `handle` from `acquire()`. The pin is released once
+        nobody is using it. Releasing a handle more than once does nothing.
+        """
+        with self._lock:
+            if handle not in self._handles:
+                return
+            self._handles.discard(handle)
+            if self._handles:
+                return
+        self.shutdown()
+
+    def shutdown(self):
+        """
+        Clean shutdown function.
+        """
+        self.detach()
+        if self.levels:
+            gpio.deconfigure_pin(self.pin)
+        self.active = detections.CameraID.UNKNOWN
+        if CameraMux._shared is self:
+            CameraMux._shared = None
+
+    def _flip(self, camera: detections.CameraID):
+        """
+        Drive the mux pin. Must be called with the lock held.
+        """
+        gpio.output(self.pin, self.levels[camera])
+        self.active = camera
+        self._switch_started_s = time.monotonic()
+        self._settle_remaining = self.settle_frames
+        self._frames_on_camera = 0
+        self.switches_metric.inc()
+
+    def select(self, camera: detections.CameraID) -> Exception|None:
+        """
+        Connect the given camera to the CSI port. Does nothing if it is already connected.
+        """
+        if camera not in self.levels:
+            return ValueError(f"Camera {camera.name} is not enabled")
+
+        with self._lock:
+            if camera != self.active:
+                self._flip(camera)
+        return None
+
+    def attach(self, pipeline: gst_app.GStreamerApp, source: gst_source.GStreamerSource):
+        """
+        Watch the frames coming out of the given pipeline's camera source, so that we can
+        drop frames during switches, measure switch latency, and tag frames with their camera.
+
+        The probe goes on the capsfilter after the camera (see `GStreamerSource.caps_name`) rather
+        than on the camera itself: with two streams, the camera's own `src` pad is the full-resolution
+        stream, whereas its capsfilter is on the stream that goes down the pipeline to the model.
+        """
+        self.detach()
+        with self._lock:
+            # The mux was set up before the pipeline started, so its first frames are good
+            self._switch_started_s = None
+            self._settle_remaining = 0
+
+        self._pipeline = pipeline
+        self._element_name = source.caps_name
+        self._probe = pipeline.add_buffer_probe(self._element_name, self._on_source_buffer)
+
+    def detach(self, pipeline: gst_app.GStreamerApp|None = None):
+        """
+        Stop watching the pipeline given to `attach()` (if any).
+        If `pipeline` is given, only detach if that is the pipeline we are attached to.
+        """
+        if pipeline is not None and pipeline is not self._pipeline:
+            return
+
+        with self._lock:
+            self._multiplex_cameras = []
+            self._tags.clear()
+
+        if self._pipeline is not None and self._probe is not None:
+            self._pipeline.remove_buffer_probe(self._element_name, self._probe)
+        self._pipeline = None
+        self._probe = None
+
+    def switch(self, camera: detections.CameraID, pipeline: gst_app.GStreamerApp|None = None) -> Exception|None:
+        """
+        Switch to the given camera. If a (running) pipeline is given, it is paused while we flip the mux
+        and then resumed, which is much faster than tearing it down and building a new one.
+        """
+        if camera not in self.levels:
+            return ValueError(f"Camera {camera.name} is not enabled")
+
+        if pipeline is not None:
+            pipeline.pause()
+
+        with self._lock:
+            if camera != self.active:
+                self._flip(camera)
+
+        if pipeline is not None:
+            pipeline.resume()
+
+        return None
+
+    def start_multiplexing(self, frames_per_camera: int, cameras=(detections.CameraID.FRONT, detections.CameraID.REAR)) -> Exception|None:
+        """
+        Alternate between the given cameras every `frames_per_camera` frames of the attached pipeline.
+        """
+        if self._pipeline is None:
+            return ValueError("The mux must be attached to a pipeline before multiplexing")
+
+        for camera in cameras:
+            if camera not in self.levels:
+                return ValueError(f"Camera {camera.name} is not enabled")
+
+        with self._lock:
+            self._multiplex_cameras = list(cameras)
+            self._frames_per_camera = frames_per_camera
+            self._flip(self._multiplex_cameras[0])
+        return None
+
+    def stop_multiplexing(self):
+        """
+        Stay on whichever camera is currently selected.
+        """
+        with self._lock:
+            self._multiplex_cameras = []
+
+    def camera_for_pts(self, pts: int) -> detections.CameraID:
+        """
+        Return the camera that the frame with the given PTS came from.
+        Suitable for `GStreamerResultsTap`'s `camera_of` argument.
+        """
+        with self._lock:
+            return self._tags.get(pts, self.active)
+
+    def _on_source_buffer(self, pts: int) -> bool:
+        """
+        Called for every frame the camera source produces. Returns whether to keep the frame.
+        """
+        with self._lock:
+            if self._settle_remaining > 0:
+                self._settle_remaining -= 1
+                self.settle_drops_metric.inc()
+                return False
+
+            if self._switch_started_s is not None:
+                latency_s = time.monotonic() - self._switch_started_s
+                self.switch_latencies_s.append(latency_s)
+                self.switch_latency_metric.observe(latency_s)
+                self._switch_started_s = None
+                log.debug("Camera mux switched to %s in %.1f ms", self.active.name, latency_s * 1000)
+
+            frames_metric = self.frames_metrics.get(self.active)
+            if frames_metric is not None:
+                frames_metric.inc()
+
+            self._tags[pts] = self.active
+            if len(self._tags) > self._TAG_HISTORY:
+                self._tags.popitem(last=False)
+
+            if self._multiplex_cameras:
+                self._frames_on_camera += 1
+                if self._frames_on_camera >= self._frames_per_camera:
+                    i = self._multiplex_cameras.index(self.active) if self.active in self._multiplex_cameras else -1
+                    self._flip(self._multiplex_cameras[(i + 1) % len(self._multiplex_cameras)])
+
+            return True
 
 class Camera:
     """
     The `Camera` class provides high-level functionality for a camera hardware module.
     """
-    def __init__(self, config: Dict[str, Any], config_name: str) -> None:
+    def __init__(self, config: Dict[str, Any], config_name: str, camera: detections.CameraID, mux: CameraMux|None = None) -> None:
         self.pipeline = None
 
-        self.cam_id = str(config['pinconfig']['cameras'][config_name]['id'])
-        self.cam_mux = int(config['pinconfig']['cameras']['camera-mux']['pin'])
-        level = str(config['pinconfig']['cameras'][config_name]['mux-active-level'])
-        self.mux_level = gpio.Level.HIGH if level == 'HIGH' else gpio.Level.LOW
-        self.enabled = config['pinconfig']['cameras'][config_name]['enabled'].lower() == "true"
+        self.camera = camera
+        camera_config = getattr(appconfig.section(config, appconfig.CameraPinsConfig), config_name.replace('-', '_'))
+        self.cam_id = camera_config.id
+        self.enabled = camera_config.enabled
 
-        if self.enabled:
-            # Set up the camera mux pin
-            gpio.configure_pin(self.cam_mux, gpio.Direction.OUT)
+        # All the cameras share the one mux
+        self.mux = mux if mux is not None else CameraMux.shared(config)
+        self._mux_handle = self.mux.acquire()
+
+        metrics.gauge("camera_streaming", "Whether each camera has a pipeline of its own running (1) or not (0)",
+                      {"camera": camera.name}, fn=lambda: int(self.pipeline is not None))
 
     def _switch_to_this_camera(self):
         """
         Switch to this camera.
         """
         if self.enabled:
-            gpio.output(self.cam_mux, self.mux_level)
+            self.mux.select(self.camera)
 
     def shutdown(self) -> None:
         """
@@ -42,7 +297,7 @@ class Camera:
         """
         if self.enabled:
             self.stop_streaming()
-            gpio.deconfigure_pin(self.cam_mux)
+        self.mux.release(self._mux_handle)
 
     def stream_to_display(self) -> Exception|None:
         """
@@ -54,6 +309,7 @@ class Camera:
             source = gst_source.GStreamerSource(self.cam_id)
             sink = gst_sink.GStreamerSink("display")
             self.pipeline = gst_app.GStreamerApp("camera-to-display", source, sink)
+            self.mux.attach(self.pipeline, source)
             self.pipeline.run()
 
         return None
@@ -68,10 +324,44 @@ class Camera:
             source = gst_source.GStreamerSource(self.cam_id)
             sink = gst_sink.GStreamerSink(fpath)
             self.pipeline = gst_app.GStreamerApp("camera-to-file", source, sink)
+            self.mux.attach(self.pipeline, source)
             self.pipeline.run()
 
         return None
 
+    def stream_to_tap(self, tap: gst_frames.FrameTap) -> Exception|None:
+        """
+        Asynchronously stream to a frame tap, to get the camera's frames in Python (see `FrameTap.pull()`).
+        """
+        if self.enabled:
+            self._switch_to_this_camera()
+
+            source = gst_source.GStreamerSource(self.cam_id)
+            self.pipeline = gst_app.GStreamerApp("camera-to-tap", source, tap)
+            self.mux.attach(self.pipeline, source)
+            self.pipeline.run()
+
+        return None
+
+    def hand_over_to(self, other: "Camera") -> Exception|None:
+        """
+        Hand this camera's running pipeline over to the other camera, without rebuilding it.
+        The pipeline is paused while the mux is switched.
+        """
+        if self.pipeline is None:
+            return ValueError("This camera is not streaming")
+
+        if not other.enabled:
+            return ValueError("The other camera is not enabled")
+
+        err = self.mux.switch(other.camera, self.pipeline)
+        if err:
+            return err
+
+        other.pipeline = self.pipeline
+        self.pipeline = None
+        return None
+
     def stop_streaming(self) -> Exception|None:
         """
         Stop streaming.
@@ -80,6 +370,7 @@ class Camera:
             self._switch_to_this_camera()
 
             if self.pipeline is not None:
+                self.mux.detach(self.pipeline)
                 self.pipeline.shutdown()
                 self.pipeline = None
 
@@ -89,12 +380,12 @@ class FrontCamera(Camera):
     """
     The `FrontCamera` singleton class.
     """
-    def __init__(self, config: Dict[str, Any]) -> None:
-        super().__init__(config, 'front-camera')
+    def __init__(self, config: Dict[str, Any], mux: CameraMux|None = None) -> None:
+        super().__init__(config, 'front-camera', detections.CameraID.FRONT, mux)
 
 class RearCamera(Camera):
     """
     The `RearCamera` singleton class.
     """
-    def __init__(self, config: Dict[str, Any]) -> None:
-        super().__init__(config, 'rear-camera')
+    def __init__(self, config: Dict[str, Any], mux: CameraMux|None = None) -> None:
+        super().__init__(config, 'rear-camera', detections.CameraID.REAR, mux)
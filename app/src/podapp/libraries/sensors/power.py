@@ -0,0 +1,141 @@
+"""
+This module provides readers for power meters, so that we can measure
+how much power the pod draws.
+
+All readers have a `read_watts()` method which returns a tuple of
+(`Exception|None`, `float|None`).
+"""
+from typing import Any
+from typing import Dict
+from typing import Tuple
+import glob
+import os
+from ..common import appconfig
+
+try:
+    import smbus2
+    SMBUS_ENABLED = True
+except ImportError:
+    SMBUS_ENABLED = False
+
+class INA219HwmonPowerMeter:
+    """
+    Reads an INA219 through the kernel's ina2xx hwmon driver.
+    """
+    def __init__(self, hwmon_dpath="auto", root="/") -> None:
+        """
+        `hwmon_dpath` is the hwmon directory of the INA219 (e.g., '/sys/class/hwmon/hwmon2'),
+        or 'auto' to find it by name. `root` is prepended to all sysfs paths (for testing).
+        """
+        if hwmon_dpath == "auto":
+            hwmon_dpath = None
+            for name_fpath in sorted(glob.glob(os.path.join(root, "sys/class/hwmon/hwmon*/name"))):
+                with open(name_fpath, 'r') as f:
+                    if f.read().strip() == "ina219":
+                        hwmon_dpath = os.path.dirname(name_fpath)
+                        break
+        else:
+            hwmon_dpath = os.path.join(root, hwmon_dpath.lstrip('/'))
+
+        self.hwmon_dpath = hwmon_dpath
+
+    def read_watts(self) -> Tuple[Exception|None, float|None]:
+        """
+        Read the power in watts.
+        """
+        if self.hwmon_dpath is None:
+            return (FileNotFoundError("Could not find an INA219 hwmon device"), None)
+
+        try:
+            power_fpath = os.path.join(self.hwmon_dpath, "power1_input")
+            if os.path.isfile(power_fpath):
+                # Microwatts
+                with open(power_fpath, 'r') as f:
+                    return (None, int(f.read()) / 1e6)
+
+            # No power channel, so calculate it from bus voltage (mV) and current (mA)
+            with open(os.path.join(self.hwmon_dpath, "in1_input"), 'r') as f:
+                millivolts = int(f.read())
+            with open(os.path.join(self.hwmon_dpath, "curr1_input"), 'r') as f:
+                milliamps = int(f.read())
+            return (None, millivolts * milliamps / 1e6)
+        except (OSError, ValueError) as e:
+            return (e, None)
+
+class INA219I2CPowerMeter:
+    """
+    Reads an INA219 directly over I2C (for when the kernel driver is not loaded).
+    """
+    _REG_CONFIG = 0x00
+    _REG_POWER = 0x03
+    _REG_CALIBRATION = 0x05
+
+    def __init__(self, bus=1, address=0x40, shunt_ohms=0.1, max_expected_amps=3.2) -> None:
+        self.bus = None
+        self.address = address
+
+        # See the INA219 datasheet, section 8.5.1
+        self.current_lsb = max_expected_amps / 32768
+        self.power_lsb = 20 * self.current_lsb
+        self.calibration = int(0.04096 / (self.current_lsb * shunt_ohms))
+
+        if SMBUS_ENABLED:
+            self.bus = smbus2.SMBus(bus)
+            self._write_register(self._REG_CALIBRATION, self.calibration)
+
+    def _write_register(self, register: int, value: int):
+        # The INA219 is big-endian; SMBus word transfers are little-endian
+        self.bus.write_word_data(self.address, register, ((value & 0xFF) << 8) | (value >> 8))
+
+    def _read_register(self, register: int) -> int:
+        value = self.bus.read_word_data(self.address, register)
+        return ((value & 0xFF) << 8) | (value >> 8)
+
+    def read_watts(self) -> Tuple[Exception|None, float|None]:
+        """
+        Read the power in watts.
+        """
+        if self.bus is None:
+            return (ImportError("smbus2 is not installed"), None)
+
+        try:
+            return (None, self._read_register(self._REG_POWER) * self.power_lsb)
+        except OSError as e:
+            return (e, None)
+
+class FilePowerMeter:
+    """
+    Reads the power (in watts) as a number from a file. Useful as a stand-in when
+    there is no meter attached, or when some other program logs the power for us.
+    """
+    def __init__(self, fpath: str) -> None:
+        self.fpath = fpath
+
+    def read_watts(self) -> Tuple[Exception|None, float|None]:
+        """
+        Read the power in watts.
+        """
+        try:
+            with open(self.fpath, 'r') as f:
+                return (None, float(f.read().strip()))
+        except (OSError, ValueError) as e:
+            return (e, None)
+
+def from_config(config: Dict[str, Any]) -> Tuple[Exception|None, Any]:
+    """
+    Create the power meter reader described by the configuration.
+    """
+    try:
+        power_config = appconfig.section(config, appconfig.ProfilingConfig).power_meter
+    except appconfig.ConfigError as e:
+        return (e, None)
+
+    match power_config.type:
+        case "ina219-hwmon":
+            return (None, INA219HwmonPowerMeter(power_config.hwmon_dpath))
+        case "ina219-i2c":
+            return (None, INA219I2CPowerMeter(bus=power_config.i2c_bus, address=power_config.i2c_address, shunt_ohms=power_config.shunt_ohms))
+        case "file":
+            return (None, FilePowerMeter(power_config.fpath))
+        case other:
+            return (ValueError(f"Unknown power meter type: {other}"), None)
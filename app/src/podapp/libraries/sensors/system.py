@@ -0,0 +1,92 @@
+"""
+This module reads the health of the system itself (CPU, temperature, memory)
+from procfs and sysfs, and publishes it as metrics (see `register_metrics()`).
+
+Every reader takes a `root` which is prepended to the /proc and /sys paths,
+so that tests can point it at a fake tree.
+"""
+from typing import List
+from typing import Tuple
+import os
+from ..common import metrics
+
+def read_cpu_times(root="/") -> Tuple[int, int]:
+    """
+    Return (busy, total) jiffies across all CPUs since boot.
+    """
+    with open(os.path.join(root, "proc/stat"), 'r') as f:
+        fields = [int(v) for v in f.readline().split()[1:]]
+
+    # user nice system idle iowait irq softirq steal ...
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    total = sum(fields[:8])
+    return (total - idle, total)
+
+def read_temperatures_c(root="/") -> List[float]:
+    """
+    Return the temperature (in degrees C) of every thermal zone.
+    """
+    temperatures = []
+    dpath = os.path.join(root, "sys/class/thermal")
+    if not os.path.isdir(dpath):
+        return temperatures
+
+    for zone in sorted(os.listdir(dpath)):
+        fpath = os.path.join(dpath, zone, "temp")
+        if zone.startswith("thermal_zone") and os.path.isfile(fpath):
+            with open(fpath, 'r') as f:
+                temperatures.append(int(f.read()) / 1000)
+    return temperatures
+
+def read_rss_bytes(pid="self", root="/") -> int:
+    """
+    Return the resident set size of the given process.
+    """
+    with open(os.path.join(root, "proc", str(pid), "status"), 'r') as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                # Always reported in kB
+                return int(line.split()[1]) * 1024
+    return 0
+
+class CPUUsage:
+    """
+    Tracks CPU utilization between calls to `sample()`.
+    """
+    def __init__(self, root="/") -> None:
+        self.root = root
+        self._last = read_cpu_times(root)
+
+    def sample(self) -> float:
+        """
+        Return the fraction of time (0 to 1) the CPUs were busy since the last call.
+        """
+        busy, total = read_cpu_times(self.root)
+        last_busy, last_total = self._last
+        self._last = (busy, total)
+        if total == last_total:
+            return 0.0
+        return (busy - last_busy) / (total - last_total)
+
+def read_memory_available_bytes(root="/") -> int:
+    """
+    Return how much memory is available for starting new applications, without swapping.
+    """
+    with open(os.path.join(root, "proc/meminfo"), 'r') as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                # Always reported in kB
+                return int(line.split()[1]) * 1024
+    return 0
+
+def register_metrics(registry: metrics.Registry = metrics.REGISTRY, root="/"):
+    """
+    Publish the system's health. Everything is read when the metrics are collected;
+    CPU utilization is since the previous collection. Without any thermal zones (e.g., in
+    a container), there is no temperature.
+    """
+    usage = CPUUsage(root)
+    registry.gauge("system_cpu_busy_fraction", "Fraction of time (0 to 1) the CPUs were busy since the metrics were last collected", fn=usage.sample)
+    registry.gauge("system_temperature_max_celsius", "Temperature of the hottest thermal zone", fn=lambda: max(read_temperatures_c(root), default=None))
+    registry.gauge("system_memory_available_bytes", "Memory available to start new applications without swapping", fn=lambda: read_memory_available_bytes(root))
+    registry.gauge("process_resident_memory_bytes", "Resident set size of this process", fn=lambda: read_rss_bytes(root=root))
@@ -0,0 +1,93 @@
+"""
+This module collects telemetry from the sensors behind the MCU (temperature/humidity,
+GPS, IMU) and keeps it in a `TelemetryStore`.
+"""
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+import os
+import threading
+import time
+from ..common import appconfig
+from ..common import log
+from ..coprocessors import mcu
+from ..storage import telemetry
+
+# The channels each sensor's values go into, in the order the MCU reports them
+SENSOR_CHANNELS = {
+    mcu.Sensor.TEMPERATURE_HUMIDITY: ("temperature_c", "humidity_pct"),
+    mcu.Sensor.GPS: ("gps_latitude_deg", "gps_longitude_deg", "gps_altitude_m", "gps_fix"),
+    mcu.Sensor.IMU: ("imu_accel_x_mps2", "imu_accel_y_mps2", "imu_accel_z_mps2", "imu_gyro_x_radps", "imu_gyro_y_radps", "imu_gyro_z_radps"),
+}
+
+class Telemetry:
+    """
+    The `Telemetry` class should be a singleton. It polls the configured sensors through
+    the MCU link every `sample-period-seconds` and records their values.
+    """
+    def __init__(self, config: Dict[str, Any], link: mcu.MCU, clock: Callable[[], float] = time.time) -> None:
+        telemetry_config = appconfig.section(config, appconfig.TelemetryConfig)
+        self.link = link
+        self.clock = clock
+        self.period_s = telemetry_config.sample_period_seconds
+        self.sensors: List[mcu.Sensor] = [mcu.Sensor[name.upper().replace('-', '_')] for name in telemetry_config.sensors]
+
+        dpath = telemetry_config.dpath
+        try:
+            os.makedirs(dpath, exist_ok=True)
+        except OSError:
+            log.warning("Configuration file's telemetry 'dpath' is not usable. Value given: %s", dpath)
+            dpath = telemetry_config.dpath_dev
+
+        self.store = telemetry.TelemetryStore(
+            dpath,
+            [channel for sensor in self.sensors for channel in SENSOR_CHANNELS[sensor]],
+            ring_samples=telemetry_config.ring_samples,
+            history=dict(telemetry_config.history),
+            flush_rows=telemetry_config.flush_rows,
+        )
+
+        self._thread = None
+        self._stop = threading.Event()
+
+    def poll(self) -> Exception|None:
+        """
+        Read every sensor once and record the values. The reads all go out together,
+        so they share SPI transactions.
+        """
+        now_s = self.clock()
+        futures = [(sensor, self.link.read_sensor(sensor)) for sensor in self.sensors]
+
+        err = None
+        for sensor, future in futures:
+            try:
+                values = future.result()
+            except (mcu.MCUError, TimeoutError) as e:
+                log.warning("Could not read %s from the MCU: %s", sensor.name, e)
+                err = e
+                continue
+            self.store.record(now_s, dict(zip(SENSOR_CHANNELS[sensor], values)))
+        return err
+
+    def start(self):
+        """
+        Poll in a background thread until `shutdown()`.
+        """
+        def run():
+            while not self._stop.wait(self.period_s):
+                self.poll()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """
+        Clean shutdown function.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.store.close()
@@ -0,0 +1,129 @@
+"""
+This module keeps a workload from heating the SoC until it thermal-throttles.
+
+The `ThermalController` watches the hottest thermal zone and moves through a list
+of levels (0 being full speed): it steps down a level as soon as the temperature
+reaches that level's step-down temperature, and steps back up only once it has been
+comfortably (`hysteresis`) below it for a while (`hold`), so that it doesn't flap.
+What a level means is up to whoever is told about it (e.g., `AICoprocessor` runs
+inference on fewer frames).
+"""
+from typing import Callable
+import threading
+import time
+from ..common import appconfig
+from ..common import log
+from ..common import metrics
+from . import system
+
+class ThermalController:
+    """
+    Calls `on_level(level)` (from its own thread, once started) whenever the level changes.
+    `clock` tells the time in seconds, and can be swapped out for testing.
+    """
+    def __init__(self, thermal_config: appconfig.ThermalConfig, on_level: Callable[[int], None], clock: Callable[[], float] = time.monotonic) -> None:
+        self.on_level = on_level
+        self.clock = clock
+        self.reconfigure(thermal_config)
+
+        self.level = 0
+        self.temperature_c = None
+        self._cool_since_s = None
+
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.level_metric = metrics.gauge("thermal_level", "Thermal step-down level (0 is full speed)")
+        self.step_down_metric = metrics.counter("thermal_transitions", "Times the thermal controller changed level", {"direction": "down"})
+        self.step_up_metric = metrics.counter("thermal_transitions", "Times the thermal controller changed level", {"direction": "up"})
+
+    def reconfigure(self, thermal_config: appconfig.ThermalConfig) -> None:
+        """
+        Apply a (new) thermal configuration section. Takes effect from the next reading.
+        """
+        self.root = thermal_config.sysfs_root
+        self.period_s = thermal_config.poll_seconds
+        self.step_down_c = thermal_config.step_down_celsius
+        self.hysteresis_c = thermal_config.hysteresis_celsius
+        self.hold_s = thermal_config.hold_seconds
+
+    def update(self, temperature_c: float) -> int:
+        """
+        Take a new temperature reading into account. Returns the (possibly new) level.
+        """
+        self.temperature_c = temperature_c
+        level = self.level
+        max_level = len(self.step_down_c)
+
+        if level < max_level and temperature_c >= self.step_down_c[level]:
+            # Heat is urgent: go down as many levels as it takes, right away
+            while level < max_level and temperature_c >= self.step_down_c[level]:
+                level += 1
+            self._cool_since_s = None
+        elif level > 0 and temperature_c < self.step_down_c[level - 1] - self.hysteresis_c:
+            now_s = self.clock()
+            if self._cool_since_s is None:
+                self._cool_since_s = now_s
+            if now_s - self._cool_since_s >= self.hold_s:
+                level -= 1
+                # The next level up has to wait out its own hold
+                self._cool_since_s = now_s
+        else:
+            self._cool_since_s = None
+
+        if level != self.level:
+            log.info("Thermal level %d -> %d at %.1f C", self.level, level, temperature_c)
+            (self.step_down_metric if level > self.level else self.step_up_metric).inc()
+            self.level = level
+            self.level_metric.set(level)
+            self.on_level(level)
+        return level
+
+    def poll(self) -> Exception|None:
+        """
+        Read the hottest thermal zone once and update the level.
+        """
+        try:
+            temperatures = system.read_temperatures_c(self.root)
+        except (OSError, ValueError) as e:
+            return e
+
+        if not temperatures:
+            return FileNotFoundError(f"No thermal zones under {self.root}")
+
+        self.update(max(temperatures))
+        return None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        """
+        Poll in a background thread until `shutdown()`. Does nothing if already started.
+        """
+        if self._thread is not None:
+            return
+
+        def run():
+            err = self.poll()
+            if err:
+                log.warning("Not controlling the temperature: %s", err)
+                return
+            while not self._stop.wait(self.period_s):
+                err = self.poll()
+                if err:
+                    log.warning("Could not read the temperature: %s", err)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="thermal", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """
+        Stop polling. The level is kept, so that starting again doesn't start out too hot.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
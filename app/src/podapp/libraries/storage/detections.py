@@ -0,0 +1,374 @@
+"""
+This module defines the on-disk representation of AI detections.
+
+Every detection is a fixed-width record (see `DETECTION_DTYPE`), so a file
+of detections is just a flat array of records that can be read back
+with `numpy.fromfile` or memory-mapped.
+
+`DetectionStore` builds on this to keep a long-running, append-only
+collection of detections in fixed-size, memory-mapped chunk files, with a
+small index that lets queries skip chunks by time range and class.
+"""
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Set
+from typing import Tuple
+import enum
+import json
+import os
+import threading
+import numpy as np
+
+# One row per detection. 36 bytes per row.
+DETECTION_DTYPE = np.dtype([
+    # Nanoseconds. Buffer PTS for recorded clips, wall-clock time for live cameras.
+    # The two are kept in separate stores (see `FILE_RUNS_DNAME`), so they are never mixed.
+    ("timestamp", "<i8"),
+    # Index of the frame in the stream the detection came from
+    ("frame", "<u4"),
+    # A `CameraID`
+    ("camera", "u1"),
+    # Index of the model in `ai.AIModelType`
+    ("model", "u1"),
+    # The class ID as reported by the model's post-process
+    ("class_id", "<u2"),
+    # Confidence in [0, 1]
+    ("score", "<f4"),
+    # (xmin, ymin, xmax, ymax), normalized to [0, 1]
+    ("box", "<f4", (4,)),
+])
+
+# The subdirectory of a store's directory that holds the store for detections from recorded files,
+# whose timestamps are PTS (nanoseconds since the start of the clip) rather than wall-clock time.
+FILE_RUNS_DNAME = "files"
+
+class CameraID(enum.IntEnum):
+    """
+    The camera a detection came from.
+    """
+    UNKNOWN = 0
+    FRONT   = 1
+    REAR    = 2
+
+def empty(n: int) -> np.ndarray:
+    """
+    Return an array of `n` (uninitialized) detection records.
+    """
+    return np.empty(n, dtype=DETECTION_DTYPE)
+
+def read_detections(fpath: str) -> np.ndarray:
+    """
+    Read all the detection records from the given file.
+    """
+    return np.fromfile(fpath, dtype=DETECTION_DTYPE)
+
+class DetectionWriter:
+    """
+    Appends detection records to a file.
+
+    Records are staged in a pre-allocated buffer and only written
+    out when the buffer is full (or on `flush()`/`close()`), so the
+    pipeline thread does not hit the disk on every frame.
+    """
+    def __init__(self, fpath: str, buffer_rows=4096) -> None:
+        self.fpath = fpath
+        self.nrows_written = 0
+        self._buffer = empty(buffer_rows)
+        self._nbuffered = 0
+        self._f = open(fpath, 'ab')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, records: np.ndarray):
+        """
+        Append the given detection records.
+        """
+        start = 0
+        while start < len(records):
+            n = min(len(records) - start, len(self._buffer) - self._nbuffered)
+            self._buffer[self._nbuffered:self._nbuffered + n] = records[start:start + n]
+            self._nbuffered += n
+            start += n
+            if self._nbuffered == len(self._buffer):
+                self.flush()
+
+    def flush(self):
+        """
+        Write any staged records to disk.
+        """
+        if self._nbuffered:
+            self._f.write(self._buffer[:self._nbuffered].tobytes())
+            self.nrows_written += self._nbuffered
+            self._nbuffered = 0
+        self._f.flush()
+
+    def close(self):
+        """
+        Flush and close the file.
+        """
+        if not self._f.closed:
+            self.flush()
+            os.fsync(self._f.fileno())
+            self._f.close()
+
+class DetectionStore:
+    """
+    An append-only store of detection records on disk.
+
+    Records live in chunk files of `chunk_rows` rows each, which are memory-mapped
+    rather than read, so a query only pulls in the pages it actually touches.
+    Alongside the chunks we keep `index.json`, which holds for each chunk its number of
+    committed rows, its time range, whether its timestamps are sorted, and how many
+    detections of each class it holds, and `labels.json`, which maps each model's class IDs
+    to human-readable labels so that you can query for e.g. "fox".
+
+    Rows are only guaranteed to survive a crash once `flush()` has been called
+    (which happens automatically every `flush_rows` rows and on `close()`).
+    """
+    INDEX_FILE_NAME = "index.json"
+    LABELS_FILE_NAME = "labels.json"
+
+    def __init__(self, dpath: str, chunk_rows=65536, flush_rows=4096) -> None:
+        self.dpath = dpath
+        self.flush_rows = flush_rows
+        self._lock = threading.Lock()
+        self._readers: Dict[str, np.memmap] = {}
+        self._unflushed = 0
+        os.makedirs(dpath, exist_ok=True)
+
+        index_fpath = os.path.join(dpath, self.INDEX_FILE_NAME)
+        if os.path.isfile(index_fpath):
+            with open(index_fpath, 'r') as f:
+                index = json.load(f)
+            self.chunk_rows = index['chunk_rows']
+            self.chunks: List[Dict] = index['chunks']
+        else:
+            self.chunk_rows = chunk_rows
+            self.chunks = []
+
+        labels_fpath = os.path.join(dpath, self.LABELS_FILE_NAME)
+        if os.path.isfile(labels_fpath):
+            with open(labels_fpath, 'r') as f:
+                self.labels: Dict[str, Dict[str, str]] = json.load(f)
+        else:
+            self.labels = {}
+
+        self._writer = None
+        if self.chunks and self.chunks[-1]['rows'] < self.chunk_rows:
+            self._writer = self._map_chunk(self.chunks[-1]['name'], 'r+')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return sum(chunk['rows'] for chunk in self.chunks)
+
+    def _map_chunk(self, name: str, mode: str) -> np.memmap:
+        return np.memmap(os.path.join(self.dpath, name), dtype=DETECTION_DTYPE, mode=mode, shape=(self.chunk_rows,))
+
+    def _new_chunk(self):
+        """
+        Seal the current chunk (if any) and start a new one.
+        """
+        if self._writer is not None:
+            self._writer.flush()
+
+        name = f"chunk-{len(self.chunks):06d}.det"
+        self._writer = self._map_chunk(name, 'w+')
+        self.chunks.append({"name": name, "rows": 0, "tmin": None, "tmax": None, "sorted": True, "classes": {}})
+
+    def append(self, records: np.ndarray):
+        """
+        Append the given detection records. Suitable for use as an `AICoprocessor` results callback.
+        """
+        if len(records) == 0:
+            return
+
+        with self._lock:
+            start = 0
+            while start < len(records):
+                if self._writer is None or self.chunks[-1]['rows'] == self.chunk_rows:
+                    self._new_chunk()
+
+                chunk = self.chunks[-1]
+                n = min(len(records) - start, self.chunk_rows - chunk['rows'])
+                batch = records[start:start + n]
+                self._writer[chunk['rows']:chunk['rows'] + n] = batch
+                self._update_chunk_index(chunk, batch)
+                chunk['rows'] += n
+                start += n
+
+            self._unflushed += len(records)
+            if self._unflushed >= self.flush_rows:
+                self._flush()
+
+    def _update_chunk_index(self, chunk: Dict, batch: np.ndarray):
+        timestamps = batch['timestamp']
+        tmin = int(timestamps.min())
+        tmax = int(timestamps.max())
+        if chunk['sorted']:
+            chunk['sorted'] = bool(np.all(timestamps[1:] >= timestamps[:-1])) and (chunk['tmax'] is None or tmin >= chunk['tmax'])
+        chunk['tmin'] = tmin if chunk['tmin'] is None else min(chunk['tmin'], tmin)
+        chunk['tmax'] = tmax if chunk['tmax'] is None else max(chunk['tmax'], tmax)
+
+        class_ids, counts = np.unique(batch['class_id'], return_counts=True)
+        for class_id, count in zip(class_ids.tolist(), counts.tolist()):
+            chunk['classes'][str(class_id)] = chunk['classes'].get(str(class_id), 0) + count
+
+    def _flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+
+        # Write the index atomically, so a crash never leaves us with a torn index
+        index_fpath = os.path.join(self.dpath, self.INDEX_FILE_NAME)
+        with open(index_fpath + ".tmp", 'w') as f:
+            json.dump({"chunk_rows": self.chunk_rows, "chunks": self.chunks}, f)
+        os.replace(index_fpath + ".tmp", index_fpath)
+        self._unflushed = 0
+
+    def flush(self):
+        """
+        Make sure everything appended so far is on disk.
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """
+        Flush and release the store.
+        """
+        with self._lock:
+            self._flush()
+            self._writer = None
+            self._readers.clear()
+
+    def set_labels(self, model_index: int, labels: Dict[int, str]):
+        """
+        Record the labels for the given model's class IDs.
+        """
+        with self._lock:
+            model_labels = self.labels.setdefault(str(model_index), {})
+            model_labels.update({str(k): v for k, v in labels.items()})
+            labels_fpath = os.path.join(self.dpath, self.LABELS_FILE_NAME)
+            with open(labels_fpath + ".tmp", 'w') as f:
+                json.dump(self.labels, f)
+            os.replace(labels_fpath + ".tmp", labels_fpath)
+
+    def class_ids_for_label(self, label: str, model=None) -> List[int]:
+        """
+        Return every class ID that has the given label, either for the given model
+        or across all models if `model` is None.
+        """
+        return sorted({class_id for _, class_id in self.classes_for_label(label, model)})
+
+    def classes_for_label(self, label: str, model=None) -> Set[Tuple[int, int]]:
+        """
+        Return every (model, class ID) pair that has the given label, either for the given model
+        or across all models if `model` is None. Class IDs only mean something for the model that
+        reported them, so this is what to filter rows on.
+        """
+        classes = set()
+        for model_index, model_labels in self.labels.items():
+            if model is None or int(model_index) == model:
+                classes.update((int(model_index), int(k)) for k, v in model_labels.items() if v == label)
+        return classes
+
+    def _chunk_rows(self, chunk: Dict) -> np.ndarray:
+        """
+        Return a read-only view of the committed rows of the given chunk.
+        """
+        if chunk is self.chunks[-1] and self._writer is not None:
+            return self._writer[:chunk['rows']]
+
+        if chunk['name'] not in self._readers:
+            self._readers[chunk['name']] = self._map_chunk(chunk['name'], 'r')
+        return self._readers[chunk['name']][:chunk['rows']]
+
+    def iter_query(self, start_ns=None, end_ns=None, class_ids: Iterable[int]|None = None, labels: Iterable[str]|None = None,
+                   min_score=None, camera=None, model=None) -> Iterator[np.ndarray]:
+        """
+        Like `query()`, but yields the matching rows one chunk at a time, so that arbitrarily
+        large results never need to be held in memory at once.
+        """
+        # Explicit class IDs match in any model; labels match (model, class ID) pairs,
+        # which we compare as `model << 16 | class_id`
+        wanted = None
+        wanted_classes = None
+        if class_ids is not None or labels is not None:
+            wanted = set(class_ids or [])
+            pairs = set()
+            for label in labels or []:
+                pairs.update(self.classes_for_label(label, model))
+            wanted_classes = np.array([(m << 16) | c for m, c in pairs], dtype=np.uint32)
+            wanted.update(c for _, c in pairs)
+            if not wanted:
+                return
+            explicit = np.array(sorted(class_ids or []), dtype=np.uint16)
+
+        with self._lock:
+            chunks = [dict(chunk) for chunk in self.chunks]
+            views = [self._chunk_rows(chunk) for chunk in self.chunks]
+
+        for chunk, rows in zip(chunks, views):
+            # Skip whole chunks using the index
+            if chunk['rows'] == 0:
+                continue
+            if start_ns is not None and chunk['tmax'] < start_ns:
+                continue
+            if end_ns is not None and chunk['tmin'] >= end_ns:
+                continue
+            if wanted is not None and not any(str(c) in chunk['classes'] for c in wanted):
+                continue
+
+            # Narrow down by time. If the chunk is sorted, this is a binary search and only touches a few pages.
+            rows = rows[:chunk['rows']]
+            if chunk['sorted']:
+                lo = 0 if start_ns is None else int(np.searchsorted(rows['timestamp'], start_ns, side='left'))
+                hi = len(rows) if end_ns is None else int(np.searchsorted(rows['timestamp'], end_ns, side='left'))
+                rows = rows[lo:hi]
+                mask = np.ones(len(rows), dtype=bool)
+            else:
+                mask = np.ones(len(rows), dtype=bool)
+                if start_ns is not None:
+                    mask &= rows['timestamp'] >= start_ns
+                if end_ns is not None:
+                    mask &= rows['timestamp'] < end_ns
+
+            if wanted is not None:
+                keys = (rows['model'].astype(np.uint32) << 16) | rows['class_id']
+                mask &= np.isin(rows['class_id'], explicit) | np.isin(keys, wanted_classes)
+            if min_score is not None:
+                mask &= rows['score'] > min_score
+            if camera is not None:
+                mask &= rows['camera'] == camera
+            if model is not None:
+                mask &= rows['model'] == model
+
+            matches = np.asarray(rows[mask])
+            if len(matches):
+                yield matches
+
+    def query(self, start_ns=None, end_ns=None, class_ids: Iterable[int]|None = None, labels: Iterable[str]|None = None,
+              min_score=None, camera=None, model=None) -> np.ndarray:
+        """
+        Return (a copy of) all the detections matching every given criterion:
+
+        - `start_ns`/`end_ns`: timestamp in [start_ns, end_ns)
+        - `class_ids`/`labels`: class is any of the given IDs, or has one of the given labels in the model that reported it
+        - `min_score`: score is strictly greater than this
+        - `camera`: a `CameraID`
+        - `model`: the index of the model in `ai.AIModelType`
+        """
+        results = list(self.iter_query(start_ns, end_ns, class_ids, labels, min_score, camera, model))
+        if not results:
+            return empty(0)
+        return np.concatenate(results)
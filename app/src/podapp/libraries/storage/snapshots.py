@@ -0,0 +1,345 @@
+"""
+This module keeps small JPEG snapshots of what the AI pipeline detects, for reviewing
+on the pod's touchscreen without going through whole video files.
+
+The `Snapshotter` is handed each frame's detections along with the frame's pixels
+(from the streaming thread). For every detection that passes `min-score`, it copies
+the detection's region of interest (and, if configured to, the whole frame) and
+queues it; a writer thread does the JPEG encoding and the writing, so the pipeline
+never waits on either. Each track gets at most one snapshot every `min-interval-seconds`.
+With a tracker (see `tracking.py`), a track is one animal, and detections that aren't
+tracked (yet) are not snapshotted. Without one, a track is a class on a camera.
+
+Snapshots are also shrunk (see `downscale()`) into a `ThumbnailCache`, an in-memory LRU
+cache with a byte cap, which is what the UI browses, so that looking through recent
+detections never touches the SD card.
+"""
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+import collections
+import os
+import queue
+import threading
+import time
+import numpy as np
+from ..common import appconfig
+from ..common import lazy
+from ..common import log
+from ..common import metrics
+from . import detections
+
+# Only needed by the writer thread, to encode the JPEGs
+QtCore = lazy.load_module("PyQt6.QtCore")
+QtGui = lazy.load_module("PyQt6.QtGui")
+
+def encode_jpeg(pixels: np.ndarray, quality: int) -> bytes:
+    """
+    Encode an (H, W, 3) array of RGB pixels as a JPEG of the given quality (0 to 100).
+    """
+    height, width, _ = pixels.shape
+    data = np.ascontiguousarray(pixels, dtype=np.uint8).tobytes()
+    image = QtGui.QImage(data, width, height, 3 * width, QtGui.QImage.Format.Format_RGB888)
+    encoded = QtCore.QByteArray()
+    buffer = QtCore.QBuffer(encoded)
+    buffer.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
+    if not image.save(buffer, "JPEG", quality):
+        raise ValueError(f"Could not encode a {width}x{height} JPEG")
+    return bytes(encoded)
+
+def downscale(pixels: np.ndarray, max_side: int) -> np.ndarray:
+    """
+    Shrink an (H, W, 3) array by a whole factor, averaging each block of pixels, so that
+    neither side is longer than `max_side`. Returns it as is if it is already small enough.
+    """
+    height, width, _ = pixels.shape
+    factor = -(-max(height, width) // max_side)
+    if factor <= 1:
+        return pixels
+
+    height, width = height // factor, width // factor
+    if height == 0 or width == 0:
+        # Too thin to average over whole blocks
+        return pixels[::factor, ::factor]
+    blocks = pixels[:height * factor, :width * factor].reshape(height, factor, width, factor, -1)
+    return blocks.mean(axis=(1, 3)).astype(np.uint8)
+
+class ThumbnailCache:
+    """
+    Least-recently-used cache of encoded thumbnails, keyed by snapshot ID, holding at
+    most `max_bytes` of them. Thread-safe.
+    """
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items: collections.OrderedDict[str, bytes] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_metric = metrics.counter("snapshot_cache_requests", "Thumbnail cache lookups", {"result": "hit"})
+        self.misses_metric = metrics.counter("snapshot_cache_requests", "Thumbnail cache lookups", {"result": "miss"})
+        self.evictions_metric = metrics.counter("snapshot_cache_evictions", "Thumbnails evicted from the cache to stay under its byte cap")
+        metrics.gauge("snapshot_cache_bytes", "Bytes of thumbnails in the cache", fn=lambda: self.nbytes)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Add (or replace) a thumbnail, evicting the least recently used ones to make room.
+        A thumbnail bigger than the whole cache is not kept.
+        """
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            if len(data) > self.max_bytes:
+                return
+
+            self._items[key] = data
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= len(evicted)
+                self.evictions_metric.inc()
+
+    def get(self, key: str) -> bytes|None:
+        """
+        The thumbnail, or None if it isn't (or is no longer) cached.
+        """
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses_metric.inc()
+                return None
+            self._items.move_to_end(key)
+        self.hits_metric.inc()
+        return data
+
+class Snapshotter:
+    """
+    The `Snapshotter` class should be used as a singleton (see `Snapshotter.shared()`), so that the
+    thumbnail cache outlives any one AI pipeline.
+
+    `encode(pixels, quality)` encodes an (H, W, 3) RGB array, and `clock` tells the time in seconds;
+    both can be swapped out for testing.
+    """
+    _shared = None
+
+    def __init__(self, config: Dict[str, Any], encode: Callable[[np.ndarray, int], bytes] = encode_jpeg, clock: Callable[[], float] = time.monotonic) -> None:
+        snapshots_config = appconfig.section(config, appconfig.SnapshotsConfig)
+        self.min_score = snapshots_config.min_score
+        self.interval_s = snapshots_config.min_interval_seconds
+        self.full_frames = snapshots_config.full_frames
+        self.padding = snapshots_config.padding
+        self.quality = snapshots_config.jpeg_quality
+        self.thumbnail_size = snapshots_config.thumbnail_size
+        self.encode = encode
+        self.clock = clock
+
+        self.dpath = snapshots_config.dpath
+        try:
+            os.makedirs(self.dpath, exist_ok=True)
+        except OSError:
+            log.warning("Configuration file's snapshots 'dpath' is not usable. Value given: %s", self.dpath)
+            self.dpath = snapshots_config.dpath_dev
+
+        self.cache = ThumbnailCache(snapshots_config.cache_bytes)
+        # Snapshots that have been written, most recent last
+        self._recent = collections.deque(maxlen=snapshots_config.recent_count)
+        # When each track was last snapshotted, least recently first. Tracks that were last
+        # snapshotted more than an interval ago are forgotten (see `offer()`).
+        self._last_s: collections.OrderedDict[Any, float] = collections.OrderedDict()
+        self._encode_failed = False
+
+        self.taken_metric = metrics.counter("snapshots_taken", "Detections snapshotted")
+        self.dropped_metric = metrics.counter("snapshots_dropped", "Frames whose snapshots were dropped because the writer had fallen behind")
+        self.written_metric = metrics.counter("snapshots_written", "Snapshot files written")
+        self.errors_metric = metrics.counter("snapshot_errors", "Snapshots that could not be encoded or written")
+
+        self._queue = queue.Queue(maxsize=snapshots_config.queue_size)
+        self._thread = threading.Thread(target=self._run, name="snapshots", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def shared(cls, config: Dict[str, Any]) -> "Snapshotter":
+        """
+        Return the snapshotter shared by every AI pipeline, creating it if needed.
+        """
+        if cls._shared is None:
+            cls._shared = Snapshotter(config)
+        return cls._shared
+
+    @classmethod
+    def shutdown_shared(cls):
+        """
+        Shut down the shared snapshotter, if there is one.
+        """
+        if cls._shared is not None:
+            cls._shared.shutdown()
+
+    def offer(self, records: np.ndarray, frame: np.ndarray, labels: Dict[int, str]|None = None, track_ids: np.ndarray|None = None) -> int:
+        """
+        Snapshot whichever of a frame's detection `records` call for it. `frame` is the frame's
+        (H, W, 3) RGB pixels, which only need to stay valid for the duration of the call.
+        `track_ids` is the track ID of each record, if they are being tracked.
+        Called from the streaming thread, so this only copies pixels. Returns the number of
+        detections snapshotted.
+        """
+        now_s = self.clock()
+        wall_ns = time.time_ns()
+        # Forget the tracks that are due another snapshot anyway (most of them are long gone)
+        while self._last_s and now_s - next(iter(self._last_s.values())) >= self.interval_s:
+            self._last_s.popitem(last=False)
+
+        height, width, _ = frame.shape
+        snapshots = []
+        tracks = []
+        for i, record in enumerate(records):
+            score = float(record['score'])
+            if score < self.min_score:
+                continue
+
+            if track_ids is None:
+                track = (int(record['camera']), int(record['class_id']))
+            elif track_ids[i]:
+                track = int(track_ids[i])
+            else:
+                continue
+            last_s = self._last_s.get(track)
+            if (last_s is not None and now_s - last_s < self.interval_s) or track in tracks:
+                continue
+
+            xmin, ymin, xmax, ymax = (float(v) for v in record['box'])
+            pad_x = (xmax - xmin) * self.padding
+            pad_y = (ymax - ymin) * self.padding
+            x0 = max(0, round((xmin - pad_x) * width))
+            y0 = max(0, round((ymin - pad_y) * height))
+            x1 = min(width, round((xmax + pad_x) * width))
+            y1 = min(height, round((ymax + pad_y) * height))
+            if x1 - x0 < 2 or y1 - y0 < 2:
+                continue
+
+            tracks.append(track)
+            class_id = int(record['class_id'])
+            info = {
+                "id": f"{wall_ns}-{i}",
+                "timestamp": int(record['timestamp']),
+                "camera": detections.CameraID(int(record['camera'])).name,
+                "class_id": class_id,
+                "label": (labels or {}).get(class_id, str(class_id)),
+                "score": round(score, 3),
+                "track": int(track_ids[i]) if track_ids is not None else None,
+                "box": [round(float(v), 4) for v in record['box']],
+            }
+            snapshots.append((info, frame[y0:y1, x0:x1].copy()))
+
+        if not snapshots:
+            return 0
+
+        full_frame = frame.copy() if self.full_frames else None
+        try:
+            self._queue.put_nowait((snapshots, full_frame))
+        except queue.Full:
+            # Nothing was taken, so the tracks can try again with the next frame
+            self.dropped_metric.inc()
+            return 0
+
+        for track in tracks:
+            self._last_s[track] = now_s
+            self._last_s.move_to_end(track)
+        self.taken_metric.inc(len(snapshots))
+        return len(snapshots)
+
+    def recent(self, n: int|None = None) -> List[Dict[str, Any]]:
+        """
+        Information about the (at most `n`) most recent snapshots, most recent first.
+        Their thumbnails are in `cache` (unless they have been evicted since).
+        """
+        snapshots = list(reversed(self._recent))
+        return snapshots if n is None else snapshots[:n]
+
+    def thumbnail(self, snapshot_id: str) -> bytes|None:
+        """
+        The JPEG thumbnail of a snapshot, if it is still cached. Never reads the disk.
+        """
+        return self.cache.get(snapshot_id)
+
+    def _write(self, fpath: str, data: bytes) -> Exception|None:
+        """
+        Write a file in one go, so that nothing ever sees half a JPEG.
+        """
+        try:
+            os.makedirs(os.path.dirname(fpath), exist_ok=True)
+            with open(fpath + ".tmp", 'wb') as f:
+                f.write(data)
+            os.replace(fpath + ".tmp", fpath)
+        except OSError as e:
+            return e
+        self.written_metric.inc()
+        return None
+
+    def _encode(self, pixels: np.ndarray) -> bytes|None:
+        try:
+            return self.encode(pixels, self.quality)
+        except (ImportError, ValueError) as e:
+            self.errors_metric.inc()
+            if not self._encode_failed:
+                log.error("Could not encode a snapshot: %s", e)
+                self._encode_failed = True
+            return None
+
+    def _run(self):
+        """
+        The writer thread.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            snapshots, full_frame = item
+            day = time.strftime("%Y-%m-%d")
+            frame_id = snapshots[0][0]["id"]
+
+            # One full frame for all of the frame's snapshots
+            full_fpath = None
+            if full_frame is not None:
+                full_jpeg = self._encode(full_frame)
+                if full_jpeg is not None:
+                    full_fpath = os.path.join(self.dpath, day, f"{frame_id}-full.jpg")
+                    err = self._write(full_fpath, full_jpeg)
+                    if err:
+                        log.warning("Could not write snapshot %s: %s", full_fpath, err)
+                        self.errors_metric.inc()
+                        full_fpath = None
+
+            for info, pixels in snapshots:
+                jpeg = self._encode(pixels)
+                if jpeg is None:
+                    continue
+
+                thumbnail = downscale(pixels, self.thumbnail_size)
+                thumbnail_jpeg = jpeg if thumbnail is pixels else self._encode(thumbnail)
+                if thumbnail_jpeg is not None:
+                    self.cache.put(info["id"], thumbnail_jpeg)
+                info["fpath"] = os.path.join(self.dpath, day, f"{info['id']}.jpg")
+                err = self._write(info["fpath"], jpeg)
+                if err:
+                    log.warning("Could not write snapshot %s: %s", info["fpath"], err)
+                    self.errors_metric.inc()
+                    info["fpath"] = None
+                info["full_fpath"] = full_fpath
+                self._recent.append(info)
+
+    def shutdown(self):
+        """
+        Write out whatever is still queued and stop the writer thread.
+        """
+        if Snapshotter._shared is self:
+            Snapshotter._shared = None
+
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,356 @@
+"""
+This module keeps sensor telemetry: a fixed-size ring buffer of recent raw samples
+per channel, and min/max/mean rollups over progressively coarser periods (tiers).
+
+Raw samples feed the finest tier (minutes); each tier's finished buckets feed the
+next (hours). Memory use is fixed no matter how long we run, and finished rollups
+are written to disk, in batches, as fixed-width records (see `ROLLUP_DTYPE`) in one
+file per tier per month. On close, the partially-filled buckets are written too, so a
+restart in the middle of a bucket leaves two records with the same start on disk;
+`read_rollups()` merges those back into one.
+"""
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+import glob
+import json
+import os
+import threading
+import numpy as np
+
+# One row per channel per bucket. 25 bytes per row.
+ROLLUP_DTYPE = np.dtype([
+    # Start of the bucket, seconds since the epoch
+    ("start", "<i8"),
+    # Index of the channel (see `TelemetryStore.channels`)
+    ("channel", "u1"),
+    # Number of raw samples in the bucket
+    ("count", "<u4"),
+    ("min", "<f4"),
+    ("max", "<f4"),
+    ("mean", "<f4"),
+])
+
+# Tier name -> bucket period in seconds, finest first
+TIERS = {"minute": 60, "hour": 3600}
+
+class RingBuffer:
+    """
+    The most recent `capacity` (time, value) samples of one channel.
+    """
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self._head = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def extend(self, times: np.ndarray, values: np.ndarray):
+        """
+        Add samples (oldest first), overwriting the oldest ones if we are full.
+        """
+        n = len(times)
+        if n >= self.capacity:
+            times, values = times[-self.capacity:], values[-self.capacity:]
+            n = self.capacity
+
+        first = min(n, self.capacity - self._head)
+        self.times[self._head:self._head + first] = times[:first]
+        self.values[self._head:self._head + first] = values[:first]
+        self.times[:n - first] = times[first:]
+        self.values[:n - first] = values[first:]
+        self._head = (self._head + n) % self.capacity
+        self._count = min(self.capacity, self._count + n)
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return copies of (times, values), oldest first.
+        """
+        start = (self._head - self._count) % self.capacity
+        order = (np.arange(self._count) + start) % self.capacity
+        return self.times[order], self.values[order]
+
+class RollupTier:
+    """
+    Aggregates (count, sum, min, max) per channel into buckets of `period_s` seconds,
+    and keeps the last `history` finished buckets in memory.
+    """
+    def __init__(self, period_s: int, nchannels: int, history: int) -> None:
+        self.period_s = period_s
+        self.history = np.zeros(history, dtype=ROLLUP_DTYPE)
+        self._history_head = 0
+        self._history_count = 0
+
+        # The bucket currently being filled, per channel
+        self._bucket = np.full(nchannels, -1, dtype=np.int64)
+        self._count = np.zeros(nchannels, dtype=np.int64)
+        self._sum = np.zeros(nchannels, dtype=np.float64)
+        self._min = np.zeros(nchannels, dtype=np.float32)
+        self._max = np.zeros(nchannels, dtype=np.float32)
+
+    def add(self, channel: int, times: np.ndarray, counts: np.ndarray, sums: np.ndarray, mins: np.ndarray, maxs: np.ndarray) -> np.ndarray:
+        """
+        Add partial aggregates (raw samples have count 1 and sum = min = max = value),
+        sorted by time. Returns the buckets that this finished.
+        """
+        if len(times) == 0:
+            return np.zeros(0, dtype=ROLLUP_DTYPE)
+
+        # Group consecutive inputs by bucket
+        buckets = np.floor_divide(times, self.period_s).astype(np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        group_buckets = buckets[starts]
+        group_counts = np.add.reduceat(counts, starts).astype(np.int64)
+        group_sums = np.add.reduceat(sums.astype(np.float64), starts)
+        group_mins = np.minimum.reduceat(mins, starts).astype(np.float32)
+        group_maxs = np.maximum.reduceat(maxs, starts).astype(np.float32)
+
+        # Merge into (or finish) the bucket we were already filling
+        finished = []
+        if self._bucket[channel] == group_buckets[0]:
+            group_counts[0] += self._count[channel]
+            group_sums[0] += self._sum[channel]
+            group_mins[0] = min(group_mins[0], self._min[channel])
+            group_maxs[0] = max(group_maxs[0], self._max[channel])
+        elif self._bucket[channel] >= 0:
+            finished.append(self._pending_record(channel))
+
+        # Everything but the last group is finished; the last one is the new current bucket
+        done = np.zeros(len(group_buckets) - 1, dtype=ROLLUP_DTYPE)
+        done['start'] = group_buckets[:-1] * self.period_s
+        done['channel'] = channel
+        done['count'] = group_counts[:-1]
+        done['min'] = group_mins[:-1]
+        done['max'] = group_maxs[:-1]
+        done['mean'] = group_sums[:-1] / group_counts[:-1]
+        finished.append(done)
+
+        self._bucket[channel] = group_buckets[-1]
+        self._count[channel] = group_counts[-1]
+        self._sum[channel] = group_sums[-1]
+        self._min[channel] = group_mins[-1]
+        self._max[channel] = group_maxs[-1]
+
+        records = np.concatenate(finished)
+        self._remember(records)
+        return records
+
+    def _pending_record(self, channel: int) -> np.ndarray:
+        record = np.zeros(1, dtype=ROLLUP_DTYPE)
+        record['start'] = self._bucket[channel] * self.period_s
+        record['channel'] = channel
+        record['count'] = self._count[channel]
+        record['min'] = self._min[channel]
+        record['max'] = self._max[channel]
+        record['mean'] = self._sum[channel] / self._count[channel]
+        return record
+
+    def drain(self) -> np.ndarray:
+        """
+        Finish every partially-filled bucket and return them.
+        """
+        channels = np.flatnonzero(self._bucket >= 0)
+        records = np.concatenate([self._pending_record(c) for c in channels]) if len(channels) else np.zeros(0, dtype=ROLLUP_DTYPE)
+        self._bucket[:] = -1
+        self._remember(records)
+        return records
+
+    def _remember(self, records: np.ndarray):
+        capacity = len(self.history)
+        for record in records[-capacity:]:
+            self.history[self._history_head] = record
+            self._history_head = (self._history_head + 1) % capacity
+        self._history_count = min(capacity, self._history_count + len(records))
+
+    def recent(self, channel: int|None = None) -> np.ndarray:
+        """
+        The finished buckets we still have in memory (oldest first), optionally for just one channel.
+        """
+        capacity = len(self.history)
+        start = (self._history_head - self._history_count) % capacity
+        records = self.history[(np.arange(self._history_count) + start) % capacity]
+        return records if channel is None else records[records['channel'] == channel]
+
+def _rollup_fpath(dpath: str, tier: str, month: np.datetime64) -> str:
+    return os.path.join(dpath, f"{tier}-{month}.roll")
+
+def merge_rollups(records: np.ndarray) -> np.ndarray:
+    """
+    Merge the records that are for the same channel and bucket start (e.g., the part of a
+    bucket written on close and the rest of it after a restart) into one, and return
+    the records sorted by start, then channel.
+    """
+    if len(records) == 0:
+        return records
+
+    order = np.lexsort((records['channel'], records['start']))
+    records = records[order]
+    same = (records['start'][1:] == records['start'][:-1]) & (records['channel'][1:] == records['channel'][:-1])
+    if not same.any():
+        return records
+
+    starts = np.concatenate(([0], np.flatnonzero(~same) + 1))
+    counts = records['count'].astype(np.int64)
+    merged = records[starts].copy()
+    merged['count'] = np.add.reduceat(counts, starts)
+    merged['min'] = np.minimum.reduceat(records['min'], starts)
+    merged['max'] = np.maximum.reduceat(records['max'], starts)
+    merged['mean'] = np.add.reduceat(records['mean'].astype(np.float64) * counts, starts) / np.maximum(merged['count'], 1)
+    return merged
+
+def read_rollups(dpath: str, tier: str, channel: int|None = None, start_s=None, end_s=None) -> np.ndarray:
+    """
+    Read the given tier's rollups from disk (see `merge_rollups()`), optionally filtered by
+    channel and by bucket start time ([start_s, end_s)).
+    """
+    chunks = []
+    for fpath in sorted(glob.glob(os.path.join(dpath, f"{tier}-*.roll"))):
+        records = np.fromfile(fpath, dtype=ROLLUP_DTYPE)
+        mask = np.ones(len(records), dtype=bool)
+        if channel is not None:
+            mask &= records['channel'] == channel
+        if start_s is not None:
+            mask &= records['start'] >= start_s
+        if end_s is not None:
+            mask &= records['start'] < end_s
+        chunks.append(records[mask])
+    return merge_rollups(np.concatenate(chunks)) if chunks else np.zeros(0, dtype=ROLLUP_DTYPE)
+
+class TelemetryStore:
+    """
+    Recent samples and rollups for a fixed set of named channels.
+
+    `channels.json` in `dpath` maps channel indexes to names, so that the rollup files can
+    be read back without the configuration. Finished rollups are written every `flush_rows`
+    rows, on `flush()` and on `close()` (which also writes the partially-filled buckets,
+    whose rest `read_rollups()` merges in if we pick up again in the same bucket).
+    """
+    CHANNELS_FILE_NAME = "channels.json"
+
+    def __init__(self, dpath: str, channels: Iterable[str], ring_samples=3600, history: Dict[str, int]|None = None, flush_rows=256) -> None:
+        self.dpath = dpath
+        self.flush_rows = flush_rows
+        self._lock = threading.Lock()
+        os.makedirs(dpath, exist_ok=True)
+
+        # Keep channel indexes stable across runs, even if the configured channels change
+        channels_fpath = os.path.join(dpath, self.CHANNELS_FILE_NAME)
+        self.channels: List[str] = []
+        if os.path.isfile(channels_fpath):
+            with open(channels_fpath, 'r') as f:
+                self.channels = json.load(f)
+        for name in channels:
+            if name not in self.channels:
+                self.channels.append(name)
+        if len(self.channels) > np.iinfo(ROLLUP_DTYPE['channel']).max + 1:
+            raise ValueError(f"Too many telemetry channels: {len(self.channels)}")
+        with open(channels_fpath + ".tmp", 'w') as f:
+            json.dump(self.channels, f)
+        os.replace(channels_fpath + ".tmp", channels_fpath)
+
+        history = history if history is not None else {}
+        self.rings = {name: RingBuffer(ring_samples) for name in self.channels}
+        self.tiers = {name: RollupTier(period_s, len(self.channels), history.get(name, 1440)) for name, period_s in TIERS.items()}
+        self._unflushed: Dict[str, List[np.ndarray]] = {name: [] for name in TIERS}
+        self._unflushed_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def channel_index(self, name: str) -> int:
+        return self.channels.index(name)
+
+    def extend(self, name: str, times: np.ndarray, values: np.ndarray):
+        """
+        Add samples (sorted by time, seconds since the epoch) for the given channel.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float32)
+        with self._lock:
+            self.rings[name].extend(times, values)
+            self._roll_up(self.channel_index(name), times, np.ones(len(times), dtype=np.int64), values, values, values)
+            if self._unflushed_rows >= self.flush_rows:
+                self._flush()
+
+    def record(self, time_s: float, values: Dict[str, float]):
+        """
+        Add one sample for each of the given channels, all taken at `time_s`.
+        """
+        for name, value in values.items():
+            self.extend(name, np.array([time_s]), np.array([value]))
+
+    def _roll_up(self, channel: int, times, counts, sums, mins, maxs):
+        """
+        Feed the finest tier, and each tier's finished buckets into the next.
+        """
+        for name, tier in self.tiers.items():
+            finished = tier.add(channel, times, counts, sums, mins, maxs)
+            if len(finished) == 0:
+                return
+            self._keep(name, finished)
+            times = finished['start'].astype(np.float64)
+            counts = finished['count'].astype(np.int64)
+            sums = finished['mean'].astype(np.float64) * counts
+            mins, maxs = finished['min'], finished['max']
+
+    def _keep(self, tier: str, records: np.ndarray):
+        self._unflushed[tier].append(records)
+        self._unflushed_rows += len(records)
+
+    def _flush(self):
+        for tier, batches in self._unflushed.items():
+            if not batches:
+                continue
+            records = np.concatenate(batches)
+            months = records['start'].astype('datetime64[s]').astype('datetime64[M]')
+            for month in np.unique(months):
+                with open(_rollup_fpath(self.dpath, tier, month), 'ab') as f:
+                    records[months == month].tofile(f)
+            batches.clear()
+        self._unflushed_rows = 0
+
+    def flush(self):
+        """
+        Write all the finished rollups to disk.
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """
+        Finish the partially-filled buckets and write everything to disk.
+        """
+        with self._lock:
+            # Drain finest first, so that each tier's last bucket makes it into the next tier
+            names = list(self.tiers)
+            for i, name in enumerate(names):
+                drained = self.tiers[name].drain()
+                self._keep(name, drained)
+                for next_name in names[i + 1:i + 2]:
+                    for channel in np.unique(drained['channel']):
+                        rows = drained[drained['channel'] == channel]
+                        counts = rows['count'].astype(np.int64)
+                        finished = self.tiers[next_name].add(int(channel), rows['start'].astype(np.float64), counts, rows['mean'].astype(np.float64) * counts, rows['min'], rows['max'])
+                        self._keep(next_name, finished)
+            self._flush()
+
+    def recent(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The raw samples we still have for the given channel, as (times, values).
+        """
+        with self._lock:
+            return self.rings[name].snapshot()
+
+    def rollups(self, tier: str, name: str|None = None) -> np.ndarray:
+        """
+        The given tier's finished buckets that are still in memory, optionally for one channel.
+        """
+        with self._lock:
+            return self.tiers[tier].recent(None if name is None else self.channel_index(name))
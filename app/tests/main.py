@@ -1,17 +1,53 @@
 import unittest
+from . import test_adaptive
 from . import test_ai
+from . import test_appconfig
 from . import test_cameras
+from . import test_daemon
+from . import test_decode
+from . import test_frames
+from . import test_gpio
 from . import test_leds
+from . import test_log
 from . import test_mcu
+from . import test_metrics
+from . import test_model
+from . import test_power
+from . import test_preproc
+from . import test_scheduler
 from . import test_screen
+from . import test_snapshots
+from . import test_startup
+from . import test_storage
+from . import test_telemetry
+from . import test_thermal
+from . import test_tracking
 
 def gather():
     suite = unittest.TestSuite()
+    suite.addTest(test_adaptive.gather())
     suite.addTest(test_ai.gather())
+    suite.addTest(test_appconfig.gather())
     suite.addTest(test_cameras.gather())
+    suite.addTest(test_daemon.gather())
+    suite.addTest(test_decode.gather())
+    suite.addTest(test_frames.gather())
+    suite.addTest(test_gpio.gather())
     suite.addTest(test_leds.gather())
+    suite.addTest(test_log.gather())
     suite.addTest(test_mcu.gather())
+    suite.addTest(test_metrics.gather())
+    suite.addTest(test_model.gather())
+    suite.addTest(test_power.gather())
+    suite.addTest(test_preproc.gather())
+    suite.addTest(test_scheduler.gather())
     suite.addTest(test_screen.gather())
+    suite.addTest(test_snapshots.gather())
+    suite.addTest(test_startup.gather())
+    suite.addTest(test_storage.gather())
+    suite.addTest(test_telemetry.gather())
+    suite.addTest(test_thermal.gather())
+    suite.addTest(test_tracking.gather())
     return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,85 @@
+import unittest
+from ..src.podapp.libraries.common import appconfig
+from ..src.podapp.libraries.gstreamer_utils import adaptive
+
+class TestAdaptive(unittest.TestCase):
+    """
+    Tests for the adaptive resolution/frame rate controller and the frame tracker that feeds it, with fake clocks.
+    """
+    def setUp(self) -> None:
+        self.now_s = 0.0
+        self.rungs = []
+        config = appconfig.AdaptiveConfig(enabled=True, target_latency_ms=100, max_drop_fraction=0.1, headroom=0.5,
+                                          window_seconds=1, hold_seconds=10, ladder=("1280x720@30", "640x360@30", "640x360@10"))
+        self.controller = adaptive.AdaptiveController(config, lambda rung, settings: self.rungs.append((rung, settings)), clock=lambda: self.now_s)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.controller.shutdown()
+        return super().tearDown()
+
+    def _settle(self):
+        # The window after each change is ignored
+        self.controller.update(0.0, 0.0)
+
+    def test_steps_down_when_behind(self):
+        """Test that we step down a rung for each window that is too slow or loses too many frames."""
+        self.assertEqual(self.controller.update(0.09, 0.0), 0)
+        self.assertEqual(self.controller.update(0.11, 0.0), 1)
+        self._settle()
+        self.assertEqual(self.controller.update(0.05, 0.2), 2)
+        self._settle()
+        # Nothing came out at all
+        self.assertEqual(self.controller.update(None, 1.0), 2)
+        self.assertEqual(self.rungs, [(1, (640, 360, 30.0)), (2, (640, 360, 10.0))])
+        self.assertEqual(self.controller.settings, (640, 360, 10.0))
+
+    def test_steps_up_with_headroom(self):
+        """Test that we only step up once the latency has been well under the target for the hold time."""
+        self.controller.update(0.2, 0.0)
+        self._settle()
+
+        # Under the target, but without enough headroom
+        self.assertEqual(self.controller.update(0.08, 0.0), 1)
+        self.now_s += 20
+        self.assertEqual(self.controller.update(0.08, 0.0), 1)
+
+        # Enough headroom, but not for long enough (losing it restarts the hold)
+        self.assertEqual(self.controller.update(0.04, 0.0), 1)
+        self.now_s += 5
+        self.controller.update(0.08, 0.0)
+        self.now_s += 6
+        self.assertEqual(self.controller.update(0.04, 0.0), 1)
+        self.now_s += 10
+        self.assertEqual(self.controller.update(0.04, 0.0), 0)
+        self.assertEqual(self.rungs, [(1, (640, 360, 30.0)), (0, (1280, 720, 30.0))])
+
+    def test_frame_tracker(self):
+        """Test that the tracker measures latency, ignores skipped frames, and counts frames that never come out as lost."""
+        now_s = [0.0]
+        tracker = adaptive.FrameTracker(timeout_s=1.0, max_in_flight=4, clock=lambda: now_s[0])
+        self.assertEqual(tracker.take_window(), (None, 0.0, 0))
+
+        for pts in range(10):
+            tracker.frame_in(pts)
+            now_s[0] += 0.01
+            if pts == 3:
+                tracker.skip(pts)
+            elif pts != 5:
+                tracker.frame_out(pts)
+        now_s[0] += 2.0
+        latency_s, drop_fraction, nframes = tracker.take_window()
+        self.assertAlmostEqual(latency_s, 0.01)
+        self.assertEqual(nframes, 9)
+        self.assertAlmostEqual(drop_fraction, 1 / 9)
+
+        # Too many in flight: the oldest is lost
+        for pts in range(5):
+            tracker.frame_in(pts)
+        tracker.frame_out(4)
+        latency_s, drop_fraction, nframes = tracker.take_window()
+        self.assertEqual((latency_s, drop_fraction, nframes), (0.0, 0.5, 2))
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestAdaptive)
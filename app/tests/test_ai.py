@@ -1,7 +1,10 @@
+import concurrent.futures
+import threading
 import time
 import unittest
 from . import testutils
 from ..src.podapp.libraries.coprocessors import ai
+from ..src.podapp.libraries.outputs import gpio
 from ..src.podapp.libraries.gstreamer_utils import utils as gst_utils
 
 @unittest.skipIf(testutils.in_wsl_mode(), "Running in WSL mode")
@@ -79,6 +82,98 @@ class TestAI(unittest.TestCase):
                 self._setup_pipeline(source, model_type, *sinks)
                 self._run_pipeline_and_reset_it()
 
+    def test_standby_and_wake(self):
+        """Test that we can preroll, wake, and go back into standby, and that the wake is timed"""
+        self._setup_pipeline(self.sources[0], ai.AIModelType.OBJECT_DETECTION_YOLO_V8, self.sinks[0])
+        self.assertIsNone(self.coproc.standby())
+        self.assertFalse(self.coproc.awake)
+
+        self.assertIsNone(self.coproc.wake(edge_ns=time.monotonic_ns()))
+        time.sleep(1.0)
+        latencies = self.coproc.wakes[-1].latencies_ms()
+        self.assertIsNotNone(latencies['playing'])
+        self.assertIsNotNone(latencies['first_buffer'])
+        self.assertLessEqual(latencies['wake'], latencies['playing'])
+
+        self.assertIsNone(self.coproc.standby())
+        self.assertFalse(self.coproc.awake)
+
+class TestWakeTimeline(unittest.TestCase):
+    """
+    Tests for the wake timeline bookkeeping.
+    """
+    def test_latencies(self):
+        """Test that latencies are measured from the edge if there is one, and from the wake otherwise"""
+        timeline = ai.WakeTimeline(edge_ns=1_000_000, wake_ns=3_000_000)
+        timeline.playing_ns = 10_000_000
+        self.assertEqual(timeline.latencies_ms(), {"wake": 2.0, "playing": 9.0, "first_buffer": None, "first_detection": None})
+
+        timeline = ai.WakeTimeline(edge_ns=None, wake_ns=3_000_000)
+        timeline.first_detection_ns = 53_000_000
+        self.assertEqual(timeline.latencies_ms()['wake'], 0.0)
+        self.assertEqual(timeline.latencies_ms()['first_detection'], 50.0)
+
+class TestModelIDs(unittest.TestCase):
+    """
+    Tests for the model IDs saved in the detection store.
+    """
+    def test_ids_are_stable(self):
+        """Test that the saved model IDs never change, so existing stores keep decoding to the right model"""
+        self.assertEqual({model_type.value: model_type.id for model_type in ai.AIModelType}, {
+            "OBJECT_DETECTION_YOLOV8": 0,
+            "INSTANCE_SEGMENTATION": 1,
+            "POSE_ESTIMATION": 2,
+            "OBJECT_DETECTION_YOLOV8_PYTHON": 3,
+        })
+
+class TestWakeOnEdge(unittest.TestCase):
+    """
+    Tests for waking the pipeline from a GPIO edge.
+    """
+    PIN = 26
+
+    def setUp(self):
+        self.config = testutils.load_config()
+        testutils.initialize_logger(self.config)
+        self.coproc = ai.AICoprocessor(self.config, store_detections=False)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="hardware")
+        return super().setUp()
+
+    def tearDown(self):
+        self.executor.shutdown()
+        return super().tearDown()
+
+    def test_wake_is_submitted(self):
+        """Test that an edge hands the wake to the given executor rather than running it on the GPIO thread"""
+        woken = []
+        submitted = threading.Semaphore(0)
+        def submit(fn, *args):
+            self.executor.submit(fn, *args).result()
+            submitted.release()
+
+        self.coproc.pipeline = object()
+        self.coproc.wake = lambda edge_ns: woken.append((edge_ns, threading.current_thread().name))
+        handle = self.coproc.wake_on_edge(self.PIN, edge=gpio.Edge.BOTH, submit=submit)
+        try:
+            gpio.simulate_edge(self.PIN, gpio.Level.HIGH, timestamp_ns=1)
+            self.assertTrue(submitted.acquire(timeout=5))
+
+            # No wake once the pipeline has been shut down
+            self.coproc.pipeline = None
+            gpio.simulate_edge(self.PIN, gpio.Level.LOW, timestamp_ns=2)
+            self.assertTrue(submitted.acquire(timeout=5))
+        finally:
+            gpio.remove_edge_callback(handle)
+
+        self.assertEqual(len(woken), 1)
+        self.assertEqual(woken[0][0], 1)
+        self.assertTrue(woken[0][1].startswith("hardware"))
+
 def gather() -> unittest.TestSuite:
     loader = unittest.TestLoader()
-    return loader.loadTestsFromTestCase(TestAI)
+    suite = unittest.TestSuite()
+    suite.addTest(loader.loadTestsFromTestCase(TestAI))
+    suite.addTest(loader.loadTestsFromTestCase(TestWakeTimeline))
+    suite.addTest(loader.loadTestsFromTestCase(TestModelIDs))
+    suite.addTest(loader.loadTestsFromTestCase(TestWakeOnEdge))
+    return suite
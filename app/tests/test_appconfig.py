@@ -0,0 +1,130 @@
+import dataclasses
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from ..src.podapp.libraries.common import appconfig
+
+class TestAppConfig(unittest.TestCase):
+    """
+    Tests for compiling, caching and reloading the configuration file.
+    """
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fpath = os.path.join(self.tmpdir.name, "appconfig.yaml")
+        shutil.copy(appconfig.DEFAULT_CONFIG_FILE_PATH, self.fpath)
+        self.cache_patch = mock.patch.object(appconfig, "CACHE_DPATH", os.path.join(self.tmpdir.name, "cache"))
+        self.cache_patch.start()
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.cache_patch.stop()
+        self.tmpdir.cleanup()
+        return super().tearDown()
+
+    def _replace(self, old: str, new: str):
+        with open(self.fpath) as f:
+            contents = f.read()
+        self.assertIn(old, contents)
+        with open(self.fpath, 'w') as f:
+            f.write(contents.replace(old, new, 1))
+        # Make sure the change is visible even on file systems with coarse timestamps
+        stat = os.stat(self.fpath)
+        os.utime(self.fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def test_default_config_compiles(self):
+        """Test that the shipped configuration file is valid, and that sections are typed and immutable."""
+        config = appconfig.compile_config(appconfig.load_config_file(self.fpath))
+        self.assertIsInstance(config.mcu.spi_speed_hz, int)
+        self.assertIsInstance(config.camera_pins.rear_camera.enabled, bool)
+        self.assertIsInstance(config.leds.strips, tuple)
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            config.mcu.spi_bus = 1
+
+    def test_bad_values(self):
+        """Test that bad values are reported along with where they are."""
+        raw = appconfig.load_config_file(self.fpath)
+        raw['moduleconfig']['leds']['brightness'] = "1.5"
+        with self.assertRaisesRegex(appconfig.ConfigError, r"moduleconfig\.leds\.brightness"):
+            appconfig.compile_config(raw)
+
+        raw = appconfig.load_config_file(self.fpath)
+        raw['pinconfig']['cameras']['rear-camera']['enabled'] = "maybe"
+        with self.assertRaisesRegex(appconfig.ConfigError, r"pinconfig\.cameras\.rear-camera\.enabled"):
+            appconfig.compile_config(raw)
+
+        raw = appconfig.load_config_file(self.fpath)
+        del raw['moduleconfig']['mcu']['spi-bus']
+        with self.assertRaisesRegex(appconfig.ConfigError, r"moduleconfig\.mcu\.spi-bus: missing"):
+            appconfig.section(raw, appconfig.MCUConfig)
+
+        raw = appconfig.load_config_file(self.fpath)
+        raw['moduleconfig']['thermal']['step-down-celsius'] = ["70", "74"]
+        with self.assertRaisesRegex(appconfig.ConfigError, r"moduleconfig\.thermal: there must be one"):
+            appconfig.compile_config(raw)
+
+        raw = appconfig.load_config_file(self.fpath)
+        raw['moduleconfig']['adaptive']['ladder'] = ["1280x720@30", "640x360"]
+        with self.assertRaisesRegex(appconfig.ConfigError, r"moduleconfig\.adaptive: bad ladder: 640x360 is not"):
+            appconfig.compile_config(raw)
+
+    def test_defaults(self):
+        """Test that optional keys fall back to their defaults."""
+        raw = appconfig.load_config_file(self.fpath)
+        del raw['moduleconfig']['cameras']
+        self.assertEqual(appconfig.section(raw, appconfig.CamerasConfig), appconfig.CamerasConfig())
+
+    def test_cache(self):
+        """Test that an unchanged file is not parsed again, and that a changed one is."""
+        first = appconfig.load_config_file(self.fpath)
+        with mock.patch.object(appconfig.yaml, "load", side_effect=AssertionError("parsed again")):
+            self.assertEqual(appconfig.load_config_file(self.fpath), first)
+
+        self._replace("brightness: 0.5", "brightness: 0.25")
+        self.assertEqual(appconfig.load_config_file(self.fpath)['moduleconfig']['leds']['brightness'], "0.25")
+
+    def test_touched_file_is_not_read_again(self):
+        """Test that a file that was touched but not changed is only read once more."""
+        first = appconfig.load_config_file(self.fpath)
+        stat = os.stat(self.fpath)
+        os.utime(self.fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        with mock.patch.object(appconfig.yaml, "load", side_effect=AssertionError("parsed again")):
+            self.assertEqual(appconfig.load_config_file(self.fpath), first)
+            with mock.patch.object(appconfig.hashlib, "sha256", side_effect=AssertionError("read again")):
+                self.assertEqual(appconfig.load_config_file(self.fpath), first)
+
+    def test_sections_of_the_compiled_config(self):
+        """Test that the compiled config's sections are handed out as they are, and raw ones are compiled."""
+        raw = appconfig.load_config_file(self.fpath)
+        config = appconfig.compile_config(raw)
+        with mock.patch.object(appconfig, "_build", side_effect=AssertionError("compiled again")):
+            self.assertIs(appconfig.section(config, appconfig.LEDsConfig), config.leds)
+            self.assertIs(appconfig.section(config, appconfig.CameraPinsConfig), config.camera_pins)
+
+        raw['moduleconfig']['leds']['brightness'] = "0.25"
+        self.assertEqual(appconfig.section(raw, appconfig.LEDsConfig).brightness, 0.25)
+
+    def test_watcher_notifies_changed_sections_only(self):
+        """Test that a reload only calls the subscribers of the sections that changed."""
+        watcher = appconfig.ConfigWatcher(self.fpath)
+        calls = []
+        watcher.subscribe("leds", lambda section: calls.append(("leds", section)))
+        watcher.subscribe("screen", lambda section: calls.append(("screen", section)))
+        self.assertEqual(watcher.check(), [])
+
+        self._replace("brightness: 0.5", "brightness: 0.25")
+        self.assertEqual(watcher.check(), ["leds"])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][0], "leds")
+        self.assertEqual(calls[0][1].brightness, 0.25)
+
+        # A bad file is ignored, and the last good configuration kept
+        self._replace("brightness: 0.25", "brightness: bright")
+        self.assertEqual(watcher.check(), [])
+        self.assertEqual(watcher.config.leds.brightness, 0.25)
+        self.assertEqual(len(calls), 1)
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestAppConfig)
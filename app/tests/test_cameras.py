@@ -1,9 +1,13 @@
 import os
 import time
 import unittest
+import unittest.mock
 from . import testutils
 from ..src.podapp.libraries.sensors import cameras
+from ..src.podapp.libraries.gstreamer_utils import sink as gst_sink
+from ..src.podapp.libraries.gstreamer_utils import source as gst_source
 from ..src.podapp.libraries.gstreamer_utils import utils as gst_utils
+from ..src.podapp.libraries.storage import detections
 
 @unittest.skipIf(testutils.in_wsl_mode(), "Cannot access cameras from WSL without a lot of hassle")
 class TestCameras(unittest.TestCase):
@@ -62,6 +66,123 @@ class TestCameras(unittest.TestCase):
                 err = cam.stop_streaming()
                 self.assertIsNone(err)
 
+class FakePipeline:
+    """
+    Stands in for a `GStreamerApp` so that we can push frames through the mux by hand.
+    """
+    def __init__(self) -> None:
+        self.probes = {}
+        self.probed_elements = {}
+        self.paused = False
+        self.calls = []
+
+    def pause(self):
+        self.paused = True
+        self.calls.append("pause")
+
+    def resume(self):
+        self.paused = False
+        self.calls.append("resume")
+
+    def add_buffer_probe(self, element_name, callback, pad_name="src"):
+        probe_id = len(self.probes)
+        self.probes[probe_id] = callback
+        self.probed_elements[probe_id] = (element_name, pad_name)
+        return probe_id
+
+    def remove_buffer_probe(self, element_name, probe_id, pad_name="src"):
+        del self.probes[probe_id]
+        del self.probed_elements[probe_id]
+
+    def push(self, pts: int) -> bool:
+        return all(probe(pts) for probe in self.probes.values())
+
+class TestCameraMux(unittest.TestCase):
+    """
+    Tests to make sure the camera mux switches and tags frames correctly.
+    """
+    def setUp(self) -> None:
+        self.config = testutils.load_config()
+        testutils.initialize_logger(self.config)
+        self.config['pinconfig']['cameras']['front-camera']['enabled'] = "True"
+        self.config['moduleconfig']['cameras']['mux-settle-frames'] = "1"
+        self.mux = cameras.CameraMux(self.config)
+        self.pipeline = FakePipeline()
+        self.mux.attach(self.pipeline, gst_source.GStreamerSource("cam0"))
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.mux.shutdown()
+        return super().tearDown()
+
+    def test_switch_pauses_and_drops_settle_frames(self):
+        """Test that a switch pauses the pipeline, drops the settle frames, and measures latency."""
+        self.mux.select(detections.CameraID.REAR)
+        self.assertFalse(self.pipeline.push(0))
+        self.assertTrue(self.pipeline.push(1))
+        self.assertEqual(self.mux.camera_for_pts(1), detections.CameraID.REAR)
+
+        # The mux pin must be flipped while the pipeline is paused
+        flip = self.mux._flip
+        def record_flip(camera):
+            self.pipeline.calls.append(("flip", camera, self.pipeline.paused))
+            flip(camera)
+
+        with unittest.mock.patch.object(self.mux, "_flip", side_effect=record_flip):
+            self.assertIsNone(self.mux.switch(detections.CameraID.FRONT, self.pipeline))
+        self.assertEqual(self.pipeline.calls, ["pause", ("flip", detections.CameraID.FRONT, True), "resume"])
+        self.assertFalse(self.pipeline.paused)
+        self.assertFalse(self.pipeline.push(2))
+        self.assertTrue(self.pipeline.push(3))
+        self.assertEqual(self.mux.camera_for_pts(3), detections.CameraID.FRONT)
+        self.assertEqual(len(self.mux.switch_latencies_s), 2)
+
+    def test_dual_stream_probe_is_on_the_model_stream(self):
+        """Test that with two camera streams, the mux watches the model's stream rather than the full-resolution one."""
+        gst_utils.configure(self.config)
+        source = gst_source.GStreamerSource("cam0", video_width=640, video_height=640)
+        self.assertIsNone(source.set_main_stream("NV12", 1920, 1080, gst_sink.GStreamerSink("null", name="main_sink")))
+        pipeline = FakePipeline()
+        self.mux.attach(pipeline, source)
+
+        # The probed element is the capsfilter on the camera's second (model) stream
+        (element_name, pad_name), = pipeline.probed_elements.values()
+        self.assertEqual((element_name, pad_name), (source.caps_name, "src"))
+        model_stream = source.element_pipeline.split(f"{source.name}.src_0 ! ", 1)[1]
+        self.assertTrue(model_stream.startswith(f"capsfilter name={element_name} "))
+
+        self.mux.detach(pipeline)
+        self.assertEqual(pipeline.probed_elements, {})
+
+    def test_release_is_per_handle(self):
+        """Test that releasing a handle twice doesn't tear the mux down under its other users."""
+        first = self.mux.acquire()
+        second = self.mux.acquire()
+        with unittest.mock.patch.object(self.mux, "shutdown") as shutdown:
+            self.mux.release(first)
+            self.mux.release(first)
+            self.assertEqual(self.mux.users, 1)
+            shutdown.assert_not_called()
+
+            self.mux.release(second)
+            self.mux.release(second)
+            self.assertEqual(self.mux.users, 0)
+            shutdown.assert_called_once()
+
+    def test_multiplexing_tags_frames(self):
+        """Test that multiplexing alternates cameras and tags each kept frame with its camera."""
+        self.assertIsNone(self.mux.start_multiplexing(3))
+        kept = [pts for pts in range(20) if self.pipeline.push(pts)]
+        tags = [self.mux.camera_for_pts(pts) for pts in kept]
+
+        # Every run of 3 kept frames is one camera, alternating, with one dropped frame between runs
+        F, R = detections.CameraID.FRONT, detections.CameraID.REAR
+        self.assertEqual(tags[:12], [F, F, F, R, R, R, F, F, F, R, R, R])
+        self.assertEqual(kept[:6], [1, 2, 3, 5, 6, 7])
+
 def gather() -> unittest.TestSuite:
     loader = unittest.TestLoader()
-    return loader.loadTestsFromTestCase(TestCameras)
+    suite = unittest.TestSuite()
+    suite.addTest(loader.loadTestsFromTestCase(TestCameras))
+    suite.addTest(loader.loadTestsFromTestCase(TestCameraMux))
+    return suite
@@ -0,0 +1,231 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from . import testutils
+from ..src.podapp.app import client
+from ..src.podapp.app import daemon
+from ..src.podapp.libraries.common import appconfig
+from ..src.podapp.libraries.storage import telemetry
+
+class TestDaemon(unittest.TestCase):
+    """
+    Tests for the daemon's control socket, using hardware that works off-device.
+    """
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_patch = mock.patch.object(appconfig, "CACHE_DPATH", os.path.join(self.tmpdir.name, "cache"))
+        self.cache_patch.start()
+        self.config_fpath = os.path.join(self.tmpdir.name, "appconfig.yaml")
+        shutil.copy(appconfig.DEFAULT_CONFIG_FILE_PATH, self.config_fpath)
+
+        self.config = testutils.load_config()
+        testutils.initialize_logger(self.config)
+        self.config['moduleconfig']['leds']['backend'] = "null"
+        self.config['moduleconfig']['daemon']['config-poll-seconds'] = "0"
+        self.config['moduleconfig']['metrics']['http-port'] = "0"
+        self.config['moduleconfig']['metrics']['snapshot-seconds'] = "0"
+        self.config['moduleconfig']['snapshots']['dpath'] = os.path.join(self.tmpdir.name, "snapshots")
+        self.config['moduleconfig']['telemetry']['dpath'] = os.path.join(self.tmpdir.name, "telemetry")
+        self.config['moduleconfig']['mcu']['backend'] = "emulated"
+        self.path = os.path.join(self.tmpdir.name, "podapp.sock")
+        self.daemon = None
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        if self.daemon is not None:
+            self.daemon.stop()
+            self.thread.join(timeout=5)
+        self.cache_patch.stop()
+        self.tmpdir.cleanup()
+        return super().tearDown()
+
+    def _start(self) -> client.Client:
+        self.daemon = daemon.Daemon(self.config, config_fpath=self.config_fpath, path=self.path)
+        self.errors = []
+        self.thread = threading.Thread(target=lambda: self.errors.append(self.daemon.run()))
+        self.thread.start()
+        self.assertTrue(self.daemon.ready.wait(5))
+        return client.Client(self.path, timeout_s=5)
+
+    def test_requests(self):
+        """Test good, unknown and malformed requests."""
+        with self._start() as c:
+            err, result = c.call("ping")
+            self.assertIsNone(err)
+            self.assertIn("uptime_s", result)
+
+            err, _ = c.call("no.such.command")
+            self.assertIsInstance(err, client.DaemonError)
+
+            # Bad arguments are an error, not a crash
+            err, _ = c.call("ping", bogus=1)
+            self.assertIsInstance(err, client.DaemonError)
+
+            c._sock.sendall(b"this is not json\n")
+            self.assertEqual(c._receive()["error"], "Malformed request")
+
+            err, _ = c.call("ping")
+            self.assertIsNone(err)
+
+    def test_hardware_outlives_the_client(self):
+        """Test that what a client starts keeps running after it disconnects."""
+        with self._start() as c:
+            err, _ = c.call("led.animate", effect="rainbow")
+            self.assertIsNone(err)
+
+        time.sleep(0.1)
+        with client.Client(self.path, timeout_s=5) as c:
+            err, status = c.call("daemon.status")
+            self.assertIsNone(err)
+            self.assertTrue(status["leds_running"])
+
+            err, stats = c.call("led.stop")
+            self.assertIsNone(err)
+            self.assertGreater(stats["frames_rendered"], 0)
+
+    def test_telemetry(self):
+        """Test that the daemon polls the sensors while it runs and writes out what it has when it stops."""
+        self.config['moduleconfig']['telemetry']['sample-period-seconds'] = "0.01"
+        with self._start() as c:
+            err, status = c.call("daemon.status")
+            self.assertIsNone(err)
+            self.assertTrue(status["telemetry_running"])
+            deadline_s = time.monotonic() + 5
+            while len(self.daemon.telemetry.store.recent("temperature_c")[0]) < 3 and time.monotonic() < deadline_s:
+                time.sleep(0.01)
+
+        store = self.daemon.telemetry.store
+        self.daemon.stop()
+        self.thread.join(timeout=5)
+        self.daemon = None
+        rollups = telemetry.read_rollups(store.dpath, "minute", channel=store.channel_index("temperature_c"))
+        self.assertGreaterEqual(int(rollups['count'].sum()), 3)
+
+    def test_metrics(self):
+        """Test that the daemon's metrics can be read over the socket."""
+        with self._start() as c:
+            err, text = c.call("metrics")
+            self.assertIsNone(err)
+            self.assertIn("podapp_daemon_connections 1\n", text)
+            self.assertTrue(text.endswith("# EOF\n"))
+
+    def test_snapshots(self):
+        """Test that snapshots are listed, and that thumbnails are only served from the cache."""
+        with self._start() as c:
+            err, recent = c.call("snapshots.recent", n=10)
+            self.assertIsNone(err)
+            self.assertEqual(recent, [])
+            err, _ = c.call("snapshots.thumbnail", id="nonexistent")
+            self.assertIsInstance(err, client.DaemonError)
+
+    def test_events(self):
+        """Test that events only go to subscribers of their topic."""
+        with self._start() as subscriber, client.Client(self.path, timeout_s=5) as other:
+            err, _ = subscriber.call("subscribe", topics=["nonsense"])
+            self.assertIsInstance(err, client.DaemonError)
+
+            events = subscriber.events(["wake"])
+            # The subscription is made when the generator starts
+            threading.Timer(0.1, self.daemon.publish, args=("detections", {"n": 0})).start()
+            threading.Timer(0.2, self.daemon.publish, args=("wake", {"n": 1})).start()
+            self.assertEqual(next(events), ("wake", {"n": 1}))
+
+            err, status = other.call("daemon.status")
+            self.assertEqual(status["subscribers"], {"wake": 1})
+
+    def test_config_changes_are_published(self):
+        """Test that subscribers hear about configuration changes."""
+        self.config['moduleconfig']['daemon']['config-poll-seconds'] = "0.05"
+        with self._start() as c:
+            events = c.events(["config"])
+            def change():
+                with open(self.config_fpath) as f:
+                    contents = f.read()
+                with open(self.config_fpath, 'w') as f:
+                    f.write(contents.replace("brightness: 0.5", "brightness: 0.25"))
+                stat = os.stat(self.config_fpath)
+                os.utime(self.config_fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+            threading.Timer(0.1, change).start()
+            self.assertEqual(next(events), ("config", {"section": "leds"}))
+
+    def test_power_scheduler(self):
+        """Test that the power scheduler duty-cycles the daemon's hardware, on the hardware thread."""
+        budget = self.config['moduleconfig']['power-budget']
+        budget['tick-seconds'] = "0.02"
+        budget['components']['flashlight']['on-demand-seconds'] = "0.2"
+        calls = []
+
+        class FakeFlashLight:
+            def __init__(self, config) -> None:
+                pass
+
+            def turn_on(self):
+                calls.append(("on", threading.current_thread().name))
+
+            def turn_off(self):
+                calls.append(("off", threading.current_thread().name))
+
+            def shutdown(self):
+                pass
+
+        with mock.patch.object(daemon.leds, "FlashLight", FakeFlashLight):
+            self._start().close()
+            self.assertEqual(sorted(self.daemon.scheduler.components), ["ai", "display", "flashlight"])
+            self.daemon.scheduler.notify("flashlight")
+            deadline_s = time.monotonic() + 5
+            while [on for on, _ in calls][-2:] != ["on", "off"] and time.monotonic() < deadline_s:
+                time.sleep(0.01)
+
+        # The first tick may turn the flashlight off before it is notified, since the scheduler doesn't know its state yet
+        self.assertIn([on for on, _ in calls], (["on", "off"], ["off", "on", "off"]))
+        self.assertTrue(all(thread.startswith("daemon-hardware") for _, thread in calls))
+
+    def test_display_state(self):
+        """Test that the display's state is reported as whether it is on."""
+        dsi_id = self.config['pinconfig']['screen']['dsi']['id']
+        state = {"enabled": True}
+
+        def wlr_randr(args):
+            if "--on" in args or "--off" in args:
+                state["enabled"] = "--on" in args
+            return 0, f"{dsi_id} \"Some Panel\"\n  Enabled: {'yes' if state['enabled'] else 'no'}\n"
+
+        display = daemon.screen.Display
+        with mock.patch.object(daemon.screen, "Display", lambda config: display(config, run_command=wlr_randr)):
+            with self._start() as c:
+                err, _ = c.call("display.on")
+                self.assertIsNone(err)
+                err, on = c.call("display.state")
+                self.assertIsNone(err)
+                self.assertIs(on, True)
+
+                err, _ = c.call("display.off")
+                self.assertIsNone(err)
+                err, on = c.call("display.state")
+                self.assertIsNone(err)
+                self.assertIs(on, False)
+
+    def test_socket_ownership(self):
+        """Test that a stale socket is replaced but a live daemon's is not."""
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self._start().close()
+
+        second = daemon.Daemon(self.config, path=self.path)
+        self.assertIsInstance(second.run(), RuntimeError)
+
+        self.daemon.stop()
+        self.thread.join(timeout=5)
+        self.daemon = None
+        self.assertEqual(self.errors, [None])
+        self.assertFalse(os.path.exists(self.path))
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestDaemon)
@@ -0,0 +1,65 @@
+import unittest
+import numpy as np
+from ..src.podapp.libraries.gstreamer_utils import decode
+
+class TestDecode(unittest.TestCase):
+    """
+    Tests for the vectorized post-process, mostly against the naive one on synthetic outputs.
+    """
+    def _compare(self, quantized: bool, batch: int):
+        input_size = (128, 96)
+        box_maps, score_maps, box_quant, score_quant = decode.synthetic_yolov8(batch, num_classes=5, input_size=input_size, quantized=quantized, objects=6)
+        if quantized:
+            self.assertTrue(all(m.dtype == np.uint8 for m in box_maps + score_maps))
+        boxes = [decode.dequantize(m, *box_quant) for m in box_maps]
+        scores = [decode.dequantize(m, *score_quant) for m in score_maps]
+
+        results = decode.postprocess_yolov8(boxes, scores, input_size, 0.3, 0.45)
+        naive_results = decode.postprocess_yolov8_naive(boxes, scores, input_size, 0.3, 0.45)
+        self.assertEqual(len(results), batch)
+        self.assertGreater(sum(len(r[1]) for r in results), 0)
+        for (b, s, c), (naive_b, naive_s, naive_c) in zip(results, naive_results):
+            np.testing.assert_allclose(b, naive_b, atol=1e-5)
+            np.testing.assert_allclose(s, naive_s)
+            np.testing.assert_array_equal(c, naive_c)
+            self.assertTrue(np.all((b >= 0) & (b <= 1)))
+
+    def test_matches_naive_quantized(self):
+        """Test that decoding UINT8 outputs across a batch agrees with the naive loops."""
+        self._compare(quantized=True, batch=3)
+
+    def test_matches_naive_float(self):
+        """Test that decoding FLOAT32 outputs agrees with the naive loops."""
+        self._compare(quantized=False, batch=1)
+
+    def test_dequantize(self):
+        """Test that quantized tensors are mapped to float32 and float tensors are left alone."""
+        q = np.array([0, 128, 255], dtype=np.uint8)
+        np.testing.assert_allclose(decode.dequantize(q, 0.5, 128), [-64.0, 0.0, 63.5])
+        self.assertEqual(decode.dequantize(q, 0.5, 128).dtype, np.float32)
+        f = np.array([0.25], dtype=np.float32)
+        self.assertIs(decode.dequantize(f, 0.5, 128), f)
+
+    def test_nms_groups(self):
+        """Test that suppression only happens within a class of a frame, and that max_detections is applied per frame."""
+        box = [0.1, 0.1, 0.5, 0.5]
+        boxes = np.array([[box, box, [0.11, 0.1, 0.5, 0.5]]] * 2, dtype=np.float32)
+        scores = np.zeros((2, 3, 2), dtype=np.float32)
+        # Frame 0: two overlapping boxes of class 0, and one of class 1
+        scores[0, 0, 0] = 0.9
+        scores[0, 2, 0] = 0.8
+        scores[0, 1, 1] = 0.7
+        # Frame 1: the same box as frame 0's best, which frame 0 must not suppress
+        scores[1, 0, 0] = 0.6
+
+        results = decode.batched_nms(boxes, scores, score_threshold=0.5, iou_threshold=0.5)
+        np.testing.assert_allclose(results[0][1], [0.9, 0.7])
+        np.testing.assert_array_equal(results[0][2], [0, 1])
+        np.testing.assert_allclose(results[1][1], [0.6])
+
+        results = decode.batched_nms(boxes, scores, score_threshold=0.5, iou_threshold=0.5, max_detections=1)
+        self.assertEqual([len(r[1]) for r in results], [1, 1])
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestDecode)
@@ -0,0 +1,42 @@
+import unittest
+import numpy as np
+from ..src.podapp.libraries.gstreamer_utils import frames
+
+class TestFrames(unittest.TestCase):
+    """
+    Tests for wrapping frame memory in NumPy arrays (without GStreamer).
+    """
+    def test_default_layout(self):
+        """Test that rows are padded to 4 bytes and planes follow each other."""
+        self.assertEqual(frames.default_layout("RGB", 641, 2), ([0], [1924]))
+        self.assertEqual(frames.default_layout("NV12", 6, 4), ([0, 32], [8, 8]))
+        self.assertEqual(frames.default_layout("I420", 6, 4), ([0, 32, 40], [8, 4, 4]))
+        with self.assertRaises(ValueError):
+            frames.default_layout("MJPG", 6, 4)
+
+    def test_views_share_memory(self):
+        """Test that the planes are views of the buffer, with its strides, rather than copies."""
+        width, height = 6, 4
+        offsets, strides = frames.default_layout("NV12", width, height)
+        data = bytearray(offsets[1] + strides[1] * height // 2)
+        y, uv = frames.plane_views(data, "NV12", width, height)
+        self.assertEqual((y.shape, uv.shape), ((4, 6), (2, 3, 2)))
+
+        data[strides[0] + 5] = 7
+        data[offsets[1] + strides[1] + 2 * 2 + 1] = 9
+        self.assertEqual(y[1, 5], 7)
+        self.assertEqual(uv[1, 2, 1], 9)
+        self.assertTrue(np.shares_memory(y, np.frombuffer(data, dtype=np.uint8)))
+
+    def test_strides_from_meta(self):
+        """Test that explicit (e.g., padded) strides and offsets are honored, and that a short buffer is refused."""
+        data = bytearray(3 * 16)
+        (rgb,) = frames.plane_views(data, "RGB", 4, 3, offsets=[0], strides=[16])
+        data[16 + 3 * 3 + 2] = 5
+        self.assertEqual(rgb[1, 3, 2], 5)
+        with self.assertRaises(ValueError):
+            frames.plane_views(bytearray(20), "RGB", 4, 3, offsets=[0], strides=[16])
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestFrames)
@@ -0,0 +1,91 @@
+import asyncio
+import queue
+import time
+import unittest
+from ..src.podapp.libraries.outputs import gpio
+
+@unittest.skipIf(gpio.GPIO_ENABLED, "Needs the simulated GPIO backend")
+class TestGPIO(unittest.TestCase):
+    """
+    Tests for batched writes and edge callbacks, against the simulated pins.
+    """
+    PIN = 17
+
+    def setUp(self) -> None:
+        gpio.configure_pin(self.PIN, gpio.Direction.IN)
+        gpio.pin_dict[self.PIN].level = gpio.Level.LOW
+        self.events = queue.Queue()
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        gpio.shutdown()
+        return super().tearDown()
+
+    def _collect(self, n: int) -> list:
+        return [self.events.get(timeout=1.0) for _ in range(n)]
+
+    def test_output_many(self):
+        """Test that a batched write sets every pin."""
+        gpio.output_many({5: gpio.Level.HIGH, 6: gpio.Level.LOW, 13: gpio.Level.HIGH})
+        self.assertEqual([gpio.input_level(p) for p in (5, 6, 13)], [gpio.Level.HIGH, gpio.Level.LOW, gpio.Level.HIGH])
+
+    def test_edges(self):
+        """Test that callbacks only get the edges they asked for."""
+        rising = queue.Queue()
+        gpio.add_edge_callback(self.PIN, gpio.Edge.RISING, rising.put)
+        gpio.add_edge_callback(self.PIN, gpio.Edge.BOTH, self.events.put)
+        for level in (gpio.Level.HIGH, gpio.Level.LOW, gpio.Level.HIGH, gpio.Level.HIGH):
+            gpio.simulate_edge(self.PIN, level)
+
+        # Setting the same level twice is not an edge
+        self.assertEqual([e.level for e in self._collect(3)], [gpio.Level.HIGH, gpio.Level.LOW, gpio.Level.HIGH])
+        self.assertEqual([rising.get(timeout=1.0).level for _ in range(2)], [gpio.Level.HIGH, gpio.Level.HIGH])
+        self.assertTrue(self.events.empty())
+
+    def test_debounce(self):
+        """Test that edges too close to an accepted one are ignored, going by the edges' timestamps."""
+        gpio.add_edge_callback(self.PIN, gpio.Edge.BOTH, self.events.put, debounce_ms=5)
+        t0 = time.monotonic_ns()
+        for offset_ms, level in ((0, gpio.Level.HIGH), (1, gpio.Level.LOW), (2, gpio.Level.HIGH), (20, gpio.Level.LOW)):
+            gpio.simulate_edge(self.PIN, level, timestamp_ns=t0 + offset_ms * 1_000_000)
+
+        events = self._collect(2)
+        self.assertEqual([e.timestamp_ns - t0 for e in events], [0, 20_000_000])
+        time.sleep(0.05)
+        self.assertTrue(self.events.empty())
+
+    def test_remove(self):
+        """Test that removed callbacks are not called."""
+        watch = gpio.add_edge_callback(self.PIN, gpio.Edge.BOTH, self.events.put)
+        gpio.simulate_edge(self.PIN, gpio.Level.HIGH)
+        self._collect(1)
+        gpio.remove_edge_callback(watch)
+        gpio.simulate_edge(self.PIN, gpio.Level.LOW)
+        time.sleep(0.05)
+        self.assertTrue(self.events.empty())
+
+    def test_asyncio(self):
+        """Test delivering edges to an asyncio event loop."""
+        async def main():
+            loop = asyncio.get_running_loop()
+            got = asyncio.Queue()
+            gpio.add_edge_callback(self.PIN, gpio.Edge.RISING, got.put_nowait, loop=loop)
+            gpio.simulate_edge(self.PIN, gpio.Level.HIGH)
+            return await asyncio.wait_for(got.get(), timeout=1.0)
+
+        event = asyncio.run(main())
+        self.assertEqual((event.pin, event.level), (self.PIN, gpio.Level.HIGH))
+
+    def test_latency(self):
+        """Test that edges reach their handlers quickly."""
+        latencies_ns = queue.Queue()
+        gpio.add_edge_callback(self.PIN, gpio.Edge.BOTH, lambda e: latencies_ns.put(time.monotonic_ns() - e.timestamp_ns))
+        for i in range(100):
+            gpio.simulate_edge(self.PIN, gpio.Level.HIGH if i % 2 == 0 else gpio.Level.LOW)
+            latencies_ns.get(timeout=1.0)
+        gpio.simulate_edge(self.PIN, gpio.Level.HIGH if gpio.input_level(self.PIN) == gpio.Level.LOW else gpio.Level.LOW)
+        self.assertLess(latencies_ns.get(timeout=1.0), 50_000_000)
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestGPIO)
@@ -1,6 +1,9 @@
+import concurrent.futures
 import time
 import unittest
+import numpy as np
 from . import testutils
+from ..src.podapp.libraries.coprocessors import mcu
 from ..src.podapp.libraries.outputs import leds
 
 class TestLEDs(unittest.TestCase):
@@ -32,6 +35,127 @@ class TestLEDs(unittest.TestCase):
         self.flashlight.turn_off()
         self.assertTrue(self.flashlight.off)
 
+class StalledLink(leds.NullLink):
+    """
+    A link that never finishes anything until told to.
+    """
+    def __init__(self) -> None:
+        self.futures = []
+
+    def request(self, command, payload=b""):
+        future = concurrent.futures.Future()
+        self.futures.append(future)
+        return future
+
+    def finish(self):
+        for future in self.futures:
+            future.set_result(b"")
+        self.futures.clear()
+
+class TestLEDStrips(unittest.TestCase):
+    """
+    Tests for the LED animation engine, against the emulated MCU.
+    """
+    def setUp(self) -> None:
+        self.config = testutils.load_config()
+        testutils.initialize_logger(self.config)
+        self.config['moduleconfig']['mcu']['batch-window-seconds'] = "0"
+        self.config['moduleconfig']['leds']['strips'] = ["10", "100"]
+        self.config['moduleconfig']['leds']['brightness'] = "1.0"
+        self.config['moduleconfig']['leds']['gamma'] = "1.0"
+        self.emulator = mcu.EmulatedMCU()
+        self.link = mcu.MCU(self.config, backend=self.emulator)
+        self.strips = leds.LEDStrips(self.config, link=self.link)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.strips.shutdown()
+        self.link.shutdown()
+        return super().tearDown()
+
+    def _shown(self, strip: int) -> np.ndarray:
+        return np.frombuffer(self.emulator.led_shown[strip], dtype=np.uint8).reshape(-1, 3)
+
+    def test_frames_reach_the_mcu(self):
+        """Test that a rendered frame ends up on the (emulated) strips, across several requests."""
+        self.strips.play(leds.rainbow())
+        self.strips.render(0.3)
+        self.assertTrue(self.strips.send())
+        self.strips.flush()
+        np.testing.assert_array_equal(self._shown(0), self.strips.frame[:10])
+        np.testing.assert_array_equal(self._shown(1), self.strips.frame[10:])
+
+    def test_only_changes_are_sent(self):
+        """Test that only the changed pixels of an unchanged strip are sent."""
+        self.strips.play(leds.solid((0.0, 0.0, 1.0)))
+        self.strips.render(0.0)
+        self.strips.send()
+        self.strips.flush()
+        full_bytes = self.strips.bytes_sent
+
+        # Nothing changed: nothing to send
+        self.strips.render(1.0)
+        self.strips.send()
+        self.assertEqual(self.strips.bytes_sent, full_bytes)
+
+        # One pixel on the long strip changed: one small range and a latch
+        self.strips.frame[50] = (255, 0, 0)
+        self.strips.send()
+        self.strips.flush()
+        self.assertEqual(self.strips.bytes_sent - full_bytes, (mcu.FRAME_OVERHEAD + 3 + 3) + (mcu.FRAME_OVERHEAD + 1))
+        np.testing.assert_array_equal(self._shown(1)[40], (255, 0, 0))
+
+    def test_frames_are_dropped_when_busy(self):
+        """Test that frames are dropped, not queued, while the link is busy."""
+        link = StalledLink()
+        strips = leds.LEDStrips(self.config, link=link)
+        strips.play(leds.chase())
+        strips.render(0.0)
+        self.assertTrue(strips.send())
+        requests = len(link.futures)
+        for i in range(5):
+            strips.render(i / 10)
+            self.assertFalse(strips.send())
+        self.assertEqual(len(link.futures), requests)
+        self.assertEqual(strips.frames_dropped, 5)
+
+        link.finish()
+        strips.render(0.5)
+        self.assertTrue(strips.send())
+
+    def test_shutdown_turns_the_strips_off(self):
+        """Test that shutting down sends the off frame even if the link is still busy with the last frame."""
+        link = StalledLink()
+        strips = leds.LEDStrips(self.config, link=link)
+        strips.play(leds.solid((1.0, 1.0, 1.0)))
+        strips.render(0.0)
+        self.assertTrue(strips.send())
+        requests = len(link.futures)
+
+        strips.flush = lambda timeout_s=None: None
+        strips.shutdown()
+        self.assertEqual(len(link.futures), 2 * requests)
+        self.assertFalse(strips.frame.any())
+        self.assertEqual(strips.frames_dropped, 0)
+
+    def test_effects(self):
+        """Test that every effect renders a color for every pixel."""
+        for name, effect in leds.EFFECTS.items():
+            rgb = effect()(1.25, self.strips.positions)
+            self.assertEqual(rgb.shape, (110, 3), name)
+            self.assertTrue(np.all((rgb >= 0) & (rgb <= 1)), name)
+
+    def test_benchmark(self):
+        """Test the off-device benchmark."""
+        strips = leds.LEDStrips(self.config, link=leds.NullLink())
+        results = leds.benchmark(strips, leds.rainbow(), nframes=100)
+        self.assertEqual(results['frames_rendered'], 100)
+        self.assertEqual(results['frames_dropped'], 0)
+        self.assertGreater(results['bytes_per_frame'], 0)
+
 def gather() -> unittest.TestSuite:
     loader = unittest.TestLoader()
-    return loader.loadTestsFromTestCase(TestLEDs)
+    suite = unittest.TestSuite()
+    suite.addTest(loader.loadTestsFromTestCase(TestLEDs))
+    suite.addTest(loader.loadTestsFromTestCase(TestLEDStrips))
+    return suite
@@ -0,0 +1,137 @@
+import glob
+import gzip
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+from . import testutils
+from ..src.podapp.libraries.common import log
+
+class _Formatted:
+    """
+    An argument that records which threads formatted it.
+    """
+    def __init__(self) -> None:
+        self.threads = []
+
+    def __str__(self) -> str:
+        self.threads.append(threading.current_thread().name)
+        return "formatted"
+
+class _SlowHandler(logging.Handler):
+    def emit(self, record):
+        time.sleep(0.05)
+
+class TestLog(unittest.TestCase):
+    """
+    Tests for the logging pipeline.
+    """
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fpath = os.path.join(self.tmpdir.name, "creaturepod.log")
+        self.config = testutils.load_config()
+        self.logging_config = self.config['moduleconfig']['logging']
+        self.logging_config['log-file-path'] = self.fpath
+        self.logging_config['log-to-console'] = "False"
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        log.shutdown()
+        self.tmpdir.cleanup()
+        return super().tearDown()
+
+    def _contents(self) -> str:
+        with open(self.fpath) as f:
+            return f.read()
+
+    def test_lazy_formatting(self):
+        """Test that messages are only formatted if logged, and then by the writer thread."""
+        self.logging_config['log-level'] = "INFO"
+        log.init(self.config)
+        arg = _Formatted()
+        log.debug("Not logged: %s", arg)
+        log.info("Logged: %s", arg)
+        log.shutdown()
+
+        self.assertEqual(arg.threads, ["log-writer"])
+        contents = self._contents()
+        self.assertIn("Logged: formatted", contents)
+        self.assertNotIn("Not logged", contents)
+
+    def test_rate_limit(self):
+        """Test that each call site is rate limited on its own, and suppressed messages are counted."""
+        self.logging_config['rate-limit-messages'] = "3"
+        self.logging_config['rate-limit-seconds'] = "0.2"
+        log.init(self.config)
+        def noisy(i):
+            log.debug("Noisy %d", i)
+        for i in range(10):
+            noisy(i)
+            if i < 3:
+                log.debug("Other %d", i)
+        time.sleep(0.25)
+        noisy(10)
+        self.assertEqual(log.stats()["suppressed"], 7)
+        log.shutdown()
+
+        lines = self._contents().splitlines()
+        self.assertEqual(len([line for line in lines if "Noisy" in line]), 4)
+        self.assertEqual(len([line for line in lines if "Other" in line]), 3)
+        self.assertIn("Noisy 10 [7 similar messages suppressed]", lines[-1])
+
+    def test_full_queue_drops(self):
+        """Test that a writer that falls behind makes records get dropped instead of blocking."""
+        logger = logging.getLogger(f"{log.LOGGER_NAME}.test.drops")
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        pipeline = log._Pipeline(logger, [_SlowHandler()], queue_size=2)
+        start_s = time.perf_counter()
+        for i in range(20):
+            logger.debug("Message %d", i)
+        self.assertLess(time.perf_counter() - start_s, 0.5)
+        pipeline.stop()
+        self.assertGreater(pipeline.queue_handler.dropped, 0)
+
+    def test_rotation(self):
+        """Test that the log file is rotated on size and the old ones are gzipped."""
+        handler = log.RotatingFileHandler(self.fpath, max_bytes=1000, backup_count=2)
+        logger = logging.getLogger(f"{log.LOGGER_NAME}.test.rotation")
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        for i in range(100):
+            logger.debug("Line %d %s", i, "x" * 50)
+        logger.removeHandler(handler)
+        handler.close()
+
+        self.assertEqual(sorted(os.path.basename(f) for f in glob.glob(self.fpath + "*")),
+                         ["creaturepod.log", "creaturepod.log.1.gz", "creaturepod.log.2.gz"])
+        with gzip.open(self.fpath + ".1.gz", 'rt') as f:
+            self.assertIn("x" * 50, f.read())
+        self.assertIn("Line 99", self._contents())
+
+    def test_rotation_on_age(self):
+        """Test that the log file is rotated once it is old enough."""
+        handler = log.RotatingFileHandler(self.fpath, rotate_s=0.1, backup_count=1)
+        handler.emit(logging.makeLogRecord({"msg": "old"}))
+        time.sleep(0.15)
+        handler.emit(logging.makeLogRecord({"msg": "new"}))
+        handler.close()
+
+        self.assertEqual(self._contents(), "new\n")
+        with gzip.open(self.fpath + ".1.gz", 'rt') as f:
+            self.assertEqual(f.read(), "old\n")
+
+    def test_benchmark(self):
+        """Test that the benchmark runs and reports both ways of writing."""
+        results = log.benchmark(self.fpath, ncalls=200)
+        for name in ("sync", "queued"):
+            self.assertGreater(results[f"{name}_calls_per_s"], 0)
+            self.assertGreaterEqual(results[f"{name}_stall_us_max"], results[f"{name}_stall_us_p50"])
+        self.assertEqual(results["queued_dropped"], 0)
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestLog)
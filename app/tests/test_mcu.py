@@ -1,3 +1,5 @@
+import asyncio
+import struct
 import unittest
 from . import testutils
 from ..src.podapp.libraries.coprocessors import mcu
@@ -10,6 +12,173 @@ class TestMCU(unittest.TestCase):
     # Nothing to do yet
     pass
 
+class CorruptingMCU(mcu.EmulatedMCU):
+    """
+    An emulated MCU whose responses get a bit flipped on the wire every so often.
+    """
+    def __init__(self, every: int) -> None:
+        super().__init__()
+        self.every = every
+
+    def transfer(self, tx, rx):
+        super().transfer(tx, rx)
+        if self.transactions % self.every == 0 and rx[0] == mcu.SOF:
+            rx[mcu.HEADER_SIZE] ^= 0x01
+
+class FailingMCU(mcu.EmulatedMCU):
+    """
+    An emulated MCU whose SPI device goes away after a number of transactions.
+    """
+    def __init__(self, after: int) -> None:
+        super().__init__()
+        self.after = after
+
+    def transfer(self, tx, rx):
+        if self.transactions >= self.after:
+            raise OSError(5, "Input/output error")
+        super().transfer(tx, rx)
+
+class TestMCUProtocol(unittest.TestCase):
+    """
+    Tests for the framed SPI protocol, against the emulated MCU.
+    """
+    def setUp(self) -> None:
+        self.config = testutils.load_config()
+        testutils.initialize_logger(self.config)
+        self.config['moduleconfig']['mcu']['batch-window-seconds'] = "0"
+        self.emulator = mcu.EmulatedMCU()
+        self.mcu = mcu.MCU(self.config, backend=self.emulator)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.mcu.shutdown()
+        return super().tearDown()
+
+    def test_frame_round_trip(self):
+        """Test that frames survive packing and unpacking, padding and all."""
+        buffer = bytearray(64)
+        end = mcu.pack_frame(buffer, 0, 7, mcu.Command.PING, b"hello")
+        end = mcu.pack_frame(buffer, end, 8, mcu.Command.FLASHLIGHT, b"\x01")
+        frames, corrupt, partial = mcu.unpack_frames(buffer)
+        self.assertEqual(corrupt, 0)
+        self.assertEqual(partial, len(buffer))
+        self.assertEqual(frames, [(7, mcu.Command.PING, b"hello"), (8, mcu.Command.FLASHLIGHT, b"\x01")])
+
+        # A frame cut off at the end is left for the next buffer, not counted as corrupt
+        frames, corrupt, partial = mcu.unpack_frames(buffer[:end - 2])
+        self.assertEqual((len(frames), corrupt, partial), (1, 0, 11))
+
+        # Flip a payload bit: that frame is dropped, the other one still parses
+        buffer[mcu.HEADER_SIZE] ^= 0x80
+        frames, corrupt, _ = mcu.unpack_frames(buffer)
+        self.assertEqual(corrupt, 1)
+        self.assertEqual(frames, [(8, mcu.Command.FLASHLIGHT, b"\x01")])
+
+    def test_ping(self):
+        """Test a simple request and response."""
+        err, payload = self.mcu.call(mcu.Command.PING, b"abc")
+        self.assertIsNone(err)
+        self.assertEqual(payload, b"abc")
+
+    def test_commands_change_state(self):
+        """Test that the emulated MCU does what it is told."""
+        err, _ = self.mcu.call(mcu.Command.FLASHLIGHT, b"\x01")
+        self.assertIsNone(err)
+        self.assertTrue(self.emulator.flashlight_on)
+
+        pixels = bytes(range(12))
+        self.assertIsNone(self.mcu.call(mcu.Command.LED_PIXELS, b"\x00" + struct.pack("<H", 2) + pixels)[0])
+        self.assertIsNone(self.mcu.call(mcu.Command.LED_SHOW, b"\x00")[0])
+        self.assertEqual(self.emulator.led_shown[0], bytes(6) + pixels)
+
+    def test_read_sensor(self):
+        """Test that sensor values come back as floats."""
+        values = self.mcu.read_sensor(mcu.Sensor.TEMPERATURE_HUMIDITY).result()
+        self.assertEqual(values, (21.5, 40.0))
+
+    def test_errors(self):
+        """Test that the MCU's errors are surfaced."""
+        err, payload = self.mcu.call(0x42)
+        self.assertIsInstance(err, mcu.MCUError)
+        self.assertIsNone(payload)
+
+        with self.assertRaises(ValueError):
+            self.mcu.request(mcu.Command.PING, bytes(mcu.MAX_PAYLOAD + 1))
+
+    def test_requests_are_batched(self):
+        """Test that many outstanding requests share SPI transactions."""
+        futures = [self.mcu.request(mcu.Command.PING, i.to_bytes(4, 'little')) for i in range(200)]
+        for i, future in enumerate(futures):
+            self.assertEqual(future.result(timeout=5), i.to_bytes(4, 'little'))
+
+        # 10-byte frames in 256-byte transfers: at least 25 requests per transaction, plus a
+        # trailing transaction to collect the last responses. Allow some slack for thread timing.
+        self.assertLess(self.mcu.transactions, 100)
+
+    def test_responses_split_across_transactions(self):
+        """Test that responses that are cut off at the end of a transaction are put back together from the next one."""
+        self.mcu.shutdown()
+        self.config['moduleconfig']['mcu']['transfer-size'] = "16"
+        self.mcu = mcu.MCU(self.config, backend=mcu.EmulatedMCU())
+
+        # The IMU's response is a 30-byte frame, which takes two 16-byte transactions
+        futures = [self.mcu.read_sensor(mcu.Sensor.IMU) for _ in range(40)]
+        expected = struct.unpack("<6f", struct.pack("<6f", 0.0, 0.0, 9.81, 0.0, 0.0, 0.0))
+        for future in futures:
+            self.assertEqual(future.result(timeout=5), expected)
+        self.assertEqual(self.mcu.crc_errors, 0)
+
+    def test_async(self):
+        """Test the asyncio API."""
+        async def main():
+            return await asyncio.gather(*(self.mcu.arequest(mcu.Command.PING, bytes([i])) for i in range(10)))
+
+        self.assertEqual(asyncio.run(main()), [bytes([i]) for i in range(10)])
+
+    def test_corrupt_responses_time_out(self):
+        """Test that a response corrupted on the wire fails its request instead of hanging."""
+        self.mcu.shutdown()
+        self.config['moduleconfig']['mcu']['request-timeout-seconds'] = "0.05"
+        self.mcu = mcu.MCU(self.config, backend=CorruptingMCU(every=2))
+
+        results = []
+        for i in range(10):
+            try:
+                results.append(self.mcu.request(mcu.Command.PING, bytes([i])).result(timeout=5))
+            except TimeoutError:
+                results.append(None)
+
+        self.assertGreater(self.mcu.crc_errors, 0)
+        self.assertIn(None, results)
+        for i, result in enumerate(results):
+            self.assertIn(result, (None, bytes([i])))
+
+    def test_link_failure(self):
+        """Test that a failed transfer fails the requests that were waiting, and any after it, rather than hanging them."""
+        self.mcu.shutdown()
+        self.mcu = mcu.MCU(self.config, backend=FailingMCU(after=2))
+        self.assertEqual(self.mcu.call(mcu.Command.PING, b"ok"), (None, b"ok"))
+
+        futures = [self.mcu.request(mcu.Command.PING) for _ in range(50)]
+        for future in futures:
+            self.assertIsInstance(future.exception(timeout=5), mcu.MCUError)
+        self.assertIsInstance(self.mcu.link_error, OSError)
+        self.assertFalse(self.mcu._thread.is_alive())
+
+        err, _ = self.mcu.call(mcu.Command.PING)
+        self.assertIsInstance(err, mcu.MCUError)
+
+    def test_benchmark(self):
+        """Test that the benchmark runs and reports sensible numbers."""
+        results = mcu.benchmark(self.mcu, nrequests=500, in_flight=16)
+        self.assertEqual(results['requests'], 500)
+        self.assertGreater(results['requests_per_transaction'], 1)
+        self.assertGreater(results['requests_per_s'], 0)
+        self.assertLessEqual(results['latency_p50_ms'], results['latency_p99_ms'])
+
 def gather() -> unittest.TestSuite:
     loader = unittest.TestLoader()
-    return loader.loadTestsFromTestCase(TestMCU)
+    suite = unittest.TestSuite()
+    suite.addTest(loader.loadTestsFromTestCase(TestMCU))
+    suite.addTest(loader.loadTestsFromTestCase(TestMCUProtocol))
+    return suite
@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+import unittest
+import urllib.request
+from ..src.podapp.libraries.common import metrics
+from ..src.podapp.libraries.sensors import system
+
+class TestMetrics(unittest.TestCase):
+    """
+    Tests for the metrics registry and its exporters.
+    """
+    def setUp(self) -> None:
+        self.registry = metrics.Registry(prefix="test_")
+        return super().setUp()
+
+    def test_render(self):
+        """Test the OpenMetrics text for each kind of metric."""
+        self.registry.counter("frames", "Frames seen", {"camera": "FRONT"}).inc(3)
+        self.registry.gauge("level", "A \"level\"", {"queue": 'q"1'}).set(2.5)
+        histogram = self.registry.histogram("latency_seconds", "Latency", bounds=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value)
+
+        self.assertEqual(self.registry.render(), "\n".join([
+            "# TYPE test_frames counter",
+            "# HELP test_frames Frames seen",
+            'test_frames_total{camera="FRONT"} 3',
+            "# TYPE test_latency_seconds histogram",
+            "# HELP test_latency_seconds Latency",
+            'test_latency_seconds_bucket{le="0.1"} 2',
+            'test_latency_seconds_bucket{le="1.0"} 3',
+            'test_latency_seconds_bucket{le="+Inf"} 4',
+            "test_latency_seconds_count 4",
+            "test_latency_seconds_sum 5.65",
+            "# TYPE test_level gauge",
+            '# HELP test_level A \\"level\\"',
+            'test_level{queue="q\\"1"} 2.5',
+            "# EOF",
+        ]) + "\n")
+
+    def test_get_or_create(self):
+        """Test that asking for a metric again returns the same one, and functions are read when collected."""
+        a = self.registry.counter("frames", "Frames seen", {"camera": "FRONT"})
+        b = self.registry.counter("frames", "Frames seen", {"camera": "FRONT"})
+        self.assertIs(a, b)
+        self.assertIsNot(a, self.registry.counter("frames", "Frames seen", {"camera": "REAR"}))
+        with self.assertRaises(ValueError):
+            self.registry.gauge("frames", "Frames seen")
+
+        values = [1, 2]
+        self.registry.gauge("popped", "Pops", fn=values.pop)
+        self.registry.gauge("broken", "Raises", fn=lambda: 1 / 0)
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot["test_popped"], [{"labels": {}, "value": 2}])
+        self.assertEqual(snapshot["test_broken"], [])
+        self.assertIsNone(self.registry.gauge("broken", "Raises").get())
+
+    def test_system_metrics_without_sensors(self):
+        """Test that the system metrics still render on a machine without thermal zones."""
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, "proc", "self"))
+            with open(os.path.join(root, "proc", "stat"), 'w') as f:
+                f.write("cpu  1 0 1 8 0 0 0 0 0 0\n")
+            with open(os.path.join(root, "proc", "meminfo"), 'w') as f:
+                f.write("MemAvailable:     1024 kB\n")
+            with open(os.path.join(root, "proc", "self", "status"), 'w') as f:
+                f.write("VmRSS:     2048 kB\n")
+
+            system.register_metrics(self.registry, root=root)
+            snapshot = self.registry.snapshot()
+            self.assertEqual(snapshot["test_system_temperature_max_celsius"], [])
+            self.assertEqual(snapshot["test_system_memory_available_bytes"], [{"labels": {}, "value": 1024 * 1024}])
+            self.assertIn("test_process_resident_memory_bytes 2097152\n", self.registry.render())
+
+    def test_http(self):
+        """Test scraping the registry over HTTP."""
+        self.registry.counter("frames", "Frames seen").inc()
+        server = metrics.MetricsServer(self.registry, port=0)
+        server.start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=5) as response:
+                self.assertEqual(response.headers["Content-Type"], metrics.CONTENT_TYPE)
+                self.assertIn("test_frames_total 1\n", response.read().decode())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://127.0.0.1:{server.port}/other", timeout=5)
+        finally:
+            server.shutdown()
+
+    def test_snapshots(self):
+        """Test that snapshots are appended to the day's file, including one on shutdown."""
+        counter = self.registry.counter("frames", "Frames seen")
+        with tempfile.TemporaryDirectory() as dpath:
+            writer = metrics.SnapshotWriter(dpath, period_s=60, registry=self.registry)
+            self.assertIsNone(writer.write())
+            counter.inc()
+            writer.start()
+            writer.shutdown()
+
+            fnames = os.listdir(dpath)
+            self.assertEqual(len(fnames), 1)
+            self.assertRegex(fnames[0], r"^metrics-\d{4}-\d{2}-\d{2}\.jsonl$")
+            with open(os.path.join(dpath, fnames[0])) as f:
+                lines = [json.loads(line) for line in f]
+            self.assertEqual([line["metrics"]["test_frames"][0]["value"] for line in lines], [0, 1])
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestMetrics)
@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from ..src.podapp.libraries.common import appconfig
+from ..src.podapp.libraries.gstreamer_utils import hef
+from ..src.podapp.libraries.gstreamer_utils import model
+from ..src.podapp.libraries.gstreamer_utils import utils
+
+PARSE_HEF_OUTPUT = """\
+Architecture HEF was compiled for: HAILO8L
+Network group name: yolov8s, Multi Context - Number of contexts: 3
+    Network name: yolov8s/yolov8s
+        VStream infos:
+            Input  yolov8s/input_layer1 UINT8, NHWC(640x480x3)
+            Output yolov8s/yolov8_nms_postprocess FLOAT32, HAILO NMS(number of classes: 80, maximum bounding boxes per class: 100, maximum frame size: 160320)
+"""
+
+class TestModel(unittest.TestCase):
+    """
+    Tests for reading HEF metadata and for the model pipelines built from it, off-device.
+    """
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patches = [
+            mock.patch.object(appconfig, "CACHE_DPATH", os.path.join(self.tmpdir.name, "cache")),
+            mock.patch.object(hef, "_cache", {}),
+            mock.patch.object(utils, "HAILO_PARAMS", utils.HAILO_PARAMS._replace(base_model_folder_path=self.tmpdir.name)),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+        self.reads = 0
+        with open(os.path.join(self.tmpdir.name, model.OBJECT_DETECTION_YOLOV8['hef_name']), 'wb') as f:
+            f.write(b"not really a HEF")
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.tmpdir.cleanup()
+        return super().tearDown()
+
+    def _reader(self, hef_fpath: str) -> hef.HefInfo:
+        self.reads += 1
+        return hef.parse_hailortcli(PARSE_HEF_OUTPUT)
+
+    def test_parse(self):
+        """Test that hailortcli's description of a HEF is parsed, including streams without a shape."""
+        info = hef.parse_hailortcli(PARSE_HEF_OUTPUT)
+        self.assertEqual(info.network_group, "yolov8s")
+        self.assertEqual(info.inputs, (hef.VStreamInfo("yolov8s/input_layer1", "UINT8", "NHWC", (640, 480, 3)),))
+        self.assertEqual(info.outputs[0].order, "HAILO NMS")
+        self.assertEqual(info.outputs[0].shape, ())
+        with self.assertRaises(ValueError):
+            hef.parse_hailortcli("Network group name: nothing")
+
+    def test_cache(self):
+        """Test that a HEF is only read once, even by another process, until it changes."""
+        hef_fpath = os.path.join(self.tmpdir.name, model.OBJECT_DETECTION_YOLOV8['hef_name'])
+        err, info = hef.read_hef_info(hef_fpath, reader=self._reader)
+        self.assertIsNone(err)
+        self.assertEqual(hef.read_hef_info(hef_fpath, reader=self._reader), (None, info))
+        # From the file cache
+        hef._cache.clear()
+        self.assertEqual(hef.read_hef_info(hef_fpath, reader=self._reader), (None, info))
+        self.assertEqual(self.reads, 1)
+
+        with open(hef_fpath, 'ab') as f:
+            f.write(b"!")
+        hef.read_hef_info(hef_fpath, reader=self._reader)
+        self.assertEqual(self.reads, 2)
+
+        err, _ = hef.read_hef_info(os.path.join(self.tmpdir.name, "missing.hef"), reader=self._reader)
+        self.assertIsInstance(err, FileNotFoundError)
+
+    def test_pipeline(self):
+        """Test that models share a virtual device with per-model scheduler settings, and fit their input to the HEF."""
+        hef.read_hef_info(os.path.join(self.tmpdir.name, model.OBJECT_DETECTION_YOLOV8['hef_name']), reader=self._reader)
+        model_config = model.OBJECT_DETECTION_YOLOV8 | {"scheduler_priority": 20, "scheduler_timeout_ms": 40, "scheduler_threshold": 2}
+        element = model.GStreamerModel(model_config)
+        self.assertEqual((element.width, element.height, element.color_format), (480, 640, "RGB"))
+
+        pipeline = element.element_pipeline
+        self.assertIn("video/x-raw, format=RGB, pixel-aspect-ratio=1/1", pipeline)
+        hailonet = pipeline[pipeline.index("hailonet "):].split()
+        self.assertIn("vdevice-group-id=podapp", hailonet)
+        self.assertIn("scheduling-algorithm=HAILO_SCHEDULING_ALGORITHM_ROUND_ROBIN", hailonet)
+        self.assertIn("scheduler-priority=20", hailonet)
+        self.assertIn("scheduler-timeout-ms=40", hailonet)
+        self.assertIn("scheduler-threshold=2", hailonet)
+
+        element.prescaled = True
+        self.assertTrue(element.element_pipeline.startswith("queue name=inference_hailonet_q"))
+        self.assertIn("vdevice-group-id=podapp", element.element_pipeline)
+
+        # Without the scheduler, there are no scheduler settings to give
+        with mock.patch.object(utils, "HAILO_PARAMS", utils.HAILO_PARAMS._replace(scheduling_algorithm="HAILO_SCHEDULING_ALGORITHM_NONE", vdevice_group_id="")):
+            pipeline = model.GStreamerModel(model_config).element_pipeline
+        self.assertNotIn("scheduler-priority", pipeline)
+        self.assertNotIn("vdevice-group-id", pipeline)
+
+    def test_fallback(self):
+        """Test that the configured input is used when the HEF can't be read."""
+        with mock.patch.object(hef, "_default_reader", lambda: None):
+            element = model.GStreamerModel(model.OBJECT_DETECTION_YOLOV8)
+        self.assertIsNone(element.hef_info)
+        self.assertEqual((element.width, element.height), (model.OBJECT_DETECTION_YOLOV8['width'], model.OBJECT_DETECTION_YOLOV8['height']))
+
+    def test_python_postprocess_labels(self):
+        """Test that the model post-processed in Python has a label for each of its classes."""
+        labels = model.OBJECT_DETECTION_YOLOV8_PYTHON['labels']
+        self.assertEqual(len(labels), 80)
+        self.assertEqual((labels[0], labels[14], labels[79]), ("person", "bird", "toothbrush"))
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestModel)
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from . import testutils
+from ..src.podapp.libraries.common import appconfig
+from ..src.podapp.libraries.sensors import power
+from ..src.podapp.libraries.sensors import system
+
+class TestPowerMeters(unittest.TestCase):
+    """
+    Tests to make sure we can read the power meters (from a fake sysfs tree).
+    """
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+        return super().tearDown()
+
+    def _write(self, relpath: str, contents: str):
+        fpath = os.path.join(self.root, relpath)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        with open(fpath, 'w') as f:
+            f.write(contents)
+
+    def test_ina219_hwmon_autodetect(self):
+        """Test that we find the INA219 among other hwmon devices and read its power channel."""
+        self._write("sys/class/hwmon/hwmon0/name", "cpu_thermal\n")
+        self._write("sys/class/hwmon/hwmon1/name", "ina219\n")
+        self._write("sys/class/hwmon/hwmon1/power1_input", "2500000\n")
+        meter = power.INA219HwmonPowerMeter(root=self.root)
+        self.assertEqual(meter.read_watts(), (None, 2.5))
+
+    def test_ina219_hwmon_voltage_and_current(self):
+        """Test that we fall back to voltage times current when there is no power channel."""
+        self._write("sys/class/hwmon/hwmon3/in1_input", "5000\n")
+        self._write("sys/class/hwmon/hwmon3/curr1_input", "600\n")
+        meter = power.INA219HwmonPowerMeter("/sys/class/hwmon/hwmon3", root=self.root)
+        self.assertEqual(meter.read_watts(), (None, 3.0))
+
+    def test_missing_meter(self):
+        """Test that a missing meter is reported as an error, not raised."""
+        err, watts = power.INA219HwmonPowerMeter(root=self.root).read_watts()
+        self.assertIsNotNone(err)
+        self.assertIsNone(watts)
+
+    def test_file_meter(self):
+        """Test the file-based stand-in."""
+        self._write("power.txt", "4.25\n")
+        meter = power.FilePowerMeter(os.path.join(self.root, "power.txt"))
+        self.assertEqual(meter.read_watts(), (None, 4.25))
+
+    def test_from_config(self):
+        """Test that the configured meter is built, and a bad type is reported as an error, not raised."""
+        config = testutils.load_config()
+        power_config = config['moduleconfig']['profiling']['power-meter']
+        power_config['type'] = "file"
+        err, meter = power.from_config(config)
+        self.assertIsNone(err)
+        self.assertIsInstance(meter, power.FilePowerMeter)
+
+        power_config['type'] = "multimeter"
+        err, meter = power.from_config(config)
+        self.assertIsInstance(err, appconfig.ConfigError)
+        self.assertIsNone(meter)
+
+    def test_system_readers(self):
+        """Test the CPU, temperature and memory readers."""
+        self._write("proc/stat", "cpu  100 0 100 800 0 0 0 0 0 0\n")
+        self._write("proc/self/status", "Name:\tpodapp\nVmRSS:\t  2048 kB\n")
+        self._write("sys/class/thermal/thermal_zone0/temp", "51234\n")
+        cpu = system.CPUUsage(self.root)
+        self._write("proc/stat", "cpu  150 0 150 900 0 0 0 0 0 0\n")
+        self.assertAlmostEqual(cpu.sample(), 0.5)
+        self.assertEqual(system.read_temperatures_c(self.root), [51.234])
+        self.assertEqual(system.read_rss_bytes(root=self.root), 2048 * 1024)
+        self._write("proc/meminfo", "MemTotal:\t 8000000 kB\nMemFree:\t 1000 kB\nMemAvailable:\t 4000 kB\n")
+        self.assertEqual(system.read_memory_available_bytes(self.root), 4000 * 1024)
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestPowerMeters)
@@ -0,0 +1,100 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from ..src.podapp.libraries.gstreamer_utils import frames
+from ..src.podapp.libraries.gstreamer_utils import preproc
+
+# Inverts the first plane, and fails on frames that aren't GRAY8 or NV12
+SOURCE = r"""
+#include <stdint.h>
+#include <string.h>
+
+int invert(uint8_t *data, uint64_t size, int32_t width, int32_t height, const char *format,
+           int32_t n_planes, const int32_t *offsets, const int32_t *strides, int64_t pts)
+{
+    if (strcmp(format, "GRAY8") != 0 && strcmp(format, "NV12") != 0)
+        return 3;
+    if ((uint64_t)offsets[0] + (uint64_t)strides[0] * height > size)
+        return 4;
+    for (int32_t row = 0; row < height; row++)
+        for (int32_t col = 0; col < width; col++)
+            data[offsets[0] + row * strides[0] + col] = 255 - data[offsets[0] + row * strides[0] + col];
+    return 0;
+}
+"""
+
+@unittest.skipUnless(shutil.which("cc"), "needs a C compiler")
+class TestNativePreprocess(unittest.TestCase):
+    """
+    Tests for calling a native pre-process on frames in place, with a shared object built for the test.
+    """
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        source_fpath = os.path.join(cls.tmpdir.name, "invert.c")
+        cls.so_fpath = os.path.join(cls.tmpdir.name, "libinvert.so")
+        with open(source_fpath, 'w') as f:
+            f.write(SOURCE)
+        subprocess.run(["cc", "-shared", "-fPIC", "-O2", "-o", cls.so_fpath, source_fpath], check=True)
+        return super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmpdir.cleanup()
+        return super().tearDownClass()
+
+    def test_in_place(self):
+        """Test that the function changes the frame's own memory, honoring its layout."""
+        function = preproc.NativeFunction(self.so_fpath, "invert")
+        width, height = 6, 4
+        offsets, strides = frames.default_layout("NV12", width, height)
+        data = np.zeros(offsets[1] + strides[1] * height // 2, dtype=np.uint8)
+        y, uv = frames.plane_views(data, "NV12", width, height)
+        y[:] = np.arange(width)[None, :]
+        uv[:] = 7
+
+        self.assertEqual(function(data, "NV12", width, height), 0)
+        np.testing.assert_array_equal(y, 255 - np.arange(width)[None, :].repeat(height, axis=0))
+        # Padding and the other plane are left alone
+        self.assertTrue(np.all(data[width:strides[0]] == 0))
+        self.assertTrue(np.all(uv == 7))
+        self.assertEqual((function.calls, function.errors, function.last_result[0]), (1, 0, 0))
+
+    def test_errors(self):
+        """Test that error codes and unwritable frames are reported, and the library is only loaded once."""
+        function = preproc.NativeFunction(self.so_fpath, "invert")
+        self.assertIs(function.function, preproc.NativeFunction(self.so_fpath, "invert").function)
+        self.assertEqual(function(np.zeros(12, dtype=np.uint8), "RGB", 2, 2), 3)
+        self.assertEqual((function.calls, function.errors), (1, 1))
+
+        with self.assertRaises(ValueError):
+            function(bytes(16), "GRAY8", 4, 4)
+        with self.assertRaises(ValueError):
+            preproc.NativeFunction(self.so_fpath, "nope")
+        with self.assertRaises(FileNotFoundError):
+            preproc.NativeFunction(os.path.join(self.tmpdir.name, "nope.so"), "invert")
+
+    def test_element_pipeline(self):
+        """Test that the element converts first only if asked to."""
+        element = preproc.GStreamerPreprocess(self.so_fpath, "invert", name="native")
+        self.assertTrue(element.element_pipeline.startswith("queue name=native_queue"))
+        self.assertIn(f"{preproc.TRANSFORM_ELEMENT_NAME} name=native_transform", element.element_pipeline)
+        element = preproc.GStreamerPreprocess(self.so_fpath, "invert", video_format="GRAY8", name="native")
+        self.assertTrue(element.element_pipeline.startswith("videoconvert name=native_convert ! video/x-raw, format=GRAY8 ! queue"))
+
+    def test_drop_on_error(self):
+        """Test that frames the function fails on are only dropped if asked to."""
+        for drop_on_error in (False, True):
+            element = preproc.GStreamerPreprocess(self.so_fpath, "invert", drop_on_error=drop_on_error, name="native")
+            with mock.patch.object(element, "_process", return_value=3):
+                self.assertEqual(element._on_frame(None, None), not drop_on_error)
+            with mock.patch.object(element, "_process", return_value=0):
+                self.assertTrue(element._on_frame(None, None))
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestNativePreprocess)
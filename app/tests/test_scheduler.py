@@ -0,0 +1,106 @@
+import datetime
+import unittest
+from ..src.podapp.libraries.common import scheduler
+
+class FakeComponent:
+    """
+    Records when it was turned on and off.
+    """
+    def __init__(self) -> None:
+        self.on = False
+        self.transitions = 0
+
+    def turn_on(self):
+        self.on = True
+        self.transitions += 1
+
+    def turn_off(self):
+        self.on = False
+        self.transitions += 1
+
+class TestPowerScheduler(unittest.TestCase):
+    """
+    Tests to make sure the power scheduler duty-cycles components within the budget.
+    """
+    def _clock_at(self, hour: int, minute=0) -> scheduler.SimulatedClock:
+        return scheduler.SimulatedClock(datetime.datetime(2026, 6, 1, hour, minute).timestamp())
+
+    def _run(self, sched: scheduler.PowerScheduler, clock: scheduler.SimulatedClock, seconds: float, tick_s: float, component: FakeComponent) -> float:
+        """Tick for the given time and return the fraction of ticks the component was on."""
+        ticks_on = 0
+        nticks = int(seconds / tick_s)
+        for _ in range(nticks):
+            sched.tick()
+            ticks_on += component.on
+            clock.advance(tick_s)
+        return ticks_on / nticks
+
+    def setUp(self) -> None:
+        self.ai = FakeComponent()
+        self.display = FakeComponent()
+        windows = [scheduler.Window(5, 8, 1, 1), scheduler.Window(20, 5, 1, 5)]
+        self.components = [
+            scheduler.ScheduledComponent("ai", 2.0, self.ai.turn_on, self.ai.turn_off, priority=1, windows=windows),
+            scheduler.ScheduledComponent("display", 1.0, self.display.turn_on, self.display.turn_off, priority=0, demand_hold_s=10),
+        ]
+        return super().setUp()
+
+    def test_night_duty_cycle(self):
+        """Test that the AI runs one second in five at night."""
+        clock = self._clock_at(23)
+        sched = scheduler.PowerScheduler(10.0, 1.0, self.components, clock=clock)
+        self.assertAlmostEqual(self._run(sched, clock, 100, 0.5, self.ai), 0.2)
+
+    def test_continuous_at_dawn_and_off_at_midday(self):
+        """Test that the AI runs continuously at dawn and not at all outside its windows."""
+        clock = self._clock_at(6)
+        sched = scheduler.PowerScheduler(10.0, 1.0, self.components, clock=clock)
+        self.assertEqual(self._run(sched, clock, 10, 0.5, self.ai), 1.0)
+        self.assertEqual(self.ai.transitions, 1)
+
+        clock.now_s = self._clock_at(12).now_s
+        self.assertEqual(self._run(sched, clock, 10, 0.5, self.ai), 0.0)
+
+    def test_display_on_demand(self):
+        """Test that the display is off unless touched, and turns off after the hold time."""
+        clock = self._clock_at(12)
+        sched = scheduler.PowerScheduler(10.0, 1.0, self.components, clock=clock)
+        self.assertEqual(self._run(sched, clock, 5, 0.5, self.display), 0.0)
+        sched.notify("display")
+        self.assertEqual(self._run(sched, clock, 10, 0.5, self.display), 1.0)
+        self.assertEqual(self._run(sched, clock, 5, 0.5, self.display), 0.0)
+
+    def test_first_tick_applies_the_state(self):
+        """Test that a component that was already on when the scheduler started is turned off if it should be."""
+        clock = self._clock_at(12)
+        self.display.on = True
+        sched = scheduler.PowerScheduler(10.0, 1.0, self.components, clock=clock)
+        sched.tick()
+        self.assertFalse(self.display.on)
+        self.assertEqual(self.display.transitions, 1)
+        sched.tick()
+        self.assertEqual(self.display.transitions, 1)
+
+    def test_budget_sheds_least_important(self):
+        """Test that going over budget cuts back the AI (less important) before the display."""
+        clock = self._clock_at(6)
+        # Baseline 1 W + display 1 W leaves 1 W, which is half of the AI's 2 W
+        sched = scheduler.PowerScheduler(3.0, 1.0, self.components, clock=clock)
+        sched.notify("display")
+        sched.tick()
+        self.assertEqual(self.components[1].duty, 1.0)
+        self.assertAlmostEqual(self.components[0].duty, 0.5)
+        self.assertAlmostEqual(sched.expected_power_w(), 3.0)
+
+    def test_shutdown_turns_everything_off(self):
+        """Test that shutting the scheduler down turns off whatever it turned on."""
+        clock = self._clock_at(6)
+        sched = scheduler.PowerScheduler(10.0, 1.0, self.components, clock=clock)
+        sched.tick()
+        self.assertTrue(self.ai.on)
+        sched.shutdown()
+        self.assertFalse(self.ai.on)
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestPowerScheduler)
@@ -1,3 +1,4 @@
+import threading
 import time
 import unittest
 from . import testutils
@@ -47,6 +48,99 @@ class TestScreen(unittest.TestCase):
         self.assertIsNone(err)
         self.assertFalse(on)
 
+class FakeWlrRandr:
+    """
+    Pretends to be wlr-randr, and counts how many times it was run.
+    """
+    def __init__(self, dsi_id: str) -> None:
+        self.dsi_id = dsi_id
+        self.enabled = True
+        self.calls = []
+
+    def __call__(self, args):
+        self.calls.append(args)
+        if "--on" in args:
+            self.enabled = True
+        elif "--off" in args:
+            self.enabled = False
+        return 0, f"{self.dsi_id} \"Some Panel\"\n  Enabled: {'yes' if self.enabled else 'no'}\n"
+
+class TestDisplayState(unittest.TestCase):
+    """
+    Tests to make sure the display caches its state and blanks itself when idle.
+    """
+    def setUp(self) -> None:
+        self.config = testutils.load_config()
+        self.config['moduleconfig']['screen']['timeout-seconds'] = "0.1"
+        self.now = 0.0
+        self.wlr_randr = FakeWlrRandr(self.config['pinconfig']['screen']['dsi']['id'])
+        self.display = screen.Display(self.config, run_command=self.wlr_randr, clock=lambda: self.now, sleep=self.sleep)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.display.shutdown()
+        return super().tearDown()
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+    def test_queries_are_cached(self):
+        """Test that repeated queries only run wlr-randr once until the cache gets old."""
+        for _ in range(5):
+            self.assertEqual(self.display.on(), (None, True))
+            self.assertEqual(self.display.off(), (None, False))
+        self.assertEqual(len(self.wlr_randr.calls), 1)
+
+        self.now += self.display.refresh_seconds
+        self.display.on()
+        self.assertEqual(len(self.wlr_randr.calls), 2)
+
+    def test_redundant_requests_are_free(self):
+        """Test that asking for the state we are already in does not run wlr-randr."""
+        self.assertIsNone(self.display.turn_off())
+        self.assertIsNone(self.display.turn_off())
+        self.assertEqual(self.display.off(), (None, True))
+        self.assertEqual(self.wlr_randr.calls, [["--output", self.wlr_randr.dsi_id, "--off"]])
+
+    def test_idle_auto_blank(self):
+        """Test that the display turns itself off after the idle timeout."""
+        self.assertIsNone(self.display.turn_on())
+        idle_thread = self.display._idle_thread
+        if idle_thread is not None:
+            idle_thread.join()
+        self.assertFalse(self.wlr_randr.enabled)
+        self.assertGreaterEqual(self.now, self.display.timeout_seconds)
+
+    def test_merged_requests_get_the_result(self):
+        """Test that a request merged into another thread's gets that thread's result."""
+        started = threading.Event()
+        release = threading.Event()
+        def run_command(args):
+            if "--on" in args:
+                started.set()
+                release.wait()
+                return 1, "no such output"
+            return self.wlr_randr(args)
+        self.display.run_command = run_command
+        self.display.turn_off()
+
+        results = {}
+        first = threading.Thread(target=lambda: results.setdefault("first", self.display.turn_on()))
+        first.start()
+        started.wait()
+        second = threading.Thread(target=lambda: results.setdefault("second", self.display.turn_off()))
+        second.start()
+        while self.display._wanted is not False:
+            time.sleep(0.001)
+        release.set()
+        first.join()
+        second.join()
+        self.assertIsInstance(results["first"], Exception)
+        self.assertIs(results["second"], results["first"])
+
 def gather() -> unittest.TestSuite:
     loader = unittest.TestLoader()
-    return loader.loadTestsFromTestCase(TestScreen)
+    suite = unittest.TestSuite()
+    suite.addTest(loader.loadTestsFromTestCase(TestScreen))
+    suite.addTest(loader.loadTestsFromTestCase(TestDisplayState))
+    return suite
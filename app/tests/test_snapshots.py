@@ -0,0 +1,145 @@
+import os
+import queue
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from ..src.podapp.libraries.storage import detections
+from ..src.podapp.libraries.storage import snapshots
+from . import testutils
+
+class TestThumbnailCache(unittest.TestCase):
+    """
+    Tests for the in-memory LRU thumbnail cache.
+    """
+    def test_byte_cap(self):
+        """Test that the least recently used thumbnails are evicted to stay under the byte cap."""
+        cache = snapshots.ThumbnailCache(max_bytes=10)
+        cache.put("a", b"aaaa")
+        cache.put("b", b"bbbb")
+        self.assertEqual(cache.get("a"), b"aaaa")
+        cache.put("c", b"cccc")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (b"aaaa", b"cccc"))
+        self.assertEqual(cache.nbytes, 8)
+
+        # Replacing one doesn't count it twice, and one that could never fit isn't kept
+        cache.put("a", b"aa")
+        self.assertEqual(cache.nbytes, 6)
+        cache.put("d", b"d" * 11)
+        self.assertNotIn("d", cache)
+        self.assertEqual(len(cache), 2)
+
+class TestSnapshotter(unittest.TestCase):
+    """
+    Tests for taking snapshots of detections, with a fake encoder and a fake clock.
+    """
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.now_s = 0.0
+        self.config = testutils.load_config()
+        section = self.config['moduleconfig']['snapshots']
+        section.update({"dpath": self.tmpdir.name, "min-score": "0.5", "min-interval-seconds": "10", "padding": "0", "full-frames": "True"})
+        # The "JPEG" is the shape of what was encoded
+        encode = lambda pixels, quality: f"{pixels.shape[1]}x{pixels.shape[0]}".encode()
+        self.snapshotter = snapshots.Snapshotter(self.config, encode=encode, clock=lambda: self.now_s)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.snapshotter.shutdown()
+        self.tmpdir.cleanup()
+        return super().tearDown()
+
+    def _records(self, *rows) -> np.ndarray:
+        records = detections.empty(len(rows))
+        records['timestamp'] = 1000
+        records['frame'] = 0
+        records['camera'] = detections.CameraID.FRONT
+        records['model'] = 0
+        for i, (class_id, score, box) in enumerate(rows):
+            records[i]['class_id'] = class_id
+            records[i]['score'] = score
+            records[i]['box'] = box
+        return records
+
+    def test_snapshots(self):
+        """Test that detections over the threshold are cropped, cached and written, at most once per interval per track."""
+        frame = np.zeros((100, 200, 3), dtype=np.uint8)
+        records = self._records((1, 0.9, (0.1, 0.2, 0.3, 0.6)), (2, 0.4, (0.0, 0.0, 1.0, 1.0)))
+        self.assertEqual(self.snapshotter.offer(records, frame, {1: "bird"}), 1)
+        # Too soon for the same track
+        self.now_s += 5
+        self.assertEqual(self.snapshotter.offer(records, frame), 0)
+        self.now_s += 5
+        self.assertEqual(self.snapshotter.offer(records, frame), 1)
+        self.snapshotter.shutdown()
+
+        recent = self.snapshotter.recent()
+        self.assertEqual(len(recent), 2)
+        first = recent[-1]
+        self.assertEqual((first["label"], first["camera"], first["class_id"]), ("bird", "FRONT", 1))
+        self.assertEqual(self.snapshotter.thumbnail(first["id"]), b"40x40")
+        with open(first["fpath"], 'rb') as f:
+            self.assertEqual(f.read(), b"40x40")
+        with open(first["full_fpath"], 'rb') as f:
+            self.assertEqual(f.read(), b"200x100")
+        self.assertEqual(len(self.snapshotter.recent(1)), 1)
+        self.assertEqual(os.path.dirname(first["fpath"]), os.path.dirname(recent[0]["fpath"]))
+
+    def test_tracked(self):
+        """Test that with track IDs, each animal is its own track and untracked detections are skipped."""
+        frame = np.zeros((100, 200, 3), dtype=np.uint8)
+        box = (0.1, 0.2, 0.3, 0.6)
+        records = self._records((1, 0.9, box), (1, 0.9, box), (1, 0.9, box))
+        self.assertEqual(self.snapshotter.offer(records, frame, track_ids=np.array([7, 8, 0])), 2)
+        self.assertEqual(self.snapshotter.offer(records, frame, track_ids=np.array([7, 9, 0])), 1)
+        self.snapshotter.shutdown()
+        self.assertEqual([info["track"] for info in self.snapshotter.recent()], [9, 8, 7])
+
+    def test_full_queue_does_not_hold_off_the_track(self):
+        """Test that a snapshot dropped because the queue was full doesn't count toward the track's interval."""
+        frame = np.zeros((100, 200, 3), dtype=np.uint8)
+        records = self._records((1, 0.9, (0.1, 0.2, 0.3, 0.6)))
+        with mock.patch.object(self.snapshotter._queue, "put_nowait", side_effect=queue.Full):
+            self.assertEqual(self.snapshotter.offer(records, frame, track_ids=np.array([7])), 0)
+        self.assertEqual(self.snapshotter.offer(records, frame, track_ids=np.array([7])), 1)
+
+    def test_old_tracks_are_forgotten(self):
+        """Test that tracks last snapshotted over an interval ago are forgotten, and can be snapshotted again."""
+        frame = np.zeros((100, 200, 3), dtype=np.uint8)
+        records = self._records(*[(1, 0.9, (0.1, 0.2, 0.3, 0.6))] * 50)
+        self.assertEqual(self.snapshotter.offer(records, frame, track_ids=np.arange(1, 51)), 50)
+        self.now_s += 10
+        self.assertEqual(self.snapshotter.offer(records[:1], frame, track_ids=np.array([51])), 1)
+        self.assertEqual(list(self.snapshotter._last_s), [51])
+        self.now_s += 5
+        self.assertEqual(self.snapshotter.offer(records[:2], frame, track_ids=np.array([51, 1])), 1)
+
+    def test_thumbnails_are_downscaled(self):
+        """Test that the cached thumbnail is shrunk, but the snapshot written out isn't."""
+        self.snapshotter.thumbnail_size = 10
+        frame = np.zeros((100, 200, 3), dtype=np.uint8)
+        self.assertEqual(self.snapshotter.offer(self._records((1, 0.9, (0.1, 0.2, 0.3, 0.6))), frame), 1)
+        self.snapshotter.shutdown()
+
+        (info,) = self.snapshotter.recent()
+        self.assertEqual(self.snapshotter.thumbnail(info["id"]), b"10x10")
+        with open(info["fpath"], 'rb') as f:
+            self.assertEqual(f.read(), b"40x40")
+
+    def test_downscale(self):
+        """Test that downscaling averages whole blocks and keeps both sides within the limit."""
+        pixels = np.zeros((4, 6, 3), dtype=np.uint8)
+        pixels[0, 0] = 200
+        small = snapshots.downscale(pixels, 3)
+        self.assertEqual(small.shape, (2, 3, 3))
+        self.assertEqual(small[0, 0, 0], 50)
+        self.assertIs(snapshots.downscale(pixels, 6), pixels)
+        self.assertEqual(snapshots.downscale(np.zeros((2, 100, 3), dtype=np.uint8), 10).shape, (1, 10, 3))
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    suite.addTest(loader.loadTestsFromTestCase(TestThumbnailCache))
+    suite.addTest(loader.loadTestsFromTestCase(TestSnapshotter))
+    return suite
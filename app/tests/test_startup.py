@@ -0,0 +1,54 @@
+import subprocess
+import sys
+import unittest
+from ..src.podapp.app import startup
+
+class TestStartup(unittest.TestCase):
+    """
+    Tests for keeping the CLI's startup fast.
+    """
+    def test_cli_import_is_lazy(self):
+        """Test that importing the CLI doesn't import GStreamer, numpy, or the hardware modules."""
+        heavy = ["gi", "numpy", "yaml", "asyncio", "importlib.metadata"]
+        code = (
+            "import sys, types\n"
+            f"from {startup.__package__} import cli\n"
+            f"print([m for m in {heavy!r} if type(sys.modules.get(m)) is types.ModuleType])\n"
+        )
+        p = subprocess.run([sys.executable, "-c", code], capture_output=True, encoding='utf-8')
+        self.assertEqual(p.returncode, 0, p.stderr)
+        self.assertEqual(p.stdout.strip(), "[]")
+
+    def test_help_does_not_load_the_config(self):
+        """Test that a command's --help doesn't load the configuration file or define its sections."""
+        code = (
+            "import sys, types\n"
+            f"from {startup.__package__} import cli\n"
+            "cli.cli.main(['display', '--help'], standalone_mode=False)\n"
+            "print([m for m in ('dataclasses', 'yaml', cli.appconfig.__name__.replace('appconfig', 'sections')) if type(sys.modules.get(m)) is types.ModuleType])\n"
+        )
+        p = subprocess.run([sys.executable, "-c", code], capture_output=True, encoding='utf-8')
+        self.assertEqual(p.returncode, 0, p.stderr)
+        self.assertEqual(p.stdout.strip().splitlines()[-1], "[]")
+
+    def test_parse_importtime(self):
+        """Test parsing `-X importtime` output."""
+        text = "\n".join([
+            "import time: self [us] | cumulative | imported package",
+            "import time:       100 |        100 |   _abc",
+            "import time:       250 |        350 | abc",
+            "something else on stderr",
+            "import time:        50 |         50 | click",
+        ])
+        times, other = startup.parse_importtime(text)
+        self.assertEqual(times, [
+            startup.ImportTime("_abc", 100, 100, 1),
+            startup.ImportTime("abc", 250, 350, 0),
+            startup.ImportTime("click", 50, 50, 0),
+        ])
+        self.assertEqual(other, ["something else on stderr"])
+        self.assertEqual(startup.total_import_us(times), 400)
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestStartup)
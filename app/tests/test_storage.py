@@ -0,0 +1,148 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from ..src.podapp.libraries.storage import detections
+
+class TestDetectionWriter(unittest.TestCase):
+    """
+    Tests to make sure detections make it to disk and back.
+    """
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fpath = os.path.join(self.tmpdir.name, "test.det")
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+        return super().tearDown()
+
+    def _records(self, n: int, start_frame=0) -> np.ndarray:
+        records = detections.empty(n)
+        records['timestamp'] = np.arange(n) * 1000
+        records['frame'] = np.arange(start_frame, start_frame + n)
+        records['camera'] = detections.CameraID.REAR
+        records['model'] = 0
+        records['class_id'] = np.arange(n) % 3
+        records['score'] = 0.5
+        records['box'] = (0.1, 0.2, 0.3, 0.4)
+        return records
+
+    def test_round_trip(self):
+        """Test that records written across several buffer flushes read back unchanged."""
+        records = self._records(25)
+        with detections.DetectionWriter(self.fpath, buffer_rows=7) as writer:
+            writer.append(records[:10])
+            writer.append(records[10:])
+
+        self.assertEqual(writer.nrows_written, 25)
+        readback = detections.read_detections(self.fpath)
+        np.testing.assert_array_equal(readback, records)
+
+    def test_appends_to_existing_file(self):
+        """Test that reopening a file appends rather than truncates."""
+        with detections.DetectionWriter(self.fpath) as writer:
+            writer.append(self._records(3))
+        with detections.DetectionWriter(self.fpath) as writer:
+            writer.append(self._records(2, start_frame=3))
+
+        readback = detections.read_detections(self.fpath)
+        self.assertEqual(list(readback['frame']), [0, 1, 2, 3, 4])
+
+    def test_record_size(self):
+        """Test that the record layout stays compact."""
+        self.assertEqual(detections.DETECTION_DTYPE.itemsize, 36)
+
+class TestDetectionStore(unittest.TestCase):
+    """
+    Tests to make sure the memory-mapped detection store answers queries correctly.
+    """
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.rng = np.random.default_rng(0)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+        return super().tearDown()
+
+    def _records(self, n: int, t0=0) -> np.ndarray:
+        records = detections.empty(n)
+        records['timestamp'] = t0 + np.arange(n) * 10
+        records['frame'] = np.arange(n)
+        records['camera'] = self.rng.integers(1, 3, n)
+        records['model'] = 0
+        records['class_id'] = self.rng.integers(0, 5, n)
+        records['score'] = self.rng.random(n)
+        records['box'] = 0.5
+        return records
+
+    def _brute_force(self, records, start_ns, end_ns, class_ids, min_score):
+        mask = (records['timestamp'] >= start_ns) & (records['timestamp'] < end_ns)
+        mask &= np.isin(records['class_id'], class_ids) & (records['score'] > min_score)
+        return records[mask]
+
+    def test_query_matches_brute_force(self):
+        """Test that indexed queries across many chunks return exactly what a full scan would."""
+        records = self._records(1000)
+        with detections.DetectionStore(self.tmpdir.name, chunk_rows=64, flush_rows=100) as store:
+            for batch in np.array_split(records, 37):
+                store.append(batch)
+
+            self.assertEqual(len(store), 1000)
+            result = store.query(start_ns=1234, end_ns=7777, class_ids=[1, 3], min_score=0.6)
+            expected = self._brute_force(records, 1234, 7777, [1, 3], 0.6)
+            np.testing.assert_array_equal(result, expected)
+
+    def test_query_by_label(self):
+        """Test that we can query by the human-readable label."""
+        records = self._records(200)
+        with detections.DetectionStore(self.tmpdir.name, chunk_rows=64) as store:
+            store.append(records)
+            store.set_labels(0, {2: "fox", 4: "owl"})
+            result = store.query(labels=["fox"])
+
+        np.testing.assert_array_equal(result, records[records['class_id'] == 2])
+
+    def test_query_by_label_across_models(self):
+        """Test that a label only matches the class ID it has in the model that reported each row."""
+        records = self._records(200)
+        records['model'][100:] = 1
+        with detections.DetectionStore(self.tmpdir.name, chunk_rows=64) as store:
+            store.append(records)
+            store.set_labels(0, {2: "fox"})
+            store.set_labels(1, {3: "fox", 2: "owl"})
+            result = store.query(labels=["fox"])
+
+        mask = ((records['model'] == 0) & (records['class_id'] == 2)) | ((records['model'] == 1) & (records['class_id'] == 3))
+        np.testing.assert_array_equal(result, records[mask])
+
+    def test_reopen_and_append(self):
+        """Test that a reopened store sees the old rows and keeps appending after them."""
+        first = self._records(100)
+        second = self._records(50, t0=10_000)
+        with detections.DetectionStore(self.tmpdir.name, chunk_rows=64) as store:
+            store.append(first)
+        with detections.DetectionStore(self.tmpdir.name) as store:
+            store.append(second)
+            self.assertEqual(store.chunk_rows, 64)
+            result = store.query()
+
+        np.testing.assert_array_equal(result, np.concatenate([first, second]))
+
+    def test_unsorted_chunks(self):
+        """Test that time queries still work when timestamps go backwards (e.g., several clips)."""
+        records = np.concatenate([self._records(30, t0=500), self._records(30, t0=0)])
+        with detections.DetectionStore(self.tmpdir.name, chunk_rows=64) as store:
+            store.append(records)
+            result = store.query(start_ns=100, end_ns=600)
+
+        mask = (records['timestamp'] >= 100) & (records['timestamp'] < 600)
+        np.testing.assert_array_equal(result, records[mask])
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    suite.addTest(loader.loadTestsFromTestCase(TestDetectionWriter))
+    suite.addTest(loader.loadTestsFromTestCase(TestDetectionStore))
+    return suite
@@ -0,0 +1,153 @@
+import tempfile
+import unittest
+import numpy as np
+from . import testutils
+from ..src.podapp.libraries.coprocessors import mcu
+from ..src.podapp.libraries.sensors import telemetry as sensor_telemetry
+from ..src.podapp.libraries.storage import telemetry
+
+class TestTelemetryStore(unittest.TestCase):
+    """
+    Tests for the ring buffers and rollup tiers.
+    """
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dpath = self.tmpdir.name
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+        return super().tearDown()
+
+    def test_ring_buffer_wraps(self):
+        """Test that the ring buffer keeps only the newest samples, in order."""
+        ring = telemetry.RingBuffer(5)
+        ring.extend(np.arange(3.0), np.arange(3.0))
+        ring.extend(np.arange(3.0, 7.0), np.arange(3.0, 7.0))
+        times, values = ring.snapshot()
+        self.assertEqual(len(ring), 5)
+        np.testing.assert_array_equal(times, [2, 3, 4, 5, 6])
+        np.testing.assert_array_equal(values, [2, 3, 4, 5, 6])
+
+        # More samples than the capacity at once
+        ring.extend(np.arange(100.0, 112.0), np.arange(12.0))
+        times, _ = ring.snapshot()
+        np.testing.assert_array_equal(times, np.arange(107.0, 112.0))
+
+    def test_rollups_match_brute_force(self):
+        """Test minute and hour rollups against a straightforward calculation."""
+        rng = np.random.default_rng(0)
+        start_s = 1_700_000_000 - (1_700_000_000 % 3600)
+        times = start_s + np.sort(rng.uniform(0, 3 * 3600, size=5000))
+        values = rng.normal(20, 5, size=5000).astype(np.float32)
+
+        store = telemetry.TelemetryStore(self.dpath, ["temperature_c"], ring_samples=100, history={"minute": 1000, "hour": 10})
+        # Feed it in uneven batches
+        for batch in np.array_split(np.arange(len(times)), 37):
+            store.extend("temperature_c", times[batch], values[batch])
+        store.close()
+
+        for tier, period_s in telemetry.TIERS.items():
+            rollups = telemetry.read_rollups(self.dpath, tier)
+            buckets = (times // period_s).astype(np.int64)
+            expected_starts = np.unique(buckets) * period_s
+            np.testing.assert_array_equal(rollups['start'], expected_starts)
+            for row in rollups:
+                mask = buckets == row['start'] // period_s
+                self.assertEqual(row['count'], mask.sum())
+                self.assertAlmostEqual(float(row['min']), float(values[mask].min()), places=4)
+                self.assertAlmostEqual(float(row['max']), float(values[mask].max()), places=4)
+                self.assertAlmostEqual(float(row['mean']), float(values[mask].mean()), places=3)
+
+        # The ring buffer only holds the newest raw samples
+        recent_times, _ = store.recent("temperature_c")
+        np.testing.assert_array_equal(recent_times, times[-100:])
+
+    def test_channels_are_stable(self):
+        """Test that channel indexes survive a restart with a different set of channels."""
+        with telemetry.TelemetryStore(self.dpath, ["a", "b"]) as store:
+            store.record(0.0, {"a": 1.0, "b": 2.0})
+        with telemetry.TelemetryStore(self.dpath, ["b", "c"]) as store:
+            self.assertEqual(store.channels, ["a", "b", "c"])
+            store.record(60.0, {"c": 3.0})
+
+        rollups = telemetry.read_rollups(self.dpath, "minute", channel=2)
+        self.assertEqual(len(rollups), 1)
+        self.assertEqual(rollups[0]['mean'], 3.0)
+
+    def test_restart_mid_bucket(self):
+        """Test that a bucket split by a restart reads back as one bucket."""
+        start_s = 1_700_000_000 - (1_700_000_000 % 3600)
+        times = start_s + np.arange(0.0, 150.0, 5.0)
+        values = np.arange(len(times), dtype=np.float32)
+        split = 15
+        for part in (slice(None, split), slice(split, None)):
+            with telemetry.TelemetryStore(self.dpath, ["a"]) as store:
+                store.extend("a", times[part], values[part])
+
+        for tier, period_s in telemetry.TIERS.items():
+            rollups = telemetry.read_rollups(self.dpath, tier)
+            buckets = (times // period_s).astype(np.int64)
+            np.testing.assert_array_equal(rollups['start'], np.unique(buckets) * period_s)
+            for row in rollups:
+                mask = buckets == row['start'] // period_s
+                self.assertEqual(row['count'], mask.sum())
+                self.assertEqual(row['min'], values[mask].min())
+                self.assertEqual(row['max'], values[mask].max())
+                self.assertAlmostEqual(float(row['mean']), float(values[mask].mean()), places=4)
+
+    def test_only_finished_buckets_are_written(self):
+        """Test that nothing hits the disk until buckets finish and a flush is due."""
+        store = telemetry.TelemetryStore(self.dpath, ["a"], flush_rows=3)
+        for t in range(0, 180, 10):
+            store.record(float(t), {"a": float(t)})
+        self.assertEqual(len(telemetry.read_rollups(self.dpath, "minute")), 0)
+
+        # The third finished minute triggers a flush
+        store.record(180.0, {"a": 0.0})
+        self.assertEqual(len(telemetry.read_rollups(self.dpath, "minute")), 3)
+        self.assertEqual(len(store.rollups("minute", "a")), 3)
+        store.close()
+
+class TestTelemetry(unittest.TestCase):
+    """
+    Tests for collecting telemetry through the (emulated) MCU.
+    """
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.config = testutils.load_config()
+        testutils.initialize_logger(self.config)
+        self.config['moduleconfig']['mcu']['batch-window-seconds'] = "0"
+        self.config['moduleconfig']['telemetry']['dpath'] = self.tmpdir.name
+        self.link = mcu.MCU(self.config, backend=mcu.EmulatedMCU())
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.link.shutdown()
+        self.tmpdir.cleanup()
+        return super().tearDown()
+
+    def test_poll(self):
+        """Test that polling records every configured sensor's values."""
+        now = [1_700_000_000.0]
+        tele = sensor_telemetry.Telemetry(self.config, self.link, clock=lambda: now[0])
+        for _ in range(120):
+            self.assertIsNone(tele.poll())
+            now[0] += 1.0
+        tele.shutdown()
+
+        times, values = tele.store.recent("temperature_c")
+        self.assertEqual(len(times), 120)
+        np.testing.assert_array_equal(values, np.full(120, 21.5, dtype=np.float32))
+        self.assertIn("gps_fix", tele.store.channels)
+
+        rollups = telemetry.read_rollups(self.tmpdir.name, "minute", channel=tele.store.channel_index("humidity_pct"))
+        self.assertEqual(int(rollups['count'].sum()), 120)
+        np.testing.assert_array_equal(rollups['mean'], np.full(len(rollups), 40.0, dtype=np.float32))
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    suite.addTest(loader.loadTestsFromTestCase(TestTelemetryStore))
+    suite.addTest(loader.loadTestsFromTestCase(TestTelemetry))
+    return suite
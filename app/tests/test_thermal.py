@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+from ..src.podapp.libraries.common import appconfig
+from ..src.podapp.libraries.sensors import thermal
+
+class TestThermal(unittest.TestCase):
+    """
+    Tests for the thermal controller, with a fake sysfs tree and a fake clock.
+    """
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        self.now_s = 0.0
+        self.levels = []
+        config = appconfig.ThermalConfig(enabled=True, sysfs_root=self.root, poll_seconds=1, strides=(1, 2, 4),
+                                         step_down_celsius=(70.0, 75.0), hysteresis_celsius=5.0, hold_seconds=10.0)
+        self.controller = thermal.ThermalController(config, self.levels.append, clock=lambda: self.now_s)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.controller.shutdown()
+        self.tmpdir.cleanup()
+        return super().tearDown()
+
+    def _write_zone(self, zone: int, temperature_c: float):
+        dpath = os.path.join(self.root, "sys/class/thermal", f"thermal_zone{zone}")
+        os.makedirs(dpath, exist_ok=True)
+        with open(os.path.join(dpath, "temp"), 'w') as f:
+            f.write(f"{int(temperature_c * 1000)}\n")
+
+    def test_steps_down_right_away(self):
+        """Test that we step down as soon as it is too hot, as many levels as it takes."""
+        self.assertEqual(self.controller.update(69.9), 0)
+        self.assertEqual(self.controller.update(70.0), 1)
+        self.assertEqual(self.controller.update(80.0), 2)
+        self.assertEqual(self.levels, [1, 2])
+
+        self.controller.level = 0
+        self.assertEqual(self.controller.update(76.0), 2)
+
+    def test_steps_up_with_hysteresis(self):
+        """Test that we only step up once it has been well below the threshold for the hold time."""
+        self.controller.update(76.0)
+
+        # Below the threshold, but not by enough
+        self.assertEqual(self.controller.update(72.0), 2)
+        self.now_s += 20
+        self.assertEqual(self.controller.update(72.0), 2)
+
+        # Cool enough, but not for long enough (warming back up restarts the hold)
+        self.assertEqual(self.controller.update(69.0), 2)
+        self.now_s += 5
+        self.controller.update(72.0)
+        self.now_s += 6
+        self.assertEqual(self.controller.update(69.0), 2)
+        self.now_s += 10
+        self.assertEqual(self.controller.update(69.0), 1)
+
+        # Each level up waits out its own hold
+        self.assertEqual(self.controller.update(50.0), 1)
+        self.now_s += 10
+        self.assertEqual(self.controller.update(50.0), 0)
+        self.assertEqual(self.levels, [2, 1, 0])
+
+    def test_poll_reads_the_hottest_zone(self):
+        """Test reading the temperature from sysfs."""
+        self.assertIsInstance(self.controller.poll(), FileNotFoundError)
+        self._write_zone(0, 50.0)
+        self._write_zone(1, 71.5)
+        self.assertIsNone(self.controller.poll())
+        self.assertEqual(self.controller.temperature_c, 71.5)
+        self.assertEqual(self.controller.level, 1)
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestThermal)
@@ -0,0 +1,83 @@
+import unittest
+import numpy as np
+from ..src.podapp.libraries.common import appconfig
+from ..src.podapp.libraries.gstreamer_utils import tracking
+from ..src.podapp.libraries.storage import detections
+
+class TestTracking(unittest.TestCase):
+    """
+    Tests for the multi-object tracker.
+    """
+    def setUp(self) -> None:
+        config = appconfig.TrackingConfig(enabled=True, min_hits=2, max_age_frames=2)
+        self.tracker = tracking.Tracker(config)
+        return super().setUp()
+
+    def _records(self, *rows) -> np.ndarray:
+        records = detections.empty(len(rows))
+        records['timestamp'] = 0
+        records['frame'] = 0
+        records['camera'] = detections.CameraID.FRONT
+        records['model'] = 0
+        for i, (class_id, score, box) in enumerate(rows):
+            records[i]['class_id'] = class_id
+            records[i]['score'] = score
+            records[i]['box'] = box
+        return records
+
+    def test_ids(self):
+        """Test that moving boxes keep their IDs once confirmed, and that classes and cameras are kept apart."""
+        ids = []
+        for frame in range(6):
+            dx = 0.01 * frame
+            records = self._records(
+                (0, 0.9, (0.1 + dx, 0.1, 0.2 + dx, 0.2)),
+                (1, 0.9, (0.1 + dx, 0.1, 0.2 + dx, 0.2)),
+                (0, 0.9, (0.7 - dx, 0.7, 0.8 - dx, 0.8)),
+            )
+            ids.append(self.tracker.update(records, detections.CameraID.FRONT).tolist())
+        # Tentative on the first frame, then the same three IDs every frame
+        self.assertEqual(ids[0], [0, 0, 0])
+        self.assertEqual(sorted(ids[1]), [1, 2, 3])
+        self.assertTrue(all(frame_ids == ids[1] for frame_ids in ids[1:]))
+
+        # Another camera's detection in the same place starts its own track
+        records = self._records((0, 0.9, (0.16, 0.1, 0.26, 0.2)))
+        self.assertEqual(self.tracker.update(records, detections.CameraID.REAR).tolist(), [0])
+        self.assertEqual(self.tracker.confirmed, 3)
+        self.assertEqual(len(self.tracker.tracks()), 3)
+
+    def test_coasting_and_low_scores(self):
+        """Test that a confirmed track survives missed frames and low scores, but not too many missed frames."""
+        box = (0.4, 0.4, 0.5, 0.5)
+        for _ in range(2):
+            [track_id] = self.tracker.update(self._records((0, 0.9, box)))
+        self.assertEqual(track_id, 1)
+
+        # A low-scoring detection keeps the track, but can't start one
+        self.assertEqual(self.tracker.update(self._records((0, 0.2, box), (0, 0.2, (0.0, 0.0, 0.1, 0.1)))).tolist(), [1, 0])
+        # Missed for as long as allowed
+        for _ in range(2):
+            self.tracker.update(self._records())
+        self.assertEqual(self.tracker.update(self._records((0, 0.9, box))).tolist(), [1])
+        # Missed for longer
+        for _ in range(3):
+            self.tracker.update(self._records())
+        self.assertEqual(self.tracker.tracks(), [])
+        self.assertEqual(self.tracker.update(self._records((0, 0.9, box))).tolist(), [0])
+
+    def test_capacity(self):
+        """Test that detections beyond the preallocated track slots are left untracked."""
+        tracker = tracking.Tracker(appconfig.TrackingConfig(enabled=True, min_hits=1, max_tracks=2))
+        rows = [(0, 0.9, (0.2 * i, 0.0, 0.2 * i + 0.1, 0.1)) for i in range(3)]
+        self.assertEqual(tracker.update(self._records(*rows)).tolist(), [1, 2, 0])
+
+    def test_benchmark(self):
+        """Test that synthetic trajectories are tracked with few ID switches."""
+        results = tracking.benchmark(objects=20, frames=50)
+        self.assertGreater(results["tracked_fraction"], 0.8)
+        self.assertLessEqual(results["id_switches"], 4)
+
+def gather() -> unittest.TestSuite:
+    loader = unittest.TestLoader()
+    return loader.loadTestsFromTestCase(TestTracking)